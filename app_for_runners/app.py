@@ -1,21 +1,152 @@
 import socket
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, g, has_app_context
 import flask_socketio
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user
-from werkzeug.security import check_password_hash, generate_password_hash # для хэширования паролей
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
 from functools import wraps
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer
+from sqlalchemy.dialects import sqlite as sqlite_dialect, postgresql as postgresql_dialect
 import jwt
 from flask_migrate import Migrate
 import eventlet
+import time
+import math
+import numpy as np
+import os
+import uuid
+import atexit
+from message_writer import MessageWriter, WriterBusy
+from fanout import make_client_manager, run_workers, LocalBusBroker
+import search_index
+import tracks
+import spatial_index
+import routing
+import segments
+import friend_graph
+import live_location
+import database
+import metrics
+import json_provider
+import compression
+import password_hashing
+import offload
+import logging
+import zlib
+import shutil
+import tempfile
 
 app=Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///kurs.db'
-db=SQLAlchemy(app)
+app.config['SQLALCHEMY_DATABASE_URI'] = database.normalize_url(os.environ.get('DATABASE_URL', 'sqlite:///kurs.db'))
+# Пул соединений и режим SQLite (см. database.py)
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'wal').lower()
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'normal').lower()
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# 'immediate' - транзакции основного пула сразу берут блокировку записи (без
+# SQLITE_BUSY при переходе от чтения к записи); имеет смысл вместе с DB_READ_POOL
+app.config['SQLITE_BEGIN'] = os.environ.get('SQLITE_BEGIN', 'deferred').lower()
+# Пул только для чтения для GET-запросов: DB_READ_POOL=1 (тот же файл/сервер)
+# или DATABASE_READ_URL (например, реплика Postgres)
+app.config['DB_READ_POOL'] = os.environ.get('DB_READ_POOL', '0') == '1'
+app.config['DATABASE_READ_URL'] = os.environ.get('DATABASE_READ_URL')
+app.config['DB_READ_POOL_SIZE'] = int(os.environ.get('DB_READ_POOL_SIZE', 10))
+# В продакшене схему ведут миграции (flask db upgrade), create_all - для разработки
+app.config['DB_CREATE_ALL'] = os.environ.get('DB_CREATE_ALL', '1') == '1'
+if app.config['SQLITE_JOURNAL_MODE'] not in database.SQLITE_JOURNAL_MODES:
+    raise SystemExit(f"SQLITE_JOURNAL_MODE must be one of: {', '.join(database.SQLITE_JOURNAL_MODES)}")
+if app.config['SQLITE_SYNCHRONOUS'] not in database.SQLITE_SYNCHRONOUS:
+    raise SystemExit(f"SQLITE_SYNCHRONOUS must be one of: {', '.join(database.SQLITE_SYNCHRONOUS)}")
+if app.config['SQLITE_BEGIN'] not in database.SQLITE_BEGIN_MODES:
+    raise SystemExit(f"SQLITE_BEGIN must be one of: {', '.join(database.SQLITE_BEGIN_MODES)}")
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
+# Запись сообщений чата: 'sync' - коммит на каждое сообщение,
+# 'batched' - отложенная запись пачками (не дольше CHAT_WRITE_MAX_DELAY_MS)
+app.config['CHAT_WRITE_MODE'] = os.environ.get('CHAT_WRITE_MODE', 'sync')
+app.config['CHAT_WRITE_BATCH_SIZE'] = int(os.environ.get('CHAT_WRITE_BATCH_SIZE', 200))
+app.config['CHAT_WRITE_MAX_DELAY_MS'] = int(os.environ.get('CHAT_WRITE_MAX_DELAY_MS', 20))
+# Сколько сообщений может ждать записи; сверх этого send_message отвечает 'busy'
+app.config['CHAT_WRITE_MAX_PENDING'] = int(os.environ.get('CHAT_WRITE_MAX_PENDING', 10000))
+# Шина для рассылки событий Socket.IO между воркерами (см. fanout.py).
+# Без неё emit(room=...) доходит только до клиентов своего процесса
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+app.config['WORKERS'] = int(os.environ.get('WORKERS', 1))
+app.config['PORT'] = int(os.environ.get('PORT', 5000))
+# Ограничение на размер тела запроса (загрузка GPX-треков)
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_UPLOAD_MB', 64)) * 1024 * 1024
+# Каталог пешеходного графа для /api/route (собирается `python routing.py build ...`)
+app.config['ROUTING_GRAPH'] = os.environ.get('ROUTING_GRAPH')
+# Фоновое сопоставление загруженных треков с сегментами (см. segments.py)
+app.config['SEGMENT_MATCHING'] = os.environ.get('SEGMENT_MATCHING', '1') == '1'
+app.config['SEGMENT_MATCH_INTERVAL'] = float(os.environ.get('SEGMENT_MATCH_INTERVAL', 2.0))
+# Сколько раз пробовать трек или сегмент, прежде чем пропустить его с ошибкой в логе
+app.config['SEGMENT_MATCH_ATTEMPTS'] = int(os.environ.get('SEGMENT_MATCH_ATTEMPTS', 3))
+# Раз во сколько секунд воркер сверяет свою копию графа дружб с БД (см. friend_graph.py);
+# новые дружбы приходят в граф сразу, в том числе из других воркеров
+app.config['FRIEND_GRAPH_TTL'] = float(os.environ.get('FRIEND_GRAPH_TTL', 600))
+# Наблюдаемость (см. metrics.py). /metrics отдаётся только адресам из METRICS_ALLOW;
+# запросы, события сокетов и SQL дольше порогов пишутся в лог
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()
+app.config['METRICS_ALLOW'] = [addr.strip() for addr in os.environ.get('METRICS_ALLOW', '127.0.0.1,::1').split(',')
+                               if addr.strip()]
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+# Сэмплирующий профилировщик: стеки запросов дольше PROFILE_SLOW_MS (0 - выключен)
+app.config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+app.config['PROFILE_TOP_STACKS'] = int(os.environ.get('PROFILE_TOP_STACKS', 10))
+# Сериализация JSON (см. json_provider.py): auto - orjson, если установлен; orjson; std
+app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'auto').lower()
+# Сжатие ответов от COMPRESS_MIN_BYTES байт (см. compression.py). Если ответы
+# сжимает прокси перед приложением, сжатие здесь выключается COMPRESS=0
+app.config['COMPRESS'] = os.environ.get('COMPRESS', '1') == '1'
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4))
+# Списки от JSON_STREAM_MIN_ITEMS элементов отдаются потоком, частями по JSON_STREAM_CHUNK
+app.config['JSON_STREAM_MIN_ITEMS'] = int(os.environ.get('JSON_STREAM_MIN_ITEMS', 500))
+app.config['JSON_STREAM_CHUNK'] = int(os.environ.get('JSON_STREAM_CHUNK', 200))
+app.json = json_provider.make_provider(app, app.config['JSON_PROVIDER'])
+# Живые позиции совместной пробежки (см. live_location.py): период рассылки в комнату,
+# точек в секунду от участника, длина следа для снимка, через сколько секунд
+# молчания участник отключается и сколько точек записи трека хранится в памяти
+app.config['LIVE_LOCATION_BROADCAST_MS'] = int(os.environ.get('LIVE_LOCATION_BROADCAST_MS', 1000))
+app.config['LIVE_LOCATION_RATE'] = float(os.environ.get('LIVE_LOCATION_RATE', 5))
+app.config['LIVE_LOCATION_HISTORY'] = int(os.environ.get('LIVE_LOCATION_HISTORY', 120))
+app.config['LIVE_LOCATION_STALE_SECONDS'] = float(os.environ.get('LIVE_LOCATION_STALE_SECONDS', 120))
+app.config['LIVE_LOCATION_RECORD_MAX_POINTS'] = int(os.environ.get('LIVE_LOCATION_RECORD_MAX_POINTS', 20000))
+# Журнал изменений для /api/sync: сколько дней хранятся записи (0 - не очищать)
+# и как часто воркер удаляет устаревшие, секунд
+app.config['SYNC_RETENTION_DAYS'] = int(os.environ.get('SYNC_RETENTION_DAYS', 30))
+app.config['SYNC_PRUNE_INTERVAL'] = float(os.environ.get('SYNC_PRUNE_INTERVAL', 3600))
+# Хеширование паролей (см. password_hashing.py). Метод в формате werkzeug: 'scrypt',
+# 'scrypt:<n>:<r>:<p>' или 'pbkdf2:sha256:<итераций>'; хеши с другими параметрами
+# пересчитываются при следующем входе пользователя
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_SALT_LENGTH'] = int(os.environ.get('PASSWORD_SALT_LENGTH', 16))
+# Потоки ОС для хеширования на воркер, длина очереди и сколько в ней можно ждать;
+# при переполнении /login и /register отвечают 503
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+app.config['PASSWORD_HASH_QUEUE_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 5))
+# 0 - считать хеш прямо в зелёном потоке запроса (для сравнения в benchmarks/login_burst.py)
+app.config['PASSWORD_HASH_OFFLOAD'] = os.environ.get('PASSWORD_HASH_OFFLOAD', '1') == '1'
+try:
+    password_hasher = password_hashing.PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_SALT_LENGTH'], app.config['PASSWORD_HASH_WORKERS'],
+        app.config['PASSWORD_HASH_QUEUE'], app.config['PASSWORD_HASH_QUEUE_TIMEOUT'], app.config['PASSWORD_HASH_OFFLOAD'])
+except ValueError as e:
+    raise SystemExit(f'PASSWORD_HASH_METHOD: {e}')
+db=SQLAlchemy(app, session_options={'class_': database.RoutingSession})
 migrate = Migrate(app, db)
+log = logging.getLogger('runners')
 
 CORS(app)
 #Для сессий:
@@ -28,6 +159,10 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(255), nullable=False)
     email = db.Column(db.String(100), nullable=False)
 
+    __table_args__ = (
+        db.Index('uq_users_email', 'email', unique=True),
+    )
+
     user_info = db.relationship("UserInfo", back_populates="user", uselist=False)
     group_chats = db.relationship('GroupChat', secondary='user_group_chat', back_populates="members")
     friendships = db.relationship(
@@ -59,6 +194,12 @@ class Friendship(db.Model):
     status = db.Column(db.String(20), default='pending')  # 'pending', 'accepted', 'rejected'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_friendships_user_status', 'user_id', 'status', 'friend_id'),
+        db.Index('uq_friendships_user_friend', 'user_id', 'friend_id', unique=True),
+        db.Index('ix_friendships_friend_status', 'friend_id', 'status'),
+    )
+
     def __repr__(self):
         return f'<Friendship {self.id}: {self.user_id} - {self.friend_id}>'
 
@@ -72,15 +213,31 @@ class UserInfo(db.Model):
     sex = db.Column(db.String(10), nullable=False) # Пол
     Age=db.Column(db.Integer, nullable=False)
     Country = db.Column(db.String(30), nullable=False)
+    # Нормализованное имя для поиска (см. search_index.py)
+    name_norm = db.Column(db.String(150), nullable=True, index=True)
+    # Версии для условных GET (ETag): профиль и статистика, растут при каждой записи
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    updated_at = db.Column(db.DateTime, nullable=True)
+    statistics_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    statistics_updated_at = db.Column(db.DateTime, nullable=True)
     # Связь с User
     user = db.relationship("User", back_populates="user_info")
 
+    @db.validates('name')
+    def _sync_name_norm(self, key, value):
+        self.name_norm = search_index.normalize_name(value)
+        return value
+
 class UserGroupChatAssociation(db.Model):
     __tablename__ = 'user_group_chat'
     user_id = db.Column(db.Integer, db.ForeignKey('users.id_User'), primary_key=True)
     chat_id = db.Column(db.Integer, db.ForeignKey('group_chat.id'), primary_key=True)
     joined_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_user_group_chat_chat', 'chat_id'),
+    )
+
 class UserStatistic(db.Model):
     __tablename__ = 'user_statistic'
     id = db.Column(db.Integer, primary_key=True)
@@ -93,10 +250,54 @@ class UserStatistic(db.Model):
     # связь с UserInfo
     user_info = db.relationship("UserInfo", backref="statistics")
 
+    # Одна запись на пользователя и день - на этом построен upsert
+    __table_args__ = (
+        db.UniqueConstraint('id_User', 'date', name='uq_user_statistic_user_date'),
+    )
+
+# Ключи идемпотентности уже применённых записей статистики (повторы при плохой связи).
+# Хранятся столько же, сколько журнал изменений (SYNC_RETENTION_DAYS, см. prune_change_log)
+class UserStatisticSyncKey(db.Model):
+    __tablename__ = 'user_statistic_sync_key'
+    id_User = db.Column(db.Integer, db.ForeignKey('user_info.id_User'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+# Недельные и месячные суммы статистики, обновляются в add_user_statistic
+class UserStatisticRollup(db.Model):
+    __tablename__ = 'user_statistic_rollup'
+    id_User = db.Column(db.Integer, db.ForeignKey('user_info.id_User'), primary_key=True)
+    granularity = db.Column(db.String(10), primary_key=True)  # 'week', 'month'
+    period_start = db.Column(db.Date, primary_key=True)  # понедельник / первое число
+    calories = db.Column(db.Float, nullable=False, default=0)
+    steps = db.Column(db.Integer, nullable=False, default=0)
+    distance = db.Column(db.Float, nullable=False, default=0)
+    days = db.Column(db.Integer, nullable=False, default=0)  # дней с записями
+
+# Суммы статистики за последние 7/30 дней для рейтинга друзей. Строка актуальна,
+# пока as_of - сегодняшний день: новые записи прибавляются к ней, устаревшие строки
+# пересчитываются из дневных записей при первом обращении в новый день
+class UserStatisticWindow(db.Model):
+    __tablename__ = 'user_statistic_window'
+    id_User = db.Column(db.Integer, db.ForeignKey('user_info.id_User'), primary_key=True)
+    window_days = db.Column(db.Integer, primary_key=True)
+    as_of = db.Column(db.Date, nullable=False)  # последний день окна
+    calories = db.Column(db.Float, nullable=False, default=0)
+    steps = db.Column(db.Integer, nullable=False, default=0)
+    distance = db.Column(db.Float, nullable=False, default=0)
+
 class GroupChat(db.Model):
     __tablename__ = 'group_chat'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
+    # Денормализованный указатель на последнее сообщение (обновляется при отправке)
+    last_message_id = db.Column(db.Integer, nullable=True)
+    last_message_at = db.Column(db.DateTime, nullable=True, index=True)
+    last_message_preview = db.Column(db.String(255), nullable=True)
+    # Версия чата для условных GET: новые сообщения, состав участников, их имена
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, nullable=True)
 
     members = db.relationship('User', secondary='user_group_chat', back_populates="group_chats")
     messages = db.relationship('GroupMessage', backref='chat', lazy='dynamic')
@@ -111,8 +312,275 @@ class GroupMessage(db.Model):
 
     sender = db.relationship("User", backref="sent_messages")
 
+    # Индекс под постраничную загрузку истории (keyset по timestamp, id)
+    __table_args__ = (
+        db.Index('ix_group_message_chat_ts_id', 'chat_id', 'timestamp', 'id'),
+    )
+
+# Журнал изменений для /api/sync. Курсор клиента - id записи: он только растёт
+# (sqlite_autoincrement не даёт переиспользовать id после очистки журнала) и идёт
+# в порядке фиксации транзакций (см. record_changes).
+# Записи пользователя (user_id) - дружбы, статистика, вход в чат и выход из него;
+# записи чата (chat_id) - сообщения и смена состава: они пишутся один раз на чат,
+# а не на каждого участника, и видны всем его текущим участникам
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id_User'), nullable=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('group_chat.id'), nullable=True)
+    entity = db.Column(db.String(20), nullable=False)  # 'friendship', 'chat', 'message', 'statistic'
+    entity_id = db.Column(db.Integer, nullable=True)
+    day = db.Column(db.Date, nullable=True)  # день записи статистики
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_change_log_user_id', 'user_id', 'id'),
+        db.Index('ix_change_log_chat_id', 'chat_id', 'id'),
+        {'sqlite_autoincrement': True},
+    )
+
+# Загруженные GPX-треки. Точки хранятся закодированной полилинией (см. tracks.py),
+# итоги и габариты считаются один раз при загрузке
+class Track(db.Model):
+    __tablename__ = 'tracks'
+    id = db.Column(db.Integer, primary_key=True)
+    id_User = db.Column(db.Integer, db.ForeignKey('users.id_User'), nullable=False, index=True)
+    name = db.Column(db.String(255), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    point_count = db.Column(db.Integer, nullable=False)
+    distance = db.Column(db.Float, nullable=False)  # м
+    elevation_gain = db.Column(db.Float, nullable=False, default=0)  # м
+    min_lat = db.Column(db.Float, nullable=False)
+    min_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+    start_lat = db.Column(db.Float, nullable=False)
+    start_lon = db.Column(db.Float, nullable=False)
+    polyline = db.Column(db.Text, nullable=False)
+    elevations = db.Column(db.Text, nullable=True)  # одномерная полилиния, дециметры
+    times = db.Column(db.Text, nullable=True)  # одномерная полилиния, секунды от started_at
+    # Когда трек сопоставлен с сегментами (NULL - ждёт фоновой обработки) и сколько
+    # раз его брали в работу: после SEGMENT_MATCH_ATTEMPTS неудач трек пропускается
+    segments_matched_at = db.Column(db.DateTime, nullable=True, index=True)
+    segment_match_attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    lods = db.relationship('TrackLod', backref='track', lazy='dynamic', cascade='all, delete-orphan')
+
+    # Запасной вариант поиска по старту, если R*Tree недоступен (см. spatial_index.py)
+    __table_args__ = (
+        db.Index('ix_tracks_start', 'start_lat', 'start_lon'),
+    )
+
+# Упрощённые версии трека для разных масштабов карты (считаются при загрузке)
+class TrackLod(db.Model):
+    __tablename__ = 'track_lod'
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), primary_key=True)
+    tolerance = db.Column(db.Float, primary_key=True)  # м
+    point_count = db.Column(db.Integer, nullable=False)
+    polyline = db.Column(db.Text, nullable=False)
+
+# Участки маршрутов, на которых ведётся рейтинг
+class Segment(db.Model):
+    __tablename__ = 'segments'
+    id = db.Column(db.Integer, primary_key=True)
+    id_User = db.Column(db.Integer, db.ForeignKey('users.id_User'), nullable=False)
+    name = db.Column(db.String(255), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    point_count = db.Column(db.Integer, nullable=False)
+    distance = db.Column(db.Float, nullable=False)  # м
+    min_lat = db.Column(db.Float, nullable=False)
+    min_lon = db.Column(db.Float, nullable=False)
+    max_lat = db.Column(db.Float, nullable=False)
+    max_lon = db.Column(db.Float, nullable=False)
+    polyline = db.Column(db.Text, nullable=False)
+    # Сопоставление с уже загруженными треками: последний просмотренный id трека
+    # и время завершения (NULL - ещё идёт в фоне); число неудачных проходов подряд
+    match_cursor = db.Column(db.Integer, nullable=False, default=0)
+    matched_at = db.Column(db.DateTime, nullable=True, index=True)
+    match_failures = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+# Проходы сегментов: не больше одного (лучшего) на трек
+class SegmentEffort(db.Model):
+    __tablename__ = 'segment_effort'
+    id = db.Column(db.Integer, primary_key=True)
+    segment_id = db.Column(db.Integer, db.ForeignKey('segments.id'), nullable=False)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), nullable=False, index=True)
+    id_User = db.Column(db.Integer, db.ForeignKey('users.id_User'), nullable=False)
+    elapsed = db.Column(db.Float, nullable=False)  # с
+    started_at = db.Column(db.DateTime, nullable=True)
+    start_index = db.Column(db.Integer, nullable=False)
+    end_index = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('segment_id', 'track_id', name='uq_segment_effort_segment_track'),
+    )
+
+# Лучший проход каждого пользователя на сегменте - из этой таблицы читается рейтинг
+class SegmentBest(db.Model):
+    __tablename__ = 'segment_best'
+    segment_id = db.Column(db.Integer, db.ForeignKey('segments.id'), primary_key=True)
+    id_User = db.Column(db.Integer, db.ForeignKey('users.id_User'), primary_key=True)
+    elapsed = db.Column(db.Float, nullable=False)
+    track_id = db.Column(db.Integer, db.ForeignKey('tracks.id'), nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    efforts = db.Column(db.Integer, nullable=False, default=1)
+
+    __table_args__ = (
+        db.Index('ix_segment_best_segment_elapsed', 'segment_id', 'elapsed'),
+    )
+
 with app.app_context():
-    db.create_all() #debug=True лишает необходимость постоянно перезагружать сервер, то есть он сам обновляется
+    database.configure_sqlite(db.engine, app.config)
+    app.extensions['db_read_engine'] = database.create_read_engine(db.engine, app.config)
+    # Схему базы под миграциями создаёт и меняет только flask db upgrade: DDL при
+    # импорте выполнился бы раньше миграций (в том числе при самом flask db upgrade)
+    if app.config['DB_CREATE_ALL'] and not database.migrations_managed(db.engine):
+        db.create_all() #debug=True лишает необходимость постоянно перезагружать сервер, то есть он сам обновляется
+        search_index.create_fts_index(db.engine)
+        spatial_index.create_rtree_index(db.engine)
+    search_fts_enabled = search_index.fts_index_exists(db.engine)
+    spatial_index_enabled = spatial_index.rtree_index_exists(db.engine)
+    if db.engine.dialect.name == 'sqlite' and not spatial_index_enabled:
+        log.warning('Spatial index is not available, track and segment lookups scan B-tree indexes')
+
+# Метрики процесса (см. metrics.py), выдаются на GET /metrics
+metrics_registry = metrics.Registry()
+request_latency = metrics_registry.add(metrics.Histogram(
+    'http_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method', 'status')))
+request_queries = metrics_registry.add(metrics.Histogram(
+    'http_request_sql_queries', 'SQL statements per HTTP request', ('endpoint',), metrics.QUERY_COUNT_BUCKETS))
+request_sql_time = metrics_registry.add(metrics.Histogram(
+    'http_request_sql_seconds', 'Time spent in SQL per HTTP request', ('endpoint',)))
+event_latency = metrics_registry.add(metrics.Histogram(
+    'socketio_event_duration_seconds', 'Socket.IO event handler latency', ('event',)))
+event_queries = metrics_registry.add(metrics.Histogram(
+    'socketio_event_sql_queries', 'SQL statements per Socket.IO event', ('event',), metrics.QUERY_COUNT_BUCKETS))
+event_sql_time = metrics_registry.add(metrics.Histogram(
+    'socketio_event_sql_seconds', 'Time spent in SQL per Socket.IO event', ('event',)))
+sql_queries_total = metrics_registry.add(metrics.Counter(
+    'sql_queries_total', 'SQL statements executed, including background tasks'))
+sql_slow_total = metrics_registry.add(metrics.Counter(
+    'sql_slow_queries_total', 'SQL statements slower than SLOW_QUERY_MS'))
+slow_total = metrics_registry.add(metrics.Counter(
+    'slow_requests_total', 'HTTP requests and Socket.IO events slower than SLOW_REQUEST_MS', ('kind', 'name')))
+metrics_registry.add(metrics.Gauge(
+    'socketio_sessions', 'Authenticated Socket.IO connections in this process', lambda: len(socket_sessions)))
+live_location_updates = metrics_registry.add(metrics.Counter(
+    'live_location_updates_total', 'Live location points received', ('result',)))
+metrics_registry.add(metrics.Gauge(
+    'live_location_sharers', 'Users sharing live location via this process', lambda: live_locations.sharers()))
+stack_sampler = None
+if app.config['PROFILE_SLOW_MS'] > 0:
+    stack_sampler = metrics.StackSampler(interval=app.config['PROFILE_INTERVAL_MS'] / 1000.0)
+
+def current_query_stats():
+    return g.get('query_stats') if has_app_context() else None
+
+def record_query(statement, seconds):
+    sql_queries_total.inc()
+    if seconds * 1000 >= app.config['SLOW_QUERY_MS']:
+        sql_slow_total.inc()
+        log.warning('slow query %.1f ms in %s: %s', seconds * 1000,
+                    g.get('measure_name', 'background') if has_app_context() else 'background',
+                    ' '.join(statement.split())[:500])
+
+with app.app_context():
+    for engine in (db.engine, app.extensions['db_read_engine']):
+        if engine is not None:
+            metrics.track_queries(engine, current_query_stats, record_query)
+    if hasattr(db.engine.pool, 'checkedout'):
+        pool = db.engine.pool
+        metrics_registry.add(metrics.Gauge(
+            'db_pool_checked_out', 'Connections of the primary pool in use', pool.checkedout))
+
+def begin_measure(name):
+    g.measure_name = name
+    g.measure_started = time.perf_counter()
+    g.query_stats = metrics.QueryStats()
+    g.profile_token = stack_sampler.begin() if stack_sampler is not None else None
+
+def finish_measure(kind):
+    # Возвращает (секунды, QueryStats); медленные запросы - в лог, со стеками при PROFILE_SLOW_MS
+    elapsed = time.perf_counter() - g.measure_started
+    stats = g.query_stats
+    name = g.measure_name
+    elapsed_ms = elapsed * 1000
+    if elapsed_ms >= app.config['SLOW_REQUEST_MS']:
+        slow_total.inc(kind, name)
+        log.warning('slow %s %s: %.1f ms, %d queries, %.1f ms in SQL',
+                    kind, name, elapsed_ms, stats.count, stats.seconds * 1000)
+    if g.profile_token is not None:
+        stacks = stack_sampler.end(g.profile_token)
+        g.profile_token = None
+        if elapsed_ms >= app.config['PROFILE_SLOW_MS'] and stacks:
+            # Формат "стек число" - как у flamegraph.pl/speedscope
+            log.warning('profile of %s %s (%.1f ms, %d samples):\n%s', kind, name, elapsed_ms,
+                        sum(count for _, count in stacks),
+                        '\n'.join(f'{stack} {count}' for stack, count in stacks[:app.config['PROFILE_TOP_STACKS']]))
+    return elapsed, stats
+
+@app.before_request
+def start_request_measure():
+    # Несовпавшие адреса - одной меткой, иначе каждый путь станет отдельной серией
+    begin_measure(request.endpoint or 'unmatched')
+
+@app.after_request
+def finish_request_measure(response):
+    if g.get('measure_started') is not None:
+        elapsed, stats = finish_measure('http')
+        request_latency.observe(elapsed, g.measure_name, request.method, response.status_code)
+        request_queries.observe(stats.count, g.measure_name)
+        request_sql_time.observe(stats.seconds, g.measure_name)
+        g.measure_started = None
+    return response
+
+def measured_event(event):
+    # Замер обработчика события Socket.IO (ставится под @socketio.on)
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            # disconnect() из обработчика синхронно вызывает обработчик 'disconnect' в том же
+            # контексте: замер внешнего события сохраняется и восстанавливается после вложенного
+            outer = None
+            if g.get('measure_started') is not None:
+                outer = (g.measure_name, g.measure_started, g.query_stats, g.profile_token)
+            begin_measure(event)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed, stats = finish_measure('socketio')
+                event_latency.observe(elapsed, event)
+                event_queries.observe(stats.count, event)
+                event_sql_time.observe(stats.seconds, event)
+                g.measure_started = None
+                if outer is not None:
+                    g.measure_name, g.measure_started, g.query_stats, g.profile_token = outer
+        return wrapper
+    return decorator
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    # Только для локального сбора: запрос через прокси (X-Forwarded-For) не считается локальным
+    if request.remote_addr not in app.config['METRICS_ALLOW'] or request.headers.get('X-Forwarded-For'):
+        return jsonify({'error': 'Not found'}), 404
+    return metrics_registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@app.after_request
+def release_db_session(response):
+    # Соединение возвращается в пул до отправки ответа: медленный клиент
+    # не держит его (и открытую транзакцию SQLite) во время записи в сокет
+    db.session.remove()
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Регистрируется последним, поэтому выполняется первым: время сжатия входит в замер запроса
+    if app.config['COMPRESS']:
+        compression.compress_response(response, request.accept_encodings, app.config['COMPRESS_MIN_BYTES'],
+                                      app.config['COMPRESS_GZIP_LEVEL'], app.config['COMPRESS_BROTLI_QUALITY'])
+    return response
 
 # @app.route('/index')
 # @app.route('/')
@@ -143,14 +611,17 @@ def generate_jwt(user_id):
         token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
         return token
 
-def verify_jwt(token):
+def decode_jwt(token):
     try:
-        payload = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        return payload['user_id']
+        return jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
-        return None 
+        return None
     except jwt.InvalidTokenError:
         return None
+
+def verify_jwt(token):
+    payload = decode_jwt(token)
+    return payload['user_id'] if payload else None
     
 @app.route('/login', methods=['POST'])
 def login_page():
@@ -160,7 +631,17 @@ def login_page():
         password = item['password']
         if email and password:
             user = User.query.filter_by(email=email).first()
-            if user and check_password_hash(user.password, password):
+            # На время хеширования соединение возвращается в пул: иначе всплеск
+            # входов займёт весь пул, и встанут запросы, которым хеш не нужен
+            if user is not None:
+                db.session.expunge(user)
+            db.session.commit()
+            try:
+                valid = user is not None and password_hasher.check(user.password, password)
+            except password_hashing.HasherBusy:
+                return hasher_busy()
+            if valid:
+                rehash_password(user, password)
                 login_user(user) 
                 session['id_User'] = user.id_User
                 token = generate_jwt(user.id_User)
@@ -171,110 +652,578 @@ def login_page():
             return jsonify({'success': False,'message': 'Заполните поля для входа'}), 201
     return jsonify({'message': 'Метод GET не поддерживается для этого маршрута'}), 405
 
+def hasher_busy():
+    # Очередь хеширования переполнена - клиент повторит запрос позже
+    return jsonify({'success': False, 'message': 'Сервер перегружен, повторите попытку позже'}), 503, \
+        {'Retry-After': '1'}
+
+def rehash_password(user, password):
+    # Пароль известен только при входе - тогда и переводим хеш на текущие параметры
+    try:
+        if password_hasher.needs_rehash(user.password):
+            user.password = password_hasher.hash(password)
+            User.query.filter_by(id_User=user.id_User).update({User.password: user.password})
+            db.session.commit()
+    except password_hashing.HasherBusy:
+        pass
+
 # Это типо login_required. Декоратор прописывается @token_requires и только для авторизированных пользователей
 def token_required(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
             token = request.headers.get('Authorization')
-            print(f"Received token: {token}")
             if not token:
                 return jsonify({'message': 'Токен отсутствует'}), 401
 
-            user_id = verify_jwt(token)
-            if not user_id:
-                return jsonify({'message': 'Токен недействителен (время истекло)'}), 401
+            # Подзапросы /api/batch идут с тем же токеном - он проверяется один раз
+            if g.get('verified_token') == token:
+                user_id = g.verified_user_id
+            else:
+                user_id = verify_jwt(token)
+                if not user_id:
+                    return jsonify({'message': 'Токен недействителен (время истекло)'}), 401
+                g.verified_token, g.verified_user_id = token, user_id
 
             return f(user_id, *args, **kwargs)  # Передаем user_id в функцию
 
         return decorated_function
 
+# Размер страницы истории чата по умолчанию и максимальный
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+
+# Размер страницы списка чатов по умолчанию и максимальный
+CHATS_PAGE_SIZE = 100
+CHATS_PAGE_MAX = 500
+
+def parse_page_limit(value, default=MESSAGES_PAGE_SIZE, maximum=MESSAGES_PAGE_MAX):
+    try:
+        limit = int(value) if value is not None else default
+    except (TypeError, ValueError):
+        return None
+    if limit < 1:
+        return None
+    return min(limit, maximum)
+
+def json_list(items, convert=None):
+    # Ответ со списком: длинный список - потоком (см. json_provider.iter_json_array),
+    # convert(элемент) -> dict применяется к элементам items
+    if len(items) < app.config['JSON_STREAM_MIN_ITEMS']:
+        return jsonify([convert(item) for item in items] if convert is not None else items)
+    return app.response_class(json_provider.iter_json_array(app.json, items, convert, app.config['JSON_STREAM_CHUNK']),
+                              mimetype=app.json.mimetype)
+
+def version_etag(*parts):
+    # Тег версии ответа: сущность, id, счётчик версии; параметры запроса - хешем
+    if request.query_string:
+        parts += (format(zlib.crc32(request.query_string), 'x'),)
+    return '-'.join(str(part) for part in parts)
+
+def with_version(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    # Last-Modified точен до секунды: пока секунда изменения не прошла, в неё может
+    # попасть ещё одна запись, и такой отметке верить нельзя
+    if last_modified is not None and last_modified.replace(microsecond=0) < datetime.utcnow().replace(microsecond=0):
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Хранить можно, но перед показом - сверяться с сервером
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def not_modified(etag, last_modified=None):
+    # Ответ 304, если версия у клиента актуальна (If-None-Match, без него - If-Modified-Since), иначе None
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    else:
+        matched = False
+    if not matched:
+        return None
+    return with_version(app.response_class(status=304), etag, last_modified)
+
+def bump_chat_versions(condition):
+    # Сдвигает версии чатов, попавших под условие (без commit)
+    db.session.execute(db.update(GroupChat).where(condition).values(
+        version=GroupChat.version + 1, updated_at=datetime.utcnow()))
+
+def user_change(user_id, entity, entity_id=None, day=None):
+    return {'user_id': user_id, 'chat_id': None, 'entity': entity, 'entity_id': entity_id, 'day': day}
+
+def chat_change(chat_id, entity='chat', entity_id=None):
+    return {'user_id': None, 'chat_id': chat_id, 'entity': entity,
+            'entity_id': chat_id if entity_id is None else entity_id, 'day': None}
+
+# Ключ advisory lock Postgres, которым сериализуются записи в change_log
+CHANGE_LOG_LOCK_KEY = 0x72756e73
+
+def record_changes(changes):
+    # Записи журнала изменений (см. ChangeLog) в текущей транзакции (без commit)
+    if changes:
+        if db.engine.dialect.name == 'postgresql':
+            # В Postgres id из последовательности выдаются в порядке вставки, а транзакции
+            # фиксируются в любом порядке: клиент, получивший курсор 11, навсегда пропустил бы
+            # 10, зафиксированную позже. Блокировка до конца транзакции выстраивает записи
+            # журнала в очередь - следующий id берётся только после фиксации предыдущего
+            db.session.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': CHANGE_LOG_LOCK_KEY})
+        now = datetime.utcnow()
+        db.session.execute(ChangeLog.__table__.insert(), [dict(change, created_at=now) for change in changes])
+
+def member_chat_version(user_id, chat_id):
+    # (версия, время изменения) чата, если пользователь в нём состоит, иначе None
+    return db.session.query(GroupChat.version, GroupChat.updated_at) \
+        .join(UserGroupChatAssociation, UserGroupChatAssociation.chat_id == GroupChat.id) \
+        .filter(GroupChat.id == chat_id, UserGroupChatAssociation.user_id == user_id).first()
+
+# Длина превью последнего сообщения в списке чатов
+MESSAGE_PREVIEW_LENGTH = 100
+
+def update_chat_last_message(chat_id, message_id, timestamp, content):
+    # Сдвигаем указатель только вперёд, чтобы запоздавшая запись не откатила его;
+    # версия чата растёт при любой записи
+    newer = db.or_(GroupChat.last_message_at.is_(None), GroupChat.last_message_at <= timestamp)
+    GroupChat.query.filter(GroupChat.id == chat_id).update({
+        GroupChat.last_message_id: db.case((newer, message_id), else_=GroupChat.last_message_id),
+        GroupChat.last_message_at: db.case((newer, timestamp), else_=GroupChat.last_message_at),
+        GroupChat.last_message_preview: db.case((newer, content[:MESSAGE_PREVIEW_LENGTH]),
+                                                else_=GroupChat.last_message_preview),
+        GroupChat.version: GroupChat.version + 1,
+        GroupChat.updated_at: datetime.utcnow()
+    }, synchronize_session=False)
+
 # SocketIO initialization
-socketio = flask_socketio.SocketIO(app, cors_allowed_origins="*")
+socketio_options = {}
+if app.config['SOCKETIO_MESSAGE_QUEUE']:
+    socketio_options['client_manager'] = make_client_manager(app.config['SOCKETIO_MESSAGE_QUEUE'])
+socketio = flask_socketio.SocketIO(app, cors_allowed_origins="*", **socketio_options)
+
+def persist_messages(rows):
+    # Пачка сообщений от MessageWriter: вставка и сдвиг указателей одной транзакцией
+    with app.app_context():
+        try:
+            db.session.execute(GroupMessage.__table__.insert(), rows)
+            if db.engine.dialect.name == 'postgresql':
+                # id выданы писателем - сдвигаем последовательность, иначе обычная вставка получит занятый id
+                db.session.execute(db.text("SELECT setval(pg_get_serial_sequence('group_message', 'id'), :id)"),
+                                   {'id': max(row['id'] for row in rows)})
+            latest = {}
+            for row in rows:
+                current = latest.get(row['chat_id'])
+                if current is None or (row['timestamp'], row['id']) > (current['timestamp'], current['id']):
+                    latest[row['chat_id']] = row
+            for row in latest.values():
+                update_chat_last_message(row['chat_id'], row['id'], row['timestamp'], row['content'])
+            record_changes([chat_change(row['chat_id'], 'message', row['id']) for row in rows])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+# id выдаются писателем заранее, поэтому в режиме 'batched' сообщения
+# должен записывать только один процесс
+message_writer = None
+if app.config['CHAT_WRITE_MODE'] == 'batched':
+    message_writer = MessageWriter(
+        persist_messages,
+        batch_size=app.config['CHAT_WRITE_BATCH_SIZE'],
+        max_delay=app.config['CHAT_WRITE_MAX_DELAY_MS'] / 1000.0,
+        max_pending=app.config['CHAT_WRITE_MAX_PENDING'],
+        start_task=socketio.start_background_task,
+        sleep=socketio.sleep
+    )
+    with app.app_context():
+        message_writer.start(db.session.query(db.func.max(GroupMessage.id)).scalar())
+    atexit.register(message_writer.close)
+
+def store_message(chat_id, sender_id, content):
+    # Возвращает (id, timestamp) сохранённого (или поставленного в очередь) сообщения
+    if message_writer is not None:
+        timestamp = datetime.utcnow()
+        message_id = message_writer.submit({
+            'chat_id': chat_id,
+            'sender_id': sender_id,
+            'content': content,
+            'timestamp': timestamp
+        })
+        return message_id, timestamp
+
+    new_message = GroupMessage(chat_id=chat_id, sender_id=sender_id, content=content)
+    db.session.add(new_message)
+    db.session.flush()  # нужны id и timestamp для указателя в чате
+    update_chat_last_message(chat_id, new_message.id, new_message.timestamp, content)
+    record_changes([chat_change(chat_id, 'message', new_message.id)])
+    db.session.commit()
+    return new_message.id, new_message.timestamp
+
+# Сессии сокетов: sid -> {'user_id', 'email', 'exp', 'rooms'}.
+# Токен проверяется один раз при подключении, дальше события работают по сессии
+socket_sessions = {}
+
+def socket_token(auth=None):
+    # Токен может прийти в auth-пакете, в заголовке или в query-параметре
+    if isinstance(auth, dict) and auth.get('token'):
+        return auth['token']
+    return request.headers.get('Authorization') or request.args.get('token')
+
+def current_socket_session():
+    sess = socket_sessions.get(request.sid)
+    if sess is None:
+        return None
+    if sess['exp'] is not None and sess['exp'] <= time.time():
+        # Токен истёк - сессию сбрасываем, клиент должен переподключиться с новым
+        flask_socketio.emit('session_expired', {'message': 'Токен недействителен (время истекло)'})
+        flask_socketio.disconnect()
+        socket_sessions.pop(request.sid, None)
+        return None
+    return sess
+
+def ensure_chat_room(sess, chat_id):
+    # Проверка членства делается один раз на соединение, дальше - по множеству комнат
+    if chat_id in sess['rooms']:
+        return True
+    if not is_chat_member(sess['user_id'], chat_id):
+        return False
+    flask_socketio.join_room(chat_id)
+    sess['rooms'].add(chat_id)
+    return True
+
+def drop_local_chat_sessions(user_id, chat_id):
+    # Сокеты участника в этом процессе выходят из комнаты и забывают членство,
+    # трансляция его позиции через этот процесс прекращается
+    for sid, sess in list(socket_sessions.items()):
+        if sess['user_id'] == user_id and chat_id in sess['rooms']:
+            sess['rooms'].discard(chat_id)
+            socketio.server.leave_room(sid, chat_id, namespace='/')
+    live_locations.stop(chat_id, user_id)
+
+def drop_chat_sessions(user_id, chat_id):
+    # Вызывается при удалении участника из чата. Его сокеты могут быть подключены
+    # к другим воркерам - рассылаем сброс членства по шине, каждый процесс
+    # (и этот тоже) обрабатывает его в drop_local_chat_sessions
+    manager = socketio.server.manager
+    if hasattr(manager, 'publish_control'):
+        manager.publish_control('drop_chat_sessions', user_id, chat_id)
+    else:
+        drop_local_chat_sessions(user_id, chat_id)
+
+if hasattr(socketio.server.manager, 'on_control'):
+    socketio.server.manager.on_control('drop_chat_sessions', drop_local_chat_sessions)
+
+def parse_chat_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+@socketio.on('connect')
+@measured_event('connect')
+def handle_connect(auth=None):
+    payload = decode_jwt(socket_token(auth))
+    if not payload:
+        return False
+
+    user = User.query.get(payload['user_id'])
+    if not user:
+        return False
+
+    socket_sessions[request.sid] = {
+        'user_id': user.id_User,
+        'email': user.email,
+        'exp': payload.get('exp'),
+        'rooms': set()
+    }
+
+@socketio.on('disconnect')
+@measured_event('disconnect')
+def handle_disconnect(*args):
+    socket_sessions.pop(request.sid, None)
+    live_locations.stop_sid(request.sid)
 
 @socketio.on('join_chat')
+@measured_event('join_chat')
 def handle_join_chat(data):
-    print('>>> JOIN_CHAT EVENT TRIGGERED <<<')
-    print(f"Data: {data}")
-    auth_header = request.headers.get('Authorization')
-    token = data.get('token')
-    user_id = verify_jwt(token)
-    if not user_id:
+    log.debug('join_chat %s: %s', request.sid, data)
+    sess = current_socket_session()
+    if not sess:
         return
 
-    chat_id = data.get('chat_id')
-    user = User.query.get(user_id)
-    chat = GroupChat.query.get(chat_id)
-    if not chat or not UserGroupChatAssociation.query.filter_by(user_id=user_id, chat_id=chat_id).first():
+    chat_id = parse_chat_id(data.get('chat_id'))
+    if chat_id is None or not ensure_chat_room(sess, chat_id):
         return
 
-    flask_socketio.join_room(chat_id)
-    flask_socketio.emit('joined', {'message': f'User {user.email} joined chat {chat_id}'}, room=chat_id)
+    flask_socketio.emit('joined', {'message': f"User {sess['email']} joined chat {chat_id}"}, room=chat_id)
+    # Опоздавшему к совместной пробежке - текущие позиции и следы участников
+    request_live_snapshots(request.sid, chat_id)
 
 @socketio.on('send_message')
+@measured_event('send_message')
 def handle_send_message(data):
-    print('>>> SEND_MESSAGE EVENT TRIGGERED <<<')
-    print(f"Data: {data}")
-    auth_header = request.headers.get('Authorization')
-    token = data.get('token')
-    user_id = verify_jwt(token)
-    if not user_id:
+    # Ответ (ack) 'busy' - сообщение не принято: очередь записи переполнена
+    log.debug('send_message %s: %s', request.sid, data)
+    sess = current_socket_session()
+    if not sess:
         return
 
-    chat_id = data.get('chat_id')
+    chat_id = parse_chat_id(data.get('chat_id'))
     content = data.get('content')
-    if not content:
+    if chat_id is None or not content:
         return
 
-    user = User.query.get(user_id)
-    chat = GroupChat.query.get(chat_id)
-    if not chat or not UserGroupChatAssociation.query.filter_by(user_id=user_id, chat_id=chat_id).first():
+    if not ensure_chat_room(sess, chat_id):
         return
 
-    new_message = GroupMessage(chat_id=chat_id, sender_id=user_id, content=content)
-    db.session.add(new_message)
-    db.session.commit()
+    user_id = sess['user_id']
+    try:
+        message_id, timestamp = store_message(chat_id, user_id, content)
+    except WriterBusy:
+        log.warning('send_message %s: message writer is full', request.sid)
+        return 'busy'
 
     message_data = {
-        'id': new_message.id,
-        'sender': user.email,
+        'id': message_id,
+        'sender_id': user_id,
+        'sender': sess['email'],
         'content': content,
-        'timestamp': new_message.timestamp.isoformat()
+        'timestamp': timestamp.isoformat()
     }
     flask_socketio.emit('new_message', message_data, room=chat_id)
 
+def persist_live_tracks(recordings):
+    # Пачка записанных совместных пробежек: по треку на участника одной транзакцией
+    with app.app_context():
+        try:
+            titles = dict(db.session.query(GroupChat.id, GroupChat.title).filter(
+                GroupChat.id.in_({chat_id for _, chat_id, _ in recordings})))
+            for user_id, chat_id, points in recordings:
+                builder = tracks.TrackBuilder()
+                for lat, lon, ele, moment in points:
+                    builder.add_point(lat, lon, ele, datetime.fromtimestamp(moment, timezone.utc).replace(tzinfo=None))
+                if builder.count < 2:
+                    continue
+                title = titles.get(chat_id, f'Chat {chat_id}')
+                db.session.add(new_track(user_id, f"{title} {builder.started_at:%Y-%m-%d}", builder))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+live_locations = live_location.LiveLocations(
+    lambda event, data, room: socketio.emit(event, data, room=room),
+    persist_live_tracks,
+    broadcast_interval=app.config['LIVE_LOCATION_BROADCAST_MS'] / 1000.0,
+    rate=app.config['LIVE_LOCATION_RATE'],
+    history=app.config['LIVE_LOCATION_HISTORY'],
+    stale_after=app.config['LIVE_LOCATION_STALE_SECONDS'],
+    record_max_points=app.config['LIVE_LOCATION_RECORD_MAX_POINTS']
+)
+atexit.register(live_locations.close)
+
+def send_live_snapshots(sid, chat_id, stream=None):
+    # Снимок этого процесса сокету sid (он может быть подключён к другому воркеру):
+    # без stream - если в комнате кто-то делится позицией через этот процесс,
+    # со stream - только от процесса с этим потоком, даже пустой
+    if stream is not None and stream != live_locations.stream:
+        return
+    snapshot = live_locations.snapshot(chat_id)
+    if snapshot is None and stream is not None:
+        snapshot = live_locations.empty_snapshot(chat_id)
+    if snapshot is not None:
+        socketio.emit('live_location_snapshot', snapshot, to=sid)
+
+def request_live_snapshots(sid, chat_id, stream=None):
+    # Участники комнаты шлют точки в разные воркеры - снимки собираются со всех по шине
+    manager = socketio.server.manager
+    if hasattr(manager, 'publish_control'):
+        manager.publish_control('live_location_snapshot', sid, chat_id, stream)
+    else:
+        send_live_snapshots(sid, chat_id, stream)
+
+if hasattr(socketio.server.manager, 'on_control'):
+    socketio.server.manager.on_control('live_location_snapshot', send_live_snapshots)
+
+@socketio.on('live_location_start')
+@measured_event('live_location_start')
+def handle_live_location_start(data):
+    # {"chat_id", "record": true - сохранить пробежку треком после остановки}
+    sess = current_socket_session()
+    if not sess:
+        return
+    chat_id = parse_chat_id(data.get('chat_id'))
+    if chat_id is None or not ensure_chat_room(sess, chat_id):
+        return
+    live_locations.start(chat_id, sess['user_id'], request.sid, record=data.get('record') is True)
+    request_live_snapshots(request.sid, chat_id)
+
+@socketio.on('live_location')
+@measured_event('live_location')
+def handle_live_location(data):
+    # {"chat_id", "lat", "lon", "ele"}; без БД - членство проверено при старте.
+    # Ответ (ack) - 'ok', 'throttled' или 'not_sharing'
+    sess = current_socket_session()
+    if not sess:
+        return
+    chat_id = parse_chat_id(data.get('chat_id'))
+    lat, lon, ele = data.get('lat'), data.get('lon'), data.get('ele')
+    if chat_id is None or not live_location.valid_position(lat, lon):
+        return 'invalid'
+    if not isinstance(ele, (int, float)) or isinstance(ele, bool) or not math.isfinite(ele):
+        ele = None
+    result = live_locations.update(chat_id, sess['user_id'], lat, lon, ele)
+    live_location_updates.inc(result)
+    return result
+
+@socketio.on('live_location_stop')
+@measured_event('live_location_stop')
+def handle_live_location_stop(data):
+    sess = current_socket_session()
+    if not sess:
+        return
+    chat_id = parse_chat_id(data.get('chat_id'))
+    if chat_id is not None:
+        live_locations.stop(chat_id, sess['user_id'])
+
+@socketio.on('live_location_snapshot')
+@measured_event('live_location_snapshot')
+def handle_live_location_snapshot(data):
+    # {"chat_id", "stream"}: клиент пропустил событие потока (разрыв в seq) - заново
+    # берёт его базу разностей. Без stream - снимки всех потоков комнаты
+    sess = current_socket_session()
+    if not sess:
+        return
+    chat_id = parse_chat_id(data.get('chat_id'))
+    if chat_id is None or chat_id not in sess['rooms']:
+        return
+    stream = data.get('stream')
+    request_live_snapshots(request.sid, chat_id, stream if isinstance(stream, str) else None)
+
+def load_friend_graph():
+    with app.app_context():
+        return db.session.query(Friendship.user_id, Friendship.friend_id).filter(Friendship.status == 'accepted').all()
+
+friends_cache = friend_graph.FriendGraph(load_friend_graph, ttl=app.config['FRIEND_GRAPH_TTL'],
+                                         start_task=socketio.start_background_task)
+
+def add_local_friendships(edges):
+    for user_id, friend_id in edges:
+        friends_cache.add_edge(user_id, friend_id)
+
+def publish_friendships(edges):
+    # Подтверждённые дружбы - в граф каждого воркера (и этого тоже), без перечитывания
+    manager = socketio.server.manager
+    if hasattr(manager, 'publish_control'):
+        manager.publish_control('friendships', edges)
+    else:
+        add_local_friendships(edges)
+
+if hasattr(socketio.server.manager, 'on_control'):
+    socketio.server.manager.on_control('friendships', add_local_friendships)
+
+# Рекомендации "возможно, вы знакомы" по умолчанию и максимум
+SUGGESTIONS_LIMIT = 20
+SUGGESTIONS_MAX = 100
 
 @app.route('/api/friends', methods=['GET'])
 @token_required
 def get_friends(user_id):
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
-    friends = user.get_friends()
-    friend_list = [{
-        'id': friend.id_User,
-        'email': friend.email,
-        'name': friend.user_info.name if friend.user_info else None
-    } for friend in friends]
+    # Один запрос вместо запроса на каждого друга за его профилем
+    friends = db.session.query(User.id_User, User.email, UserInfo.name).join(
+        Friendship, Friendship.friend_id == User.id_User
+    ).outerjoin(UserInfo, UserInfo.id_User == User.id_User).filter(
+        Friendship.user_id == user_id, Friendship.status == 'accepted'
+    ).order_by(Friendship.id).all()
+
+    return json_list(friends, lambda row: {
+        'id': row.id_User,
+        'email': row.email,
+        'name': row.name
+    }), 200
 
-    return jsonify(friend_list), 200
+@app.route('/api/friends/suggestions', methods=['GET'])
+@token_required
+def get_friend_suggestions(user_id):
+    # Друзья друзей по числу общих друзей; считается по графу в памяти, без запросов к БД
+    limit = parse_page_limit(request.args.get('limit'), default=SUGGESTIONS_LIMIT, maximum=SUGGESTIONS_MAX)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+    ranked = friends_cache.suggestions(user_id, limit)
+    # Имена только тех, кто попал в ответ
+    names = dict(db.session.query(UserInfo.id_User, UserInfo.name)
+                 .filter(UserInfo.id_User.in_([candidate for candidate, _ in ranked]))) if ranked else {}
+    return jsonify([{
+        'id': candidate,
+        'name': names.get(candidate),
+        'mutual_friends': mutual
+    } for candidate, mutual in ranked]), 200
+
+@app.route('/api/friends/leaderboard', methods=['GET'])
+@token_required
+@database.primary_only
+def get_friends_leaderboard(user_id):
+    # ?metric=distance|steps|calories&window=7d|30d - пользователь и его друзья
+    # по сумме за последние дни (включая сегодняшний)
+    metric = request.args.get('metric', 'distance')
+    window_name = request.args.get('window', '7d')
+    if metric not in FRIENDS_LEADERBOARD_METRICS:
+        return jsonify({'error': 'metric must be distance, steps or calories'}), 400
+    if window_name not in FRIENDS_LEADERBOARD_WINDOWS:
+        return jsonify({'error': 'window must be 7d or 30d'}), 400
+    window_days = FRIENDS_LEADERBOARD_WINDOWS[window_name]
+    today = datetime.utcnow().date()
+
+    friend_ids = db.select(Friendship.friend_id).where(Friendship.user_id == user_id, Friendship.status == 'accepted')
+    members = db.select(UserInfo.id_User).where(db.or_(UserInfo.id_User == user_id, UserInfo.id_User.in_(friend_ids)))
+    try:
+        # Обычно пересчитывать нечего: устаревают строки только раз в день
+        refresh_statistic_windows(members, window_days, today)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+    value = getattr(UserStatisticWindow, metric)
+    rows = db.session.query(UserStatisticWindow.id_User, UserInfo.name, value).join(
+        UserInfo, UserInfo.id_User == UserStatisticWindow.id_User
+    ).filter(
+        UserStatisticWindow.window_days == window_days,
+        UserStatisticWindow.id_User.in_(members)
+    ).order_by(value.desc(), UserStatisticWindow.id_User.asc()).all()
+
+    return jsonify({
+        'metric': metric,
+        'window': window_name,
+        'from': today - timedelta(days=window_days - 1),
+        'to': today,
+        'entries': [{
+            'rank': index + 1,
+            'user_id': member_id,
+            'name': name,
+            'value': total,
+            'me': member_id == user_id
+        } for index, (member_id, name, total) in enumerate(rows)]
+    }), 200
 
 @app.route('/api/friends/requests', methods=['GET'])
 @token_required
 def get_friend_requests(user_id):
     try:
         # Ищем запросы, где текущий пользователь (user_id) является получателем (friend_id)
-        requests = Friendship.query.filter_by(friend_id=user_id, status='pending').all()
+        # Имена отправителей - тем же запросом
+        requests = db.session.query(Friendship.id, Friendship.user_id, UserInfo.name).outerjoin(
+            UserInfo, UserInfo.id_User == Friendship.user_id
+        ).filter(Friendship.friend_id == user_id, Friendship.status == 'pending').order_by(Friendship.id).all()
         request_list = [
             {
-                'id': req.id,  # Используем уникальный идентификатор запроса (если нужен)
-                'fromUserId': req.user_id,  # ID отправителя
-                'fromUserName': UserInfo.query.get(req.user_id).name if UserInfo.query.get(req.user_id) else 'Неизвестный пользователь'
-            } for req in requests
+                'id': request_id,  # Используем уникальный идентификатор запроса (если нужен)
+                'fromUserId': from_user_id,  # ID отправителя
+                'fromUserName': name if name is not None else 'Неизвестный пользователь'
+            } for request_id, from_user_id, name in requests
         ]
         return jsonify(request_list), 200
     except Exception as e:
-        print(f"Error in get_friend_requests: {e}")
+        log.exception('get_friend_requests failed')
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
 @app.route('/api/friends/reject_request', methods=['POST'])
@@ -286,33 +1235,44 @@ def reject_friend_request(user_id):
         if not request_id:
             return jsonify({'error': 'Request ID is required'}), 400
 
-        request = Friendship.query.get(request_id)
-        if not request or request.to_user_id != user_id or request.status != 'pending':
+        friend_request = Friendship.query.get(request_id)
+        if not friend_request or friend_request.friend_id != user_id or friend_request.status != 'pending':
             return jsonify({'error': 'Invalid request'}), 400
 
-        request.status = 'rejected'
+        friend_request.status = 'rejected'
+        record_changes([user_change(member, 'friendship', friend_request.id)
+                        for member in (friend_request.user_id, friend_request.friend_id)])
         db.session.commit()
 
         return jsonify({'message': 'Friend request rejected'}), 200
     except Exception as e:
         db.session.rollback()
-        print(f"Error in reject_friend_request: {e}")
+        log.exception('reject_friend_request failed')
         return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
 
-@app.route('/api/user_info/<int:user_id>', methods=['GET'])
+@app.route('/api/user_info/<int:other_user_id>', methods=['GET'])
 @token_required
-def get_user_info_by_id(user_id):
-    # Проверяем, авторизован ли текущий пользователь
-    current_user_id = user_id
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
+def get_user_info_by_id(user_id, other_user_id):
+    # user_id - текущий пользователь из токена, other_user_id - запрошенный.
+    # Сначала читается только версия анкеты: на 304 сама анкета не нужна
+    info_version = db.session.query(UserInfo.version, UserInfo.updated_at) \
+        .filter(UserInfo.id_User == other_user_id).first()
+    if info_version is None:
+        if db.session.query(User.id_User).filter(User.id_User == other_user_id).first() is None:
+            return jsonify({'error': 'User not found'}), 404
+        return jsonify({'error': 'User info not found'}), 404
 
-    user_info = UserInfo.query.filter_by(id_User=user_id).first()
+    etag = version_etag('user', other_user_id, info_version.version)
+    cached = not_modified(etag, info_version.updated_at)
+    if cached is not None:
+        return cached
+
+    user_info = UserInfo.query.filter_by(id_User=other_user_id).first()
     if not user_info:
         return jsonify({'error': 'User info not found'}), 404
-
-    return jsonify({
+    # Анкета могла измениться между запросами - тег по прочитанной версии
+    etag = version_etag('user', other_user_id, user_info.version)
+    return with_version(jsonify({
         "id": user_info.id_User,
         "name": user_info.name,
         "weight": user_info.weight,
@@ -320,34 +1280,100 @@ def get_user_info_by_id(user_id):
         "sex": user_info.sex,
         "age": user_info.Age,
         "country": user_info.Country,
-    }), 200
+    }), etag, user_info.updated_at), 200
+
+# Размер страницы поиска пользователей по умолчанию и максимальный
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+
+def search_prefix_matches(query, exclude_id, after, limit):
+    # Имена, начинающиеся с query, по (name_norm, id) - диапазон по индексу name_norm
+    q = UserInfo.query.filter(
+        UserInfo.name_norm >= query,
+        UserInfo.name_norm < query + '\U0010ffff',
+        UserInfo.id_User != exclude_id
+    )
+    if after is not None:
+        last_name, last_id = after
+        q = q.filter(db.or_(
+            UserInfo.name_norm > last_name,
+            db.and_(UserInfo.name_norm == last_name, UserInfo.id_User > last_id)
+        ))
+    return q.order_by(UserInfo.name_norm.asc(), UserInfo.id_User.asc()).limit(limit).all()
+
+def search_substring_matches(query, exclude_id, after_id, limit):
+    # Совпадения в середине имени (без тех, что уже выданы как префиксные), по id
+    if len(query) < search_index.MIN_SUBSTRING_QUERY:
+        return []
+
+    def keep(user):
+        return user.id_User != exclude_id and not user.name_norm.startswith(query)
+
+    if not search_fts_enabled:
+        # Префиксные совпадения отсекаются тем же диапазоном, что и в search_prefix_matches,
+        # иначе limit считал бы строки, которые потом выбрасываются, и страница выходила короче
+        return UserInfo.query.filter(
+            UserInfo.name_norm.contains(query, autoescape=True),
+            db.or_(UserInfo.name_norm < query, UserInfo.name_norm >= query + '\U0010ffff'),
+            UserInfo.id_User != exclude_id,
+            UserInfo.id_User > after_id
+        ).order_by(UserInfo.id_User.asc()).limit(limit).all()
+
+    found = []
+    while len(found) < limit:
+        chunk = max(limit * 2, 32)
+        ids = search_index.fts_substring_ids(db.session, query, after_id, chunk)
+        if not ids:
+            break
+        users = {u.id_User: u for u in UserInfo.query.filter(UserInfo.id_User.in_(ids)).all()}
+        found.extend(users[i] for i in ids if i in users and keep(users[i]))
+        after_id = ids[-1]
+        if len(ids) < chunk:
+            break
+    return found[:limit]
 
 @app.route('/api/users/search', methods=['GET'])
 @token_required
 def search_users(user_id):
-    try:
-        query = request.args.get('name', '')
-        print(f"Search query: {query}, user_id: {user_id}")  # Логирование запроса
-        if not query:
-            return jsonify({'error': 'Name query parameter is required'}), 400
-
-        # Используем безопасный запрос с учетом регистра и отладкой
-        users = UserInfo.query.filter(UserInfo.name.ilike(f'%{query}%')).all()
-        user_list = []
-        for user in users:
-            user_dict = {
-                'id': user.id_User,
-                'name': user.name
-            }
-            print(f"Found user: {user_dict}")  # Логирование найденных пользователей
-            user_list.append(user_dict)
-
-        if not user_list:
-            print(f"No users found for query: {query}")  # Дополнительное логирование
-        return jsonify(user_list), 200
-    except Exception as e:
-        print(f"Error in search_users: {e}")  # Логирование ошибки
-        return jsonify({'error': 'Internal server error', 'details': str(e)}), 500
+    # Ранжирование: сначала совпадения с начала имени, затем - в середине.
+    # Следующая страница: ?cursor=<значение заголовка X-Next-Cursor>
+    query = search_index.normalize_name(request.args.get('name', ''))
+    if not query:
+        return jsonify({'error': 'Name query parameter is required'}), 400
+
+    limit = parse_page_limit(request.args.get('limit'), default=SEARCH_PAGE_SIZE, maximum=SEARCH_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    cursor = request.args.get('cursor')
+    position = search_index.decode_cursor(cursor) if cursor else (0, None, 0)
+    if position is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    tier, last_name, last_id = position
+
+    results = []
+    next_cursor = None
+    if tier == 0:
+        after = (last_name, last_id) if last_name is not None else None
+        prefix = search_prefix_matches(query, user_id, after, limit + 1)
+        results = [(0, u) for u in prefix[:limit]]
+        last_id = 0
+        if len(prefix) > limit:
+            last = prefix[limit - 1]
+            next_cursor = search_index.encode_cursor(0, last.name_norm, last.id_User)
+
+    if next_cursor is None:
+        remaining = limit - len(results)
+        substring = search_substring_matches(query, user_id, last_id, remaining + 1)
+        results += [(1, u) for u in substring[:remaining]]
+        if len(substring) > remaining:
+            after_id = substring[remaining - 1].id_User if remaining else last_id
+            next_cursor = search_index.encode_cursor(1, None, after_id)
+
+    response = jsonify([{'id': u.id_User, 'name': u.name} for _, u in results])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response, 200
 
 @app.route('/api/friends/send_request', methods=['POST'])
 @token_required
@@ -373,6 +1399,9 @@ def send_friend_request(user_id):
 
     new_friendship = Friendship(user_id=user_id, friend_id=friend_id, status='pending')
     db.session.add(new_friendship)
+    db.session.flush()
+    record_changes([user_change(user_id, 'friendship', new_friendship.id),
+                    user_change(friend_id, 'friendship', new_friendship.id)])
     db.session.commit()
 
     return jsonify({'message': 'Friend request sent', 'friend_id': friend_id}), 201
@@ -382,8 +1411,6 @@ def send_friend_request(user_id):
 def accept_friend_request(user_id):
     data = request.get_json()
     friend_id = data.get('friend_id')
-    print(user_id)
-    print(friend_id)
     if not friend_id or not User.query.get(friend_id):
         return jsonify({'error': 'Invalid friend ID'}), 400
 
@@ -392,31 +1419,46 @@ def accept_friend_request(user_id):
         return jsonify({'error': 'No pending friend request found'}), 404
 
     friendship.status = 'accepted'
-    db.session.commit()
+    changed = [friendship]
 
     # Создаём обратную запись для взаимности
     reverse_friendship = Friendship.query.filter_by(user_id=user_id, friend_id=friend_id).first()
     if not reverse_friendship:
-        db.session.add(Friendship(user_id=user_id, friend_id=friend_id, status='accepted'))
-        db.session.commit()
+        reverse_friendship = Friendship(user_id=user_id, friend_id=friend_id, status='accepted')
+        db.session.add(reverse_friendship)
+        db.session.flush()
+        changed.append(reverse_friendship)
+    record_changes([user_change(member, 'friendship', row.id) for row in changed for member in (user_id, friend_id)])
+    db.session.commit()
+    # В графе только подтверждённые дружбы - добавляем их, не перечитывая граф
+    publish_friendships([[row.user_id, row.friend_id] for row in (friendship, reverse_friendship)
+                         if row.status == 'accepted'])
 
     return jsonify({'message': 'Friend request accepted', 'friend_id': friend_id}), 200
 
 @app.route('/api/group_chats', methods=['GET'])
 @token_required
 def get_group_chats(user_id):
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({'error': 'User not found'}), 404
-
-    chat_data = []
-    for chat in user.group_chats:
-        last_message = chat.messages.order_by(GroupMessage.timestamp.desc()).first()
-        chat_data.append({
-            'id': chat.id,
-            'title': chat.title,
-            'lastMessage': last_message.content if last_message else ''
-        })
+    limit = parse_page_limit(request.args.get('limit'), default=CHATS_PAGE_SIZE, maximum=CHATS_PAGE_MAX)
+    offset = request.args.get('offset', 0, type=int)
+    if limit is None or offset < 0:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+
+    # Один запрос: чаты пользователя вместе с указателем на последнее сообщение,
+    # сначала самые активные
+    chats = GroupChat.query \
+        .join(UserGroupChatAssociation, UserGroupChatAssociation.chat_id == GroupChat.id) \
+        .filter(UserGroupChatAssociation.user_id == user_id) \
+        .order_by(GroupChat.last_message_at.desc().nulls_last(), GroupChat.id.desc()) \
+        .limit(limit).offset(offset).all()
+
+    chat_data = [{
+        'id': chat.id,
+        'title': chat.title,
+        'lastMessage': chat.last_message_preview or '',
+        'lastMessageId': chat.last_message_id,
+        'lastMessageAt': chat.last_message_at
+    } for chat in chats]
 
     return jsonify(chat_data), 200
 
@@ -440,6 +1482,7 @@ def create_group_chat(user_id):
     all_member_ids.add(user_id)  # обязательно добавить текущего пользователя
 
     try:
+        added = []
         for member_id in all_member_ids:
             if User.query.get(member_id):
                 # Проверяем, существует ли запись
@@ -448,7 +1491,9 @@ def create_group_chat(user_id):
                 ).first()
                 if not existing_association:
                     db.session.add(UserGroupChatAssociation(user_id=member_id, chat_id=new_chat.id))
+                    added.append(member_id)
 
+        record_changes([user_change(member_id, 'chat', new_chat.id) for member_id in added])
         db.session.commit()
         return jsonify({'message': 'Групповой чат создан', 'chat_id': new_chat.id}), 201
     except IntegrityError as e:
@@ -471,10 +1516,28 @@ def join_group_chat(user_id, chat_id):
 
     new_assoc = UserGroupChatAssociation(user_id=user_id, chat_id=chat_id)
     db.session.add(new_assoc)
+    bump_chat_versions(GroupChat.id == chat_id)
+    record_changes([user_change(user_id, 'chat', chat_id), chat_change(chat_id)])
     db.session.commit()
 
     return jsonify({'message': 'Joined chat successfully'}), 201
 
+@app.route('/api/group_chats/<int:chat_id>/leave', methods=['POST'])
+@token_required
+def leave_group_chat(user_id, chat_id):
+    association = UserGroupChatAssociation.query.filter_by(user_id=user_id, chat_id=chat_id).first()
+    if not association:
+        return jsonify({'error': 'Not a member'}), 404
+
+    db.session.delete(association)
+    bump_chat_versions(GroupChat.id == chat_id)
+    # Запись пользователя: записи чата ушедшему больше не видны
+    record_changes([user_change(user_id, 'chat', chat_id), chat_change(chat_id)])
+    db.session.commit()
+    drop_chat_sessions(user_id, chat_id)
+
+    return jsonify({'message': 'Left chat successfully'}), 200
+
 @app.route('/api/group_chats/<int:chat_id>/add_user', methods=['POST'])
 @token_required
 def add_user_to_chat(user_id, chat_id):
@@ -496,9 +1559,58 @@ def add_user_to_chat(user_id, chat_id):
         return jsonify({'message': 'Пользователь уже в чате'}), 200
 
     db.session.add(UserGroupChatAssociation(user_id=new_user_id, chat_id=chat_id))
+    bump_chat_versions(GroupChat.id == chat_id)
+    record_changes([user_change(new_user_id, 'chat', chat_id), chat_change(chat_id)])
     db.session.commit()
     return jsonify({'message': 'Пользователь добавлен в чат'}), 201
 
+def is_chat_member(user_id, chat_id):
+    return UserGroupChatAssociation.query.filter_by(user_id=user_id, chat_id=chat_id).first() is not None
+
+def load_chat_participants(chat_id):
+    # Имена участников одним запросом (без ленивой подгрузки user_info)
+    rows = db.session.query(UserGroupChatAssociation.user_id, UserInfo.name) \
+        .outerjoin(UserInfo, UserInfo.id_User == UserGroupChatAssociation.user_id) \
+        .filter(UserGroupChatAssociation.chat_id == chat_id) \
+        .order_by(UserGroupChatAssociation.joined_at.asc(), UserGroupChatAssociation.user_id.asc()) \
+        .all()
+    return [name if name else f"User {member_id}" for member_id, name in rows]
+
+def load_chat_messages(chat_id, before_id=None, limit=MESSAGES_PAGE_SIZE):
+    # Keyset-пагинация: сообщения старше before_id, от новых к старым.
+    # Возвращает страницу в хронологическом порядке и курсор на следующую.
+    query = db.session.query(GroupMessage, UserInfo.name) \
+        .outerjoin(UserInfo, UserInfo.id_User == GroupMessage.sender_id) \
+        .filter(GroupMessage.chat_id == chat_id)
+
+    if before_id is not None:
+        anchor = db.session.query(GroupMessage.timestamp) \
+            .filter_by(id=before_id, chat_id=chat_id).first()
+        if anchor is None:
+            return [], None
+        query = query.filter(db.or_(
+            GroupMessage.timestamp < anchor.timestamp,
+            db.and_(GroupMessage.timestamp == anchor.timestamp, GroupMessage.id < before_id)
+        ))
+
+    rows = query.order_by(GroupMessage.timestamp.desc(), GroupMessage.id.desc()) \
+        .limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+
+    messages = [{
+        'id': msg.id,
+        'content': msg.content,
+        'sender_id': msg.sender_id,
+        'sender': name if name else f"User {msg.sender_id}",
+        'timestamp': msg.timestamp
+    } for msg, name in rows]
+
+    next_before_id = messages[0]['id'] if has_more and messages else None
+    return messages, next_before_id
+
 @app.route('/api/group_chats/<int:chat_id>', methods=['GET'])
 @token_required
 def get_group_chat_details(user_id, chat_id):
@@ -507,35 +1619,66 @@ def get_group_chat_details(user_id, chat_id):
         return jsonify({'error': 'Chat not found'}), 404
 
     # Проверяем, что пользователь входит в чат
-    assoc = UserGroupChatAssociation.query.filter_by(user_id=user_id, chat_id=chat_id).first()
-    if not assoc:
+    if not is_chat_member(user_id, chat_id):
         return jsonify({'error': 'Access denied'}), 403
 
-    # Получаем участников (имена)
-    participants = []
-    for member in chat.members:
-        if member.user_info:
-            participants.append(member.user_info.name)
-        else:
-            participants.append(f"User {member.id_User}")
-
-    # Получаем сообщения
-    messages = []
-    for msg in chat.messages.order_by(GroupMessage.timestamp.asc()).all():
-        sender_name = msg.sender.user_info.name if msg.sender.user_info else f"User {msg.sender.id_User}"
-        messages.append({
-            'id': msg.id,
-            'content': msg.content,
-            'sender': sender_name,
-            'timestamp': msg.timestamp.isoformat()
-        })
+    limit = parse_page_limit(request.args.get('limit'))
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
 
-    return jsonify({
+    etag = version_etag('chat', chat_id, chat.version)
+    cached = not_modified(etag, chat.updated_at)
+    if cached is not None:
+        return cached
+
+    # Отдаём только последнюю страницу истории, остальное - через /messages
+    messages, next_before_id = load_chat_messages(chat_id, limit=limit)
+
+    return with_version(jsonify({
         'id': chat.id,
         'title': chat.title,
-        'participants': participants,
-        'messages': messages
-    }), 200
+        'participants': load_chat_participants(chat_id),
+        'messages': messages,
+        'next_before_id': next_before_id
+    }), etag, chat.updated_at), 200
+
+@app.route('/api/group_chats/<int:chat_id>/participants', methods=['GET'])
+@token_required
+def get_group_chat_participants(user_id, chat_id):
+    chat_version = member_chat_version(user_id, chat_id)
+    if chat_version is None:
+        return jsonify({'error': 'Access denied'}), 403
+
+    etag = version_etag('chat-participants', chat_id, chat_version.version)
+    cached = not_modified(etag, chat_version.updated_at)
+    if cached is not None:
+        return cached
+    return with_version(jsonify(load_chat_participants(chat_id)), etag, chat_version.updated_at), 200
+
+@app.route('/api/group_chats/<int:chat_id>/messages', methods=['GET'])
+@token_required
+def get_group_chat_messages(user_id, chat_id):
+    # История чата по страницам: ?before_id=<id самого старого загруженного>&limit=50
+    chat_version = member_chat_version(user_id, chat_id)
+    if chat_version is None:
+        return jsonify({'error': 'Access denied'}), 403
+
+    limit = parse_page_limit(request.args.get('limit'))
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    etag = version_etag('chat-messages', chat_id, chat_version.version)
+    cached = not_modified(etag, chat_version.updated_at)
+    if cached is not None:
+        return cached
+
+    before_id = request.args.get('before_id', type=int)
+    messages, next_before_id = load_chat_messages(chat_id, before_id=before_id, limit=limit)
+
+    return with_version(jsonify({
+        'messages': messages,
+        'next_before_id': next_before_id
+    }), etag, chat_version.updated_at), 200
 
 @app.route('/api/user_info/check', methods=['GET'])
 @token_required
@@ -550,10 +1693,13 @@ def check_user_info(user_id):
 @app.route('/api/user_info', methods=['GET'])
 @token_required
 def get_user_info(user_id):
-    print(user_id)
     user_info = UserInfo.query.filter_by(id_User=user_id).first()
     if user_info:
-        return jsonify({
+        etag = version_etag('user', user_id, user_info.version)
+        cached = not_modified(etag, user_info.updated_at)
+        if cached is not None:
+            return cached
+        return with_version(jsonify({
             "id": user_info.id_User,
             "name": user_info.name,
             "weight": user_info.weight,
@@ -561,68 +1707,942 @@ def get_user_info(user_id):
             "sex": user_info.sex,
             "age": user_info.Age,
             "country" : user_info.Country,
-        }), 200
+        }), etag, user_info.updated_at), 200
     else:
         return jsonify({"error": "User info not found"}), 404
 
+ROLLUP_GRANULARITIES = ('week', 'month')
+# Скользящие окна и показатели рейтинга друзей
+FRIENDS_LEADERBOARD_WINDOWS = {'7d': 7, '30d': 30}
+FRIENDS_LEADERBOARD_METRICS = ('distance', 'steps', 'calories')
+# Ограничения на размер ответа статистики
+STATISTICS_PAGE_SIZE = 366
+STATISTICS_PAGE_MAX = 1000
+SUMMARY_MAX_DAYS = 731
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+def period_end(start, granularity):
+    # Последний день периода (включительно)
+    if granularity == 'week':
+        return start + timedelta(days=6)
+    if granularity == 'month':
+        next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return next_month - timedelta(days=1)
+    return start
+
+def upsert(table):
+    # INSERT ... ON CONFLICT для текущей СУБД
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql_dialect.insert(table)
+    return sqlite_dialect.insert(table)
+
+def parse_statistic_record(item):
+    # Возвращает словарь записи или строку с ошибкой
+    if not isinstance(item, dict) or not all(field in item for field in ('calories', 'steps', 'distance', 'date')):
+        return 'Missing fields'
+    try:
+        record = {
+            'date': datetime.strptime(item['date'], '%Y-%m-%d').date(),
+            'calories': float(item['calories']),
+            'steps': int(item['steps']),
+            'distance': float(item['distance']),
+            'key': item.get('idempotency_key')
+        }
+    except (TypeError, ValueError):
+        return 'Invalid field value'
+    if record['key'] is not None and (not isinstance(record['key'], str) or not 0 < len(record['key']) <= 64):
+        return 'idempotency_key must be a string of up to 64 characters'
+    return record
+
+def apply_statistic_records(user_id, records):
+    # Применяет дневные записи одной транзакцией (без commit).
+    # Возвращает (число применённых записей, ключи уже применённых ранее)
+    keyed = {}
+    for r in records:
+        if r['key']:
+            keyed.setdefault(r['key'], r)
+    inserted = set()
+    if keyed:
+        # ON CONFLICT DO NOTHING вместо проверки заранее: параллельная загрузка с тем же
+        # ключом ждёт первую и получает "уже применено", а не IntegrityError
+        table = UserStatisticSyncKey.__table__
+        stmt = upsert(table).on_conflict_do_nothing(index_elements=['id_User', 'key']).returning(table.c.key)
+        now = datetime.utcnow()
+        inserted = {k for (k,) in db.session.execute(stmt, [
+            {'id_User': user_id, 'key': key, 'date': r['date'], 'created_at': now} for key, r in keyed.items()])}
+    duplicates = sorted(set(keyed) - inserted)
+
+    # Повтор ключа внутри одной пачки применяется один раз
+    fresh = [r for r in records if not r['key'] or (r['key'] in inserted and keyed[r['key']] is r)]
+    if not fresh:
+        return 0, duplicates
+
+    per_day = {}
+    for r in fresh:
+        day = per_day.setdefault(r['date'], {'id_User': user_id, 'date': r['date'], 'calories': 0.0, 'steps': 0, 'distance': 0.0})
+        day['calories'] += r['calories']
+        day['steps'] += r['steps']
+        day['distance'] += r['distance']
+
+    existing_days = {d for (d,) in db.session.query(UserStatistic.date).filter(
+        UserStatistic.id_User == user_id, UserStatistic.date.in_(list(per_day)))}
+
+    table = UserStatistic.__table__
+    stmt = upsert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=['id_User', 'date'], set_={
+        'calories': table.c.calories + stmt.excluded.calories,
+        'steps': table.c.steps + stmt.excluded.steps,
+        'distance': table.c.distance + stmt.excluded.distance,
+    })
+    db.session.execute(stmt, list(per_day.values()))
+
+    apply_statistic_rollups(user_id, per_day.values(), existing_days)
+    apply_statistic_windows(user_id, per_day.values())
+    db.session.execute(db.update(UserInfo).where(UserInfo.id_User == user_id).values(
+        statistics_version=UserInfo.statistics_version + 1, statistics_updated_at=datetime.utcnow()))
+    record_changes([user_change(user_id, 'statistic', day=day) for day in per_day])
+    return len(fresh), duplicates
+
+def statistics_version(user_id):
+    # (версия, время изменения) статистики пользователя для условных GET
+    row = db.session.query(UserInfo.statistics_version, UserInfo.statistics_updated_at) \
+        .filter(UserInfo.id_User == user_id).first()
+    return tuple(row) if row else (0, None)
+
+def apply_statistic_rollups(user_id, days, existing_days):
+    # Инкрементально добавляем дневные дельты в недельные и месячные суммы
+    rollups = {}
+    for day in days:
+        for granularity in ROLLUP_GRANULARITIES:
+            start = period_start(day['date'], granularity)
+            item = rollups.setdefault((granularity, start), {
+                'id_User': user_id, 'granularity': granularity, 'period_start': start,
+                'calories': 0.0, 'steps': 0, 'distance': 0.0, 'days': 0
+            })
+            item['calories'] += day['calories']
+            item['steps'] += day['steps']
+            item['distance'] += day['distance']
+            if day['date'] not in existing_days:
+                item['days'] += 1
+
+    table = UserStatisticRollup.__table__
+    stmt = upsert(table)
+    stmt = stmt.on_conflict_do_update(index_elements=['id_User', 'granularity', 'period_start'], set_={
+        'calories': table.c.calories + stmt.excluded.calories,
+        'steps': table.c.steps + stmt.excluded.steps,
+        'distance': table.c.distance + stmt.excluded.distance,
+        'days': table.c.days + stmt.excluded.days,
+    })
+    db.session.execute(stmt, list(rollups.values()))
+
+def refresh_statistic_windows(user_ids, window_days, today):
+    # Одним запросом пересчитывает устаревшие и недостающие суммы окна
+    # для пользователей из подзапроса user_ids
+    first_day = today - timedelta(days=window_days - 1)
+    window = UserStatisticWindow
+    # Коррелированный подзапрос - поиск по первичному ключу окна, а не просмотр всех свежих строк
+    fresh = db.exists().where(window.id_User == UserInfo.id_User, window.window_days == window_days,
+                              window.as_of == today)
+    source = db.select(
+        UserInfo.id_User,
+        db.literal(window_days, db.Integer),
+        db.literal(today, db.Date),
+        db.func.coalesce(db.func.sum(UserStatistic.calories), 0.0),
+        db.func.coalesce(db.func.sum(UserStatistic.steps), 0),
+        db.func.coalesce(db.func.sum(UserStatistic.distance), 0.0),
+    ).outerjoin(UserStatistic, db.and_(
+        UserStatistic.id_User == UserInfo.id_User, UserStatistic.date.between(first_day, today)
+    )).where(UserInfo.id_User.in_(user_ids), ~fresh).group_by(UserInfo.id_User)
+
+    table = window.__table__
+    stmt = upsert(table).from_select(['id_User', 'window_days', 'as_of', 'calories', 'steps', 'distance'], source)
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['id_User', 'window_days'], set_={
+        'as_of': stmt.excluded.as_of,
+        'calories': stmt.excluded.calories,
+        'steps': stmt.excluded.steps,
+        'distance': stmt.excluded.distance,
+    }))
+
+def apply_statistic_windows(user_id, days):
+    # Дельты дней, попавших в окно, прибавляются к актуальной строке;
+    # устаревшая или отсутствующая строка пересчитывается целиком (дни уже сохранены)
+    today = datetime.utcnow().date()
+    window = UserStatisticWindow
+    for window_days in FRIENDS_LEADERBOARD_WINDOWS.values():
+        first_day = today - timedelta(days=window_days - 1)
+        inside = [day for day in days if first_day <= day['date'] <= today]
+        if inside:
+            db.session.execute(db.update(window).where(
+                window.id_User == user_id, window.window_days == window_days, window.as_of == today
+            ).values(
+                calories=window.calories + sum(day['calories'] for day in inside),
+                steps=window.steps + sum(day['steps'] for day in inside),
+                distance=window.distance + sum(day['distance'] for day in inside),
+            ))
+        refresh_statistic_windows(db.select(db.literal(user_id, db.Integer)), window_days, today)
+
+def parse_date_arg(name, default=None):
+    # None - параметр не передан, ValueError - неверный формат
+    value = request.args.get(name)
+    if not value:
+        return default
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+# Максимум дней в одной пакетной синхронизации
+STATISTICS_BATCH_MAX = 1000
+
 @app.route('/api/user_statistic', methods=['POST'])
 @token_required
 def add_user_statistic(user_id):
     data = request.get_json()
 
-    required_fields = ['calories', 'steps', 'distance', 'date']
-    if not all(field in data for field in required_fields):
-        return jsonify({'error': 'Missing fields'}), 400
+    record = parse_statistic_record(data)
+    if isinstance(record, str):
+        return jsonify({'error': record}), 400
 
     try:
-        date_obj = datetime.strptime(data['date'], '%Y-%m-%d').date()
-
-        # Ищем существующую запись за этот день и пользователя
-        existing_stat = UserStatistic.query.filter_by(id_User=user_id, date=date_obj).first()
+        # Значения за день суммируются с уже сохранёнными
+        apply_statistic_records(user_id, [record])
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Статистика обновлена'}), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
-        if existing_stat:
-            # Если запись есть — суммируем значения
-            existing_stat.calories += data['calories']
-            existing_stat.steps += data['steps']
-            existing_stat.distance += data['distance']
-        else:
-            # Если записи нет — создаём новую
-            new_stat = UserStatistic(
-                id_User=user_id,
-                calories=data['calories'],
-                steps=data['steps'],
-                distance=data['distance'],
-                date=date_obj
-            )
-            db.session.add(new_stat)
+@app.route('/api/user_statistic/batch', methods=['POST'])
+@token_required
+def add_user_statistic_batch(user_id):
+    # Офлайн-синхронизация: {"records": [{"date", "calories", "steps", "distance",
+    # "idempotency_key"}, ...]} - все записи применяются одной транзакцией
+    data = request.get_json()
+    items = data.get('records') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'records must be a non-empty list'}), 400
+    if len(items) > STATISTICS_BATCH_MAX:
+        return jsonify({'error': f'At most {STATISTICS_BATCH_MAX} records per batch'}), 400
+
+    records = []
+    for index, item in enumerate(items):
+        record = parse_statistic_record(item)
+        if isinstance(record, str):
+            return jsonify({'error': record, 'index': index}), 400
+        records.append(record)
 
+    try:
+        applied, duplicates = apply_statistic_records(user_id, records)
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Статистика обновлена'}), 201
+        return jsonify({'success': True, 'applied': applied, 'duplicates': duplicates}), 201
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/user_statistic', methods=['GET'])
 @token_required
 def get_user_statistics(user_id):
-    date_str = request.args.get('date')  # опциональный параметр ?date=2025-06-14
-
+    # Параметры: ?date=2025-06-14 или диапазон ?from=&to=, постранично:
+    # ?limit=&before=<значение заголовка X-Next-Cursor>
     try:
-        if date_str:
-            date = datetime.strptime(date_str, '%Y-%m-%d').date()
-            stats = UserStatistic.query.filter_by(id_User=user_id, date=date).all()
-        else:
-            stats = UserStatistic.query.filter_by(id_User=user_id).order_by(UserStatistic.date.desc()).all()
+        date = parse_date_arg('date')
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to')
+        before = parse_date_arg('before')
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+
+    limit = parse_page_limit(request.args.get('limit'), default=STATISTICS_PAGE_SIZE, maximum=STATISTICS_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    version, updated_at = statistics_version(user_id)
+    etag = version_etag('statistics', user_id, version)
+    cached = not_modified(etag, updated_at)
+    if cached is not None:
+        return cached
 
-        result = [{
+    try:
+        query = UserStatistic.query.filter_by(id_User=user_id)
+        if date:
+            query = query.filter(UserStatistic.date == date)
+        if date_from:
+            query = query.filter(UserStatistic.date >= date_from)
+        if date_to:
+            query = query.filter(UserStatistic.date <= date_to)
+        if before:
+            query = query.filter(UserStatistic.date < before)
+        # Только нужные колонки: строки не превращаются в объекты модели
+        stats = query.with_entities(UserStatistic.calories, UserStatistic.steps, UserStatistic.distance,
+                                    UserStatistic.date) \
+            .order_by(UserStatistic.date.desc()).limit(limit + 1).all()
+
+        response = with_version(json_list(stats[:limit], lambda s: {
             'calories': s.calories,
             'steps': s.steps,
             'distance': s.distance,
-            'date': s.date.strftime('%Y-%m-%d')
-        } for s in stats]
+            'date': s.date
+        }), etag, updated_at)
+        if len(stats) > limit:
+            response.headers['X-Next-Cursor'] = stats[limit - 1].date.isoformat()
+        return response, 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/user_statistic/summary', methods=['GET'])
+@token_required
+def get_user_statistics_summary(user_id):
+    # ?granularity=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD (по умолчанию - последние 7 дней)
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day',) + ROLLUP_GRANULARITIES:
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+
+    try:
+        date_to = parse_date_arg('to', datetime.utcnow().date())
+        date_from = parse_date_arg('from', date_to - timedelta(days=6))
+    except ValueError:
+        return jsonify({'error': 'Invalid date, expected YYYY-MM-DD'}), 400
+    if date_from > date_to:
+        return jsonify({'error': 'from must not be after to'}), 400
+    if granularity == 'day' and (date_to - date_from).days >= SUMMARY_MAX_DAYS:
+        return jsonify({'error': f'Range is limited to {SUMMARY_MAX_DAYS} days for daily granularity'}), 400
+
+    # Диапазон по умолчанию сдвигается с датой, поэтому он входит в тег, а Last-Modified не отдаётся
+    version, _ = statistics_version(user_id)
+    etag = version_etag('statistics-summary', user_id, version, date_from, date_to)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    sums = (db.func.sum(UserStatistic.calories), db.func.sum(UserStatistic.steps),
+            db.func.sum(UserStatistic.distance), db.func.count(UserStatistic.id))
+    buckets = {}
+
+    if granularity == 'day':
+        rows = db.session.query(UserStatistic.date, *sums) \
+            .filter(UserStatistic.id_User == user_id, UserStatistic.date.between(date_from, date_to)) \
+            .group_by(UserStatistic.date).all()
+        for day, calories, steps, distance, days in rows:
+            buckets[day] = (calories, steps, distance, days)
+        starts = [date_from + timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+    else:
+        # Полные периоды берём из готовых сумм, обрезанные края диапазона - из дневных записей
+        starts, full, partial = [], [], []
+        start = period_start(date_from, granularity)
+        while start <= date_to:
+            end = period_end(start, granularity)
+            starts.append(start)
+            if start >= date_from and end <= date_to:
+                full.append(start)
+            else:
+                partial.append((start, max(start, date_from), min(end, date_to)))
+            start = end + timedelta(days=1)
+
+        if full:
+            rollups = UserStatisticRollup.query.filter(
+                UserStatisticRollup.id_User == user_id,
+                UserStatisticRollup.granularity == granularity,
+                UserStatisticRollup.period_start.between(full[0], full[-1])
+            ).all()
+            for r in rollups:
+                buckets[r.period_start] = (r.calories, r.steps, r.distance, r.days)
+
+        for start, part_from, part_to in partial:
+            row = db.session.query(*sums) \
+                .filter(UserStatistic.id_User == user_id, UserStatistic.date.between(part_from, part_to)).one()
+            if row[3]:
+                buckets[start] = tuple(row)
+
+    result = []
+    total = {'calories': 0.0, 'steps': 0, 'distance': 0.0, 'days': 0}
+    for start in starts:
+        calories, steps, distance, days = buckets.get(start, (0.0, 0, 0.0, 0))
+        item = {'start': start, 'calories': calories or 0.0, 'steps': steps or 0,
+                'distance': distance or 0.0, 'days': days or 0}
+        for key in total:
+            total[key] += item[key]
+        result.append(item)
+
+    return with_version(jsonify({
+        'granularity': granularity,
+        'from': date_from,
+        'to': date_to,
+        'buckets': result,
+        'total': total
+    }), etag), 200
+
+def track_summary(track):
+    return {
+        'id': track.id,
+        'user_id': track.id_User,
+        'name': track.name,
+        'created_at': track.created_at,
+        'started_at': track.started_at,
+        'finished_at': track.finished_at,
+        'point_count': track.point_count,
+        'distance': track.distance,
+        'elevation_gain': track.elevation_gain,
+        'bbox': [track.min_lat, track.min_lon, track.max_lat, track.max_lon],
+        'start': [track.start_lat, track.start_lon]
+    }
+
+def new_track(user_id, name, parsed, lods=None):
+    # Track с уровнями упрощения из tracks.TrackBuilder (загрузка GPX, запись совместной пробежки);
+    # lods - уже посчитанные parsed.lods()
+    track = Track(
+        id_User=user_id,
+        name=name,
+        started_at=parsed.started_at,
+        finished_at=parsed.finished_at,
+        point_count=parsed.count,
+        distance=parsed.distance,
+        elevation_gain=parsed.elevation_gain,
+        min_lat=parsed.min_lat, min_lon=parsed.min_lon,
+        max_lat=parsed.max_lat, max_lon=parsed.max_lon,
+        start_lat=parsed.start[0], start_lon=parsed.start[1],
+        polyline=parsed.polyline,
+        elevations=parsed.elevations,
+        times=parsed.times
+    )
+    for tolerance, count, polyline in (parsed.lods() if lods is None else lods):
+        track.lods.append(TrackLod(tolerance=tolerance, point_count=count, polyline=polyline))
+    return track
+
+# Тело запроса больше этого размера копится во временном файле, а не в памяти
+UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+def parse_track_upload(stream):
+    # Разбор GPX и уровни упрощения - секунды CPU на большом файле, поэтому в потоке ОС
+    parsed = tracks.parse_gpx(stream)
+    return parsed, list(parsed.lods())
+
+@app.route('/api/tracks', methods=['POST'])
+@token_required
+def upload_track(user_id):
+    # GPX принимается либо телом запроса (Content-Type: application/gpx+xml),
+    # либо multipart-полем "file". Файл читается потоком, без построения DOM
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    if request.mimetype == 'multipart/form-data' and upload is None:
+        return jsonify({'error': 'File field "file" is required'}), 400
+    if upload is not None:
+        stream = upload.stream
+    else:
+        # Сокет читается только из зелёного потока: тело сначала копируется во временный файл
+        stream = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE)
+        shutil.copyfileobj(request.stream, stream)
+        stream.seek(0)
 
-        return jsonify(result), 200
+    try:
+        parsed, lods = offload.execute(parse_track_upload, stream)
+    except tracks.GpxError as e:
+        return jsonify({'error': str(e)}), 400
+    finally:
+        if upload is None:
+            stream.close()
+
+    name = request.args.get('name')
+    if upload is not None:
+        name = name or request.form.get('name') or parsed.name or upload.filename
+    try:
+        track = new_track(user_id, name or parsed.name, parsed, lods)
+        db.session.add(track)
+        db.session.commit()
     except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+    return jsonify(track_summary(track)), 201
+
+@app.route('/api/tracks', methods=['GET'])
+@token_required
+def get_tracks(user_id):
+    # Список своих треков без точек, новые первыми: ?limit=&before_id=
+    limit = parse_page_limit(request.args.get('limit'), default=CHATS_PAGE_SIZE, maximum=CHATS_PAGE_MAX)
+    before_id = request.args.get('before_id', type=int)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    # Точки в списке не нужны - не читаем их из БД
+    query = Track.query.filter_by(id_User=user_id).options(defer(Track.polyline), defer(Track.elevations))
+    if before_id:
+        query = query.filter(Track.id < before_id)
+    items = query.order_by(Track.id.desc()).limit(limit + 1).all()
+
+    response = jsonify([track_summary(t) for t in items[:limit]])
+    if len(items) > limit:
+        response.headers['X-Next-Cursor'] = str(items[limit - 1].id)
+    return response, 200
+
+@app.route('/api/tracks/<int:track_id>', methods=['GET'])
+@token_required
+def get_track(user_id, track_id):
+    # ?tolerance=<м> - упрощённая версия: самый грубый уровень с допуском не больше
+    # запрошенного (без параметра или при слишком малом допуске - все точки)
+    tolerance = request.args.get('tolerance')
+    if tolerance is not None:
+        try:
+            tolerance = float(tolerance)
+        except ValueError:
+            return jsonify({'error': 'Invalid tolerance'}), 400
+
+    track = db.session.get(Track, track_id)
+    if track is None:
+        return jsonify({'error': 'Track not found'}), 404
+    result = track_summary(track)
+
+    lod = None
+    if tolerance:
+        lod = track.lods.filter(TrackLod.tolerance <= tolerance).order_by(TrackLod.tolerance.desc()).first()
+    if lod is not None:
+        # Высоты отдаются только вместе с полным треком
+        result.update({'tolerance': lod.tolerance, 'polyline': lod.polyline,
+                       'polyline_points': lod.point_count, 'elevations': None})
+    else:
+        result.update({'tolerance': 0, 'polyline': track.polyline,
+                       'polyline_points': track.point_count, 'elevations': track.elevations,
+                       'times': track.times})
+    return jsonify(result), 200
+
+# Поиск треков по карте: радиус по умолчанию и максимальный (м), размер выдачи
+NEARBY_RADIUS = 5000
+NEARBY_RADIUS_MAX = 50000
+TRACKS_AREA_PAGE_SIZE = 50
+TRACKS_AREA_PAGE_MAX = 200
+
+def parse_coordinate_args(*names):
+    # Список float по именам параметров или None, если какой-то не задан или неверен
+    try:
+        values = [float(request.args[name]) for name in names]
+    except (KeyError, ValueError):
+        return None
+    return values if all(math.isfinite(v) for v in values) else None
+
+def valid_box(box):
+    min_lat, min_lon, max_lat, max_lon = box
+    return -90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180
+
+@app.route('/api/tracks/nearby', methods=['GET'])
+@token_required
+def get_tracks_nearby(user_id):
+    # Треки, начинающиеся не дальше radius метров от точки, ближайшие первыми:
+    # ?lat=&lon=&radius=&limit=
+    point = parse_coordinate_args('lat', 'lon')
+    if point is None:
+        return jsonify({'error': 'lat and lon are required'}), 400
+    lat, lon = point
+    try:
+        radius = float(request.args.get('radius', NEARBY_RADIUS))
+    except ValueError:
+        return jsonify({'error': 'Invalid radius'}), 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or not 0 < radius <= NEARBY_RADIUS_MAX:
+        return jsonify({'error': f'Invalid coordinates or radius (max {NEARBY_RADIUS_MAX} m)'}), 400
+    limit = parse_page_limit(request.args.get('limit'), default=TRACKS_AREA_PAGE_SIZE, maximum=TRACKS_AREA_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    # Грубый отбор по прямоугольнику вокруг круга, затем точное расстояние
+    min_lat, min_lon, max_lat, max_lon = box = spatial_index.bbox_around(lat, lon, radius)
+    query = db.session.query(Track.id, Track.start_lat, Track.start_lon)
+    if spatial_index_enabled:
+        query = query.filter(Track.id.in_(spatial_index.start_candidates(box)))
+    else:
+        query = query.filter(Track.start_lat.between(min_lat, max_lat), Track.start_lon.between(min_lon, max_lon))
+
+    distances = {}
+    for track_id, start_lat, start_lon in query:
+        distance = tracks.haversine(lat, lon, start_lat, start_lon)
+        if distance <= radius:
+            distances[track_id] = distance
+    nearest = sorted(distances, key=lambda track_id: (distances[track_id], track_id))[:limit]
+
+    items = {t.id: t for t in Track.query.filter(Track.id.in_(nearest))
+             .options(defer(Track.polyline), defer(Track.elevations))} if nearest else {}
+    result = []
+    for track_id in nearest:
+        item = track_summary(items[track_id])
+        item['distance_to_start'] = round(distances[track_id], 1)
+        result.append(item)
+    return jsonify(result), 200
+
+def track_bbox_candidates(box, before_id, limit):
+    # Треки, габариты которых пересекаются с прямоугольником, по убыванию id
+    min_lat, min_lon, max_lat, max_lon = box
+    query = Track.query.options(defer(Track.elevations))
+    if spatial_index_enabled:
+        ids = spatial_index.bbox_candidate_ids(db.session, box, before_id, limit)
+        if not ids:
+            return []
+        items = {t.id: t for t in query.filter(Track.id.in_(ids))}
+        return [items[i] for i in ids if i in items]
+    return query.filter(
+        Track.min_lat <= max_lat, Track.max_lat >= min_lat,
+        Track.min_lon <= max_lon, Track.max_lon >= min_lon,
+        Track.id < before_id
+    ).order_by(Track.id.desc()).limit(limit).all()
+
+def track_passes_through(track, box):
+    min_lat, min_lon, max_lat, max_lon = box
+    if min_lat <= track.min_lat and track.max_lat <= max_lat and min_lon <= track.min_lon and track.max_lon <= max_lon:
+        return True
+    return any(min_lat <= p_lat <= max_lat and min_lon <= p_lon <= max_lon
+               for p_lat, p_lon in tracks.decode_polyline(track.polyline))
+
+@app.route('/api/tracks/bbox', methods=['GET'])
+@token_required
+def get_tracks_in_bbox(user_id):
+    # Треки, проходящие через прямоугольник, новые первыми:
+    # ?min_lat=&min_lon=&max_lat=&max_lon=&limit=&before_id=<X-Next-Cursor>
+    box = parse_coordinate_args('min_lat', 'min_lon', 'max_lat', 'max_lon')
+    if box is None or not valid_box(box):
+        return jsonify({'error': 'min_lat, min_lon, max_lat, max_lon are required'}), 400
+    limit = parse_page_limit(request.args.get('limit'), default=TRACKS_AREA_PAGE_SIZE, maximum=TRACKS_AREA_PAGE_MAX)
+    if limit is None:
+        return jsonify({'error': 'Invalid limit'}), 400
+    before_id = request.args.get('before_id', type=int) or 2 ** 63 - 1
+
+    found = []
+    while len(found) <= limit:
+        chunk = max(limit * 2, 32)
+        candidates = track_bbox_candidates(box, before_id, chunk)
+        # Пересечение габаритов ещё не значит, что маршрут заходит в прямоугольник
+        found.extend(t for t in candidates if track_passes_through(t, box))
+        if len(candidates) < chunk:
+            break
+        before_id = candidates[-1].id
+
+    response = jsonify([track_summary(t) for t in found[:limit]])
+    if len(found) > limit:
+        response.headers['X-Next-Cursor'] = str(found[limit - 1].id)
+    return response, 200
+
+# Граф открывается при первом запросе; файлы отображаются в память,
+# поэтому после fork воркеры делят одни и те же страницы
+routing_graph = None
+
+def get_routing_graph():
+    global routing_graph
+    if routing_graph is None and app.config['ROUTING_GRAPH']:
+        routing_graph = routing.RoutingGraph.load(app.config['ROUTING_GRAPH'])
+    return routing_graph
+
+@app.route('/api/route', methods=['GET'])
+@token_required
+def get_route(user_id):
+    # Пеший маршрут: ?from_lat=&from_lon=&to_lat=&to_lon=&mode=walking|running
+    points = parse_coordinate_args('from_lat', 'from_lon', 'to_lat', 'to_lon')
+    if points is None:
+        return jsonify({'error': 'from_lat, from_lon, to_lat, to_lon are required'}), 400
+    mode = request.args.get('mode', 'walking')
+    if mode not in routing.SPEEDS:
+        return jsonify({'error': f"mode must be one of: {', '.join(routing.SPEEDS)}"}), 400
+
+    graph = get_routing_graph()
+    if graph is None:
+        return jsonify({'error': 'Routing is not configured'}), 503
+    try:
+        return jsonify(graph.route(*points, mode=mode)), 200
+    except routing.RoutingError as e:
+        return jsonify({'error': str(e)}), 404
+
+# Сегменты: ограничения на геометрию и пачки фоновой обработки
+SEGMENT_MIN_DISTANCE = 50  # м
+SEGMENT_MAX_POINTS = 5000
+SEGMENT_MATCH_TRACKS = 20  # треков за один проход фоновой задачи
+SEGMENT_BACKFILL_TRACKS = 200  # старых треков на новый сегмент за один проход
+LEADERBOARD_PAGE_SIZE = 50
+LEADERBOARD_PAGE_MAX = 200
+
+def segment_points(segment):
+    points = np.asarray(tracks.decode_polyline(segment.polyline)).reshape(-1, 2)
+    return points[:, 0], points[:, 1]
+
+def find_segment_efforts(track, candidates):
+    # Проходы трека по сегментам-кандидатам - только вычисления, без записи в БД:
+    # [(segment, start_index, end_index, elapsed, started_at)]. Без времени точек проход не посчитать
+    if not track.times or not candidates:
+        return []
+    lat, lon, offsets = segments.decode_track(track.polyline, track.times)
+    efforts = []
+    for segment in candidates:
+        found = segments.best_effort(lat, lon, offsets, *segment_points(segment))
+        if found is None:
+            continue
+        start_index, end_index, elapsed = found
+        started_at = track.started_at + timedelta(seconds=float(offsets[start_index])) if track.started_at else None
+        efforts.append((segment, start_index, end_index, elapsed, started_at))
+    return efforts
+
+def save_segment_efforts(track, efforts):
+    # Сохраняет новые проходы и лучшие результаты
+    saved = 0
+    for segment, start_index, end_index, elapsed, started_at in efforts:
+        effort = upsert(SegmentEffort.__table__).values(
+            segment_id=segment.id, track_id=track.id, id_User=track.id_User, elapsed=elapsed,
+            started_at=started_at, start_index=start_index, end_index=end_index
+        ).on_conflict_do_nothing(index_elements=['segment_id', 'track_id']).returning(SegmentEffort.__table__.c.id)
+        if db.session.execute(effort).first() is None:
+            continue  # этот трек уже учтён
+
+        table = SegmentBest.__table__
+        stmt = upsert(table).values(segment_id=segment.id, id_User=track.id_User, elapsed=elapsed,
+                                    track_id=track.id, started_at=started_at, efforts=1)
+        faster = stmt.excluded.elapsed < table.c.elapsed
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['segment_id', 'id_User'], set_={
+            'elapsed': db.case((faster, stmt.excluded.elapsed), else_=table.c.elapsed),
+            'track_id': db.case((faster, stmt.excluded.track_id), else_=table.c.track_id),
+            'started_at': db.case((faster, stmt.excluded.started_at), else_=table.c.started_at),
+            'efforts': table.c.efforts + 1,
+        }))
+        saved += 1
+    return saved
+
+def match_track_with_segments(track, candidates):
+    return save_segment_efforts(track, find_segment_efforts(track, candidates))
+
+def segments_for_track(track):
+    # Сегменты, которые целиком помещаются в габариты трека (с допуском)
+    box = spatial_index.expand_box((track.min_lat, track.min_lon, track.max_lat, track.max_lon),
+                                   segments.MATCH_TOLERANCE)
+    if spatial_index_enabled:
+        ids = spatial_index.segments_inside_ids(db.session, box)
+        return Segment.query.filter(Segment.id.in_(ids)).all() if ids else []
+    min_lat, min_lon, max_lat, max_lon = box
+    return Segment.query.filter(Segment.min_lat >= min_lat, Segment.max_lat <= max_lat,
+                                Segment.min_lon >= min_lon, Segment.max_lon <= max_lon).all()
+
+def tracks_for_segment(segment, after_id, limit):
+    # Треки, габариты которых накрывают сегмент (с допуском), по возрастанию id
+    box = spatial_index.expand_box((segment.min_lat, segment.min_lon, segment.max_lat, segment.max_lon),
+                                   -segments.MATCH_TOLERANCE)
+    if spatial_index_enabled:
+        ids = spatial_index.tracks_covering_ids(db.session, box, after_id, limit)
+        return Track.query.filter(Track.id.in_(ids)).order_by(Track.id).all() if ids else []
+    min_lat, min_lon, max_lat, max_lon = box
+    return Track.query.filter(Track.min_lat <= min_lat, Track.max_lat >= max_lat,
+                              Track.min_lon <= min_lon, Track.max_lon >= max_lon,
+                              Track.id > after_id).order_by(Track.id).limit(limit).all()
+
+def run_segment_matching():
+    # Один проход фоновой обработки; True - работа ещё осталась.
+    # Трек сначала "захватывается" отдельной транзакцией: условный UPDATE увеличивает
+    # счётчик попыток, поэтому несколько воркеров не делают работу дважды, а ошибка
+    # сопоставления не откатывает захват. Ошибки пишутся в лог по каждому треку и
+    # сегменту, и проход идёт дальше; после SEGMENT_MATCH_ATTEMPTS неудач строка
+    # помечается обработанной, чтобы не занимать очередь. Если процесс упадёт между
+    # захватом и сохранением, трек останется в очереди и возьмётся снова
+    max_attempts = app.config['SEGMENT_MATCH_ATTEMPTS']
+    with app.app_context():
+        pending = db.session.query(Track.id, Track.segment_match_attempts) \
+            .filter(Track.segments_matched_at.is_(None)).order_by(Track.id).limit(SEGMENT_MATCH_TRACKS).all()
+        db.session.commit()
+        for track_id, attempts in pending:
+            claimed = db.session.execute(
+                db.update(Track).where(Track.id == track_id, Track.segments_matched_at.is_(None),
+                                       Track.segment_match_attempts == attempts)
+                .values(segment_match_attempts=attempts + 1)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                continue
+            try:
+                track = db.session.get(Track, track_id)
+                match_track_with_segments(track, segments_for_track(track))
+                track.segments_matched_at = datetime.utcnow()
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                if attempts + 1 < max_attempts:
+                    log.exception('segment matching failed for track %s (attempt %d of %d)',
+                                  track_id, attempts + 1, max_attempts)
+                    continue
+                log.exception('segment matching gave up on track %s after %d attempts', track_id, attempts + 1)
+                db.session.execute(db.update(Track).where(Track.id == track_id)
+                                   .values(segments_matched_at=datetime.utcnow()))
+                db.session.commit()
+
+        # Сначала id по индексу matched_at, затем строка по ключу - иначе SQLite
+        # может выбрать просмотр всей таблицы в порядке id
+        segment_id = db.session.query(Segment.id).filter(Segment.matched_at.is_(None)) \
+            .order_by(Segment.id).limit(1).scalar()
+        segment = db.session.get(Segment, segment_id) if segment_id is not None else None
+        if segment is not None:
+            failures = segment.match_failures
+            try:
+                cursor = segment.match_cursor
+                found = tracks_for_segment(segment, cursor, SEGMENT_BACKFILL_TRACKS)
+                for track in found:
+                    # Испорченный трек пропускается (его собственный проход считает попытки),
+                    # а не останавливает сопоставление сегмента со всеми остальными
+                    try:
+                        efforts = find_segment_efforts(track, [segment])
+                    except Exception:
+                        log.exception('segment %s: skipping track %s', segment.id, track.id)
+                        continue
+                    save_segment_efforts(track, efforts)
+                done = len(found) < SEGMENT_BACKFILL_TRACKS
+                db.session.execute(
+                    db.update(Segment).where(Segment.id == segment.id, Segment.match_cursor == cursor)
+                    .values(match_cursor=found[-1].id if found else cursor,
+                            matched_at=datetime.utcnow() if done else None, match_failures=0)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                failures += 1
+                gave_up = failures >= max_attempts
+                if gave_up:
+                    log.exception('segment backfill gave up on segment %s after %d failures', segment_id, failures)
+                else:
+                    log.exception('segment backfill failed for segment %s (attempt %d of %d)',
+                                  segment_id, failures, max_attempts)
+                db.session.execute(
+                    db.update(Segment).where(Segment.id == segment_id)
+                    .values(match_failures=failures, matched_at=datetime.utcnow() if gave_up else None)
+                )
+                db.session.commit()
+        return len(pending) == SEGMENT_MATCH_TRACKS or segment is not None
+
+def segment_matching_loop():
+    while True:
+        try:
+            busy = run_segment_matching()
+        except Exception:
+            log.exception('segment matching failed')
+            busy = False
+        socketio.sleep(0 if busy else app.config['SEGMENT_MATCH_INTERVAL'])
+
+def segment_summary(segment):
+    return {
+        'id': segment.id,
+        'user_id': segment.id_User,
+        'name': segment.name,
+        'created_at': segment.created_at,
+        'point_count': segment.point_count,
+        'distance': segment.distance,
+        'bbox': [segment.min_lat, segment.min_lon, segment.max_lat, segment.max_lon],
+        'polyline': segment.polyline,
+        'matching': segment.matched_at is None
+    }
+
+@app.route('/api/segments', methods=['POST'])
+@token_required
+def create_segment(user_id):
+    # {"name", "points": [[lat, lon], ...]} или участок своего трека:
+    # {"name", "track_id", "from_index", "to_index"}
+    data = request.get_json(silent=True) or {}
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({'error': 'name is required'}), 400
+
+    if 'track_id' in data:
+        track = db.session.get(Track, data.get('track_id')) if isinstance(data.get('track_id'), int) else None
+        if track is None or track.id_User != user_id:
+            return jsonify({'error': 'Track not found'}), 404
+        points = tracks.decode_polyline(track.polyline)
+        start, end = data.get('from_index', 0), data.get('to_index', len(points) - 1)
+        if not (isinstance(start, int) and isinstance(end, int) and 0 <= start < end < len(points)):
+            return jsonify({'error': 'Invalid from_index/to_index'}), 400
+        points = points[start:end + 1]
+    else:
+        points = data.get('points')
+        try:
+            points = [(float(lat), float(lon)) for lat, lon in points]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'points must be a list of [lat, lon]'}), 400
+
+    if not 2 <= len(points) <= SEGMENT_MAX_POINTS:
+        return jsonify({'error': f'Segment must have 2..{SEGMENT_MAX_POINTS} points'}), 400
+    builder = tracks.TrackBuilder()
+    try:
+        for lat, lon in points:
+            builder.add_point(lat, lon)
+    except tracks.GpxError as e:
+        return jsonify({'error': str(e)}), 400
+    if builder.distance < SEGMENT_MIN_DISTANCE:
+        return jsonify({'error': f'Segment must be at least {SEGMENT_MIN_DISTANCE} m long'}), 400
+
+    # С уже загруженными треками сегмент сопоставляется в фоне
+    segment = Segment(
+        id_User=user_id, name=name[:255], point_count=builder.count, distance=builder.distance,
+        min_lat=builder.min_lat, min_lon=builder.min_lon, max_lat=builder.max_lat, max_lon=builder.max_lon,
+        polyline=builder.polyline
+    )
+    try:
+        db.session.add(segment)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
+    return jsonify(segment_summary(segment)), 201
+
+@app.route('/api/segments/<int:segment_id>', methods=['GET'])
+@token_required
+def get_segment(user_id, segment_id):
+    segment = db.session.get(Segment, segment_id)
+    if segment is None:
+        return jsonify({'error': 'Segment not found'}), 404
+    return jsonify(segment_summary(segment)), 200
+
+@app.route('/api/segments/<int:segment_id>/leaderboard', methods=['GET'])
+@token_required
+def get_segment_leaderboard(user_id, segment_id):
+    # Лучшие результаты пользователей из segment_best: ?limit=&offset=
+    segment = db.session.get(Segment, segment_id)
+    if segment is None:
+        return jsonify({'error': 'Segment not found'}), 404
+    limit = parse_page_limit(request.args.get('limit'), default=LEADERBOARD_PAGE_SIZE, maximum=LEADERBOARD_PAGE_MAX)
+    offset = request.args.get('offset', 0, type=int)
+    if limit is None or offset < 0:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+
+    rows = db.session.query(SegmentBest, UserInfo.name).outerjoin(
+        UserInfo, UserInfo.id_User == SegmentBest.id_User
+    ).filter(SegmentBest.segment_id == segment_id).order_by(
+        SegmentBest.elapsed.asc(), SegmentBest.id_User.asc()
+    ).limit(limit).offset(offset).all()
+
+    result = [{
+        'rank': offset + index + 1,
+        'user_id': best.id_User,
+        'name': name,
+        'elapsed': best.elapsed,
+        'track_id': best.track_id,
+        'started_at': best.started_at,
+        'efforts': best.efforts
+    } for index, (best, name) in enumerate(rows)]
+
+    mine = db.session.get(SegmentBest, (segment_id, user_id))
+    my_rank = None
+    if mine is not None:
+        my_rank = SegmentBest.query.filter(
+            SegmentBest.segment_id == segment_id,
+            db.or_(SegmentBest.elapsed < mine.elapsed,
+                   db.and_(SegmentBest.elapsed == mine.elapsed, SegmentBest.id_User < user_id))
+        ).count() + 1
+    return jsonify({'segment': segment_summary(segment), 'entries': result, 'my_rank': my_rank}), 200
+
+@app.route('/api/tracks/<int:track_id>/efforts', methods=['GET'])
+@token_required
+def get_track_efforts(user_id, track_id):
+    track = db.session.get(Track, track_id)
+    if track is None:
+        return jsonify({'error': 'Track not found'}), 404
+    rows = db.session.query(SegmentEffort, Segment.name).join(
+        Segment, Segment.id == SegmentEffort.segment_id
+    ).filter(SegmentEffort.track_id == track_id).order_by(SegmentEffort.start_index).all()
+    return jsonify({
+        'matching': track.segments_matched_at is None,
+        'efforts': [{
+            'segment_id': effort.segment_id,
+            'segment_name': name,
+            'elapsed': effort.elapsed,
+            'started_at': effort.started_at,
+            'start_index': effort.start_index,
+            'end_index': effort.end_index
+        } for effort, name in rows]
+    }), 200
 
 # Создание или обновление профиля
 @app.route('/api/user_info', methods=['POST'])
@@ -633,7 +2653,11 @@ def update_user_info(user_id):
         return jsonify({"error": "Missing fields"}), 400
 
     user_info = UserInfo.query.filter_by(id_User=user_id).first()
+    # Имя видно в истории и списке участников чатов - их версии тоже сдвигаются
+    name_changed = user_info is None or user_info.name != data['name']
     if user_info:
+        user_info.version = UserInfo.version + 1
+        user_info.updated_at = datetime.utcnow()
         user_info.name = data['name']
         user_info.weight = data['weight']
         user_info.height = data['height']
@@ -649,8 +2673,12 @@ def update_user_info(user_id):
             sex=data['sex'],
             Age=data['age'],
             Country=data['country'],
+            updated_at=datetime.utcnow(),
         )
         db.session.add(user_info)
+    if name_changed:
+        bump_chat_versions(GroupChat.id.in_(
+            db.select(UserGroupChatAssociation.chat_id).where(UserGroupChatAssociation.user_id == user_id)))
 
     db.session.commit()
     return jsonify({"success": True}), 200
@@ -671,13 +2699,17 @@ def register():
             if not ( password or email):
                 return jsonify({'success': True,'message': 'Пожалуйста заполните поля'}), 201
             else:
-                hash_pwd=generate_password_hash(password)
+                try:
+                    hash_pwd = password_hasher.hash(password)
+                except password_hashing.HasherBusy:
+                    return hasher_busy()
                 new_user=User(password = hash_pwd, email=email)
                 try:
                     db.session.add(new_user)
                     db.session.commit()
                     return jsonify({'success': True, 'message' : 'Пользователь зарегестрирован'}), 201
                 except:
+                    db.session.rollback()
                     return jsonify({'success': True,'message': 'Ошибка при регистрации пользователя'}), 201
     else:
         return jsonify({'success': True,'message': 'Ошибка при отправке запроса'}), 201
@@ -688,8 +2720,327 @@ def logout(user_id):
     logout_user()
     return jsonify({'message': 'Logged out successfully'}), 200
 
+# Синхронизация по журналу изменений: GET /api/sync?since=<cursor> отдаёт текущее
+# состояние только тех дружб, чатов, сообщений и дней статистики, что менялись после
+# курсора, - работа пропорциональна числу изменений, а не размеру аккаунта.
+# Без since отдаётся только текущий курсор: клиент запоминает его, загружает списки
+# обычными эндпоинтами и дальше спрашивает изменения. has_more - взята не вся
+# порция, повторить с новым курсором; reset - журнал за курсором уже очищен
+# (SYNC_RETENTION_DAYS), нужна полная загрузка.
+# id журнала идут в порядке фиксации транзакций: в SQLite записи сериализованы и так,
+# в Postgres - блокировкой в record_changes. Иначе курсор мог бы перескочить запись
+# транзакции, которая взяла id раньше, а зафиксировалась позже
+SYNC_PAGE_SIZE = 500
+
+def load_sync_entities(user_id, rows):
+    friendship_ids, chat_ids, message_ids, days = set(), set(), set(), set()
+    for row in rows:
+        if row.entity == 'friendship':
+            friendship_ids.add(row.entity_id)
+        elif row.entity == 'chat':
+            chat_ids.add(row.entity_id)
+        elif row.entity == 'message':
+            chat_ids.add(row.chat_id)
+            message_ids.add(row.entity_id)
+        elif row.entity == 'statistic':
+            days.add(row.day)
+
+    friendships = []
+    if friendship_ids:
+        other_id = db.case((Friendship.user_id == user_id, Friendship.friend_id), else_=Friendship.user_id)
+        friendships = [{
+            'id': friendship_id, 'user_id': from_id, 'friend_id': to_id, 'status': status,
+            'name': name if name else f"User {other}"
+        } for friendship_id, from_id, to_id, status, other, name in db.session.query(
+            Friendship.id, Friendship.user_id, Friendship.friend_id, Friendship.status, other_id, UserInfo.name)
+            .outerjoin(UserInfo, UserInfo.id_User == other_id)
+            .filter(Friendship.id.in_(friendship_ids),
+                    db.or_(Friendship.user_id == user_id, Friendship.friend_id == user_id))
+            .order_by(Friendship.id)]
+
+    chats, messages = [], []
+    if chat_ids:
+        # Чаты, где пользователя уже нет, уходят в removed_chats
+        chats = GroupChat.query \
+            .join(UserGroupChatAssociation, UserGroupChatAssociation.chat_id == GroupChat.id) \
+            .filter(UserGroupChatAssociation.user_id == user_id, GroupChat.id.in_(chat_ids)) \
+            .order_by(GroupChat.id).all()
+        member_of = [chat.id for chat in chats]
+        if message_ids and member_of:
+            messages = [{
+                'id': msg.id,
+                'chat_id': msg.chat_id,
+                'content': msg.content,
+                'sender_id': msg.sender_id,
+                'sender': name if name else f"User {msg.sender_id}",
+                'timestamp': msg.timestamp
+            } for msg, name in db.session.query(GroupMessage, UserInfo.name)
+                .outerjoin(UserInfo, UserInfo.id_User == GroupMessage.sender_id)
+                .filter(GroupMessage.id.in_(message_ids), GroupMessage.chat_id.in_(member_of))
+                .order_by(GroupMessage.id)]
+
+    statistics = []
+    if days:
+        statistics = [{'calories': calories, 'steps': steps, 'distance': distance, 'date': day}
+                      for calories, steps, distance, day in db.session.query(
+                          UserStatistic.calories, UserStatistic.steps, UserStatistic.distance, UserStatistic.date)
+                      .filter(UserStatistic.id_User == user_id, UserStatistic.date.in_(days))
+                      .order_by(UserStatistic.date.desc())]
+
+    return {
+        'friendships': friendships,
+        'chats': [{
+            'id': chat.id,
+            'title': chat.title,
+            'lastMessage': chat.last_message_preview or '',
+            'lastMessageId': chat.last_message_id,
+            'lastMessageAt': chat.last_message_at
+        } for chat in chats],
+        'removed_chats': sorted(chat_ids - {chat.id for chat in chats}),
+        'messages': messages,
+        'statistics': statistics,
+    }
+
+@app.route('/api/sync', methods=['GET'])
+@token_required
+def sync_changes(user_id):
+    latest = db.session.query(db.func.max(ChangeLog.id)).scalar() or 0
+    since = request.args.get('since')
+    if not since:
+        return jsonify({'cursor': latest, 'has_more': False, 'reset': False}), 200
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    oldest = db.session.query(db.func.min(ChangeLog.id)).scalar()
+    # Курсор старше очищенной части журнала или из другой БД
+    if since < 0 or (oldest is not None and oldest > since + 1) or since > latest > 0:
+        return jsonify({'cursor': latest, 'has_more': False, 'reset': True}), 200
+
+    # Две выборки по индексам (user_id, id) и (chat_id, id), каждая не больше страницы
+    columns = (ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.chat_id, ChangeLog.day)
+    own = db.select(*columns).where(ChangeLog.user_id == user_id, ChangeLog.id > since) \
+        .order_by(ChangeLog.id).limit(SYNC_PAGE_SIZE + 1).subquery()
+    in_chats = db.select(*columns).where(ChangeLog.chat_id.in_(
+        db.select(UserGroupChatAssociation.chat_id).where(UserGroupChatAssociation.user_id == user_id)
+    ), ChangeLog.id > since).order_by(ChangeLog.id).limit(SYNC_PAGE_SIZE + 1).subquery()
+    changes = db.union_all(db.select(own), db.select(in_chats)).subquery()
+    rows = db.session.execute(db.select(changes).order_by(changes.c.id).limit(SYNC_PAGE_SIZE + 1)).all()
+
+    has_more = len(rows) > SYNC_PAGE_SIZE
+    rows = rows[:SYNC_PAGE_SIZE]
+    # Всё до latest просмотрено - курсор сдвигается и за чужие изменения
+    cursor = rows[-1].id if has_more else max(latest, since)
+    return jsonify({'cursor': cursor, 'has_more': has_more, 'reset': False,
+                    **load_sync_entities(user_id, rows)}), 200
+
+def prune_change_log():
+    # Удаляет записи старше SYNC_RETENTION_DAYS. Последняя запись остаётся всегда:
+    # по ней /api/sync отличает очищенный журнал от пустого. Ключи идемпотентности
+    # статистики живут столько же. Возвращает (записей журнала, ключей) удалено
+    cutoff = datetime.utcnow() - timedelta(days=app.config['SYNC_RETENTION_DAYS'])
+    with app.app_context():
+        try:
+            # id и created_at растут вместе - первая свежая запись ищется от начала журнала
+            keep_from = db.session.query(ChangeLog.id).filter(ChangeLog.created_at >= cutoff) \
+                .order_by(ChangeLog.id).limit(1).scalar()
+            if keep_from is None:
+                keep_from = db.session.query(db.func.max(ChangeLog.id)).scalar()
+            deleted = 0
+            if keep_from is not None:
+                deleted = db.session.execute(db.delete(ChangeLog).where(ChangeLog.id < keep_from)).rowcount
+            keys = db.session.execute(db.delete(UserStatisticSyncKey)
+                                      .where(UserStatisticSyncKey.created_at < cutoff)).rowcount
+            db.session.commit()
+            return deleted, keys
+        except Exception:
+            db.session.rollback()
+            raise
+
+def change_log_pruning_loop():
+    while True:
+        try:
+            deleted, keys = prune_change_log()
+            if deleted or keys:
+                log.info('change log: %d old entries and %d statistic sync keys removed', deleted, keys)
+        except Exception:
+            log.exception('change log pruning failed')
+        socketio.sleep(app.config['SYNC_PRUNE_INTERVAL'])
+
+# Пакетный запрос: несколько вызовов API за один круг по сети
+# {"requests": [{"id": "info", "method": "GET", "path": "/api/user_info?x=1",
+#                "headers": {"If-None-Match": "..."}, "body": {...}}, ...], "parallel": false}
+# Токен проверяется один раз, подзапросы выполняются существующими обработчиками по
+# порядку в одной сессии БД. С "parallel": true подряд идущие GET выполняются
+# одновременно в потоках ОС (у каждого своя сессия), записи остаются границами порядка.
+BATCH_MAX_REQUESTS = 20
+BATCH_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# Заголовки подзапроса, которые видит обработчик, и заголовки ответа, которые получает клиент
+BATCH_REQUEST_HEADERS = ('If-None-Match', 'If-Modified-Since')
+BATCH_RESPONSE_HEADERS = ('ETag', 'Last-Modified', 'Cache-Control', 'X-Next-Cursor', 'Retry-After')
+
+def parse_batch_item(index, item):
+    # Подзапрос в виде dict или строка с ошибкой
+    if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+        return 'path is required'
+    # Только API: служебные адреса (/metrics и т. п.) проверяют, откуда пришёл запрос
+    if not item['path'].startswith('/api/'):
+        return 'path must start with /api/'
+    method = str(item.get('method', 'GET')).upper()
+    if method not in BATCH_METHODS:
+        return f"method must be one of: {', '.join(BATCH_METHODS)}"
+    headers = item.get('headers') or {}
+    if not isinstance(headers, dict):
+        return 'headers must be an object'
+    headers = {str(name).lower(): str(value) for name, value in headers.items()}
+    return {
+        'id': item.get('id', index),
+        'method': method,
+        'path': item['path'],
+        'headers': {name: headers[name.lower()] for name in BATCH_REQUEST_HEADERS if name.lower() in headers},
+        'body': item.get('body'),
+    }
+
+def batch_environ(sub):
+    # Окружение WSGI подзапроса; строится в контексте пакета - потоки ОС его не видят
+    builder = EnvironBuilder(path=sub['path'], method=sub['method'], base_url=request.host_url,
+                             headers={'Authorization': request.headers['Authorization'], **sub['headers']},
+                             json=sub['body'], environ_base={'REMOTE_ADDR': request.remote_addr})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+def run_batch_item(sub):
+    # Обработчик вызывается напрямую, без before/after_request: замер, сжатие и
+    # освобождение сессии относятся ко всему пакету
+    with app.request_context(sub['environ']):
+        try:
+            if request.url_rule is not None and request.url_rule.endpoint == 'batch':
+                rv = jsonify({'error': 'Nested batch requests are not allowed'}), 400
+            else:
+                try:
+                    rv = app.dispatch_request()
+                except HTTPException as e:
+                    rv = app.handle_http_exception(e)
+                    if isinstance(rv, HTTPException) and rv.code >= 400:
+                        # 404/405 и т. п. без своего обработчика - JSON вместо HTML-страницы
+                        rv = jsonify({'error': rv.description}), rv.code
+                except Exception as e:
+                    # Зарегистрированные обработчики ошибок, остальное - ниже
+                    rv = app.handle_user_exception(e)
+            response = app.make_response(rv)
+        except Exception:
+            db.session.rollback()
+            log.exception('batch sub-request %s %s failed', sub['method'], sub['path'])
+            response = app.make_response((jsonify({'error': 'Internal server error'}), 500))
+        if sub['method'] not in database.READ_METHODS:
+            g.db_primary_only = True
+        return {
+            'id': sub['id'],
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in BATCH_RESPONSE_HEADERS if name in response.headers},
+            'body': response.get_json(silent=True) if response.is_json else response.get_data(as_text=True) or None,
+        }
+
+# Что подзапрос в отдельном контексте берёт из g пакета: проверенный токен,
+# счётчики SQL для /metrics и признак чтения из основной БД
+BATCH_SHARED_G = ('verified_token', 'verified_user_id', 'query_stats', 'db_primary_only')
+
+def run_batch_item_isolated(job):
+    # Для потока ОС: свой контекст приложения и своя сессия - сессия не делится между потоками
+    sub, shared = job
+    with app.app_context():
+        for name, value in shared.items():
+            setattr(g, name, value)
+        return run_batch_item(sub)
+
+@app.route('/api/batch', methods=['POST'])
+@token_required
+def batch(user_id):
+    data = request.get_json(silent=True)
+    items = data.get('requests') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_REQUESTS:
+        return jsonify({'error': f'At most {BATCH_MAX_REQUESTS} requests per batch'}), 400
+    subs = []
+    for index, item in enumerate(items):
+        sub = parse_batch_item(index, item)
+        if isinstance(sub, str):
+            return jsonify({'error': sub, 'index': index}), 400
+        sub['environ'] = batch_environ(sub)
+        subs.append(sub)
+
+    parallel = data.get('parallel') is True
+    results, reads = [], []
+
+    def run_reads():
+        if len(reads) > 1:
+            shared = {name: g.get(name) for name in BATCH_SHARED_G if name in g}
+            jobs = [(sub, shared) for sub in reads]
+            results.extend(offload.map_parallel(run_batch_item_isolated, jobs))
+        else:
+            results.extend(run_batch_item(sub) for sub in reads)
+        reads.clear()
+
+    for sub in subs:
+        if parallel and sub['method'] in database.READ_METHODS:
+            reads.append(sub)
+            continue
+        run_reads()
+        results.append(run_batch_item(sub))
+    run_reads()
+    return jsonify({'responses': results}), 200
+
+def serve(sock):
+    # Соединения пула, открытые до fork, принадлежат родителю - воркер открывает свои
+    with app.app_context():
+        for engine in (db.engine, app.extensions['db_read_engine']):
+            if engine is not None:
+                engine.dispose(close=False)
+    # После fork у воркеров одинаковый host_id менеджера очереди, и сообщения
+    # соседей отбрасываются как собственные - выдаём каждому процессу свой
+    if hasattr(socketio.server.manager, 'host_id'):
+        socketio.server.manager.host_id = uuid.uuid4().hex
+    # То же для потока живых позиций: у каждого воркера свои seq и база разностей
+    live_locations.stream = live_location.new_stream()
+    if app.config['SEGMENT_MATCHING']:
+        socketio.start_background_task(segment_matching_loop)
+    if app.config['SYNC_RETENTION_DAYS'] > 0:
+        socketio.start_background_task(change_log_pruning_loop)
+    socketio.start_background_task(live_locations.run, socketio.sleep)
+    try:
+        eventlet.wsgi.server(sock, app)
+    finally:
+        if message_writer is not None:
+            message_writer.close()
+
 if (__name__)=='__main__':
-    sock = eventlet.listen(('', 5000))
+    logging.basicConfig(level=app.config['LOG_LEVEL'],
+                        format='%(asctime)s %(process)d %(levelname)s %(name)s: %(message)s')
+    sock = eventlet.listen(('', app.config['PORT']))
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    eventlet.wsgi.server(sock, app)
-
+    workers = app.config['WORKERS']
+    queue_url = app.config['SOCKETIO_MESSAGE_QUEUE']
+    if workers > 1:
+        # Несколько процессов на одном сокете. Клиенты должны ходить по websocket
+        # (без long-polling), а комнаты рассылаются через общую шину.
+        if not queue_url or queue_url.startswith('memory://'):
+            raise SystemExit('WORKERS > 1 требует SOCKETIO_MESSAGE_QUEUE (local://, redis://, ...)')
+        if message_writer is not None:
+            raise SystemExit('CHAT_WRITE_MODE=batched поддерживается только с одним воркером')
+
+    # Локальный брокер поднимает родительский процесс, если он не запущен отдельно
+    broker = None
+    if queue_url and queue_url.startswith('local://') and os.environ.get('SOCKETIO_START_BROKER', '1') == '1':
+        broker = LocalBusBroker(queue_url)
+        broker.start()
+    try:
+        if workers > 1:
+            run_workers(workers, lambda: serve(sock))
+        else:
+            serve(sock)
+    finally:
+        if broker is not None:
+            broker.stop()
@@ -0,0 +1,86 @@
+# Сравнение пропускной способности записи сообщений чата:
+# синхронный коммит на каждое сообщение против отложенной пакетной записи.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.chat_write --messages 5000
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_mode(messages):
+    import app as runners
+
+    client = runners.app.test_client()
+    with runners.app.app_context():
+        user = runners.User(email='bench@example.com', password='x')
+        runners.db.session.add(user)
+        runners.db.session.flush()
+        chat = runners.GroupChat(title='bench')
+        runners.db.session.add(chat)
+        runners.db.session.flush()
+        runners.db.session.add(runners.UserGroupChatAssociation(user_id=user.id_User, chat_id=chat.id))
+        runners.db.session.commit()
+        token = runners.generate_jwt(user.id_User)
+        chat_id = chat.id
+
+    sock = runners.socketio.test_client(runners.app, flask_test_client=client, auth={'token': token})
+    sock.emit('join_chat', {'chat_id': chat_id})
+
+    started = time.perf_counter()
+    for i in range(messages):
+        sock.emit('send_message', {'chat_id': chat_id, 'content': f'message {i}'})
+    if runners.message_writer is not None:
+        runners.message_writer.close()
+    elapsed = time.perf_counter() - started
+
+    with runners.app.app_context():
+        stored = runners.GroupMessage.query.filter_by(chat_id=chat_id).count()
+
+    return {
+        'mode': runners.app.config['CHAT_WRITE_MODE'],
+        'messages': messages,
+        'stored': stored,
+        'seconds': round(elapsed, 3),
+        'messages_per_sec': round(messages / elapsed, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--max-delay-ms', type=int, default=20)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.messages)))
+        return
+
+    # Каждый режим - в отдельном процессе и на своей файловой БД,
+    # чтобы учитывать реальную стоимость fsync
+    results = []
+    for mode in ('sync', 'batched'):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ,
+                       DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+                       CHAT_WRITE_MODE=mode,
+                       CHAT_WRITE_BATCH_SIZE=str(args.batch_size),
+                       CHAT_WRITE_MAX_DELAY_MS=str(args.max_delay_ms))
+            out = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.chat_write', '--child', '--messages', str(args.messages)],
+                env=env, capture_output=True, text=True, check=True
+            ).stdout
+            results.append(json.loads(out.strip().splitlines()[-1]))
+
+    for r in results:
+        print(f"{r['mode']:>8}: {r['messages_per_sec']:>10} msg/s  ({r['stored']}/{r['messages']} stored, {r['seconds']} s)")
+
+
+if __name__ == '__main__':
+    main()
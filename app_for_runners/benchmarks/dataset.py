@@ -0,0 +1,256 @@
+# Генератор синтетических данных для бенчмарков: пользователи с профилями,
+# дружбы (соседи по id образуют "районы", поэтому есть общие друзья), групповые
+# чаты с историей сообщений, ежедневная статистика с недельными/месячными суммами,
+# треки со временем точек и сегменты на них.
+# Строки вставляются пачками через DBAPI-соединение SQLite, без ORM.
+#
+# Отдельно заполняет файл БД:
+#     python -m benchmarks.dataset --scale 100k --db /tmp/runners.db
+import argparse
+import bisect
+import itertools
+import math
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+
+SCALES = {
+    'tiny': dict(users=2_000, friends=20, chat_size=20, messages=200_000, statistic_users=2_000,
+                 statistic_days=365, tracks=2_000, segments=50),
+    '10k': dict(users=10_000, friends=30, chat_size=25, messages=2_000_000, statistic_users=10_000,
+                statistic_days=730, tracks=20_000, segments=200),
+    '100k': dict(users=100_000, friends=40, chat_size=30, messages=10_000_000, statistic_users=50_000,
+                 statistic_days=730, tracks=100_000, segments=1_000),
+    '1m': dict(users=1_000_000, friends=50, chat_size=30, messages=30_000_000, statistic_users=100_000,
+               statistic_days=1095, tracks=300_000, segments=5_000),
+}
+BATCH = 50_000
+PASSWORD = 'password'
+# Друзья выбираются среди ближайших FRIEND_WINDOW пользователей по id
+FRIEND_WINDOW = 400
+FIRST_NAMES = ('Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Дмитрий', 'Елена', 'Сергей', 'Наталья', 'Алексей',
+               'Ekaterina', 'John', 'Emma', 'Lukas', 'Sofia', 'Mateo')
+LAST_NAMES = ('Иванов', 'Смирнова', 'Кузнецов', 'Попова', 'Соколов', 'Lebedev', 'Novak', 'Garcia', 'Müller')
+# Центр "города" и его размер в градусах
+CITY = (53.35, 83.75)
+CITY_SIZE = 0.3
+START = datetime(2023, 1, 1)
+
+
+def stamp(moment):
+    # Формат, в котором SQLAlchemy хранит DateTime в SQLite (строки сравниваются как текст)
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def insert(cursor, sql, rows):
+    # rows - итератор; вставляем кусками по BATCH
+    batch, count = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        cursor.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def friend_pairs(users, friends, rng):
+    # Каждая пара (u, v), u < v, порождается один раз - "вперёд" от меньшего id
+    per_user = max(1, friends // 2)
+    for u in range(1, users + 1):
+        window = min(FRIEND_WINDOW, users - u)
+        if window <= 0:
+            continue
+        for offset in rng.sample(range(1, window + 1), min(per_user, window)):
+            yield u, u + offset
+
+
+def chat_plan(users, chat_size, rng):
+    # Чаты из соседних пользователей: [(chat_id, [user_id, ...]), ...]
+    chats = []
+    for chat_id, first in enumerate(range(1, users + 1, chat_size), start=1):
+        members = list(range(first, min(first + chat_size * 2, users + 1)))
+        chats.append((chat_id, rng.sample(members, min(len(members), chat_size))))
+    return chats
+
+
+def track_points(rng, count=120):
+    lat = CITY[0] + rng.uniform(-CITY_SIZE, CITY_SIZE)
+    lon = CITY[1] + rng.uniform(-CITY_SIZE, CITY_SIZE)
+    heading = rng.uniform(0, 6.283)
+    started_at = START + timedelta(days=rng.randrange(1000), seconds=rng.randrange(86400))
+    points = []
+    for k in range(count):
+        heading += rng.uniform(-0.3, 0.3)
+        lat += 0.0001 * rng.uniform(0.5, 1.0) * math.cos(heading)
+        lon += 0.00016 * rng.uniform(0.5, 1.0) * math.sin(heading)
+        points.append((lat, lon, 150 + 10 * rng.random(), started_at + timedelta(seconds=4 * k)))
+    return points
+
+
+def generate(runners, users, friends, chat_size, messages, statistic_users, statistic_days, tracks,
+             segments, seed=1, log=print):
+    # Заполняет пустую БД приложения runners. Возвращает сводку по объёмам
+    import search_index
+    import tracks as track_codec
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    summary = {}
+    with runners.app.app_context():
+        conn = runners.db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        started = time.perf_counter()
+
+        password = generate_password_hash(PASSWORD)
+        summary['users'] = insert(cursor, "INSERT INTO users (id_User, password, email) VALUES (?, ?, ?)",
+                                  ((i, password, f'user{i}@example.com') for i in range(1, users + 1)))
+
+        def profile(i):
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}'
+            return (i, name, rng.uniform(50, 100), rng.uniform(150, 200), rng.choice(('m', 'f')),
+                    rng.randrange(16, 70), 'RU', search_index.normalize_name(name))
+        insert(cursor, "INSERT INTO user_info (id_User, name, weight, height, sex, Age, Country, name_norm) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", (profile(i) for i in range(1, users + 1)))
+        conn.commit()
+        log(f'users: {users} in {time.perf_counter() - started:.1f} s')
+
+        started = time.perf_counter()
+
+        def friendship_rows():
+            for u, v in friend_pairs(users, friends, rng):
+                created = stamp(START)
+                yield u, v, 'accepted', created
+                yield v, u, 'accepted', created
+            # Немного входящих заявок - от пользователей за пределами окна дружбы
+            for u in range(1, users + 1, 10):
+                v = u + FRIEND_WINDOW + rng.randrange(1, FRIEND_WINDOW)
+                if v <= users:
+                    yield v, u, 'pending', stamp(START)
+        summary['friendships'] = insert(
+            cursor, "INSERT INTO friendships (user_id, friend_id, status, created_at) VALUES (?, ?, ?, ?)",
+            friendship_rows())
+        conn.commit()
+        log(f"friendships: {summary['friendships']} rows in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        chats = chat_plan(users, chat_size, rng)
+        insert(cursor, "INSERT INTO group_chat (id, title) VALUES (?, ?)",
+               ((chat_id, f'Пробежка {chat_id}') for chat_id, _ in chats))
+        insert(cursor, "INSERT INTO user_group_chat (user_id, chat_id, joined_at) VALUES (?, ?, ?)",
+               ((member, chat_id, stamp(START)) for chat_id, members in chats for member in members))
+        summary['chats'] = len(chats)
+
+        # Сообщения по чатам распределены неравномерно (немногие чаты очень активны);
+        # время растёт вместе с id, как при обычной записи
+        cumulative = list(itertools.accumulate(rng.paretovariate(1.2) for _ in chats))
+        step = timedelta(seconds=max(1, int(3 * 365 * 86400 / max(messages, 1))))
+        latest = {}
+
+        def message_rows():
+            moment = START
+            for message_id in range(1, messages + 1):
+                chat_id, members = chats[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+                moment += step
+                content = f'Сообщение {message_id}: встречаемся в {rng.randrange(6, 22)}:00'
+                latest[chat_id] = (message_id, moment, content)
+                yield message_id, chat_id, rng.choice(members), content, stamp(moment)
+        summary['messages'] = insert(
+            cursor, "INSERT INTO group_message (id, chat_id, sender_id, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            message_rows())
+        insert(cursor, "UPDATE group_chat SET last_message_id = ?, last_message_at = ?, last_message_preview = ? "
+                       "WHERE id = ?",
+               ((message_id, stamp(moment), content[:100], chat_id)
+                for chat_id, (message_id, moment, content) in latest.items()))
+        conn.commit()
+        log(f"chats: {len(chats)}, messages: {summary['messages']} in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        today = date.today()
+
+        def statistic_rows():
+            for u in range(1, min(statistic_users, users) + 1):
+                for d in range(statistic_days):
+                    if rng.random() < 0.2:
+                        continue  # дни без тренировок
+                    steps = rng.randrange(2000, 25000)
+                    yield u, steps * 0.04, steps, steps * 0.0008, (today - timedelta(days=d)).isoformat()
+        summary['statistics'] = insert(
+            cursor, "INSERT INTO user_statistic (id_User, calories, steps, distance, date) VALUES (?, ?, ?, ?, ?)",
+            statistic_rows())
+        # Недельные и месячные суммы - те же, что поддерживает apply_statistic_rollups
+        for granularity, start_expr in (('week', "date(date, '-' || ((strftime('%w', date) + 6) % 7) || ' days')"),
+                                        ('month', "date(date, 'start of month')")):
+            cursor.execute(
+                f"INSERT INTO user_statistic_rollup (id_User, granularity, period_start, calories, steps, distance, days) "
+                f"SELECT id_User, '{granularity}', {start_expr}, SUM(calories), SUM(steps), SUM(distance), COUNT(*) "
+                f"FROM user_statistic GROUP BY id_User, {start_expr}")
+        conn.commit()
+        log(f"statistics: {summary['statistics']} rows in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        segment_sources = []
+
+        def track_rows():
+            for track_id in range(1, tracks + 1):
+                builder = track_codec.TrackBuilder()
+                for lat, lon, ele, moment in track_points(rng):
+                    builder.add_point(lat, lon, ele, moment)
+                if len(segment_sources) < segments:
+                    segment_sources.append(builder.polyline)
+                yield (track_id, rng.randrange(1, users + 1), f'Трек {track_id}', stamp(builder.started_at),
+                       stamp(builder.started_at), stamp(builder.finished_at), builder.count,
+                       builder.distance, builder.elevation_gain, builder.min_lat, builder.min_lon, builder.max_lat,
+                       builder.max_lon, builder.start[0], builder.start[1], builder.polyline, builder.elevations,
+                       builder.times, stamp(builder.finished_at))
+        summary['tracks'] = insert(
+            cursor, "INSERT INTO tracks (id, id_User, name, created_at, started_at, finished_at, point_count, distance, "
+                    "elevation_gain, min_lat, min_lon, max_lat, max_lon, start_lat, start_lon, polyline, elevations, "
+                    "times, segments_matched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            track_rows())
+
+        def segment_rows():
+            # Сегменты - середины первых треков; с треками они уже "сопоставлены"
+            for segment_id, polyline in enumerate(segment_sources, start=1):
+                points = track_codec.decode_polyline(polyline)[30:90]
+                builder = track_codec.TrackBuilder()
+                for lat, lon in points:
+                    builder.add_point(lat, lon)
+                yield (segment_id, rng.randrange(1, users + 1), f'Сегмент {segment_id}', stamp(START),
+                       builder.count, builder.distance, builder.min_lat, builder.min_lon, builder.max_lat,
+                       builder.max_lon, builder.polyline, tracks, stamp(START))
+        summary['segments'] = insert(
+            cursor, "INSERT INTO segments (id, id_User, name, created_at, point_count, distance, min_lat, min_lon, "
+                    "max_lat, max_lon, polyline, match_cursor, matched_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            segment_rows())
+        conn.commit()
+        log(f"tracks: {summary['tracks']}, segments: {summary['segments']} in {time.perf_counter() - started:.1f} s")
+    finally:
+        conn.close()
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=list(SCALES), default='tiny')
+    parser.add_argument('--db', required=True, help='путь к новому файлу SQLite')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if os.path.exists(args.db):
+        raise SystemExit(f'{args.db} already exists')
+
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.abspath(args.db)}'
+    os.environ.setdefault('SEGMENT_MATCHING', '0')
+    import app as runners
+
+    summary = generate(runners, seed=args.seed, **SCALES[args.scale])
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+# Конкурентный доступ к одному файлу SQLite из нескольких процессов:
+# писатели сохраняют статистику (POST /api/user_statistic) и сообщения чата
+# (store_message, как обработчик сокета), читатели листают сообщения и статистику.
+# Для каждого режима печатает пропускную способность и число ошибок "database is locked".
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.db_contention --readers 4 --writers 4 --seconds 10
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Режимы: переменные окружения для каждого процесса (см. database.py)
+MODES = {
+    'rollback-journal': {'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full', 'SQLITE_BEGIN': 'deferred'},
+    'wal': {'SQLITE_JOURNAL_MODE': 'wal', 'SQLITE_SYNCHRONOUS': 'normal', 'SQLITE_BEGIN': 'deferred'},
+    'wal+immediate': {'SQLITE_JOURNAL_MODE': 'wal', 'SQLITE_SYNCHRONOUS': 'normal', 'SQLITE_BEGIN': 'immediate'},
+    'wal+immediate+read-pool': {'SQLITE_JOURNAL_MODE': 'wal', 'SQLITE_SYNCHRONOUS': 'normal',
+                                'SQLITE_BEGIN': 'immediate', 'DB_READ_POOL': '1'},
+}
+USERS = 50
+CHATS = 5
+
+
+def populate(db_url, env):
+    os.environ.update(env, DATABASE_URL=db_url)
+    import app as runners
+
+    with runners.app.app_context():
+        for i in range(1, USERS + 1):
+            runners.db.session.add(runners.User(id_User=i, email=f'bench{i}@example.com', password='x'))
+            runners.db.session.add(runners.UserInfo(id_User=i, name=f'Runner {i}', weight=70, height=175,
+                                                    sex='m', Age=30, Country='RU'))
+        for chat_id in range(1, CHATS + 1):
+            chat = runners.GroupChat(id=chat_id, title=f'Chat {chat_id}')
+            chat.members = runners.User.query.all()
+            runners.db.session.add(chat)
+        runners.db.session.commit()
+        for k in range(2000):
+            runners.store_message(k % CHATS + 1, k % USERS + 1, f'message {k}')
+
+
+def worker(role, index, db_url, env, start, deadline, results):
+    os.environ.update(env, DATABASE_URL=db_url, DB_CREATE_ALL='0', SEGMENT_MATCHING='0')
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as runners
+    rng = random.Random(index)
+    client = runners.app.test_client()
+    user_id = index % USERS + 1
+    with runners.app.app_context():
+        token = runners.generate_jwt(user_id)
+    headers = {'Authorization': token}
+    done, locked, failed, timings = 0, 0, 0, []
+    # Все процессы начинают одновременно, после импорта приложения
+    time.sleep(max(0.0, start - time.time()))
+
+    while time.time() < deadline:
+        started = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                if role == 'writer' and rng.random() < 0.5:
+                    day = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+                    response = client.post('/api/user_statistic', headers=headers, json={
+                        'date': day.isoformat(), 'calories': 10.0, 'steps': 100, 'distance': 1.0})
+                    ok = response.status_code == 201
+                    error = '' if ok else response.get_data(as_text=True)
+                elif role == 'writer':
+                    with runners.app.app_context():
+                        runners.store_message(rng.randrange(CHATS) + 1, user_id, 'hello')
+                    ok, error = True, ''
+                elif rng.random() < 0.5:
+                    response = client.get(f'/api/group_chats/{rng.randrange(CHATS) + 1}/messages?limit=50',
+                                          headers=headers)
+                    ok, error = response.status_code == 200, response.get_data(as_text=True)
+                else:
+                    response = client.get('/api/user_statistic?limit=100', headers=headers)
+                    ok, error = response.status_code == 200, response.get_data(as_text=True)
+        except Exception as e:
+            ok, error = False, str(e)
+        timings.append((time.perf_counter() - started) * 1000)
+        if ok:
+            done += 1
+        elif 'locked' in error or 'busy' in error:
+            locked += 1
+        else:
+            failed += 1
+    results.put((role, done, locked, failed, timings))
+
+
+def run_mode(name, env, args, ctx):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{os.path.join(tmp, 'contention.db')}"
+        setup = ctx.Process(target=populate, args=(db_url, env))
+        setup.start()
+        setup.join()
+
+        results = ctx.Queue()
+        start = time.time() + 5
+        deadline = start + args.seconds
+        processes = [ctx.Process(target=worker, args=(role, i, db_url, env, start, deadline, results))
+                     for role, count in (('writer', args.writers), ('reader', args.readers))
+                     for i in range(count)]
+        for p in processes:
+            p.start()
+        collected = [results.get() for _ in processes]
+        for p in processes:
+            p.join()
+
+    for role in ('writer', 'reader'):
+        rows = [r for r in collected if r[0] == role]
+        done = sum(r[1] for r in rows)
+        locked = sum(r[2] for r in rows)
+        failed = sum(r[3] for r in rows)
+        timings = sorted(t for r in rows for t in r[4]) or [0.0]
+        print(f'{name:>24} {role}s: {done / args.seconds:8.1f} ops/s, locked {locked:5d}, other errors {failed:3d}, '
+              f'median {statistics.median(timings):6.1f} ms, p99 {timings[int(len(timings) * 0.99) - 1]:7.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    # Каждый процесс импортирует приложение заново со своими настройками
+    ctx = multiprocessing.get_context('spawn')
+    for name in args.modes:
+        run_mode(name, MODES[name], args, ctx)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Нагрузочный тест рассылки сообщений чата при нескольких воркерах.
+# Поднимает app.py с WORKERS=N и локальной шиной, подключает слушателей
+# по websocket (из нескольких процессов) и считает доставки в секунду.
+#
+# Нужен клиент Socket.IO: pip install "python-socketio[client]"
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.fanout --workers 1 2 4 --listeners 60 --messages 300
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+def wait_for_port(port, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def listener_proc(url, tokens, chat_id, expected, ready, results):
+    import socketio as sio
+
+    clients = []
+    counts = [0] * len(tokens)
+    done = threading.Event()
+    finished_at = [None]
+
+    def make_handler(index):
+        def on_message(data):
+            counts[index] += 1
+            if sum(counts) >= expected * len(tokens) and finished_at[0] is None:
+                finished_at[0] = time.time()
+                done.set()
+        return on_message
+
+    for index, token in enumerate(tokens):
+        client = sio.Client()
+        client.on('new_message', make_handler(index))
+        client.connect(url, transports=['websocket'], auth={'token': token})
+        client.emit('join_chat', {'chat_id': chat_id})
+        clients.append(client)
+
+    time.sleep(0.5)  # join_chat обрабатывается асинхронно
+    ready.put(len(clients))
+    done.wait(timeout=120)
+    results.put((sum(counts), finished_at[0]))
+    for client in clients:
+        client.disconnect()
+
+
+def run(workers, args, tokens, sender_token, chat_id, db_url, tmp):
+    port = args.port
+    env = dict(os.environ,
+               DATABASE_URL=db_url,
+               WORKERS=str(workers),
+               PORT=str(port),
+               SOCKETIO_MESSAGE_QUEUE=f"local://{os.path.join(tmp, f'bus-{workers}.sock')}")
+    server = subprocess.Popen([sys.executable, 'app.py'], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        url = f'http://127.0.0.1:{port}'
+
+        ctx = multiprocessing.get_context('spawn')
+        ready, results = ctx.Queue(), ctx.Queue()
+        groups = [tokens[i::args.client_procs] for i in range(args.client_procs)]
+        procs = [ctx.Process(target=listener_proc, args=(url, group, chat_id, args.messages, ready, results))
+                 for group in groups if group]
+        for proc in procs:
+            proc.start()
+        for _ in procs:
+            ready.get(timeout=120)
+
+        import socketio as sio
+        sender = sio.Client()
+        sender.connect(url, transports=['websocket'], auth={'token': sender_token})
+        sender.emit('join_chat', {'chat_id': chat_id})
+        started = time.time()
+        for i in range(args.messages):
+            sender.emit('send_message', {'chat_id': chat_id, 'content': f'bench {i}'})
+
+        delivered, finished = 0, started
+        for _ in procs:
+            count, finished_at = results.get(timeout=180)
+            delivered += count
+            finished = max(finished, finished_at or time.time())
+        for proc in procs:
+            proc.join()
+        sender.disconnect()
+
+        elapsed = finished - started
+        return {
+            'workers': workers,
+            'delivered': delivered,
+            'expected': args.messages * len(tokens),
+            'seconds': round(elapsed, 3),
+            'deliveries_per_sec': round(delivered / elapsed, 1)
+        }
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--listeners', type=int, default=60)
+    parser.add_argument('--messages', type=int, default=300)
+    parser.add_argument('--client-procs', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5055)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_url = f"sqlite:///{os.path.join(tmp, 'fanout.db')}"
+        os.environ['DATABASE_URL'] = db_url
+        import app as runners
+
+        with runners.app.app_context():
+            users = [runners.User(email=f'runner{i}@example.com', password='x')
+                     for i in range(args.listeners + 1)]
+            runners.db.session.add_all(users)
+            chat = runners.GroupChat(title='fanout')
+            runners.db.session.add(chat)
+            runners.db.session.flush()
+            runners.db.session.add_all([
+                runners.UserGroupChatAssociation(user_id=u.id_User, chat_id=chat.id) for u in users
+            ])
+            runners.db.session.commit()
+            tokens = [runners.generate_jwt(u.id_User) for u in users]
+            chat_id = chat.id
+
+        for workers in args.workers:
+            r = run(workers, args, tokens[1:], tokens[0], chat_id, db_url, tmp)
+            print(f"workers={r['workers']}: {r['deliveries_per_sec']:>10} deliveries/s "
+                  f"({r['delivered']}/{r['expected']} in {r['seconds']} s)")
+
+
+if __name__ == '__main__':
+    main()
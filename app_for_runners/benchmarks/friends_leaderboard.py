@@ -0,0 +1,102 @@
+# Задержка /api/friends/leaderboard в зависимости от числа друзей.
+# У каждого пользователя год ежедневной статистики; для сравнения - "наивный"
+# запрос, который суммирует дневные записи друзей при каждом обращении.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.friends_leaderboard --friends 10 100 500 --days 365
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+
+def populate(runners, first_id, friends, days, seed=1):
+    # Пользователь first_id и его друзья first_id + 1 .. first_id + friends
+    rng = random.Random(seed)
+    today = runners.datetime.utcnow().date()
+    with runners.app.app_context():
+        conn = runners.db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            ids = range(first_id, first_id + friends + 1)
+            cursor.executemany("INSERT INTO users (id_User, password, email) VALUES (?, 'x', ?)",
+                               [(i, f'bench{i}@example.com') for i in ids])
+            cursor.executemany(
+                "INSERT INTO user_info (id_User, name, weight, height, sex, Age, Country, name_norm) "
+                "VALUES (?, ?, 70, 175, 'm', 30, 'RU', ?)",
+                [(i, f'Runner {i}', f'runner {i}') for i in ids])
+            rows = [(first_id, i, 'accepted') for i in ids[1:]] + [(i, first_id, 'accepted') for i in ids[1:]]
+            cursor.executemany("INSERT INTO friendships (user_id, friend_id, status) VALUES (?, ?, ?)", rows)
+            cursor.executemany(
+                "INSERT INTO user_statistic (id_User, calories, steps, distance, date) VALUES (?, ?, ?, ?, ?)",
+                [(i, rng.uniform(100, 900), rng.randrange(2000, 20000), rng.uniform(0, 15),
+                  (today - timedelta(days=d)).isoformat()) for i in ids for d in range(days)])
+            conn.commit()
+        finally:
+            conn.close()
+        return runners.generate_jwt(first_id)
+
+
+def naive(runners, user_id, window_days):
+    # Ранжирование без готовых сумм: полный проход по истории друзей
+    today = runners.datetime.utcnow().date()
+    db, UserStatistic, Friendship = runners.db, runners.UserStatistic, runners.Friendship
+    with runners.app.app_context():
+        ids = [f.friend_id for f in Friendship.query.filter_by(user_id=user_id, status='accepted')] + [user_id]
+        totals = {}
+        for uid in ids:
+            for s in UserStatistic.query.filter_by(id_User=uid).all():
+                if s.date >= today - timedelta(days=window_days - 1):
+                    totals[uid] = totals.get(uid, 0) + s.distance
+        return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def measure(call, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--friends', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'friends.db')}"
+        import app as runners
+
+        client = runners.app.test_client()
+        first_id = 1
+        for friends in args.friends:
+            user_id = first_id
+            token = populate(runners, first_id, friends, args.days)
+            first_id += friends + 1
+
+            def leaderboard():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    response = client.get('/api/friends/leaderboard?metric=distance&window=30d',
+                                          headers={'Authorization': token})
+                assert response.status_code == 200, response.data
+
+            started = time.perf_counter()
+            leaderboard()
+            first = (time.perf_counter() - started) * 1000
+            warm = measure(leaderboard, args.repeat)
+            baseline = measure(lambda: naive(runners, user_id, 30), max(1, args.repeat // 10))
+            print(f'{friends:>5} friends: first request of the day {first:7.2f} ms, '
+                  f'then {warm:6.2f} ms; naive sum {baseline:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
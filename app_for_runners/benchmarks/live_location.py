@@ -0,0 +1,105 @@
+# Живые позиции совместной пробежки без сети и БД: сколько точек в секунду
+# принимает live_location.LiveLocations, сколько стоит тик рассылки и сколько
+# байт JSON уходит в комнату - разности против абсолютных значений каждой точки
+# (как если бы сервер пересылал точки по мере поступления).
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.live_location
+#     python -m benchmarks.live_location --members 50 200 --hz 5 --seconds 60 --output live.json
+import argparse
+import json
+import random
+import time
+
+import live_location
+from benchmarks import dataset
+
+
+class Runner:
+    # Бегун со скоростью ~3 м/с в случайном направлении от центра города
+    def __init__(self, rng):
+        self.lat = dataset.CITY[0] + rng.uniform(-0.01, 0.01)
+        self.lon = dataset.CITY[1] + rng.uniform(-0.01, 0.01)
+        self.dlat = rng.uniform(-3e-5, 3e-5)
+        self.dlon = rng.uniform(-3e-5, 3e-5)
+
+    def step(self, dt):
+        self.lat += self.dlat * dt
+        self.lon += self.dlon * dt
+        return self.lat, self.lon
+
+
+def run(members, hz, seconds, send_hz, rate):
+    rng = random.Random(1)
+    now = [0.0]
+    sent = []
+    live = live_location.LiveLocations(lambda event, data, room: sent.append(json.dumps(data, separators=(',', ':'))),
+                                       rate=rate, clock=lambda: now[0], wall_clock=lambda: 1.7e9 + now[0])
+    runners = [Runner(rng) for _ in range(members)]
+    for user_id in range(1, members + 1):
+        live.start(1, user_id, f'sid{user_id}')
+
+    # Точки в порядке поступления: каждый бегун шлёт send_hz точек в секунду со сдвигом фазы
+    schedule = sorted((k / send_hz + user_id / (members * send_hz), user_id)
+                      for user_id in range(1, members + 1) for k in range(int(seconds * send_hz)))
+    raw_bytes, update_seconds, tick_seconds, results = 0, 0.0, [], {}
+    next_tick = 1 / hz
+    for moment, user_id in schedule:
+        while moment >= next_tick:
+            now[0] = next_tick
+            started = time.perf_counter()
+            live.tick()
+            tick_seconds.append(time.perf_counter() - started)
+            next_tick += 1 / hz
+        now[0] = moment
+        lat, lon = runners[user_id - 1].step(1 / send_hz)
+        # Без сервера каждая точка ушла бы в комнату сама: такой объём для сравнения
+        raw_bytes += len(json.dumps({'chat_id': 1, 'user_id': user_id, 'lat': round(lat, 6), 'lon': round(lon, 6),
+                                     't': 1.7e9 + moment}, separators=(',', ':')))
+        started = time.perf_counter()
+        result = live.update(1, user_id, lat, lon)
+        update_seconds += time.perf_counter() - started
+        results[result] = results.get(result, 0) + 1
+
+    tick_seconds.sort()
+    sent_bytes = sum(len(data) for data in sent)
+    return {
+        'points': len(schedule),
+        'results': results,
+        'update_us': round(update_seconds / len(schedule) * 1e6, 2),
+        'updates_per_second': round(len(schedule) / update_seconds),
+        'tick_p50_ms': round(tick_seconds[len(tick_seconds) // 2] * 1000, 3),
+        'tick_max_ms': round(tick_seconds[-1] * 1000, 3),
+        'events': len(sent),
+        'bytes_broadcast': sent_bytes,
+        'bytes_per_point_forwarding': raw_bytes,
+        'ratio': round(raw_bytes / sent_bytes, 1) if sent_bytes else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 50, 200])
+    parser.add_argument('--hz', type=float, default=1.0, help='рассылок в секунду')
+    parser.add_argument('--send-hz', type=float, default=5.0, help='точек в секунду от каждого бегуна')
+    parser.add_argument('--rate', type=float, default=5.0, help='LIVE_LOCATION_RATE')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    results = {members: run(members, args.hz, args.seconds, args.send_hz, args.rate) for members in args.members}
+    header = (f'{"members":>8}{"points/s":>10}{"update us":>11}{"tick p50 ms":>13}{"tick max ms":>13}'
+              f'{"events":>8}{"bytes out":>11}{"forwarding":>12}{"ratio":>7}')
+    print(header)
+    print('-' * len(header))
+    for members, row in results.items():
+        print(f'{members:>8}{members * args.send_hz:>10.0f}{row["update_us"]:>11.2f}{row["tick_p50_ms"]:>13.3f}'
+              f'{row["tick_max_ms"]:>13.3f}{row["events"]:>8}{row["bytes_broadcast"]:>11}'
+              f'{row["bytes_per_point_forwarding"]:>12}{row["ratio"]:>7}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': vars(args), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
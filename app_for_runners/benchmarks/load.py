@@ -0,0 +1,602 @@
+# Нагрузочный прогон сервера: на синтетических данных (benchmarks/dataset.py)
+# виртуальные пользователи вызывают все REST-эндпоинты и события Socket.IO
+# через тестовые клиенты Flask и Flask-SocketIO. Конкурентность - процессы
+# (--processes, каждый со своим пулом соединений) x потоки (--threads).
+# По каждой операции считает p50/p95/p99 задержки, число SQL-запросов на вызов
+# и пропускную способность; результат сохраняется в JSON (--output), а с
+# --compare печатается разница с прошлым прогоном.
+#
+# Пишущие операции меняют БД: для повторяемых сравнений прогоняйте на копии
+# одной и той же БД (--db) или на свежесгенерированной (--scale).
+# /api/route участвует, только если задан ROUTING_GRAPH.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.load --scale tiny --processes 2 --threads 4 --seconds 30 --output run.json
+#     python -m benchmarks.load --db /tmp/runners.db --seconds 60 --compare run.json
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from benchmarks import dataset
+
+# Смесь операций по умолчанию (веса): в основном чтение, как у мобильного клиента
+MIX = {
+    'login': 1, 'register': 0.5, 'token_verify': 2, 'logout': 0.5,
+    'user_info': 6, 'user_info/check': 2, 'user_info/<id>': 3, 'update user_info': 1,
+    'users/search': 3,
+    'friends': 6, 'friends/suggestions': 2, 'friends/leaderboard': 4, 'friends/requests': 2,
+    'friends/send_request': 1, 'friends/accept_request': 0.5, 'friends/reject_request': 0.5,
+    'group_chats': 6, 'create group_chat': 0.5, 'group_chat details': 2, 'group_chat participants': 2,
+    'group_chat messages': 8, 'group_chat older messages': 3,
+    'group_chat join': 0.5, 'group_chat add_user': 0.5, 'group_chat leave': 0.5,
+    'socket join_chat': 2, 'socket send_message': 8,
+    'user_statistic add': 3, 'user_statistic batch': 1, 'user_statistic': 4, 'user_statistic range': 2,
+    'user_statistic summary': 3,
+    'poll user_info': 3, 'poll user_statistic': 3, 'poll group_chat messages': 4,
+    'batch profile': 3, 'sync': 4,
+    'tracks upload': 1, 'tracks': 3, 'track': 3, 'tracks/nearby': 2, 'tracks/bbox': 2, 'track efforts': 1,
+    'segments create': 0.2, 'segment': 1, 'segment leaderboard': 2,
+    'route': 1,
+}
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(ordered, p):
+    # Ближайший ранг по отсортированному списку
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+
+def gpx(points):
+    return ('<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><name>load</name><trkseg>'
+            + ''.join(f'<trkpt lat="{lat:.6f}" lon="{lon:.6f}"><ele>{ele:.1f}</ele>'
+                      f'<time>{moment.strftime("%Y-%m-%dT%H:%M:%SZ")}</time></trkpt>'
+                      for lat, lon, ele, moment in points)
+            + '</trkseg></trk></gpx>').encode()
+
+
+class QueryCounter(threading.local):
+    # SQL-запросы текущего потока (слушатель before_cursor_execute на всех движках)
+    count = 0
+
+
+def count_queries(engine, counter):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+
+
+class Limits:
+    # Размеры БД, из которых виртуальные пользователи выбирают случайные id
+    def __init__(self, runners):
+        db = runners.db
+        with runners.app.app_context():
+            self.users = db.session.query(db.func.max(runners.User.id_User)).scalar() or 0
+            self.chats = db.session.query(db.func.max(runners.GroupChat.id)).scalar() or 0
+            self.tracks = db.session.query(db.func.max(runners.Track.id)).scalar() or 0
+            self.segments = db.session.query(db.func.max(runners.Segment.id)).scalar() or 0
+
+
+class VirtualUser:
+    def __init__(self, runners, limits, user_id, name, rng, counter, records):
+        self.runners = runners
+        self.limits = limits
+        self.user_id = user_id
+        self.name = name
+        self.rng = rng
+        self.counter = counter
+        self.records = records
+        self.recording = False
+        self.client = runners.app.test_client()
+        self.sio = None
+        self.joined = []
+        self.sequence = 0
+        self.etags = {}  # url -> ETag последнего ответа, для опроса с If-None-Match
+        self.sync_cursor = None  # курсор /api/sync
+        with runners.app.app_context():
+            self.token = runners.generate_jwt(user_id)
+            self.chats = [row[0] for row in runners.db.session.query(runners.UserGroupChatAssociation.chat_id)
+                          .filter_by(user_id=user_id)]
+        self.auth = {'Authorization': self.token}
+
+    def timed(self, name, call):
+        self.counter.count = 0
+        started = time.perf_counter()
+        try:
+            response = call()
+            status = getattr(response, 'status_code', 200)
+        except Exception as e:
+            status = f'{type(e).__name__}: {e}'[:200]
+        elapsed = (time.perf_counter() - started) * 1000
+        if self.recording:
+            self.records.append((name, elapsed, self.counter.count, status))
+
+    def get(self, name, url):
+        self.timed(name, lambda: self.client.get(url, headers=self.auth))
+
+    def poll(self, name, url):
+        # Повторный запрос, как у клиента, опрашивающего раз в минуту: 304, пока данные не менялись
+        def call():
+            response = self.client.get(url, headers={**self.auth, 'If-None-Match': self.etags.get(url, '')})
+            if response.headers.get('ETag'):
+                self.etags[url] = response.headers['ETag']
+            return response
+        self.timed(name, call)
+
+    def post(self, name, url, headers=None, **kwargs):
+        self.timed(name, lambda: self.client.post(url, headers=self.auth if headers is None else headers, **kwargs))
+
+    # Вспомогательные значения
+    def other_user(self):
+        return self.rng.randrange(1, self.limits.users + 1)
+
+    def stranger(self):
+        # Пользователь за пределами окна дружбы генератора (см. dataset.FRIEND_WINDOW)
+        offset = dataset.FRIEND_WINDOW + self.rng.randrange(1, self.limits.users)
+        return (self.user_id + offset - 1) % self.limits.users + 1
+
+    def my_chat(self):
+        return self.rng.choice(self.chats) if self.chats else self.rng.randrange(1, self.limits.chats + 1)
+
+    def other_chat(self):
+        chat_id = self.rng.randrange(1, self.limits.chats + 1)
+        return chat_id if chat_id not in self.chats else None
+
+    def recent_day(self, days=30):
+        return date.today() - timedelta(days=self.rng.randrange(days))
+
+    def city_point(self):
+        return (dataset.CITY[0] + self.rng.uniform(-dataset.CITY_SIZE, dataset.CITY_SIZE),
+                dataset.CITY[1] + self.rng.uniform(-dataset.CITY_SIZE, dataset.CITY_SIZE))
+
+    def unique(self):
+        self.sequence += 1
+        return f'{self.name}-{self.sequence}'
+
+    def pending_request_from(self, sender):
+        # Заявка sender -> этот пользователь, без замера; id заявки или None
+        runners = self.runners
+        with runners.app.app_context():
+            token = runners.generate_jwt(sender)
+        self.client.post('/api/friends/send_request', headers={'Authorization': token}, json={'friend_id': self.user_id})
+        with runners.app.app_context():
+            row = runners.Friendship.query.filter_by(user_id=sender, friend_id=self.user_id, status='pending').first()
+            return row.id if row else None
+
+    def socket(self):
+        if self.sio is None:
+            self.timed('socket connect', self.connect_socket)
+        return self.sio
+
+    def connect_socket(self):
+        self.sio = self.runners.socketio.test_client(self.runners.app, auth={'token': self.token})
+
+    def close(self):
+        if self.sio is not None and self.sio.is_connected():
+            self.sio.disconnect()
+
+    # Операции смеси
+    def op_login(self):
+        self.post('login', '/login', headers={},
+                  json={'email': f'user{self.user_id}@example.com', 'password': dataset.PASSWORD})
+
+    def op_register(self):
+        self.post('register', '/register', headers={},
+                  json={'email': f'load-{self.unique()}@example.com', 'password': 'secret'})
+
+    def op_token_verify(self):
+        self.post('token_verify', '/token_verify')
+
+    def op_logout(self):
+        self.post('logout', '/api/logout')
+
+    def op_user_info(self):
+        self.get('user_info', '/api/user_info')
+
+    def op_user_info_check(self):
+        self.get('user_info/check', '/api/user_info/check')
+
+    def op_user_info_id(self):
+        self.get('user_info/<id>', f'/api/user_info/{self.other_user()}')
+
+    def op_update_user_info(self):
+        self.post('update user_info', '/api/user_info', json={
+            'name': f'{self.rng.choice(dataset.FIRST_NAMES)} {self.rng.choice(dataset.LAST_NAMES)} {self.user_id}',
+            'weight': self.rng.randrange(50, 100), 'height': self.rng.randrange(150, 200), 'sex': 'm',
+            'age': self.rng.randrange(16, 70), 'country': 'RU'})
+
+    def op_users_search(self):
+        self.get('users/search', f'/api/users/search?name={self.rng.choice(dataset.FIRST_NAMES)[:4]}')
+
+    def op_friends(self):
+        self.get('friends', '/api/friends')
+
+    def op_friends_suggestions(self):
+        self.get('friends/suggestions', '/api/friends/suggestions')
+
+    def op_friends_leaderboard(self):
+        metric = self.rng.choice(('calories', 'steps', 'distance'))
+        self.get('friends/leaderboard', f'/api/friends/leaderboard?metric={metric}&window={self.rng.choice(("7d", "30d"))}')
+
+    def op_friends_requests(self):
+        self.get('friends/requests', '/api/friends/requests')
+
+    def op_friends_send_request(self):
+        self.post('friends/send_request', '/api/friends/send_request', json={'friend_id': self.stranger()})
+
+    def op_friends_accept_request(self):
+        sender = self.stranger()
+        self.pending_request_from(sender)
+        self.post('friends/accept_request', '/api/friends/accept_request', json={'friend_id': sender})
+
+    def op_friends_reject_request(self):
+        request_id = self.pending_request_from(self.stranger())
+        self.post('friends/reject_request', '/api/friends/reject_request', json={'request_id': request_id})
+
+    def op_group_chats(self):
+        self.get('group_chats', '/api/group_chats')
+
+    def op_create_group_chat(self):
+        self.post('create group_chat', '/api/group_chats', json={
+            'title': f'Забег {self.unique()}', 'members': [self.other_user(), self.other_user()]})
+
+    def op_group_chat_details(self):
+        self.get('group_chat details', f'/api/group_chats/{self.my_chat()}')
+
+    def op_group_chat_participants(self):
+        self.get('group_chat participants', f'/api/group_chats/{self.my_chat()}/participants')
+
+    def op_group_chat_messages(self):
+        self.get('group_chat messages', f'/api/group_chats/{self.my_chat()}/messages?limit=50')
+
+    def op_group_chat_older_messages(self):
+        # Вторая и следующие страницы: курсор из предыдущего ответа
+        chat_id = self.my_chat()
+        response = self.client.get(f'/api/group_chats/{chat_id}/messages?limit=50', headers=self.auth)
+        before_id = (response.get_json(silent=True) or {}).get('next_before_id')
+        if before_id:
+            self.get('group_chat older messages', f'/api/group_chats/{chat_id}/messages?limit=50&before_id={before_id}')
+
+    def op_group_chat_join(self):
+        chat_id = self.other_chat()
+        if chat_id is not None:
+            self.post('group_chat join', f'/api/group_chats/{chat_id}/join')
+            self.joined.append(chat_id)
+
+    def op_group_chat_add_user(self):
+        self.post('group_chat add_user', f'/api/group_chats/{self.my_chat()}/add_user',
+                  json={'user_id': self.other_user()})
+
+    def op_group_chat_leave(self):
+        # Выходим только из чатов, в которые вошли сами - исходные чаты пользователя не трогаем
+        if self.joined:
+            self.post('group_chat leave', f'/api/group_chats/{self.joined.pop()}/leave')
+
+    def op_socket_join_chat(self):
+        sio = self.socket()
+        self.timed('socket join_chat', lambda: sio.emit('join_chat', {'chat_id': self.my_chat()}))
+        sio.get_received()
+
+    def op_socket_send_message(self):
+        sio = self.socket()
+        self.timed('socket send_message', lambda: sio.emit('send_message', {
+            'chat_id': self.my_chat(), 'content': f'Нагрузка {self.unique()}'}))
+        sio.get_received()
+
+    def op_user_statistic_add(self):
+        steps = self.rng.randrange(2000, 25000)
+        self.post('user_statistic add', '/api/user_statistic', json={
+            'date': self.recent_day().isoformat(), 'calories': steps * 0.04, 'steps': steps,
+            'distance': steps * 0.0008})
+
+    def op_user_statistic_batch(self):
+        records = []
+        for d in range(7):
+            steps = self.rng.randrange(2000, 25000)
+            records.append({'date': (date.today() - timedelta(days=d)).isoformat(), 'calories': steps * 0.04,
+                            'steps': steps, 'distance': steps * 0.0008, 'idempotency_key': self.unique()})
+        self.post('user_statistic batch', '/api/user_statistic/batch', json={'records': records})
+
+    def op_user_statistic(self):
+        self.get('user_statistic', '/api/user_statistic?limit=30')
+
+    def op_poll_user_info(self):
+        self.poll('poll user_info', '/api/user_info')
+
+    def op_poll_user_statistic(self):
+        self.poll('poll user_statistic', '/api/user_statistic?limit=30')
+
+    def op_poll_group_chat_messages(self):
+        self.poll('poll group_chat messages', f'/api/group_chats/{self.my_chat()}/messages?limit=50')
+
+    def op_batch_profile(self):
+        # Экран профиля одним запросом вместо пяти
+        self.post('batch profile', '/api/batch', json={'requests': [
+            {'id': 'check', 'path': '/api/user_info/check'},
+            {'id': 'info', 'path': '/api/user_info'},
+            {'id': 'statistic', 'path': '/api/user_statistic?limit=30'},
+            {'id': 'friends', 'path': '/api/friends'},
+            {'id': 'requests', 'path': '/api/friends/requests'},
+        ]})
+
+    def op_sync(self):
+        # Опрос изменений по курсору; первый вызов берёт курсор
+        def call():
+            url = '/api/sync' if self.sync_cursor is None else f'/api/sync?since={self.sync_cursor}'
+            response = self.client.get(url, headers=self.auth)
+            if response.status_code == 200:
+                self.sync_cursor = response.get_json()['cursor']
+            return response
+        self.timed('sync', call)
+
+    def op_user_statistic_range(self):
+        end = self.recent_day(365)
+        self.get('user_statistic range',
+                 f'/api/user_statistic?from={(end - timedelta(days=60)).isoformat()}&to={end.isoformat()}')
+
+    def op_user_statistic_summary(self):
+        granularity, days = self.rng.choice((('day', 30), ('week', 180), ('month', 365)))
+        end = self.recent_day(365)
+        self.get('user_statistic summary', f'/api/user_statistic/summary?granularity={granularity}'
+                                           f'&from={(end - timedelta(days=days)).isoformat()}&to={end.isoformat()}')
+
+    def op_tracks_upload(self):
+        self.post('tracks upload', '/api/tracks', data=gpx(dataset.track_points(self.rng, 300)),
+                  content_type='application/gpx+xml')
+
+    def op_tracks(self):
+        self.get('tracks', '/api/tracks')
+
+    def op_track(self):
+        tolerance = self.rng.choice(('', '?tolerance=8', '?tolerance=32'))
+        self.get('track', f'/api/tracks/{self.rng.randrange(1, self.limits.tracks + 1)}{tolerance}')
+
+    def op_tracks_nearby(self):
+        lat, lon = self.city_point()
+        self.get('tracks/nearby', f'/api/tracks/nearby?lat={lat:.5f}&lon={lon:.5f}&radius=2000')
+
+    def op_tracks_bbox(self):
+        lat, lon = self.city_point()
+        self.get('tracks/bbox', f'/api/tracks/bbox?min_lat={lat:.5f}&min_lon={lon:.5f}'
+                                f'&max_lat={lat + 0.02:.5f}&max_lon={lon + 0.03:.5f}')
+
+    def op_track_efforts(self):
+        self.get('track efforts', f'/api/tracks/{self.rng.randrange(1, self.limits.tracks + 1)}/efforts')
+
+    def op_segments_create(self):
+        points = [[lat, lon] for lat, lon, _, _ in dataset.track_points(self.rng, 60)]
+        self.post('segments create', '/api/segments', json={'name': f'Сегмент {self.unique()}', 'points': points})
+
+    def op_segment(self):
+        self.get('segment', f'/api/segments/{self.rng.randrange(1, self.limits.segments + 1)}')
+
+    def op_segment_leaderboard(self):
+        self.get('segment leaderboard', f'/api/segments/{self.rng.randrange(1, self.limits.segments + 1)}/leaderboard')
+
+    def op_route(self):
+        (from_lat, from_lon), (to_lat, to_lon) = self.city_point(), self.city_point()
+        self.get('route', f'/api/route?from_lat={from_lat:.5f}&from_lon={from_lon:.5f}'
+                          f'&to_lat={to_lat:.5f}&to_lon={to_lon:.5f}&mode={self.rng.choice(("walking", "running"))}')
+
+
+def operation(name):
+    # 'group_chat older messages' -> VirtualUser.op_group_chat_older_messages
+    return getattr(VirtualUser, 'op_' + name.replace('<id>', 'id').replace('/', '_').replace(' ', '_'))
+
+
+def worker(index, args, mix, start, deadline, warmup_until, results):
+    os.environ.update(DATABASE_URL=args.database_url, DB_CREATE_ALL='0', SEGMENT_MATCHING='0')
+    # Приложение печатает каждый токен и событие - в замерах это только шум
+    sys.stdout = open(os.devnull, 'w')
+    import app as runners
+
+    counter = QueryCounter()
+    with runners.app.app_context():
+        for engine in (runners.db.engine, runners.app.extensions['db_read_engine']):
+            if engine is not None:
+                count_queries(engine, counter)
+    limits = Limits(runners)
+    names, weights = zip(*mix.items())
+    records = []
+
+    def run_thread(thread_index):
+        rng = random.Random(args.seed * 1000 + index * 100 + thread_index)
+        # Имя входит в email и названия - уникально и между прогонами на одной БД
+        name = f'{int(start)}-p{index}t{thread_index}'
+        user = VirtualUser(runners, limits, rng.randrange(1, limits.users + 1), name, rng, counter, records)
+        time.sleep(max(0.0, start - time.time()))
+        while time.time() < deadline:
+            user.recording = time.time() >= warmup_until
+            if rng.random() < args.switch_user:
+                # Смена виртуального пользователя: новые чаты, заявки и токен
+                user.close()
+                user = VirtualUser(runners, limits, rng.randrange(1, limits.users + 1), name, rng, counter, records)
+                user.recording = time.time() >= warmup_until
+            operation(rng.choices(names, weights)[0])(user)
+        user.close()
+
+    threads = [threading.Thread(target=run_thread, args=(i,)) for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put(records)
+
+
+def summarize(records, seconds):
+    by_name = {}
+    for name, elapsed, queries, status in records:
+        by_name.setdefault(name, []).append((elapsed, queries, status))
+    operations = {}
+    for name, rows in sorted(by_name.items()):
+        timings = sorted(row[0] for row in rows)
+        queries = [row[1] for row in rows]
+        statuses = {}
+        for row in rows:
+            statuses[str(row[2])] = statuses.get(str(row[2]), 0) + 1
+        operations[name] = {
+            'count': len(rows),
+            'throughput': round(len(rows) / seconds, 2),
+            **{f'p{p}_ms': round(percentile(timings, p), 3) for p in PERCENTILES},
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'errors': sum(1 for row in rows if not isinstance(row[2], int) or row[2] >= 500),
+            'statuses': statuses,
+        }
+    timings = sorted(row[1] for row in records)
+    total = {
+        'count': len(records),
+        'throughput': round(len(records) / seconds, 2),
+        **{f'p{p}_ms': round(percentile(timings, p), 3) if timings else None for p in PERCENTILES},
+        'queries_mean': round(sum(row[2] for row in records) / len(records), 2) if records else None,
+        'errors': sum(op['errors'] for op in operations.values()),
+    }
+    return total, operations
+
+
+def print_table(total, operations):
+    header = f"{'operation':<28} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>6}"
+    print(header)
+    print('-' * len(header))
+    for name, op in operations.items():
+        print(f"{name:<28} {op['count']:>7} {op['throughput']:>8.1f} {op['p50_ms']:>8.1f} {op['p95_ms']:>8.1f} "
+              f"{op['p99_ms']:>8.1f} {op['queries_mean']:>8.1f} {op['errors']:>6}")
+    print('-' * len(header))
+    if total['count']:
+        print(f"{'total':<28} {total['count']:>7} {total['throughput']:>8.1f} {total['p50_ms']:>8.1f} "
+              f"{total['p95_ms']:>8.1f} {total['p99_ms']:>8.1f} {total['queries_mean']:>8.1f} {total['errors']:>6}")
+
+
+def print_comparison(baseline, total, operations):
+    # Изменение относительно прошлого прогона, в процентах (минус - быстрее/меньше)
+    def change(old, new):
+        if not old or new is None:
+            return '      -'
+        return f'{(new - old) / old * 100:+6.0f}%'
+
+    print(f"\ncompared with {baseline['meta'].get('finished_at', '?')} ({baseline['meta'].get('commit') or 'unknown commit'})")
+    print(f"{'operation':<28} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+    rows = [(name, baseline['operations'].get(name), op) for name, op in operations.items()]
+    rows.append(('total', baseline['total'], total))
+    for name, old, new in rows:
+        if old is None:
+            print(f'{name:<28} {"new":>8}')
+            continue
+        print(f"{name:<28} {change(old['throughput'], new['throughput']):>8} "
+              + ' '.join(f"{change(old[f'p{p}_ms'], new[f'p{p}_ms']):>8}" for p in PERCENTILES)
+              + f" {change(old['queries_mean'], new['queries_mean']):>8}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=list(dataset.SCALES), default='tiny',
+                        help='размер сгенерированной БД, если не задан --db')
+    parser.add_argument('--db', help='готовая БД из benchmarks.dataset (будет изменена пишущими операциями)')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4, help='виртуальных пользователей на процесс')
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3, help='секунд в начале прогона, не попадающих в замеры')
+    parser.add_argument('--only', nargs='+', metavar='OPERATION', help='выполнять только эти операции')
+    parser.add_argument('--exclude', nargs='+', metavar='OPERATION', default=[])
+    parser.add_argument('--switch-user', type=float, default=0.02,
+                        help='вероятность сменить виртуального пользователя перед операцией')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='сохранить результат в JSON')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения')
+    args = parser.parse_args()
+
+    unknown = [name for name in (args.only or []) + args.exclude if name not in MIX]
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(unknown)}; known: {', '.join(MIX)}")
+    mix = {name: weight for name, weight in MIX.items()
+           if (args.only is None or name in args.only) and name not in args.exclude}
+    if not os.environ.get('ROUTING_GRAPH'):
+        mix.pop('route', None)
+    if not mix:
+        parser.error('no operations left to run')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.db) if args.db else os.path.join(tmp, 'load.db')
+        args.database_url = f'sqlite:///{path}'
+        if not args.db:
+            os.environ.update(DATABASE_URL=args.database_url, SEGMENT_MATCHING='0')
+            import app as runners
+            dataset.generate(runners, seed=args.seed, log=lambda line: print(line, file=sys.stderr),
+                             **dataset.SCALES[args.scale])
+            with runners.app.app_context():
+                runners.db.engine.dispose()
+
+        # Каждый процесс импортирует приложение заново - со своими пулами и кешами
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue()
+        start = time.time() + 3 + args.processes
+        warmup_until = start + args.warmup
+        deadline = warmup_until + args.seconds
+        processes = [ctx.Process(target=worker, args=(i, args, mix, start, deadline, warmup_until, results))
+                     for i in range(args.processes)]
+        for p in processes:
+            p.start()
+        records = [record for _ in processes for record in results.get()]
+        for p in processes:
+            p.join()
+        started_at = datetime.fromtimestamp(warmup_until)
+
+    total, operations = summarize(records, args.seconds)
+    print_table(total, operations)
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'db': args.db or f'generated:{args.scale}',
+            'processes': args.processes,
+            'threads': args.threads,
+            'concurrency': args.processes * args.threads,
+            'seconds': args.seconds,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'mix': mix,
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'cpus': os.cpu_count(),
+            'env': {key: os.environ[key] for key in sorted(os.environ)
+                    if key.startswith(('SQLITE_', 'DB_', 'CHAT_WRITE_', 'FRIEND_GRAPH_'))},
+        },
+        'total': total,
+        'operations': operations,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), total, operations)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'\nsaved to {args.output}')
+    if total['errors']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+# Задержка доставки сообщений чата во время всплеска входов. Запускает настоящий
+# сервер (python app.py, eventlet) на синтетических данных: один клиент Socket.IO
+# шлёт сообщения в чат с постоянным темпом, второй участник чата их получает,
+# а --logins потоков непрерывно вызывают POST /login. Сравнивает хеширование
+# паролей в потоке ОС (PASSWORD_HASH_OFFLOAD=1) и прямо в зелёном потоке (0):
+# во втором случае каждый вход останавливает хаб, и задержка чата растёт.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.login_burst --scale tiny --logins 16 --seconds 10
+#     python -m benchmarks.login_burst --db /tmp/runners.db --modes offload --output burst.json
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import socketio
+
+from benchmarks import dataset
+from benchmarks.load import percentile
+
+MODES = {'offload': '1', 'inline': '0'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(database_url, offload, port, extra_env, log):
+    env = dict(os.environ, DATABASE_URL=database_url, PORT=str(port), PASSWORD_HASH_OFFLOAD=offload,
+               SEGMENT_MATCHING='0', LOG_LEVEL='WARNING', **extra_env)
+    # Журнал доступа eventlet.wsgi пишет строку на каждый запрос - в консоль он не выводится
+    server = subprocess.Popen([sys.executable, 'app.py'], env=env, stdout=log, stderr=log)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f'server exited with code {server.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit('server did not start in 60 s')
+
+
+class ChatProbe:
+    # Отправитель и получатель в одном чате; задержка - от emit до new_message у получателя
+    def __init__(self, url, sender_token, receiver_token, chat_id, interval):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.sent = {}
+        self.latencies = []
+        self.phase = None
+        self.lock = threading.Lock()
+        self.receiver = socketio.Client()
+        self.receiver.on('new_message', self.on_message)
+        self.sender = socketio.Client()
+        for client, token in ((self.receiver, receiver_token), (self.sender, sender_token)):
+            client.connect(url, auth={'token': token}, transports=['websocket'])
+            client.emit('join_chat', {'chat_id': chat_id})
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def on_message(self, data):
+        received = time.perf_counter()
+        with self.lock:
+            sent = self.sent.pop(data.get('content'), None)
+        if sent is not None:
+            phase, started = sent
+            self.latencies.append((phase, (received - started) * 1000))
+
+    def run(self):
+        sequence = 0
+        while self.running:
+            sequence += 1
+            content = f'burst-probe {sequence}'
+            with self.lock:
+                self.sent[content] = (self.phase, time.perf_counter())
+            self.sender.emit('send_message', {'chat_id': self.chat_id, 'content': content})
+            time.sleep(self.interval)
+
+    def lost(self, phase):
+        with self.lock:
+            return sum(1 for sent_phase, _ in self.sent.values() if sent_phase == phase)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sender.disconnect()
+        self.receiver.disconnect()
+
+
+def login_loop(url, users, offset, stop, results):
+    session = requests.Session()
+    index = offset
+    while not stop.is_set():
+        index = index % users + 1
+        started = time.perf_counter()
+        try:
+            status = session.post(f'{url}/login', json={'email': f'user{index}@example.com',
+                                                        'password': dataset.PASSWORD}, timeout=60).status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        results.append(((time.perf_counter() - started) * 1000, status))
+
+
+def run_mode(mode, args, database_url, runners, chat_id, sender_id, receiver_id):
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    log = open(args.server_log, 'a') if args.server_log else subprocess.DEVNULL
+    server = start_server(database_url, MODES[mode], port,
+                          {'PASSWORD_HASH_WORKERS': str(args.hash_workers), 'PASSWORD_HASH_QUEUE': str(args.hash_queue)},
+                          log)
+    try:
+        with runners.app.app_context():
+            tokens = runners.generate_jwt(sender_id), runners.generate_jwt(receiver_id)
+        probe = ChatProbe(url, tokens[0], tokens[1], chat_id, args.interval / 1000)
+        probe.phase = 'idle'
+        probe.thread.start()
+        time.sleep(args.seconds)
+
+        probe.phase = 'burst'
+        stop, logins = threading.Event(), []
+        threads = [threading.Thread(target=login_loop, args=(url, args.users, i * 97, stop, logins), daemon=True)
+                   for i in range(args.logins)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        probe.phase = None
+        stop.set()
+        for thread in threads:
+            thread.join()
+        burst_seconds = time.perf_counter() - started
+        time.sleep(1)
+        probe.close()
+    finally:
+        server.terminate()
+        server.wait()
+        if args.server_log:
+            log.close()
+
+    result = {}
+    for phase in ('idle', 'burst'):
+        timings = sorted(ms for p, ms in probe.latencies if p == phase)
+        result[f'chat {phase}'] = {
+            'count': len(timings),
+            **{f'p{p}_ms': round(percentile(timings, p), 2) if timings else None for p in (50, 95, 99)},
+            'max_ms': round(timings[-1], 2) if timings else None,
+            'lost': probe.lost(phase),
+        }
+    timings = sorted(ms for ms, status in logins if status == 201)
+    statuses = {}
+    for _, status in logins:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    result['login'] = {
+        'count': len(logins),
+        'throughput': round(len(timings) / burst_seconds, 2),
+        **{f'p{p}_ms': round(percentile(timings, p), 2) if timings else None for p in (50, 95, 99)},
+        'max_ms': round(timings[-1], 2) if timings else None,
+        'statuses': statuses,
+    }
+    return result
+
+
+def print_results(results):
+    header = f'{"mode":9}{"phase":13}{"count":>7}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}  extra'
+    print(header)
+    print('-' * len(header))
+    for mode, result in results.items():
+        for phase, row in result.items():
+            extra = (f'lost {row["lost"]}' if 'lost' in row
+                     else f'{row["throughput"]}/s {row["statuses"]}')
+            values = ''.join(f'{row[key]:>9.1f}' if row[key] is not None else f'{"-":>9}'
+                             for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+            print(f'{mode:9}{phase:13}{row["count"]:>7}{values}  {extra}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=list(dataset.SCALES), default='tiny')
+    parser.add_argument('--db', help='готовая БД из benchmarks.dataset (иначе создаётся временная)')
+    parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--logins', type=int, default=16, help='потоков, вызывающих /login')
+    parser.add_argument('--seconds', type=float, default=10, help='длительность каждой фазы')
+    parser.add_argument('--interval', type=float, default=50, help='интервал сообщений чата, мс')
+    parser.add_argument('--hash-workers', type=int, default=1)
+    parser.add_argument('--hash-queue', type=int, default=32)
+    parser.add_argument('--server-log', help='дописывать вывод сервера в этот файл')
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.db) if args.db else os.path.join(tmp, 'burst.db')
+        database_url = f'sqlite:///{path}'
+        os.environ['DATABASE_URL'] = database_url
+        os.environ['SEGMENT_MATCHING'] = '0'
+        import app as runners
+
+        if not args.db:
+            dataset.generate(runners, seed=1, log=lambda line: print(line, file=sys.stderr),
+                             **dataset.SCALES[args.scale])
+        with runners.app.app_context():
+            args.users = runners.db.session.query(runners.db.func.max(runners.User.id_User)).scalar()
+            chat_id, sender_id = runners.db.session.query(
+                runners.UserGroupChatAssociation.chat_id, runners.UserGroupChatAssociation.user_id).first()
+            receiver_id = runners.db.session.query(runners.UserGroupChatAssociation.user_id).filter(
+                runners.UserGroupChatAssociation.chat_id == chat_id,
+                runners.UserGroupChatAssociation.user_id != sender_id).limit(1).scalar()
+            runners.db.session.remove()
+            runners.db.engine.dispose()
+
+        results = {mode: run_mode(mode, args, database_url, runners, chat_id, sender_id, receiver_id)
+                   for mode in args.modes}
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'meta': {'logins': args.logins, 'seconds': args.seconds, 'interval_ms': args.interval,
+                                    'hash_workers': args.hash_workers, 'cpus': os.cpu_count()},
+                           'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+# Проверка планов запросов: на синтетических данных (benchmarks/dataset.py) вызывает
+# все REST-эндпоинты, события Socket.IO и фоновые задачи, перехватывает каждый SQL-запрос
+# и прогоняет его через EXPLAIN QUERY PLAN. Полный просмотр таблицы (SCAN без индекса)
+# считается ошибкой, если он не внесён в ALLOWED_SCANS с объяснением.
+# Код выхода 1 при найденных просмотрах - так проверку можно запускать в CI
+# (tests/test_query_plans.py запускает её на наборе tiny).
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.query_plans --scale tiny
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from datetime import date
+
+from benchmarks import dataset
+
+# Намеренные полные просмотры: (шаг сценария, таблица) -> причина
+ALLOWED_SCANS = {
+    ('friend graph load', 'friendships'): 'граф дружб загружается в память целиком (friend_graph.py) - '
+                                          'при первом обращении и раз в FRIEND_GRAPH_TTL',
+    ('friend graph load', 'user_info'): 'справочник имён для графа дружб загружается вместе с графом',
+    ('change log prune', 'change_log'): 'первая свежая запись ищется по id от начала журнала - '
+                                        'просматриваются только удаляемые записи',
+}
+# Строка плана вида "SCAN table" или "SCAN table AS alias" - без индекса.
+# "SCAN anon_N" - чтение результата подзапроса SQLAlchemy (co-routine), а не таблицы
+FULL_SCAN = re.compile(r'^SCAN (?!anon_\d+$)(\w+)(?: AS \w+)?$')
+SKIP_STATEMENTS = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+GPX = ('<?xml version="1.0"?><gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><name>plan</name><trkseg>'
+       + ''.join(f'<trkpt lat="{53.3 + k * 0.0001:.6f}" lon="83.7"><time>2024-05-01T10:{k // 60:02d}:{k % 60:02d}Z'
+                 f'</time></trkpt>' for k in range(300))
+       + '</trkseg></trk></gpx>').encode()
+
+
+class StatementLog:
+    # Запросы, выполненные движком, пока включена запись
+    def __init__(self, engines):
+        self.statements = None
+        for engine in engines:
+            if engine is not None:
+                engine_events(engine, self)
+
+    def record(self, statement, parameters, executemany):
+        if self.statements is not None and not executemany:
+            self.statements.append((statement, parameters))
+
+
+def engine_events(engine, log):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        log.record(statement, parameters, executemany)
+
+
+def full_scans(plan_connection, statement, parameters):
+    if statement.lstrip().upper().startswith(SKIP_STATEMENTS):
+        return [], []
+    plan = plan_connection.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ()).fetchall()
+    details = [row[3] for row in plan]
+    return [m.group(1) for m in map(FULL_SCAN.match, details) if m], details
+
+
+def scenario(runners, user_id):
+    # Шаги: (название, функция). Пользователь user_id - обычный участник с друзьями и чатами
+    db = runners.db
+    with runners.app.app_context():
+        chat_id = db.session.query(runners.UserGroupChatAssociation.chat_id).filter_by(user_id=user_id).first()[0]
+        other_chat = db.session.query(runners.GroupChat.id).filter(~runners.GroupChat.id.in_(
+            db.select(runners.UserGroupChatAssociation.chat_id).where(
+                runners.UserGroupChatAssociation.user_id == user_id))).first()[0]
+        track = runners.Track.query.first()
+        pending = runners.Friendship.query.filter_by(status='pending').first()
+        stranger = user_id + dataset.FRIEND_WINDOW * 3
+        token = runners.generate_jwt(user_id)
+        pending_token = runners.generate_jwt(pending.friend_id)
+        before_id = db.session.query(db.func.max(runners.GroupMessage.id)).filter_by(chat_id=chat_id).scalar()
+    client = runners.app.test_client()
+    auth = {'Authorization': token}
+    track_id, box = track.id, (track.min_lat, track.min_lon, track.max_lat, track.max_lon)
+    today = date.today().isoformat()
+    sio = {}
+
+    def get(url, headers=auth):
+        return lambda: client.get(url, headers=headers)
+
+    def post(url, headers=auth, **kwargs):
+        return lambda: client.post(url, headers=headers, **kwargs)
+
+    def socket_connect():
+        sio['client'] = runners.socketio.test_client(runners.app, flask_test_client=client, auth={'token': token})
+
+    return [
+        ('login', post('/login', headers={}, json={'email': f'user{user_id}@example.com', 'password': dataset.PASSWORD})),
+        ('register', post('/register', headers={}, json={'email': 'plan-check@example.com', 'password': 'secret'})),
+        ('token_verify', post('/token_verify')),
+        ('user_info', get('/api/user_info')),
+        ('user_info/check', get('/api/user_info/check')),
+        ('user_info/<id>', get(f'/api/user_info/{user_id}')),
+        ('update user_info', post('/api/user_info', json={'name': 'План Проверка', 'weight': 70, 'height': 180,
+                                                          'sex': 'm', 'age': 30, 'country': 'RU'})),
+        ('users/search prefix', get('/api/users/search?name=анна')),
+        ('users/search substring', get('/api/users/search?name=ова')),
+        ('friends', get('/api/friends')),
+        ('friend graph load', lambda: runners.friends_cache.invalidate() or runners.friends_cache.friends(user_id)),
+        ('friends/suggestions', get('/api/friends/suggestions')),
+        ('friends/leaderboard', get('/api/friends/leaderboard?metric=distance&window=30d')),
+        ('friends/requests', get('/api/friends/requests', headers={'Authorization': pending_token})),
+        ('friends/send_request', post('/api/friends/send_request', json={'friend_id': stranger})),
+        ('friends/accept_request', post('/api/friends/accept_request', headers={'Authorization': pending_token},
+                                        json={'friend_id': pending.user_id})),
+        ('friends/reject_request', post('/api/friends/reject_request', json={'request_id': pending.id})),
+        ('group_chats', get('/api/group_chats')),
+        ('create group_chat', post('/api/group_chats', json={'title': 'План', 'members': [user_id + 1, user_id + 2]})),
+        ('group_chat details', get(f'/api/group_chats/{chat_id}')),
+        ('group_chat participants', get(f'/api/group_chats/{chat_id}/participants')),
+        ('group_chat messages', get(f'/api/group_chats/{chat_id}/messages?limit=50')),
+        ('group_chat older messages', get(f'/api/group_chats/{chat_id}/messages?limit=50&before_id={before_id}')),
+        ('group_chat join', post(f'/api/group_chats/{other_chat}/join')),
+        ('group_chat add_user', post(f'/api/group_chats/{other_chat}/add_user', json={'user_id': stranger})),
+        ('group_chat leave', post(f'/api/group_chats/{other_chat}/leave')),
+        ('socket connect', socket_connect),
+        ('socket join_chat', lambda: sio['client'].emit('join_chat', {'chat_id': chat_id})),
+        ('socket send_message', lambda: sio['client'].emit('send_message', {'chat_id': chat_id, 'content': 'план'})),
+        ('user_statistic add', post('/api/user_statistic', json={'date': today, 'calories': 100, 'steps': 1000,
+                                                                 'distance': 1.5})),
+        ('user_statistic batch', post('/api/user_statistic/batch', json={'records': [
+            {'date': today, 'calories': 1, 'steps': 10, 'distance': 0.1, 'idempotency_key': 'plan-1'}]})),
+        ('user_statistic', get('/api/user_statistic?limit=30')),
+        ('user_statistic range', get('/api/user_statistic?from=2024-01-01&to=2024-03-01')),
+        ('user_statistic summary day', get('/api/user_statistic/summary')),
+        ('user_statistic summary month', get('/api/user_statistic/summary?granularity=month&from=2024-01-10'
+                                             '&to=2024-12-20')),
+        ('sync cursor', get('/api/sync')),
+        ('sync', get('/api/sync?since=0')),
+        ('change log prune', runners.prune_change_log),
+        ('tracks upload', post('/api/tracks', data=GPX, content_type='application/gpx+xml')),
+        ('tracks', get('/api/tracks')),
+        ('track', get(f'/api/tracks/{track_id}')),
+        ('track lod', get(f'/api/tracks/{track_id}?tolerance=32')),
+        ('tracks/nearby', get(f'/api/tracks/nearby?lat={box[0]}&lon={box[1]}&radius=3000')),
+        ('tracks/bbox', get(f'/api/tracks/bbox?min_lat={box[0]}&min_lon={box[1]}&max_lat={box[2]}&max_lon={box[3]}')),
+        ('track efforts', get(f'/api/tracks/{track_id}/efforts')),
+        ('segments create', post('/api/segments', json={'name': 'План', 'track_id': track_id, 'from_index': 0,
+                                                         'to_index': 60})),
+        ('segment', get('/api/segments/1')),
+        ('segment leaderboard', get('/api/segments/1/leaderboard')),
+        ('segment matching', runners.run_segment_matching),
+        ('logout', post('/api/logout')),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scale', choices=list(dataset.SCALES), default='tiny')
+    parser.add_argument('--db', help='готовая БД из benchmarks.dataset (иначе создаётся временная)')
+    parser.add_argument('--user', type=int, default=500)
+    parser.add_argument('--analyze', action='store_true', help='собрать статистику ANALYZE перед проверкой')
+    parser.add_argument('--verbose', action='store_true', help='печатать планы всех запросов')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.abspath(args.db) if args.db else os.path.join(tmp, 'plans.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+        os.environ['SEGMENT_MATCHING'] = '0'
+        import app as runners
+
+        if not args.db:
+            dataset.generate(runners, seed=1, log=lambda line: print(line, file=sys.stderr), **dataset.SCALES[args.scale])
+        plan_connection = sqlite3.connect(path)
+        if args.analyze:
+            plan_connection.execute('ANALYZE')
+
+        with runners.app.app_context():
+            log = StatementLog([runners.db.engine, runners.app.extensions['db_read_engine']])
+        failures, checked = [], 0
+        for label, step in scenario(runners, args.user):
+            log.statements = []
+            response = step()
+            status = getattr(response, 'status_code', None)
+            if status is not None and status >= 500:
+                failures.append((label, None, f'HTTP {status}: {response.get_data(as_text=True)[:200]}'))
+            for statement, parameters in log.statements:
+                tables, details = full_scans(plan_connection, statement, parameters)
+                checked += 1
+                if args.verbose:
+                    print(f'[{label}] {" ".join(statement.split())[:160]}\n    ' + '\n    '.join(details))
+                for table in tables:
+                    if (label, table) not in ALLOWED_SCANS:
+                        failures.append((label, table, ' '.join(statement.split())))
+            log.statements = None
+
+        print(f'{checked} statements checked')
+        for (label, table), reason in ALLOWED_SCANS.items():
+            print(f'allowed: [{label}] SCAN {table} - {reason}')
+        for label, table, detail in failures:
+            print(f'FAIL [{label}] ' + (f'full scan of {table}: ' if table else '') + detail[:300])
+        print(json.dumps({'checked': checked, 'failures': len(failures)}))
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# Скорость маршрутизации (routing.py) на синтетическом "городе":
+# сетка улиц с промежуточными узлами, случайно выброшенными кварталами,
+# диагональными тропинками и непроходимыми для пешехода магистралями.
+# Сравнивает двунаправленный A* с обычным Дейкстрой и проверяет, что длины совпадают.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.routing --grid 300 --queries 200
+import argparse
+import heapq
+import math
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+
+import routing
+
+
+def write_city(path, grid, seed=1, spacing=0.001):
+    # grid x grid перекрёстков с шагом ~100 м, между соседними перекрёстками 2 промежуточных узла
+    rng = random.Random(seed)
+    lat0, lon0 = 53.30, 83.70
+
+    def node_id(i, j):
+        return i * grid + j + 1
+
+    next_id = grid * grid + 1
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        for i in range(grid):
+            for j in range(grid):
+                lat = lat0 + i * spacing + rng.uniform(-0.0002, 0.0002)
+                lon = lon0 + j * spacing * 1.6 + rng.uniform(-0.0002, 0.0002)
+                f.write(f'<node id="{node_id(i, j)}" lat="{lat:.7f}" lon="{lon:.7f}"/>\n')
+
+        ways = []
+        for i in range(grid):
+            for j in range(grid):
+                for di, dj in ((0, 1), (1, 0)):
+                    if i + di >= grid or j + dj >= grid or rng.random() < 0.1:
+                        continue
+                    refs = [node_id(i, j)]
+                    for k in (1, 2):
+                        lat = lat0 + (i + di * k / 3) * spacing
+                        lon = lon0 + (j + dj * k / 3) * spacing * 1.6
+                        f.write(f'<node id="{next_id}" lat="{lat:.7f}" lon="{lon:.7f}"/>\n')
+                        refs.append(next_id)
+                        next_id += 1
+                    refs.append(node_id(i + di, j + dj))
+                    highway = 'motorway' if i % 50 == 25 and di == 0 else rng.choice(('residential', 'footway', 'service'))
+                    ways.append((refs, highway))
+                if i + 1 < grid and j + 1 < grid and rng.random() < 0.05:
+                    ways.append(([node_id(i, j), node_id(i + 1, j + 1)], 'path'))
+
+        for way_id, (refs, highway) in enumerate(ways, start=1):
+            nds = ''.join(f'<nd ref="{ref}"/>' for ref in refs)
+            f.write(f'<way id="{way_id}">{nds}<tag k="highway" v="{highway}"/></way>\n')
+        f.write('</osm>\n')
+
+
+def dijkstra(adjacency, source, target):
+    # Обычный Дейкстра по графу без стягивания цепочек
+    dist = {source: 0.0}
+    queue = [(0.0, source)]
+    settled = set()
+    while queue:
+        d, v = heapq.heappop(queue)
+        if v in settled:
+            continue
+        if v == target:
+            return d, len(settled)
+        settled.add(v)
+        for w, weight in adjacency[v].items():
+            nd = d + weight
+            if nd < dist.get(w, math.inf):
+                dist[w] = nd
+                heapq.heappush(queue, (nd, w))
+    return None, len(settled)
+
+
+def load_adjacency(osm_path):
+    with open(osm_path, 'rb') as stream:
+        _, _, indptr, indices, weights = routing.node_graph(*routing.read_osm(stream))
+    ptr, ind, w = indptr.tolist(), indices.tolist(), weights.tolist()
+    return [dict(zip(ind[ptr[v]:ptr[v + 1]], w[ptr[v]:ptr[v + 1]])) for v in range(len(ptr) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grid', type=int, default=300)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--baseline', type=int, default=20, help='сколько запросов сверить с Дейкстрой')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        osm_path = os.path.join(tmp, 'city.osm')
+        started = time.perf_counter()
+        write_city(osm_path, args.grid)
+        print(f'extract: {os.path.getsize(osm_path) / 1e6:.1f} MB written in {time.perf_counter() - started:.1f} s')
+
+        started = time.perf_counter()
+        meta = routing.build_from_osm(osm_path, os.path.join(tmp, 'graph'))
+        print(f"build: {meta['nodes']} nodes, {meta['junctions']} junctions, {meta['edges']} directed edges in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        graph = routing.RoutingGraph.load(os.path.join(tmp, 'graph'))
+        print(f'load (mmap): {(time.perf_counter() - started) * 1000:.1f} ms')
+
+        rng = random.Random(2)
+        lat_min, lat_max = float(np.min(graph.lat)), float(np.max(graph.lat))
+        lon_min, lon_max = float(np.min(graph.lon)), float(np.max(graph.lon))
+        queries = [(rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max),
+                    rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)) for _ in range(args.queries)]
+
+        started = time.perf_counter()
+        results = []
+        for q in queries:
+            try:
+                results.append(graph.route(*q)['distance'])
+            except routing.RoutingError:
+                results.append(None)
+        elapsed = time.perf_counter() - started
+        average = sum(r for r in results if r) / max(1, sum(1 for r in results if r))
+        print(f'bidirectional A*: {len(queries) / elapsed:.1f} queries/s '
+              f'({elapsed / len(queries) * 1000:.1f} ms avg, mean route {average / 1000:.1f} km)')
+
+        adjacency = load_adjacency(osm_path)
+        checked, baseline_time = 0, 0.0
+        for q, expected in list(zip(queries, results))[:args.baseline]:
+            source, target = graph.nearest_node(q[0], q[1]), graph.nearest_node(q[2], q[3])
+            started = time.perf_counter()
+            distance, _ = dijkstra(adjacency, source, target)
+            baseline_time += time.perf_counter() - started
+            if expected is None:
+                assert distance is None
+                continue
+            assert abs(distance - expected) < 0.1, (distance, expected)
+            # Маршрут - настоящая цепочка рёбер той же длины
+            found = graph.shortest_path(source, target)
+            length = sum(adjacency[a][b] for a, b in zip(found[1], found[1][1:]))
+            assert found[1][0] == source and found[1][-1] == target and abs(length - found[0]) < 0.1
+            checked += 1
+        print(f'dijkstra baseline: {args.baseline / baseline_time:.1f} queries/s '
+              f'({checked} routes checked: same length, valid paths)')
+
+if __name__ == '__main__':
+    main()
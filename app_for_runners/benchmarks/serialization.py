@@ -0,0 +1,229 @@
+# Сериализация и сжатие больших ответов: время построения JSON из строк
+# запроса и размер тела по кодировкам. Полезные нагрузки синтетические, по
+# форме ответов эндпоинтов (история чата, статистика, друзья, список чатов, трек),
+# БД не нужна.
+#
+# Варианты сериализации:
+#   flask   - как было: даты в строки (isoformat/strftime) в каждой строке + json Flask
+#   std     - json_provider.StdJSONProvider, даты отдаются как есть
+#   orjson  - json_provider.OrjsonProvider (если установлен orjson)
+#   stream  - iter_json_array поверх провайдера приложения (только списки)
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.serialization
+#     python -m benchmarks.serialization --output serialization.json
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import compression
+import json_provider
+import tracks
+from benchmarks import dataset
+
+
+def message_rows(rng, count):
+    moment = dataset.START
+    rows = []
+    for i in range(count):
+        moment += timedelta(seconds=rng.randrange(5, 600))
+        sender = rng.randrange(1, 2000)
+        content = ' '.join(rng.choice(('забег', 'в субботу', 'кто идёт?', 'темп 5:30', 'встречаемся у парка',
+                                       'ok', 'отличная пробежка', '10 км')) for _ in range(rng.randrange(1, 8)))
+        rows.append((i + 1, content, sender, f'{rng.choice(dataset.FIRST_NAMES)} {rng.choice(dataset.LAST_NAMES)}',
+                     moment))
+    return rows
+
+
+def statistic_rows(rng, count):
+    day = dataset.START.date()
+    rows = []
+    for i in range(count):
+        steps = rng.randrange(2000, 25000)
+        rows.append((steps * 0.04, steps, steps * 0.0008, day - timedelta(days=i)))
+    return rows
+
+
+def friend_rows(rng, count):
+    return [(i + 2, f'user{i + 2}@example.com', f'{rng.choice(dataset.FIRST_NAMES)} {rng.choice(dataset.LAST_NAMES)}')
+            for i in range(count)]
+
+
+def chat_rows(rng, count):
+    return [(i + 1, f'Забег {i + 1}', 'встречаемся у парка в 8:00', rng.randrange(1, 10**6),
+             dataset.START + timedelta(minutes=rng.randrange(10**6))) for i in range(count)]
+
+
+# Строки -> dict ответа, как в эндпоинтах: raw=True - даты как есть (сейчас), False - строкой (раньше)
+def message_dict(row, raw):
+    message_id, content, sender_id, name, timestamp = row
+    return {'id': message_id, 'content': content, 'sender_id': sender_id, 'sender': name,
+            'timestamp': timestamp if raw else timestamp.isoformat()}
+
+
+def statistic_dict(row, raw):
+    calories, steps, distance, day = row
+    return {'calories': calories, 'steps': steps, 'distance': distance,
+            'date': day if raw else day.strftime('%Y-%m-%d')}
+
+
+def friend_dict(row, raw):
+    friend_id, email, name = row
+    return {'id': friend_id, 'email': email, 'name': name}
+
+
+def chat_dict(row, raw):
+    chat_id, title, preview, message_id, at = row
+    return {'id': chat_id, 'title': title, 'lastMessage': preview, 'lastMessageId': message_id,
+            'lastMessageAt': at if raw else at.isoformat()}
+
+
+def track_fields(rng, points):
+    # Полилинии трека кодируются один раз: в замер входит только сериализация
+    track = dataset.track_points(rng, points)
+    return {
+        'id': 1, 'user_id': 1, 'name': 'Утренняя пробежка',
+        'point_count': points, 'distance': 10234.5, 'elevation_gain': 120.0,
+        'bbox': [53.3, 83.7, 53.4, 83.8], 'start': [53.3, 83.7],
+        'tolerance': 0, 'polyline': tracks.encode_polyline([(lat, lon) for lat, lon, _, _ in track]),
+        'polyline_points': points, 'elevations': tracks.encode_polyline([(ele,) for _, _, ele, _ in track]),
+        'times': tracks.encode_polyline([(k * 4,) for k in range(points)]),
+    }
+
+
+def track_dict(fields, raw):
+    started = datetime(2024, 5, 1, 10, 0)
+    moments = {'created_at': started, 'started_at': started, 'finished_at': started + timedelta(hours=1)}
+    return {**fields, **{key: value if raw else value.isoformat() for key, value in moments.items()}}
+
+
+def payloads(rng):
+    # (название, строки, row -> dict, обёртка списка dict в тело ответа или None - тело сам список)
+    return [
+        ('group_chat messages x200', message_rows(rng, 200), message_dict,
+         lambda items: {'messages': items, 'next_before_id': 1}),
+        ('user_statistic x366', statistic_rows(rng, 366), statistic_dict, None),
+        ('user_statistic x1000', statistic_rows(rng, 1000), statistic_dict, None),
+        ('friends x2000', friend_rows(rng, 2000), friend_dict, None),
+        ('group_chats x500', chat_rows(rng, 500), chat_dict, None),
+        ('track 5000 points', [track_fields(rng, 5000)], track_dict, lambda items: items[0]),
+    ]
+
+
+def best_time(fn, repeat):
+    # Лучшее из repeat замеров среднего времени вызова, мс
+    best = None
+    for _ in range(repeat):
+        calls, started = 0, time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= 0.05:
+                break
+        per_call = elapsed / calls * 1000
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+
+def serializers(app):
+    flask_provider = DefaultJSONProvider(app)
+    std = json_provider.StdJSONProvider(app)
+    result = {
+        'flask': (False, lambda obj: (flask_provider.dumps(obj, separators=(',', ':')) + '\n').encode('utf-8')),
+        'std': (True, lambda obj: std.dumps_bytes(obj) + b'\n'),
+    }
+    if json_provider.orjson is not None:
+        orjson_provider = json_provider.OrjsonProvider(app)
+        result['orjson'] = (True, lambda obj: orjson_provider.dumps_bytes(obj) + b'\n')
+    return result
+
+
+def encodings(gzip_levels, brotli_quality):
+    result = {f'gzip-{level}': (lambda data, level=level: compress(data, 'gzip', gzip_level=level))
+              for level in gzip_levels}
+    if compression.brotli is not None:
+        result[f'br-{brotli_quality}'] = lambda data: compress(data, 'br', brotli_quality=brotli_quality)
+    return result
+
+
+def compress(data, encoding, gzip_level=6, brotli_quality=4):
+    compressor = compression.Compressor(encoding, gzip_level, brotli_quality)
+    return compressor.compress(data) + compressor.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--gzip-levels', type=int, nargs='+', default=[1, 6])
+    parser.add_argument('--brotli-quality', type=int, default=4)
+    parser.add_argument('--output', help='сохранить результаты в JSON')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    rng = random.Random(1)
+    methods = serializers(app)
+    codecs = encodings(args.gzip_levels, args.brotli_quality)
+    print('orjson: ' + ('yes' if json_provider.orjson is not None else 'not installed') +
+          ', brotli: ' + ('yes' if compression.brotli is not None else 'not installed'))
+
+    results = {}
+    for name, rows, to_dict, wrap in payloads(rng):
+        def build(raw):
+            items = [to_dict(row, raw) for row in rows]
+            return wrap(items) if wrap else items
+
+        entry = {'serialize_ms': {}, 'bytes': {}, 'compress_ms': {}}
+        body = None
+        for method, (raw, dumps) in methods.items():
+            # Время включает сборку dict из строк: для flask - с форматированием дат
+            entry['serialize_ms'][method] = round(best_time(lambda: dumps(build(raw)), args.repeat), 3)
+            data = dumps(build(raw))
+            if body is None:
+                body = data
+            elif json.loads(data) != json.loads(body):
+                raise SystemExit(f'{name}: {method} output differs from flask')
+        if wrap is None:
+            provider = json_provider.make_provider(app, 'auto')
+            entry['serialize_ms']['stream'] = round(best_time(
+                lambda: b''.join(json_provider.iter_json_array(provider, rows, lambda row: to_dict(row, True))),
+                args.repeat), 3)
+
+        entry['bytes']['identity'] = len(body)
+        for codec, fn in codecs.items():
+            entry['bytes'][codec] = len(fn(body))
+            entry['compress_ms'][codec] = round(best_time(lambda: fn(body), args.repeat), 3)
+        results[name] = entry
+
+    print_table(results, list(methods) + ['stream'], ['identity'] + list(codecs))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': {'orjson': json_provider.orjson is not None,
+                                'brotli': compression.brotli is not None}, 'results': results}, f, indent=2)
+
+
+def print_table(results, methods, codecs):
+    header = f'{"payload":28}' + ''.join(f'{m + " ms":>11}' for m in methods)
+    print('\nserialization (best of repeats, ms per response)')
+    print(header)
+    print('-' * len(header))
+    for name, entry in results.items():
+        print(f'{name:28}' + ''.join(f'{entry["serialize_ms"][m]:>11.3f}' if m in entry['serialize_ms']
+                                     else f'{"-":>11}' for m in methods))
+
+    header = f'{"payload":28}' + ''.join(f'{c:>12}' for c in codecs) + ''.join(f'{c + " ms":>12}' for c in codecs[1:])
+    print('\nbytes on the wire and compression time')
+    print(header)
+    print('-' * len(header))
+    for name, entry in results.items():
+        print(f'{name:28}' + ''.join(f'{entry["bytes"][c]:>12}' for c in codecs)
+              + ''.join(f'{entry["compress_ms"][c]:>12.3f}' for c in codecs[1:]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# Задержка поиска треков по карте (/api/tracks/nearby и /api/tracks/bbox)
+# с R*Tree-индексом и без него (запасной вариант на B-tree индексах).
+# Треки - короткие отрезки со случайным стартом в прямоугольнике размером с область.
+#
+# Запуск из каталога app_for_runners:
+#     python -m benchmarks.spatial --tracks 1000000 --queries 200
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def populate(runners, count, seed=1):
+    import tracks
+
+    rng = random.Random(seed)
+    rows = []
+    with runners.app.app_context():
+        user = runners.User(email='bench@example.com', password='x')
+        runners.db.session.add(user)
+        runners.db.session.commit()
+        conn = runners.db.engine.raw_connection()
+        try:
+            cursor = conn.cursor()
+            for i in range(count):
+                lat, lon = rng.uniform(51.0, 56.0), rng.uniform(78.0, 88.0)
+                size = rng.uniform(0.005, 0.05)
+                polyline = tracks.encode_polyline([(lat, lon), (lat + size, lon + size)])
+                rows.append((user.id_User, 2, 1000.0, 0.0, lat, lon, lat + size, lon + size, lat, lon, polyline))
+                if len(rows) == 50000 or i == count - 1:
+                    cursor.executemany(
+                        "INSERT INTO tracks (id_User, point_count, distance, elevation_gain, min_lat, min_lon, "
+                        "max_lat, max_lon, start_lat, start_lon, polyline) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows)
+                    rows = []
+            conn.commit()
+        finally:
+            conn.close()
+        return runners.generate_jwt(user.id_User)
+
+
+def measure(client, token, urls):
+    timings = []
+    for url in urls:
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = client.get(url, headers={'Authorization': token})
+        timings.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.data
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--radius', type=float, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmp, 'spatial.db')}"
+        import app as runners
+
+        started = time.perf_counter()
+        token = populate(runners, args.tracks)
+        print(f'{args.tracks} tracks inserted in {time.perf_counter() - started:.1f} s '
+              f'(spatial index: {runners.spatial_index_enabled})')
+
+        rng = random.Random(2)
+        points = [(rng.uniform(51.5, 55.5), rng.uniform(78.5, 87.5)) for _ in range(args.queries)]
+        nearby = [f'/api/tracks/nearby?lat={lat}&lon={lon}&radius={args.radius}' for lat, lon in points]
+        bbox = [f'/api/tracks/bbox?min_lat={lat}&min_lon={lon}&max_lat={lat + 0.02}&max_lon={lon + 0.03}'
+                for lat, lon in points]
+
+        client = runners.app.test_client()
+        modes = [('rtree', True), ('btree', False)] if runners.spatial_index_enabled else [('btree', False)]
+        for name, enabled in modes:
+            runners.spatial_index_enabled = enabled
+            for label, urls in (('nearby', nearby), ('bbox', bbox)):
+                median, p95 = measure(client, token, urls)
+                print(f'{name:>6} {label:>7}: median {median:7.2f} ms, p95 {p95:7.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
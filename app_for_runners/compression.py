@@ -0,0 +1,83 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Сжатие ответов (gzip, brotli - если установлен пакет brotli). Сжимаются
+# только текстовые типы от min_size байт; потоковые ответы - по частям.
+# Ответы 304/204 без тела и уже сжатые не трогаются. ETag у ответов API
+# слабые (см. with_version), поэтому сжатое и несжатое представления
+# могут иметь один тег.
+
+COMPRESSIBLE_TYPES = ('application/json', 'application/gpx+xml', 'application/xml',
+                      'application/javascript', 'image/svg+xml')
+
+
+def compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encodings):
+    # accept_encodings - request.accept_encodings (werkzeug учитывает q=0 и *)
+    if brotli is not None and accept_encodings['br']:
+        return 'br'
+    if accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+class Compressor:
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits=31 - формат gzip (заголовок и CRC), а не голый deflate
+            self._zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._brotli.process(data)
+        return self._zlib.compress(data)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._brotli.finish()
+        return self._zlib.flush()
+
+
+def iter_compressed(chunks, compressor):
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response, accept_encodings, min_size=1024, gzip_level=6, brotli_quality=4):
+    status = response.status_code
+    if (status < 200 or status in (204, 206, 304) or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or not compressible(response.mimetype)):
+        return response
+    if not response.is_streamed and (response.content_length or 0) < min_size:
+        return response
+
+    # Представление зависит от Accept-Encoding - это нужно знать кешам по пути
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(accept_encodings)
+    if encoding is None:
+        return response
+
+    compressor = Compressor(encoding, gzip_level, brotli_quality)
+    if response.is_streamed:
+        response.response = iter_compressed(response.response, compressor)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(compressor.compress(response.get_data()) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    return response
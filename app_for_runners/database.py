@@ -0,0 +1,148 @@
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+
+# Настройки подключения к БД.
+# SQLite по умолчанию работает в режиме WAL: читатели не блокируют писателя, а
+# писатели ждут друг друга busy_timeout миллисекунд вместо мгновенного
+# "database is locked". Для GET-запросов можно завести отдельный пул соединений
+# только для чтения (в SQLite - mode=ro, в Postgres - реплика или read only
+# транзакции). С Postgres работает та же схема, достаточно указать DATABASE_URL.
+
+SQLITE_JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist', 'memory')
+SQLITE_SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+SQLITE_BEGIN_MODES = ('deferred', 'immediate')
+READ_METHODS = ('GET', 'HEAD')
+
+
+def normalize_url(url):
+    # postgres:// встречается в переменных окружения хостингов, SQLAlchemy его не понимает
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(url, config):
+    # SQLALCHEMY_ENGINE_OPTIONS для основного пула
+    if is_memory_sqlite(url):
+        return {}
+    options = {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if make_url(url).get_backend_name() != 'sqlite':
+        options['pool_recycle'] = config['DB_POOL_RECYCLE']
+        options['pool_pre_ping'] = True
+    return options
+
+
+def configure_sqlite(engine, config, read_only=False):
+    # PRAGMA на каждое новое соединение пула
+    if engine.dialect.name != 'sqlite':
+        return
+    begin_immediate = not read_only and config['SQLITE_BEGIN'] == 'immediate'
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        if begin_immediate:
+            # Транзакции открываем сами (см. begin ниже), а не драйвер sqlite3
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+            if read_only:
+                cursor.execute("PRAGMA query_only = 1")
+            else:
+                # journal_mode сохраняется в файле БД, synchronous - настройка соединения
+                cursor.execute(f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+                cursor.execute(f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}")
+        finally:
+            cursor.close()
+
+    if begin_immediate:
+        # Транзакция сразу берёт блокировку записи. С BEGIN DEFERRED транзакция,
+        # которая сначала читает, а потом пишет, получает SQLITE_BUSY без ожидания,
+        # если другой процесс успел записать между её чтением и записью
+        @event.listens_for(engine, 'begin')
+        def begin_transaction(conn):
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def migrations_managed(engine):
+    # База под Alembic (есть alembic_version): схему меняет только flask db upgrade
+    return inspect(engine).has_table('alembic_version')
+
+
+def begin_ddl(conn):
+    # Драйвер sqlite3 сам открывает транзакцию только перед INSERT/UPDATE/DELETE, а
+    # CREATE вне транзакции фиксируется сразу - при сбое посередине осталась бы
+    # половина таблиц и триггеров. Вызывается в начале engine.begin()
+    if conn.dialect.name == 'sqlite' and not conn.connection.driver_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN')
+
+
+def create_read_engine(primary, config):
+    # Отдельный пул для чтения или None, если он не включён
+    read_url = config['DATABASE_READ_URL']
+    if not read_url and not config['DB_READ_POOL']:
+        return None
+    options = {
+        'pool_size': config['DB_READ_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    }
+    if read_url:
+        url = make_url(normalize_url(read_url))
+    elif primary.dialect.name == 'sqlite':
+        if is_memory_sqlite(primary.url):
+            return None
+        # Тот же файл, открытый только на чтение
+        url = make_url(f'sqlite:///file:{primary.url.database}?mode=ro&uri=true')
+    else:
+        url = primary.url
+    if url.get_backend_name() == 'postgresql':
+        options.update(pool_recycle=config['DB_POOL_RECYCLE'], pool_pre_ping=True,
+                       execution_options={'postgresql_readonly': True})
+    engine = create_engine(url, **options)
+    configure_sqlite(engine, config, read_only=True)
+    return engine
+
+
+def reads_from_replica():
+    # Обычный GET/HEAD-запрос. События Socket.IO выполняются в контексте GET-запроса
+    # подключения (у них есть request.sid), но пишут и сразу читают записанное - им нужен основной
+    return has_request_context() and request.method in READ_METHODS and getattr(request, 'sid', None) is None \
+        and not g.get('db_primary_only')
+
+
+def primary_only(view):
+    # GET-обработчик, который пишет в БД и читает результат в том же запросе
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_primary_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class RoutingSession(Session):
+    # Чтение в GET-запросах идёт через пул только для чтения (app.extensions['db_read_engine']),
+    # запись и всё остальное - через основной. После записи в том же запросе
+    # (g.db_primary_only, подзапросы /api/batch, обработчики с primary_only) чтение тоже
+    # идёт в основной: реплика может ещё не видеть только что записанное
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase) and reads_from_replica():
+            read_engine = current_app.extensions.get('db_read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
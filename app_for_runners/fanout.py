@@ -0,0 +1,348 @@
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+
+import socketio
+
+
+# Рассылка событий Socket.IO между несколькими процессами-воркерами.
+#
+# Поддерживаемые адреса шины (SOCKETIO_MESSAGE_QUEUE):
+#   memory://<name>            - шина внутри одного процесса (для тестов)
+#   local://<host>:<port>      - локальный брокер по TCP (один хост)
+#   local:///path/to/bus.sock  - локальный брокер по unix-сокету
+#   redis://, kafka://, zmq+tcp://, amqp:// - штатные менеджеры python-socketio
+#
+# Все менеджеры умеют служебные сообщения между воркерами (ControlMessages).
+
+CONTROL_NAMESPACE = '/__control'
+
+
+def parse_local_url(url):
+    # 'local:///tmp/bus.sock' -> (AF_UNIX, '/tmp/bus.sock')
+    # 'local://127.0.0.1:6001' -> (AF_INET, ('127.0.0.1', 6001))
+    address = url[len('local://'):]
+    if address.startswith('/'):
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+def make_client_manager(url, channel='flask-socketio'):
+    if url.startswith('memory://'):
+        return MemoryBusManager(url, channel=channel)
+    if url.startswith('local://'):
+        return LocalBusManager(url, channel=channel)
+    # Штатные менеджеры - тот же выбор по схеме, что и у Flask-SocketIO (message_queue)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        base = socketio.RedisManager
+    elif url.startswith('kafka://'):
+        base = socketio.KafkaManager
+    elif url.startswith('zmq'):
+        base = socketio.ZmqManager
+    else:
+        base = socketio.KombuManager
+    manager_class = type('Control' + base.__name__, (ControlMessages, base), {})
+    return manager_class(url, channel=channel)
+
+
+class ControlMessages:
+    # Примесь к PubSubManager: служебные сообщения между воркерами по той же шине.
+    # Уходят как emit в пространство имён, к которому не подключаются клиенты, и
+    # вместо рассылки вызывают обработчик в каждом процессе, включая отправителя
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.control_handlers = {}
+
+    def on_control(self, name, handler):
+        self.control_handlers[name] = handler
+
+    def publish_control(self, name, *args):
+        self.emit(name, args, namespace=CONTROL_NAMESPACE)
+
+    def _handle_emit(self, message):
+        if message.get('namespace') != CONTROL_NAMESPACE:
+            return super()._handle_emit(message)
+        handler = self.control_handlers.get(message.get('event'))
+        if handler is not None:
+            handler(*message['data'])
+
+
+_FRAME = struct.Struct('!I')
+
+
+def send_frame(sock, payload):
+    sock.sendall(_FRAME.pack(len(payload)) + payload)
+
+
+def recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError('bus connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    (size,) = _FRAME.unpack(recv_exact(sock, _FRAME.size))
+    return recv_exact(sock, size)
+
+
+class MemoryBusManager(ControlMessages, socketio.PubSubManager):
+    # Все менеджеры с одинаковым именем шины в одном процессе видят сообщения друг друга
+    name = 'memory'
+    _buses = {}
+    _buses_lock = threading.Lock()
+
+    def __init__(self, url='memory://default', channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.bus_name = url[len('memory://'):] + '/' + channel
+        self.queue = None
+
+    def initialize(self):
+        self.queue = self.server.eio.create_queue()
+        with self._buses_lock:
+            self._buses.setdefault(self.bus_name, []).append(self.queue)
+        super().initialize()
+
+    def _publish(self, data):
+        with self._buses_lock:
+            queues = list(self._buses.get(self.bus_name, []))
+        for queue in queues:
+            queue.put(data)
+
+    def _listen(self):
+        while True:
+            yield self.queue.get()
+
+
+class LocalBusManager(ControlMessages, socketio.PubSubManager):
+    # Клиент локального брокера LocalBusBroker: одно соединение на процесс,
+    # каждое опубликованное сообщение брокер рассылает всем подключённым процессам
+    name = 'local'
+
+    def __init__(self, url='local://127.0.0.1:6001', channel='socketio', write_only=False, logger=None, json=None,
+                 connect_timeout=10.0):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.family, self.address = parse_local_url(url)
+        self.connect_timeout = connect_timeout
+        self.conn = None
+        self._conn_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def initialize(self):
+        # Блокировки должны уступать управление в том же режиме, что и сокеты
+        self._conn_lock = self._make_lock()
+        self._send_lock = self._make_lock()
+        super().initialize()
+
+    def _make_lock(self):
+        async_mode = self.server.async_mode if self.server is not None else 'threading'
+        if async_mode == 'eventlet':
+            from eventlet.semaphore import Semaphore
+            return Semaphore()
+        if async_mode in ('gevent', 'gevent_uwsgi'):
+            from gevent.lock import Semaphore
+            return Semaphore()
+        return threading.Lock()
+
+    def _socket_module(self):
+        # В режиме eventlet/gevent сокет должен быть "зелёным", иначе чтение заблокирует хаб
+        async_mode = self.server.async_mode if self.server is not None else 'threading'
+        if async_mode == 'eventlet':
+            from eventlet.green import socket as green_socket
+            return green_socket
+        if async_mode in ('gevent', 'gevent_uwsgi'):
+            from gevent import socket as green_socket
+            return green_socket
+        return socket
+
+    def _sleep(self, seconds):
+        if self.server is not None:
+            self.server.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def _connect(self):
+        with self._conn_lock:
+            if self.conn is not None:
+                return self.conn
+            sock_module = self._socket_module()
+            deadline = time.monotonic() + self.connect_timeout
+            delay = 0.05
+            while True:
+                conn = sock_module.socket(self.family, socket.SOCK_STREAM)
+                try:
+                    conn.connect(self.address)
+                    break
+                except OSError:
+                    conn.close()
+                    # Брокер может стартовать позже воркеров
+                    if time.monotonic() >= deadline:
+                        raise
+                    self._sleep(delay)
+                    delay = min(delay * 2, 1.0)
+            if self.family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            send_frame(conn, self.channel.encode())
+            self.conn = conn
+            return conn
+
+    def _reset(self, conn):
+        with self._conn_lock:
+            if self.conn is conn:
+                self.conn = None
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def _publish(self, data):
+        payload = self.json.dumps(data).encode()
+        for _ in range(2):
+            conn = self._connect()
+            try:
+                with self._send_lock:
+                    send_frame(conn, payload)
+                return
+            except OSError:
+                self._reset(conn)
+        raise ConnectionError('local bus is not available')
+
+    def _listen(self):
+        while True:
+            conn = self._connect()
+            try:
+                while True:
+                    yield recv_frame(conn)
+            except (OSError, ConnectionError):
+                self._reset(conn)
+                self._sleep(0.1)
+
+
+class LocalBusBroker:
+    # Простейший брокер для одного хоста: пересылает каждый кадр всем
+    # соединениям того же канала (включая отправителя - так устроен PubSubManager)
+    def __init__(self, url):
+        self.family, self.address = parse_local_url(url)
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.listener = None
+        self._stopped = threading.Event()
+
+    def bind(self):
+        if self.family == socket.AF_UNIX and os.path.exists(self.address):
+            os.unlink(self.address)
+        listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(self.address)
+        listener.listen(128)
+        self.listener = listener
+        return self
+
+    def start(self):
+        if self.listener is None:
+            self.bind()
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def serve_forever(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self.listener.accept()
+            except OSError:
+                break
+            if self.family == socket.AF_INET:
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        try:
+            channel = recv_frame(conn)
+        except (OSError, ConnectionError):
+            conn.close()
+            return
+        # У каждого соединения свой замок на запись: кадры от разных
+        # отправителей не должны перемешиваться в одном потоке
+        peer = (conn, threading.Lock())
+        with self.lock:
+            self.channels.setdefault(channel, []).append(peer)
+        try:
+            while True:
+                payload = recv_frame(conn)
+                frame = _FRAME.pack(len(payload)) + payload
+                with self.lock:
+                    peers = list(self.channels[channel])
+                for peer_conn, send_lock in peers:
+                    try:
+                        with send_lock:
+                            peer_conn.sendall(frame)
+                    except OSError:
+                        pass
+        except (OSError, ConnectionError):
+            pass
+        finally:
+            with self.lock:
+                self.channels[channel].remove(peer)
+            conn.close()
+
+    def stop(self):
+        self._stopped.set()
+        if self.listener is not None:
+            self.listener.close()
+            if self.family == socket.AF_UNIX and os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+def run_workers(workers, serve):
+    # Pre-fork: слушающий сокет уже открыт в родителе, каждый дочерний процесс
+    # вызывает serve() и принимает соединения с него. Родитель только следит за детьми.
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve()
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop_children)
+    signal.signal(signal.SIGINT, stop_children)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+
+
+if __name__ == '__main__':
+    # Отдельный брокер: python fanout.py local://127.0.0.1:6001
+    broker = LocalBusBroker(sys.argv[1] if len(sys.argv) > 1 else 'local://127.0.0.1:6001')
+    broker.bind()
+    print(f'local bus broker listening on {broker.address}')
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        broker.stop()
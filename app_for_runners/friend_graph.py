@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger('runners')
+
+
+# Граф подтверждённых дружб в памяти процесса: только списки смежности, имена
+# кандидатов читаются из БД для тех, кто попал в ответ. Граф загружается целиком
+# при первом обращении; новые дружбы приходят через add_edge - и в этот процесс,
+# и (через шину, см. publish_friendships в app.py) в остальные воркеры.
+# Раз в ttl секунд граф сверяется с БД на случай пропущенных сообщений: перечитывает
+# его одна фоновая задача, а запросы до её окончания работают со старой копией.
+
+class FriendGraph:
+    def __init__(self, loader, ttl=600.0, start_task=None):
+        # loader() -> пары (user_id, friend_id) подтверждённых дружб;
+        # start_task(fn) запускает фоновое перечитывание (по умолчанию - поток)
+        self._loader = loader
+        self._ttl = ttl
+        self._start_task = start_task or self._start_thread
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._adjacency = None
+        self._loaded_at = 0.0
+        self._refreshing = False
+        self._added = None  # дружбы, добавленные, пока идёт загрузка
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def invalidate(self):
+        with self._lock:
+            self._adjacency = None
+
+    def add_edge(self, user_id, friend_id):
+        # Множество заменяется новым, а не меняется: его может обходить suggestions() в другом потоке
+        with self._lock:
+            if self._adjacency is not None:
+                self._adjacency[user_id] = self._adjacency.get(user_id, set()) | {friend_id}
+            if self._added is not None:
+                self._added.append((user_id, friend_id))
+
+    def _load(self):
+        with self._lock:
+            self._added = []
+        try:
+            edges = self._loader()
+        except Exception:
+            with self._lock:
+                self._added = None
+            raise
+        adjacency = {}
+        for user_id, friend_id in edges:
+            adjacency.setdefault(user_id, set()).add(friend_id)
+        with self._lock:
+            # Дружбы, подтверждённые во время чтения, могли в него не попасть
+            for user_id, friend_id in self._added:
+                adjacency.setdefault(user_id, set()).add(friend_id)
+            self._added = None
+            self._adjacency, self._loaded_at = adjacency, time.monotonic()
+        return adjacency
+
+    def _refresh(self):
+        try:
+            self._load()
+        except Exception:
+            log.exception('FriendGraph: reload failed, serving the previous graph')
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def _snapshot(self):
+        with self._lock:
+            adjacency = self._adjacency
+            stale = adjacency is not None and not self._refreshing \
+                and time.monotonic() - self._loaded_at >= self._ttl
+            if stale:
+                self._refreshing = True
+        if stale:
+            self._start_task(self._refresh)
+        if adjacency is not None:
+            return adjacency
+        # Первое обращение: граф загружает один вызов, остальные ждут его
+        with self._load_lock:
+            with self._lock:
+                adjacency = self._adjacency
+            return adjacency if adjacency is not None else self._load()
+
+    def friends(self, user_id):
+        return self._snapshot().get(user_id, set())
+
+    def suggestions(self, user_id, limit):
+        # Друзья друзей, ещё не друзья: [(id, число общих друзей), ...],
+        # сначала те, у кого больше общих друзей
+        adjacency = self._snapshot()
+        friends = adjacency.get(user_id, set())
+        mutual = Counter()
+        for friend_id in friends:
+            mutual.update(adjacency.get(friend_id, ()))
+        for excluded in friends | {user_id}:
+            mutual.pop(excluded, None)
+        return sorted(mutual.items(), key=lambda item: (-item[1], item[0]))[:limit]
@@ -0,0 +1,86 @@
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Сериализация JSON для jsonify/request.get_json (app.json). Даты и время
+# пишутся в ISO 8601 - как date.isoformat()/datetime.isoformat(), поэтому
+# эндпоинты отдают datetime и date как есть, без преобразования каждой строки.
+#   'orjson' - orjson (в несколько раз быстрее, datetime/date/numpy сериализует сам)
+#   'std'    - стандартный json, запасной вариант без orjson
+#   'auto'   - orjson, если установлен
+
+JSON_PROVIDERS = ('auto', 'orjson', 'std')
+
+
+class StdJSONProvider(DefaultJSONProvider):
+    # Flask по умолчанию пишет даты в формате HTTP ("Sat, 18 Oct 2025 ..."),
+    # клиенту нужен ISO 8601
+    @staticmethod
+    def default(o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+
+    def dumps_bytes(self, obj):
+        # Те же разделители и отступы, что у response()
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return self.dumps(obj, indent=2).encode('utf-8')
+        return self.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+class OrjsonProvider(StdJSONProvider):
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj):
+        # Остальные типы (Decimal, dataclass, __html__) - через default, как у Flask
+        return orjson.dumps(obj, default=self.default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj) + b'\n', mimetype=self.mimetype)
+
+
+def make_provider(app, name):
+    if name not in JSON_PROVIDERS:
+        raise SystemExit(f"JSON_PROVIDER must be one of: {', '.join(JSON_PROVIDERS)}")
+    if name == 'orjson' and orjson is None:
+        raise SystemExit('JSON_PROVIDER=orjson requires the orjson package')
+    if name == 'std' or orjson is None:
+        return StdJSONProvider(app)
+    return OrjsonProvider(app)
+
+
+def iter_json_array(provider, items, convert=None, chunk_size=200):
+    # JSON-массив частями по chunk_size элементов: тело ответа не собирается
+    # в памяти целиком, а convert(элемент) -> dict вызывается по мере отправки
+    yield b'['
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start:start + chunk_size]
+        if convert is not None:
+            chunk = [convert(item) for item in chunk]
+        # Массив части без скобок; части разделяются запятой
+        body = provider.dumps_bytes(chunk).strip()[1:-1]
+        yield body if start == 0 else b',' + body
+    yield b']\n'
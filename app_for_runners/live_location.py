@@ -0,0 +1,279 @@
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque
+
+from tracks import POLYLINE_PRECISION, encode_polyline
+
+log = logging.getLogger('runners')
+
+
+# Живые позиции участников совместной пробежки (комната = групповой чат).
+# Всё состояние в памяти процесса, БД на каждую точку не трогается:
+# - отправитель ограничен ведром токенов: rate точек в секунду, запас burst;
+#   лишние точки отбрасываются;
+# - принятые точки только заменяют последнюю позицию отправителя, а рассылает
+#   их tick() раз в broadcast_interval - одно событие на комнату со всеми
+#   сдвинувшимися участниками, сколько бы точек ни пришло между тиками;
+# - координаты квантованы по сетке полилиний треков (1e-5 градуса, ~1 м) и
+#   передаются разностью от последней разосланной позиции; каждое
+#   KEYFRAME_EVERY-е событие комнаты - с абсолютными значениями;
+# - кольцевой буфер последних history позиций каждого участника (не чаще
+#   history_interval секунд) - снимок для тех, кто открыл карту позже;
+# - если участник включил запись, его точки копятся и после остановки
+#   пачкой сохраняются в треки (persist) на следующем тике.
+# В нескольких воркерах у каждого своё состояние - поток (stream): участники,
+# которые шлют точки в этот процесс, свои seq и база разностей. События и снимки
+# помечены stream, и клиент хранит seq и позиции по паре (chat_id, stream).
+# Снимок комнаты собирается со всех воркеров (см. request_live_snapshots в app.py).
+
+KEYFRAME_EVERY = 10
+
+
+def quantize(value):
+    return int(round(value * POLYLINE_PRECISION))
+
+
+class Sharer:
+    # Участник, который сейчас делится позицией
+    def __init__(self, user_id, sid, rate, burst, history, record, now):
+        self.user_id = user_id
+        self.sid = sid
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.refilled = now
+        self.last_seen = now
+        self.latest = None  # (t, lat_q, lon_q) последней принятой точки
+        self.sent = None  # (t, lat_q, lon_q), разосланная последней - база разностей
+        self.dirty = False
+        self.history = deque(maxlen=history)
+        self.recording = [] if record else None
+
+    def take_token(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class Room:
+    def __init__(self):
+        self.sharers = {}  # user_id -> Sharer
+        self.seq = 0
+        self.left = []  # ушедшие с прошлой рассылки
+
+
+class LiveLocations:
+    def __init__(self, emit, persist=None, broadcast_interval=1.0, rate=5.0, burst=None, history=120,
+                 history_interval=5.0, stale_after=120.0, record_max_points=20000, max_retries=3,
+                 clock=time.monotonic, wall_clock=time.time, stream=None):
+        # emit(event, data, room) - рассылка в комнату Socket.IO;
+        # persist(recordings) - сохраняет список (user_id, chat_id, points) одной транзакцией,
+        # points - [(lat, lon, ele, unix_time), ...]
+        self.emit = emit
+        self.persist = persist
+        # Имя потока событий процесса; после fork каждому воркеру нужно своё
+        self.stream = stream or new_stream()
+        self.broadcast_interval = broadcast_interval
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, 2 * rate)
+        self.history = history
+        self.history_interval = history_interval
+        self.stale_after = stale_after
+        self.record_max_points = record_max_points
+        self.max_retries = max_retries
+        self.clock = clock
+        self.wall_clock = wall_clock
+
+        self._lock = threading.Lock()
+        self._rooms = {}  # chat_id -> Room
+        self._finished = []  # записи, ждущие сохранения
+        self._failures = 0
+
+    def start(self, chat_id, user_id, sid, record=False):
+        now = self.clock()
+        with self._lock:
+            room = self._rooms.setdefault(chat_id, Room())
+            sharer = room.sharers.get(user_id)
+            if sharer is not None:
+                # Повторный старт (другое устройство, переподключение) - позиция и запись сохраняются
+                sharer.sid = sid
+                sharer.last_seen = now
+                if record and sharer.recording is None:
+                    sharer.recording = []
+                return
+            room.sharers[user_id] = Sharer(user_id, sid, self.rate, self.burst, self.history, record, now)
+            if user_id in room.left:
+                room.left.remove(user_id)
+
+    def update(self, chat_id, user_id, lat, lon, ele=None):
+        # 'ok', 'throttled' или 'not_sharing'
+        now = self.clock()
+        with self._lock:
+            room = self._rooms.get(chat_id)
+            sharer = room.sharers.get(user_id) if room is not None else None
+            if sharer is None:
+                return 'not_sharing'
+            sharer.last_seen = now
+            if not sharer.take_token(now):
+                return 'throttled'
+            wall = self.wall_clock()
+            point = (int(wall), quantize(lat), quantize(lon))
+            sharer.latest = point
+            sharer.dirty = True
+            if not sharer.history or wall - sharer.history[-1][0] >= self.history_interval:
+                sharer.history.append(point)
+            if sharer.recording is not None and len(sharer.recording) < self.record_max_points:
+                sharer.recording.append((lat, lon, ele, wall))
+            return 'ok'
+
+    def stop(self, chat_id, user_id):
+        with self._lock:
+            self._remove(chat_id, user_id)
+
+    def stop_sid(self, sid):
+        # Отключение сокета: прекращаются все трансляции, начатые с него
+        with self._lock:
+            for chat_id, room in list(self._rooms.items()):
+                for user_id, sharer in list(room.sharers.items()):
+                    if sharer.sid == sid:
+                        self._remove(chat_id, user_id)
+
+    def _remove(self, chat_id, user_id):
+        room = self._rooms.get(chat_id)
+        sharer = room.sharers.pop(user_id, None) if room is not None else None
+        if sharer is None:
+            return
+        if sharer.sent is not None:
+            room.left.append(user_id)
+        if sharer.recording:
+            self._finished.append((user_id, chat_id, sharer.recording))
+        if not room.sharers and not room.left:
+            del self._rooms[chat_id]
+
+    def active(self, chat_id):
+        with self._lock:
+            return chat_id in self._rooms
+
+    def sharers(self):
+        with self._lock:
+            return sum(len(room.sharers) for room in self._rooms.values())
+
+    def snapshot(self, chat_id):
+        # Позиции на момент последней рассылки (база для следующих разностей) и
+        # следы участников полилинией; None - в комнате никто не делится позицией
+        with self._lock:
+            room = self._rooms.get(chat_id)
+            if room is None:
+                return None
+            # [user_id, lat_q, lon_q, t, след] - как positions в live_locations
+            members = [[sharer.user_id, sharer.sent[1], sharer.sent[2], sharer.sent[0],
+                        encode_polyline([(lat_q / POLYLINE_PRECISION, lon_q / POLYLINE_PRECISION)
+                                         for _, lat_q, lon_q in sharer.history])]
+                       for sharer in room.sharers.values() if sharer.sent is not None]
+            return {'chat_id': chat_id, 'stream': self.stream, 'seq': room.seq, 'members': members}
+
+    def empty_snapshot(self, chat_id):
+        # Ответ на запрос снимка потока, в котором в комнате никого нет
+        return {'chat_id': chat_id, 'stream': self.stream, 'seq': 0, 'members': []}
+
+    def tick(self):
+        # Рассылка накопленных позиций, отключение молчащих участников и сохранение
+        # записанных треков. Возвращает число разосланных событий
+        now = self.clock()
+        events = []
+        with self._lock:
+            for chat_id, room in list(self._rooms.items()):
+                for user_id, sharer in list(room.sharers.items()):
+                    if now - sharer.last_seen > self.stale_after:
+                        self._remove(chat_id, user_id)
+                if chat_id not in self._rooms:
+                    continue
+                event = self._room_event(chat_id, room)
+                if event is not None:
+                    events.append((chat_id, event))
+                if not room.sharers:
+                    del self._rooms[chat_id]
+        for chat_id, event in events:
+            self.emit('live_locations', event, chat_id)
+        self.flush()
+        return len(events)
+
+    def _room_event(self, chat_id, room):
+        changed = [sharer for sharer in room.sharers.values() if sharer.dirty]
+        if not changed and not room.left:
+            return None
+        room.seq += 1
+        keyframe = room.seq % KEYFRAME_EVERY == 0
+        if keyframe:
+            # Абсолютные значения всех участников: клиент, пропустивший событие, догоняет без снимка
+            changed = [sharer for sharer in room.sharers.values() if sharer.latest is not None]
+        positions, deltas = [], []
+        for sharer in changed:
+            t, lat_q, lon_q = sharer.latest
+            if keyframe or sharer.sent is None:
+                positions.append([sharer.user_id, lat_q, lon_q, t])
+            else:
+                sent_t, sent_lat, sent_lon = sharer.sent
+                deltas.append([sharer.user_id, lat_q - sent_lat, lon_q - sent_lon, t - sent_t])
+            sharer.sent = sharer.latest
+            sharer.dirty = False
+        event = {'chat_id': chat_id, 'stream': self.stream, 'seq': room.seq, 'keyframe': keyframe,
+                 'positions': positions, 'deltas': deltas, 'left': room.left}
+        room.left = []
+        return event
+
+    def flush(self):
+        with self._lock:
+            recordings, self._finished = self._finished, []
+        if not recordings or self.persist is None:
+            return 0
+        try:
+            self.persist(recordings)
+            self._failures = 0
+            return len(recordings)
+        except Exception:
+            self._failures += 1
+            if self._failures <= self.max_retries:
+                log.exception('LiveLocations: saving %d recorded runs failed', len(recordings))
+                with self._lock:
+                    self._finished = recordings + self._finished
+            else:
+                log.error('LiveLocations: dropped %d recorded runs after %d failed flushes',
+                          len(recordings), self._failures, exc_info=True)
+                self._failures = 0
+            return 0
+
+    def close(self):
+        # Остановка процесса: записи всех, кто ещё делится позицией, сохраняются
+        with self._lock:
+            for chat_id, room in list(self._rooms.items()):
+                for user_id in list(room.sharers):
+                    self._remove(chat_id, user_id)
+        for _ in range(self.max_retries + 1):
+            self.flush()
+            if not self._finished:
+                break
+
+    def run(self, sleep):
+        while True:
+            try:
+                self.tick()
+            except Exception:
+                log.exception('LiveLocations: tick failed')
+            sleep(self.broadcast_interval)
+
+
+def new_stream():
+    return uuid.uuid4().hex[:8]
+
+
+def valid_position(lat, lon):
+    return (isinstance(lat, (int, float)) and isinstance(lon, (int, float)) and not isinstance(lat, bool)
+            and not isinstance(lon, bool) and math.isfinite(lat) and math.isfinite(lon)
+            and -90 <= lat <= 90 and -180 <= lon <= 180)
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+log = logging.getLogger('runners')
+
+
+# Отложенная запись сообщений чата: сообщение сразу рассылается в комнату,
+# а вставки копятся в буфере и сбрасываются в БД пачкой одной транзакцией -
+# по размеру пачки или по таймеру (max_delay секунд).
+# Клиенты уже видели эти сообщения, поэтому пачка при ошибке БД не
+# выбрасывается: она остаётся в буфере и повторяется с растущей паузой
+# (до max_backoff секунд), пока запись не пройдёт.
+# Если пачка не проходит max_retries раз подряд, она пишется по половинам:
+# так одна плохая строка (слишком длинный текст, занятый id) не держит
+# остальные. Строки, которые не проходят и поодиночке, когда рядом с ними
+# что-то записалось, выбрасываются с ошибкой в логе. Если не записалось
+# ничего - БД недоступна, пачка остаётся в буфере.
+# Буфер ограничен max_pending строками: дальше submit отвечает WriterBusy.
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class MessageWriter:
+    def __init__(self, persist, batch_size=200, max_delay=0.02, max_retries=3,
+                 max_backoff=5.0, max_pending=10000, start_task=None, sleep=None, clock=time.monotonic):
+        # persist(rows) - записывает список словарей-строк одной транзакцией;
+        # после max_retries неудач подряд каждая следующая пишется в лог как ошибка
+        self.persist = persist
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self._start_task = start_task or self._start_thread
+        self._sleep = sleep or time.sleep
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer = []
+        self._next_id = None
+        self._failures = 0
+        self._retry_at = 0.0
+        self._running = False
+        self.dropped = 0
+
+    @staticmethod
+    def _start_thread(target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        return thread
+
+    def start(self, last_id):
+        # id выдаются заранее, начиная со следующего после максимального в таблице
+        self._next_id = (last_id or 0) + 1
+        self._running = True
+        self._start_task(self._run)
+
+    def submit(self, row):
+        # Возвращает id, под которым сообщение будет записано; WriterBusy - буфер полон
+        with self._lock:
+            if len(self._buffer) >= self.max_pending:
+                raise WriterBusy(f'{len(self._buffer)} messages are waiting to be saved')
+            row['id'] = self._next_id
+            self._next_id += 1
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+        if full and self._clock() >= self._retry_at:
+            self.flush()
+        return row['id']
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._buffer = self._buffer, []
+            if not rows:
+                return 0
+            try:
+                self.persist(rows)
+                self._failures = 0
+                return len(rows)
+            except Exception:
+                self._failures += 1
+                if self._failures > self.max_retries and len(rows) > 1:
+                    saved, failed = self._persist_halves(rows)
+                    if saved:
+                        self._failures = 0
+                        self._retry_at = 0.0
+                        self._drop(failed)
+                        return saved
+                # Возвращаем пачку в начало буфера и ждём перед следующей попыткой
+                with self._lock:
+                    self._buffer = rows + self._buffer
+                    pending = len(self._buffer)
+                delay = self.backoff()
+                self._retry_at = self._clock() + delay
+                if self._failures <= self.max_retries:
+                    log.exception('MessageWriter: flush of %d messages failed, retry in %.2fs',
+                                  len(rows), delay)
+                else:
+                    log.error('MessageWriter: %d failed flushes in a row, %d messages waiting, retry in %.2fs',
+                              self._failures, pending, delay, exc_info=True)
+                return 0
+
+    def _persist_halves(self, rows):
+        # Пачка, которая не записалась целиком, - по половинам, рекурсивно.
+        # Возвращает (число записанных строк, [(строка, исключение)] не записанных поодиночке)
+        saved, failed = 0, []
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            try:
+                self.persist(half)
+                saved += len(half)
+            except Exception as e:
+                if len(half) == 1:
+                    failed.append((half[0], e))
+                else:
+                    half_saved, half_failed = self._persist_halves(half)
+                    saved += half_saved
+                    failed += half_failed
+        return saved, failed
+
+    def _drop(self, failed):
+        # Строки остаются только в логе: по нему сообщение можно восстановить вручную
+        self.dropped += len(failed)
+        for row, e in failed:
+            log.error('MessageWriter: dropped message %r that cannot be saved', row,
+                      exc_info=(type(e), e, e.__traceback__))
+
+    def backoff(self):
+        # Пауза после очередной неудачи: max_delay, 2*max_delay, 4*max_delay ... до max_backoff
+        if not self._failures:
+            return 0.0
+        return min(self.max_backoff, max(self.max_delay, 0.001) * 2 ** (self._failures - 1))
+
+    def _run(self):
+        while self._running:
+            self._sleep(self.max_delay)
+            if self.pending() and self._clock() >= self._retry_at:
+                self.flush()
+
+    def close(self):
+        # Останавливаем таймер и дописываем всё, что осталось в буфере
+        self._running = False
+        for _ in range(self.max_retries + 1):
+            self.flush()
+            if not self.pending():
+                return
+            self._sleep(self.backoff())
+        log.error('MessageWriter: %d messages were not saved before shutdown', self.pending())
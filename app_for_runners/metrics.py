@@ -0,0 +1,209 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+
+from sqlalchemy import event
+
+try:
+    # При monkey-patch eventlet подменяет threading и time - сэмплеру нужен
+    # настоящий поток ОС, который видит стек воркера через sys._current_frames()
+    from eventlet.patcher import original
+    os_threading, os_time = original('threading'), original('time')
+except ImportError:
+    import time as os_time
+    os_threading = threading
+
+
+# Метрики процесса в текстовом формате Prometheus (GET /metrics): гистограммы
+# задержек HTTP-запросов и событий Socket.IO, число и время SQL-запросов на
+# запрос. Каждый воркер (WORKERS > 1) считает свои метрики.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # значения меток -> [счётчики по корзинам..., сумма, количество]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = format_labels(self.labels, label_values, f'le="{format_value(bound)}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labels, label_values, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {series[-1]}')
+            labels = format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {format_value(series[-2])}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f'{self.name}{format_labels(self.labels, key)} {format_value(value)}' for key, value in items]
+        return lines
+
+
+class Gauge:
+    # Значение читается функцией в момент выдачи метрик: fn() -> число или None
+    def __init__(self, name, help, fn):
+        self.name = name
+        self.help = help
+        self.fn = fn
+
+    def render(self):
+        value = self.fn()
+        if value is None:
+            return []
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge', f'{self.name} {format_value(value)}']
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+class QueryStats:
+    # SQL-запросы одного HTTP-запроса или события сокета
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+
+def track_queries(engine, current_stats, on_query):
+    # current_stats() -> QueryStats текущего запроса или None (фоновые задачи);
+    # on_query(statement, seconds) вызывается для каждого выполненного запроса
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        stats = current_stats()
+        if stats is not None:
+            stats.count += 1
+            stats.seconds += elapsed
+        on_query(statement, elapsed)
+
+
+class StackSampler:
+    # Сэмплирующий профилировщик: пока идёт запрос, отдельный поток ОС раз в
+    # interval секунд снимает стек потока, который его обрабатывает. Под eventlet
+    # в одном потоке живут несколько запросов - снимок достаётся всем, кто
+    # активен в этом потоке в момент замера.
+    def __init__(self, interval=0.005, depth=40):
+        self.interval = interval
+        self.depth = depth
+        self._lock = os_threading.Lock()
+        self._active = {}  # токен -> (ident потока, список стеков)
+        self._pid = None
+
+    def _ensure_started(self):
+        # Поток не переживает fork - каждый воркер запускает свой
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        os_threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+
+    def begin(self):
+        self._ensure_started()
+        token = object()
+        with self._lock:
+            self._active[token] = (os_threading.get_ident(), [])
+        return token
+
+    def end(self, token):
+        # Снятые стеки запроса: [(стек, число замеров), ...], самые частые первыми
+        with self._lock:
+            _, samples = self._active.pop(token, (None, []))
+        return StackCounter(samples).most_common()
+
+    def _run(self):
+        while True:
+            os_time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.values():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples.append(self._stack(frame))
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.depth:
+            code = frame.f_code
+            stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}')
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
@@ -5,6 +5,9 @@ from flask import current_app
 
 from alembic import context
 
+import search_index
+import spatial_index
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -51,6 +54,18 @@ def get_metadata():
     return target_db.metadata
 
 
+# Виртуальные таблицы FTS5 и R*Tree и их служебные таблицы (_data, _idx, _node, ...)
+# создают миграции вручную, в моделях их нет - сравнение схем их не учитывает
+VIRTUAL_TABLES = (search_index.FTS_TABLE, spatial_index.BBOX_TABLE, spatial_index.START_TABLE,
+                  spatial_index.SEGMENT_TABLE)
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and any(name == table or name.startswith(table + '_') for table in VIRTUAL_TABLES):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +80,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +109,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
@@ -0,0 +1,41 @@
+"""Add spatial index over track bounding boxes and start points
+
+Revision ID: 0a6e5d93c4f1
+Revises: f93c2b6d1e07
+Create Date: 2026-10-18 17:21:55.904127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import spatial_index
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6e5d93c4f1'
+down_revision = 'f93c2b6d1e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.create_index('ix_tracks_start', ['start_lat', 'start_lon'], unique=False)
+
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for statement in spatial_index.RTREE_DDL:
+            conn.execute(sa.text(statement))
+        spatial_index.rebuild_rtree_index(conn)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for trigger in spatial_index.RTREE_TRIGGERS:
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute(f'DROP TABLE IF EXISTS {spatial_index.BBOX_TABLE}')
+        op.execute(f'DROP TABLE IF EXISTS {spatial_index.START_TABLE}')
+
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_index('ix_tracks_start')
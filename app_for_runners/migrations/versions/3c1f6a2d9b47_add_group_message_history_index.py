@@ -0,0 +1,25 @@
+"""Add (chat_id, timestamp, id) index to group_message
+
+Revision ID: 3c1f6a2d9b47
+Revises: 20bfa948e72d
+Create Date: 2026-10-18 10:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f6a2d9b47'
+down_revision = '20bfa948e72d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_group_message_chat_ts_id', 'group_message',
+                    ['chat_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_group_message_chat_ts_id', table_name='group_message')
@@ -0,0 +1,26 @@
+"""Index statistic sync keys by creation time for pruning
+
+Revision ID: 4b7e0d2c9a15
+Revises: 8e3d1a6c4f20
+Create Date: 2026-10-18 17:02:48.906113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b7e0d2c9a15'
+down_revision = '8e3d1a6c4f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_statistic_sync_key', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_statistic_sync_key_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user_statistic_sync_key', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_statistic_sync_key_created_at'))
@@ -0,0 +1,112 @@
+"""Add segments, segment efforts and per-user best efforts
+
+Revision ID: 5c2e8a71d4b9
+Revises: 0a6e5d93c4f1
+Create Date: 2026-10-18 19:04:12.318540
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import spatial_index
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2e8a71d4b9'
+down_revision = '0a6e5d93c4f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('times', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('segments_matched_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_tracks_segments_matched_at'), ['segments_matched_at'], unique=False)
+
+    # У уже загруженных треков нет времени точек - сопоставлять нечего
+    op.execute("UPDATE tracks SET segments_matched_at = CURRENT_TIMESTAMP")
+
+    op.create_table('segments',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('point_count', sa.Integer(), nullable=False),
+    sa.Column('distance', sa.Float(), nullable=False),
+    sa.Column('min_lat', sa.Float(), nullable=False),
+    sa.Column('min_lon', sa.Float(), nullable=False),
+    sa.Column('max_lat', sa.Float(), nullable=False),
+    sa.Column('max_lon', sa.Float(), nullable=False),
+    sa.Column('polyline', sa.Text(), nullable=False),
+    sa.Column('match_cursor', sa.Integer(), nullable=False),
+    sa.Column('matched_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['id_User'], ['users.id_User'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_segments_matched_at'), ['matched_at'], unique=False)
+
+    op.create_table('segment_effort',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('segment_id', sa.Integer(), nullable=False),
+    sa.Column('track_id', sa.Integer(), nullable=False),
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('elapsed', sa.Float(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('start_index', sa.Integer(), nullable=False),
+    sa.Column('end_index', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['id_User'], ['users.id_User'], ),
+    sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], ),
+    sa.ForeignKeyConstraint(['track_id'], ['tracks.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('segment_id', 'track_id', name='uq_segment_effort_segment_track')
+    )
+    with op.batch_alter_table('segment_effort', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_segment_effort_track_id'), ['track_id'], unique=False)
+
+    op.create_table('segment_best',
+    sa.Column('segment_id', sa.Integer(), nullable=False),
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('elapsed', sa.Float(), nullable=False),
+    sa.Column('track_id', sa.Integer(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('efforts', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['id_User'], ['users.id_User'], ),
+    sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], ),
+    sa.ForeignKeyConstraint(['track_id'], ['tracks.id'], ),
+    sa.PrimaryKeyConstraint('segment_id', 'id_User')
+    )
+    with op.batch_alter_table('segment_best', schema=None) as batch_op:
+        batch_op.create_index('ix_segment_best_segment_elapsed', ['segment_id', 'elapsed'], unique=False)
+
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for statement in spatial_index.SEGMENT_RTREE_DDL:
+            conn.execute(sa.text(statement))
+        spatial_index.rebuild_segment_rtree_index(conn)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for trigger in spatial_index.SEGMENT_RTREE_TRIGGERS:
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute(f'DROP TABLE IF EXISTS {spatial_index.SEGMENT_TABLE}')
+
+    with op.batch_alter_table('segment_best', schema=None) as batch_op:
+        batch_op.drop_index('ix_segment_best_segment_elapsed')
+    op.drop_table('segment_best')
+
+    with op.batch_alter_table('segment_effort', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_segment_effort_track_id'))
+    op.drop_table('segment_effort')
+
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_segments_matched_at'))
+    op.drop_table('segments')
+
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tracks_segments_matched_at'))
+        batch_op.drop_column('segments_matched_at')
+        batch_op.drop_column('times')
@@ -0,0 +1,46 @@
+"""Add denormalized last message pointer to group_chat
+
+Revision ID: 7a4e2c91f0d3
+Revises: 3c1f6a2d9b47
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4e2c91f0d3'
+down_revision = '3c1f6a2d9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('group_chat', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_message_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_message_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_message_preview', sa.String(length=255), nullable=True))
+        batch_op.create_index('ix_group_chat_last_message_at', ['last_message_at'], unique=False)
+
+    # Заполняем указатель для уже существующих чатов
+    op.execute("""
+        UPDATE group_chat SET
+            last_message_id = (
+                SELECT m.id FROM group_message m WHERE m.chat_id = group_chat.id
+                ORDER BY m.timestamp DESC, m.id DESC LIMIT 1),
+            last_message_at = (
+                SELECT m.timestamp FROM group_message m WHERE m.chat_id = group_chat.id
+                ORDER BY m.timestamp DESC, m.id DESC LIMIT 1),
+            last_message_preview = (
+                SELECT substr(m.content, 1, 100) FROM group_message m WHERE m.chat_id = group_chat.id
+                ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('group_chat', schema=None) as batch_op:
+        batch_op.drop_index('ix_group_chat_last_message_at')
+        batch_op.drop_column('last_message_preview')
+        batch_op.drop_column('last_message_at')
+        batch_op.drop_column('last_message_id')
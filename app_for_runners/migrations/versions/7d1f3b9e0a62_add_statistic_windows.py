@@ -0,0 +1,38 @@
+"""Add rolling statistic windows for the friends leaderboard
+
+Revision ID: 7d1f3b9e0a62
+Revises: 5c2e8a71d4b9
+Create Date: 2026-10-18 20:12:40.551803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d1f3b9e0a62'
+down_revision = '5c2e8a71d4b9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Суммы заполняются при первом обращении к рейтингу, переносить ничего не нужно
+    op.create_table('user_statistic_window',
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('window_days', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.Column('calories', sa.Float(), nullable=False),
+    sa.Column('steps', sa.Integer(), nullable=False),
+    sa.Column('distance', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['id_User'], ['user_info.id_User'], ),
+    sa.PrimaryKeyConstraint('id_User', 'window_days')
+    )
+    with op.batch_alter_table('friendships', schema=None) as batch_op:
+        batch_op.create_index('ix_friendships_user_status', ['user_id', 'status', 'friend_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('friendships', schema=None) as batch_op:
+        batch_op.drop_index('ix_friendships_user_status')
+    op.drop_table('user_statistic_window')
@@ -0,0 +1,32 @@
+"""Count segment matching attempts on tracks and segments
+
+Revision ID: 8e3d1a6c4f20
+Revises: d60620bf6587
+Create Date: 2026-10-18 16:20:14.318206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e3d1a6c4f20'
+down_revision = 'd60620bf6587'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('segment_match_attempts', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('match_failures', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('segments', schema=None) as batch_op:
+        batch_op.drop_column('match_failures')
+
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_column('segment_match_attempts')
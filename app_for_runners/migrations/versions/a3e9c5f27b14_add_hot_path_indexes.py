@@ -0,0 +1,54 @@
+"""Add indexes for email login, friendship lookups and chat participants
+
+Revision ID: a3e9c5f27b14
+Revises: 7d1f3b9e0a62
+Create Date: 2026-10-18 21:04:37.512908
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e9c5f27b14'
+down_revision = '7d1f3b9e0a62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    # Уникальный email нельзя создать поверх дублей, а выбрать, какой из аккаунтов
+    # оставить, миграция не может - дубли нужно разобрать вручную
+    duplicates = bind.execute(sa.text(
+        "SELECT email, COUNT(*) FROM users GROUP BY email HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        listed = ', '.join(f'{email} ({count})' for email, count in duplicates[:20])
+        raise RuntimeError(f'users.email has duplicates, resolve them before upgrading: {listed}')
+
+    # Из повторных заявок между одной парой оставляем одну: принятую, затем ожидающую,
+    # затем отклонённую, при равенстве - с наименьшим id
+    op.execute("""
+        DELETE FROM friendships
+        WHERE user_id IS NOT NULL AND friend_id IS NOT NULL AND id NOT IN (
+            SELECT (SELECT f.id FROM friendships f
+                    WHERE f.user_id = pairs.user_id AND f.friend_id = pairs.friend_id
+                    ORDER BY CASE f.status WHEN 'accepted' THEN 0 WHEN 'pending' THEN 1 ELSE 2 END, f.id
+                    LIMIT 1)
+            FROM (SELECT DISTINCT user_id, friend_id FROM friendships
+                  WHERE user_id IS NOT NULL AND friend_id IS NOT NULL) pairs
+        )
+    """)
+
+    op.create_index('uq_users_email', 'users', ['email'], unique=True)
+    op.create_index('uq_friendships_user_friend', 'friendships', ['user_id', 'friend_id'], unique=True)
+    op.create_index('ix_friendships_friend_status', 'friendships', ['friend_id', 'status'], unique=False)
+    op.create_index('ix_user_group_chat_chat', 'user_group_chat', ['chat_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_user_group_chat_chat', table_name='user_group_chat')
+    op.drop_index('ix_friendships_friend_status', table_name='friendships')
+    op.drop_index('uq_friendships_user_friend', table_name='friendships')
+    op.drop_index('uq_users_email', table_name='users')
@@ -0,0 +1,50 @@
+"""Add normalized name and trigram search index to user_info
+
+Revision ID: b5d08e3f61a2
+Revises: 7a4e2c91f0d3
+Create Date: 2026-10-18 12:40:15.204377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import search_index
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d08e3f61a2'
+down_revision = '7a4e2c91f0d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_info', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name_norm', sa.String(length=150), nullable=True))
+        batch_op.create_index('ix_user_info_name_norm', ['name_norm'], unique=False)
+
+    # lower() в SQLite не понимает кириллицу, поэтому нормализуем в Python
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id_User, name FROM user_info')).all()
+    if rows:
+        conn.execute(
+            sa.text('UPDATE user_info SET name_norm = :name_norm WHERE id_User = :id_User'),
+            [{'id_User': row.id_User, 'name_norm': search_index.normalize_name(row.name)} for row in rows]
+        )
+
+    if conn.dialect.name == 'sqlite':
+        for statement in search_index.FTS_DDL:
+            conn.execute(sa.text(statement))
+        search_index.rebuild_fts_index(conn)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        for trigger in ('user_info_fts_ai', 'user_info_fts_ad', 'user_info_fts_au'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute(f'DROP TABLE IF EXISTS {search_index.FTS_TABLE}')
+
+    with op.batch_alter_table('user_info', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_info_name_norm')
+        batch_op.drop_column('name_norm')
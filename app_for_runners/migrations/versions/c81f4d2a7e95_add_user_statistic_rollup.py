@@ -0,0 +1,54 @@
+"""Add weekly/monthly user_statistic rollups
+
+Revision ID: c81f4d2a7e95
+Revises: b5d08e3f61a2
+Create Date: 2026-10-18 14:02:51.671230
+
+"""
+from datetime import date, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c81f4d2a7e95'
+down_revision = 'b5d08e3f61a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    rollup = op.create_table('user_statistic_rollup',
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('granularity', sa.String(length=10), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('calories', sa.Float(), nullable=False),
+    sa.Column('steps', sa.Integer(), nullable=False),
+    sa.Column('distance', sa.Float(), nullable=False),
+    sa.Column('days', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['id_User'], ['user_info.id_User'], ),
+    sa.PrimaryKeyConstraint('id_User', 'granularity', 'period_start')
+    )
+
+    # Заполняем суммы по уже накопленной статистике. В таблице ещё могут быть
+    # несколько строк за один день - days считает различные даты, как и живое обновление
+    conn = op.get_bind()
+    totals = {}
+    for row in conn.execute(sa.text('SELECT id_User, date, calories, steps, distance FROM user_statistic')):
+        day = row.date if isinstance(row.date, date) else date.fromisoformat(str(row.date)[:10])
+        for granularity, start in (('week', day - timedelta(days=day.weekday())), ('month', day.replace(day=1))):
+            item = totals.setdefault((row.id_User, granularity, start), [0.0, 0, 0.0, set()])
+            item[0] += row.calories
+            item[1] += row.steps
+            item[2] += row.distance
+            item[3].add(day)
+    if totals:
+        op.bulk_insert(rollup, [{
+            'id_User': user_id, 'granularity': granularity, 'period_start': start,
+            'calories': calories, 'steps': steps, 'distance': distance, 'days': len(days)
+        } for (user_id, granularity, start), (calories, steps, distance, days) in totals.items()])
+
+
+def downgrade():
+    op.drop_table('user_statistic_rollup')
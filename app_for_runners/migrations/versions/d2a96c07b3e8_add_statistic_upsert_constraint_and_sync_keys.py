@@ -0,0 +1,52 @@
+"""Add unique (id_User, date) to user_statistic and idempotency keys table
+
+Revision ID: d2a96c07b3e8
+Revises: c81f4d2a7e95
+Create Date: 2026-10-18 15:27:09.385116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a96c07b3e8'
+down_revision = 'c81f4d2a7e95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Сливаем возможные дубли за один день в запись с наименьшим id
+    op.execute("""
+        UPDATE user_statistic SET
+            calories = (SELECT SUM(s.calories) FROM user_statistic s
+                        WHERE s.id_User = user_statistic.id_User AND s.date = user_statistic.date),
+            steps = (SELECT SUM(s.steps) FROM user_statistic s
+                     WHERE s.id_User = user_statistic.id_User AND s.date = user_statistic.date),
+            distance = (SELECT SUM(s.distance) FROM user_statistic s
+                        WHERE s.id_User = user_statistic.id_User AND s.date = user_statistic.date)
+        WHERE id IN (SELECT MIN(id) FROM user_statistic GROUP BY id_User, date HAVING COUNT(*) > 1)
+    """)
+    op.execute("""
+        DELETE FROM user_statistic
+        WHERE id NOT IN (SELECT MIN(id) FROM user_statistic GROUP BY id_User, date)
+    """)
+
+    with op.batch_alter_table('user_statistic', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_user_statistic_user_date', ['id_User', 'date'])
+
+    op.create_table('user_statistic_sync_key',
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('date', sa.Date(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['id_User'], ['user_info.id_User'], ),
+    sa.PrimaryKeyConstraint('id_User', 'key')
+    )
+
+
+def downgrade():
+    op.drop_table('user_statistic_sync_key')
+    with op.batch_alter_table('user_statistic', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_statistic_user_date', type_='unique')
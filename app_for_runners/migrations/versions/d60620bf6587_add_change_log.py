@@ -0,0 +1,44 @@
+"""Add change log for delta sync
+
+Revision ID: d60620bf6587
+Revises: e61b4d0c8a53
+Create Date: 2026-10-18 23:05:41.002817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd60620bf6587'
+down_revision = 'e61b4d0c8a53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Журнал начинается пустым: клиенты берут курсор и один раз загружают списки целиком
+    op.create_table('change_log',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('chat_id', sa.Integer(), nullable=True),
+    sa.Column('entity', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('day', sa.Date(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['chat_id'], ['group_chat.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id_User'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index('ix_change_log_chat_id', ['chat_id', 'id'], unique=False)
+        batch_op.create_index('ix_change_log_user_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_log_user_id')
+        batch_op.drop_index('ix_change_log_chat_id')
+
+    op.drop_table('change_log')
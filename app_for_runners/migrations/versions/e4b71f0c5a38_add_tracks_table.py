@@ -0,0 +1,49 @@
+"""Add tracks table for uploaded GPX routes
+
+Revision ID: e4b71f0c5a38
+Revises: d2a96c07b3e8
+Create Date: 2026-10-18 16:02:41.217530
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b71f0c5a38'
+down_revision = 'd2a96c07b3e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tracks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('id_User', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('point_count', sa.Integer(), nullable=False),
+    sa.Column('distance', sa.Float(), nullable=False),
+    sa.Column('elevation_gain', sa.Float(), nullable=False),
+    sa.Column('min_lat', sa.Float(), nullable=False),
+    sa.Column('min_lon', sa.Float(), nullable=False),
+    sa.Column('max_lat', sa.Float(), nullable=False),
+    sa.Column('max_lon', sa.Float(), nullable=False),
+    sa.Column('start_lat', sa.Float(), nullable=False),
+    sa.Column('start_lon', sa.Float(), nullable=False),
+    sa.Column('polyline', sa.Text(), nullable=False),
+    sa.Column('elevations', sa.Text(), nullable=True),
+    sa.ForeignKeyConstraint(['id_User'], ['users.id_User'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_tracks_id_User'), ['id_User'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tracks_id_User'))
+
+    op.drop_table('tracks')
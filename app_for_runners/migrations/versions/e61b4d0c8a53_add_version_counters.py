@@ -0,0 +1,40 @@
+"""Add version counters to user_info and group_chat for conditional GET
+
+Revision ID: e61b4d0c8a53
+Revises: a3e9c5f27b14
+Create Date: 2026-10-18 22:10:52.604117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61b4d0c8a53'
+down_revision = 'a3e9c5f27b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_info', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('statistics_version', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('statistics_updated_at', sa.DateTime(), nullable=True))
+
+    with op.batch_alter_table('group_chat', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('group_chat', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
+
+    with op.batch_alter_table('user_info', schema=None) as batch_op:
+        batch_op.drop_column('statistics_updated_at')
+        batch_op.drop_column('statistics_version')
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('version')
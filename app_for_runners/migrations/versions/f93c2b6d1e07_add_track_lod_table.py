@@ -0,0 +1,45 @@
+"""Add track_lod table with simplified track levels
+
+Revision ID: f93c2b6d1e07
+Revises: e4b71f0c5a38
+Create Date: 2026-10-18 16:48:12.604318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+import tracks
+
+
+# revision identifiers, used by Alembic.
+revision = 'f93c2b6d1e07'
+down_revision = 'e4b71f0c5a38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    track_lod = op.create_table('track_lod',
+    sa.Column('track_id', sa.Integer(), nullable=False),
+    sa.Column('tolerance', sa.Float(), nullable=False),
+    sa.Column('point_count', sa.Integer(), nullable=False),
+    sa.Column('polyline', sa.Text(), nullable=False),
+    sa.ForeignKeyConstraint(['track_id'], ['tracks.id'], ),
+    sa.PrimaryKeyConstraint('track_id', 'tolerance')
+    )
+
+    # Уровни для уже загруженных треков
+    conn = op.get_bind()
+    for row in conn.execute(sa.text('SELECT id, polyline FROM tracks')):
+        points = tracks.decode_polyline(row.polyline)
+        lat_q = [int(round(lat * tracks.POLYLINE_PRECISION)) for lat, _ in points]
+        lon_q = [int(round(lon * tracks.POLYLINE_PRECISION)) for _, lon in points]
+        levels = tracks.simplify_lods(lat_q, lon_q)
+        if levels:
+            op.bulk_insert(track_lod, [{
+                'track_id': row.id, 'tolerance': tolerance, 'point_count': count, 'polyline': polyline
+            } for tolerance, count, polyline in levels])
+
+
+def downgrade():
+    op.drop_table('track_lod')
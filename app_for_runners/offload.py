@@ -0,0 +1,33 @@
+import threading
+
+try:
+    import greenlet
+    import eventlet
+    from eventlet import tpool
+except ImportError:
+    tpool = None
+
+
+# Работа, занимающая CPU или блокирующая поток (хеширование паролей, параллельные
+# подзапросы /api/batch), в потоках ОС через eventlet.tpool: зелёный поток ждёт
+# результат, а хаб тем временем обслуживает остальные соединения.
+
+
+def in_hub():
+    # tpool будит ждущих через хаб потока, в котором он запущен, - это главный
+    # поток сервера. Из обычного потока ОС (тестовый клиент, режим threading)
+    # ждать его нельзя, там работа выполняется на месте: такой поток блокирует только себя.
+    return (tpool is not None and greenlet.getcurrent().parent is not None
+            and threading.current_thread() is threading.main_thread())
+
+
+def execute(fn, *args):
+    return tpool.execute(fn, *args) if in_hub() else fn(*args)
+
+
+def map_parallel(fn, items):
+    # [fn(item) ...] одновременно в потоках tpool; вне хаба - по очереди
+    if not in_hub():
+        return [fn(item) for item in items]
+    threads = [eventlet.spawn(tpool.execute, fn, item) for item in items]
+    return [thread.wait() for thread in threads]
@@ -0,0 +1,82 @@
+import threading
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+import offload
+
+try:
+    from eventlet.semaphore import Semaphore as GreenSemaphore
+except ImportError:
+    GreenSemaphore = None
+
+
+# Хеширование паролей (scrypt/PBKDF2) - десятки-сотни миллисекунд CPU на вызов.
+# В зелёном потоке eventlet оно останавливает хаб, и на время всплеска входов
+# замирают все соединения воркера, включая чаты. Поэтому под eventlet хеш
+# считается в потоке ОС (см. offload.py; hashlib отпускает GIL), а зелёный
+# поток ждёт результат, не мешая остальным.
+#
+# Очередь ограничена: одновременно считается не больше workers хешей, ждать
+# могут ещё queue_size вызовов и не дольше queue_timeout секунд. Остальные
+# получают HasherBusy (ответ 503 с Retry-After), а не копятся в памяти.
+
+HASH_METHODS = ('scrypt', 'pbkdf2')
+
+
+def offload_available():
+    return offload.tpool is not None and GreenSemaphore is not None
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class Limiter:
+    # Допуск в очередь (без ожидания) и ограничение числа одновременных вычислений
+    def __init__(self, semaphore, workers, queue_size):
+        self.admission = semaphore(workers + queue_size)
+        self.running = semaphore(workers)
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', salt_length=16, workers=1, queue_size=32, queue_timeout=5.0,
+                 offload=True):
+        if method.split(':', 1)[0] not in HASH_METHODS:
+            raise ValueError(f"hash method must start with one of: {', '.join(HASH_METHODS)}")
+        self.method = method
+        self.salt_length = salt_length
+        self.queue_timeout = queue_timeout
+        self.offload = offload and offload_available()
+        # Примитивы eventlet нельзя ждать из потока ОС, а threading - из зелёного потока
+        self._os_limiter = Limiter(threading.Semaphore, workers, queue_size)
+        self._green_limiter = Limiter(GreenSemaphore, workers, queue_size) if self.offload else None
+        self._prefix = None
+
+    def hash(self, password):
+        pwhash = self._run(generate_password_hash, password, self.method, self.salt_length)
+        self._prefix = pwhash.split('$', 1)[0]
+        return pwhash
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Хеш посчитан с другими параметрами (например, после смены PASSWORD_HASH_METHOD)
+        if self._prefix is None:
+            self.hash('')
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def _run(self, fn, *args):
+        green = self.offload and offload.in_hub()
+        limiter = self._green_limiter if green else self._os_limiter
+        if not limiter.admission.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            if not limiter.running.acquire(timeout=self.queue_timeout):
+                raise HasherBusy()
+            try:
+                return offload.execute(fn, *args) if green else fn(*args)
+            finally:
+                limiter.running.release()
+        finally:
+            limiter.admission.release()
@@ -0,0 +1,457 @@
+import bz2
+import heapq
+import json
+import math
+import os
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+
+import numpy as np
+
+import tracks
+
+
+# Пешеходная маршрутизация по локальной выгрузке OpenStreetMap.
+#
+# Подготовка (один раз, офлайн):
+#     python routing.py build city.osm.bz2 graphs/city
+# читает OSM XML потоком и сохраняет граф в каталог набором .npy-файлов. Цепочки
+# вершин степени 2 (точки формы улицы) стягиваются в одно ребро между перекрёстками,
+# их координаты остаются только для геометрии маршрута и привязки точек. Граф
+# перекрёстков - CSR-списки смежности (indptr/indices/weights/edge_chain). Сервер
+# открывает файлы через np.load(mmap_mode='r'): запуск мгновенный, а страницы графа
+# общие для всех воркеров.
+#
+# Поиск - двунаправленный A* со средними потенциалами (Ikeda et al.). Эвристика -
+# длина хорды между точками на сфере: она не больше длины дуги и удовлетворяет
+# неравенству треугольника, поэтому найденный маршрут кратчайший.
+
+# Дороги, по которым можно идти пешком (если нет явного foot=no)
+WALKABLE_HIGHWAYS = {
+    'footway', 'path', 'pedestrian', 'living_street', 'residential', 'service', 'track',
+    'steps', 'cycleway', 'bridleway', 'unclassified', 'road', 'tertiary', 'tertiary_link',
+    'secondary', 'secondary_link', 'primary', 'primary_link', 'corridor',
+}
+# Эти дороги пешеходам доступны, только если это явно разрешено
+FOOT_ONLY_IF_ALLOWED = {'trunk', 'trunk_link', 'motorway', 'motorway_link'}
+FOOT_ALLOWED = {'yes', 'designated', 'permissive'}
+FOOT_DENIED = {'no', 'private'}
+
+METERS_PER_DEGREE = math.radians(1) * tracks.EARTH_RADIUS
+GRID_CELL = 0.005  # градусы, ~550 м по широте
+SNAP_MAX_DISTANCE = 500  # м
+SPEEDS = {'walking': 5 / 3.6, 'running': 10 / 3.6}  # м/с
+GRAPH_ARRAYS = (
+    # все вершины: координаты, принадлежность перекрёстку или цепочке, сеточный индекс
+    'lat', 'lon', 'node_chain', 'node_pos', 'node_offset', 'cell_keys', 'cell_start', 'cell_nodes',
+    # перекрёстки и рёбра между ними
+    'junction_node', 'xyz', 'indptr', 'indices', 'weights', 'edge_chain',
+    # стянутые цепочки: концы, длина и промежуточные вершины
+    'chain_a', 'chain_b', 'chain_length', 'shape_indptr', 'shape_nodes',
+)
+
+
+class RoutingError(Exception):
+    pass
+
+
+def is_walkable(tags):
+    highway = tags.get('highway')
+    if highway is None or tags.get('area') == 'yes':
+        return False
+    foot = tags.get('foot')
+    if foot in FOOT_DENIED:
+        return False
+    if highway in FOOT_ONLY_IF_ALLOWED:
+        return foot in FOOT_ALLOWED
+    if highway not in WALKABLE_HIGHWAYS:
+        return False
+    return foot in FOOT_ALLOWED or tags.get('access') not in FOOT_DENIED
+
+
+def _open_osm(path):
+    return bz2.open(path, 'rb') if path.endswith('.bz2') else open(path, 'rb')
+
+
+def read_osm(stream):
+    # Потоковое чтение OSM XML: все узлы (id, lat, lon) и рёбра пешеходных путей
+    node_ids, node_lat, node_lon = array('q'), array('d'), array('d')
+    edge_from, edge_to = array('q'), array('q')
+    refs, tags = [], {}
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event == 'start':
+            continue
+        tag = elem.tag
+        if tag == 'node':
+            node_ids.append(int(elem.get('id')))
+            node_lat.append(float(elem.get('lat')))
+            node_lon.append(float(elem.get('lon')))
+        elif tag == 'nd':
+            refs.append(int(elem.get('ref')))
+            continue
+        elif tag == 'tag':
+            tags[elem.get('k')] = elem.get('v')
+            continue
+        elif tag == 'way':
+            if is_walkable(tags):
+                edge_from.extend(refs[:-1])
+                edge_to.extend(refs[1:])
+        elif tag != 'relation':
+            continue
+        # Объект верхнего уровня разобран - убираем его из дерева
+        refs, tags = [], {}
+        root.clear()
+    return (np.frombuffer(node_ids, dtype=np.int64), np.frombuffer(node_lat), np.frombuffer(node_lon),
+            np.frombuffer(edge_from, dtype=np.int64), np.frombuffer(edge_to, dtype=np.int64))
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * tracks.EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def node_graph(node_ids, node_lat, node_lon, edge_from, edge_to):
+    # Граф по всем вершинам путей: (lat, lon, indptr, indices, weights).
+    # Остаются только вершины, через которые проходят пути
+    order = np.argsort(node_ids)
+    sorted_ids = node_ids[order]
+    pos_from = np.searchsorted(sorted_ids, edge_from).clip(max=len(sorted_ids) - 1)
+    pos_to = np.searchsorted(sorted_ids, edge_to).clip(max=len(sorted_ids) - 1)
+    known = (sorted_ids[pos_from] == edge_from) & (sorted_ids[pos_to] == edge_to) & (edge_from != edge_to)
+    src, dst = order[pos_from[known]], order[pos_to[known]]
+
+    used, inverse = np.unique(np.concatenate([src, dst]), return_inverse=True)
+    src, dst = inverse[:len(src)], inverse[len(src):]
+    lat, lon = node_lat[used], node_lon[used]
+
+    # Для пешехода все пути двусторонние; повторяющиеся рёбра схлопываем
+    u = np.concatenate([src, dst])
+    v = np.concatenate([dst, src])
+    pairs = np.unique(np.stack([u, v], axis=1), axis=0)
+    u, v = pairs[:, 0], pairs[:, 1]
+    weights = haversine_array(lat[u], lon[u], lat[v], lon[v])
+    indptr = np.zeros(len(used) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=len(used)), out=indptr[1:])
+    return lat, lon, indptr, v, weights
+
+
+def build_graph(node_ids, node_lat, node_lon, edge_from, edge_to):
+    # Словарь массивов графа для save_graph
+    lat, lon, indptr, indices, weights = node_graph(node_ids, node_lat, node_lon, edge_from, edge_to)
+    graph = contract_chains(indptr, indices, weights)
+    graph['lat'], graph['lon'] = lat, lon
+    graph['xyz'] = sphere_points(lat[graph['junction_node']], lon[graph['junction_node']])
+    graph['cell_keys'], graph['cell_start'], graph['cell_nodes'] = build_grid(lat, lon)
+    return graph
+
+
+def contract_chains(indptr, indices, weights):
+    # Стягивает цепочки вершин степени 2 в рёбра между перекрёстками (вершинами степени != 2)
+    n = len(indptr) - 1
+    ptr, ind, w = indptr.tolist(), indices.tolist(), weights.tolist()
+    is_junction = (np.diff(indptr) != 2).tolist()
+    visited = bytearray(n)
+    chain_a, chain_b, chain_length, shapes = [], [], [], []
+
+    def walk(a, k):
+        # Идём от перекрёстка a по ребру k до следующего перекрёстка
+        prev, cur, length, shape = a, ind[k], w[k], []
+        while not is_junction[cur]:
+            shape.append(cur)
+            visited[cur] = 1
+            k = ptr[cur] if ind[ptr[cur]] != prev else ptr[cur] + 1
+            prev, cur = cur, ind[k]
+            length += w[k]
+        return cur, length, shape
+
+    def collect(a):
+        for k in range(ptr[a], ptr[a + 1]):
+            b, length, shape = walk(a, k)
+            # Каждая цепочка находится с обоих концов - сохраняем один раз
+            if a < b or (a == b and shape[0] < shape[-1]):
+                chain_a.append(a)
+                chain_b.append(b)
+                chain_length.append(length)
+                shapes.append(shape)
+
+    for a in range(n):
+        if is_junction[a]:
+            collect(a)
+    # Кольца из одних вершин степени 2: одну вершину кольца делаем перекрёстком
+    for a in range(n):
+        if not is_junction[a] and not visited[a]:
+            is_junction[a] = True
+            collect(a)
+
+    junctions = np.flatnonzero(is_junction)
+    junction_id = np.full(n, -1, dtype=np.int64)
+    junction_id[junctions] = np.arange(len(junctions))
+    chain_a = junction_id[np.asarray(chain_a, dtype=np.int64)]
+    chain_b = junction_id[np.asarray(chain_b, dtype=np.int64)]
+    chain_length = np.asarray(chain_length)
+    shape_indptr = np.zeros(len(shapes) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in shapes], out=shape_indptr[1:])
+    shape_nodes = np.fromiter((node for s in shapes for node in s), dtype=np.int32, count=int(shape_indptr[-1]))
+
+    # Положение каждой вершины: перекрёсток (node_chain = -1, node_pos = номер перекрёстка)
+    # или точка цепочки (номер цепочки, индекс в ней и расстояние от начала цепочки)
+    node_chain = np.full(n, -1, dtype=np.int32)
+    node_pos = np.zeros(n, dtype=np.int32)
+    node_offset = np.zeros(n, dtype=np.float64)
+    node_pos[junctions] = np.arange(len(junctions))
+    for c, shape in enumerate(shapes):
+        if not shape:
+            continue
+        offsets = np.cumsum([w[_edge_index(ptr, ind, p, q)] for p, q in
+                             zip([int(junctions[chain_a[c]])] + shape[:-1], shape)])
+        node_chain[shape] = c
+        node_pos[shape] = np.arange(len(shape))
+        node_offset[shape] = offsets
+
+    # Рёбра графа перекрёстков: по одному в каждую сторону на цепочку,
+    # edge_chain = номер цепочки * 2 + 1, если цепочка проходится от b к a
+    m = len(chain_a)
+    u = np.concatenate([chain_a, chain_b])
+    v = np.concatenate([chain_b, chain_a])
+    edge_chain = np.concatenate([np.arange(m) * 2, np.arange(m) * 2 + 1])
+    edge_order = np.lexsort((v, u))
+    u, v, edge_chain = u[edge_order], v[edge_order], edge_chain[edge_order]
+    junction_indptr = np.zeros(len(junctions) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(u, minlength=len(junctions)), out=junction_indptr[1:])
+
+    return {
+        'node_chain': node_chain, 'node_pos': node_pos, 'node_offset': node_offset,
+        'junction_node': junctions.astype(np.int32), 'indptr': junction_indptr,
+        'indices': v.astype(np.int32), 'weights': chain_length[edge_chain >> 1],
+        'edge_chain': edge_chain.astype(np.int32),
+        'chain_a': chain_a.astype(np.int32), 'chain_b': chain_b.astype(np.int32),
+        'chain_length': chain_length, 'shape_indptr': shape_indptr, 'shape_nodes': shape_nodes,
+    }
+
+
+def _edge_index(ptr, ind, a, b):
+    for k in range(ptr[a], ptr[a + 1]):
+        if ind[k] == b:
+            return k
+    raise KeyError((a, b))
+
+
+def sphere_points(lat, lon):
+    # Точки на сфере радиуса EARTH_RADIUS, по строке [x, y, z]
+    p, l = np.radians(lat), np.radians(lon)
+    return tracks.EARTH_RADIUS * np.stack([np.cos(p) * np.cos(l), np.cos(p) * np.sin(l), np.sin(p)], axis=-1)
+
+
+def _cell_key(lat_cell, lon_cell):
+    return (np.asarray(lat_cell, dtype=np.int64) << 32) + (np.asarray(lon_cell, dtype=np.int64) & 0xffffffff)
+
+
+def build_grid(lat, lon):
+    keys = _cell_key(np.floor(lat / GRID_CELL), np.floor(lon / GRID_CELL))
+    cell_nodes = np.argsort(keys, kind='stable').astype(np.int32)
+    cell_keys, cell_start = np.unique(keys[cell_nodes], return_index=True)
+    cell_start = np.append(cell_start, len(cell_nodes)).astype(np.int64)
+    return cell_keys, cell_start, cell_nodes
+
+
+def save_graph(graph, path, source=None):
+    os.makedirs(path, exist_ok=True)
+    for name in GRAPH_ARRAYS:
+        np.save(os.path.join(path, f'{name}.npy'), graph[name])
+    meta = {'nodes': len(graph['lat']), 'junctions': len(graph['junction_node']),
+            'edges': len(graph['indices']), 'source': source}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+class RoutingGraph:
+    def __init__(self, arrays):
+        # Обычные ndarray поверх отображения: у np.memmap дорогой доступ к элементам
+        for name in GRAPH_ARRAYS:
+            setattr(self, name, arrays[name].view(np.ndarray))
+
+    @classmethod
+    def load(cls, path):
+        return cls({name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r') for name in GRAPH_ARRAYS})
+
+    def nearest_node(self, lat, lon, max_distance=SNAP_MAX_DISTANCE):
+        # Ближайшая вершина (любая, не только перекрёсток) в окрестности max_distance или None
+        lat_cell, lon_cell = math.floor(lat / GRID_CELL), math.floor(lon / GRID_CELL)
+        lat_rings = math.ceil(max_distance / (GRID_CELL * METERS_PER_DEGREE))
+        lon_rings = math.ceil(max_distance / (GRID_CELL * METERS_PER_DEGREE
+                                              * max(math.cos(math.radians(abs(lat) + 1)), 0.01)))
+        candidates = []
+        for dlat in range(-lat_rings, lat_rings + 1):
+            keys = _cell_key(np.full(2 * lon_rings + 1, lat_cell + dlat),
+                             np.arange(lon_cell - lon_rings, lon_cell + lon_rings + 1))
+            pos = np.searchsorted(self.cell_keys, keys)
+            for p, key in zip(pos.tolist(), keys.tolist()):
+                if p < len(self.cell_keys) and self.cell_keys[p] == key:
+                    candidates.append(self.cell_nodes[self.cell_start[p]:self.cell_start[p + 1]])
+        if not candidates:
+            return None
+        nodes = np.concatenate(candidates)
+        distances = haversine_array(lat, lon, self.lat[nodes], self.lon[nodes])
+        best = int(distances.argmin())
+        return int(nodes[best]) if distances[best] <= max_distance else None
+
+    def _shape(self, chain, reverse=False):
+        shape = self.shape_nodes[self.shape_indptr[chain]:self.shape_indptr[chain + 1]].tolist()
+        return shape[::-1] if reverse else shape
+
+    def _seeds(self, node, outgoing):
+        # Перекрёстки, с которых начинается (outgoing) или которыми заканчивается поиск:
+        # {перекрёсток: (расстояние, вершины между точкой и перекрёстком по ходу движения)}
+        chain = int(self.node_chain[node])
+        if chain < 0:
+            return {int(self.node_pos[node]): (0.0, [])}
+        pos, offset = int(self.node_pos[node]), float(self.node_offset[node])
+        shape = self._shape(chain)
+        to_a = (offset, shape[pos::-1])
+        to_b = (float(self.chain_length[chain]) - offset, shape[pos:])
+        a, b = int(self.chain_a[chain]), int(self.chain_b[chain])
+        seeds = {a: to_a}
+        if b != a or to_b[0] < to_a[0]:
+            seeds[b] = to_b
+        if not outgoing:
+            seeds = {j: (d, nodes[::-1]) for j, (d, nodes) in seeds.items()}
+        return seeds
+
+    def _direct(self, source, target):
+        # Путь вдоль одной цепочки, если обе точки на ней
+        chain = int(self.node_chain[source])
+        if chain < 0 or chain != int(self.node_chain[target]):
+            return None
+        i, j = int(self.node_pos[source]), int(self.node_pos[target])
+        shape = self._shape(chain)
+        nodes = shape[i:j + 1] if i <= j else shape[j:i + 1][::-1]
+        return abs(float(self.node_offset[target]) - float(self.node_offset[source])), nodes
+
+    def _search(self, source, target):
+        # Двунаправленный A* по графу перекрёстков от привязанных вершин source и target.
+        # Возвращает (длина, перекрёсток встречи, словари родителей, затравки) или None
+        xyz, indptr, indices, weights, edge_chain = self.xyz, self.indptr, self.indices, self.weights, self.edge_chain
+        sx, sy, sz = sphere_points(self.lat[source], self.lon[source]).tolist()
+        tx, ty, tz = sphere_points(self.lat[target], self.lon[target]).tolist()
+        potentials = {}
+
+        def potential(v):
+            # pf(v) = (h_t(v) - h_s(v)) / 2; для обратного поиска берётся с минусом
+            p = potentials.get(v)
+            if p is None:
+                x, y, z = xyz[v].tolist()
+                p = (math.sqrt((x - tx) ** 2 + (y - ty) ** 2 + (z - tz) ** 2)
+                     - math.sqrt((x - sx) ** 2 + (y - sy) ** 2 + (z - sz) ** 2)) / 2
+                potentials[v] = p
+            return p
+
+        seeds = (self._seeds(source, True), self._seeds(target, False))
+        dist = ({j: d for j, (d, _) in seeds[0].items()}, {j: d for j, (d, _) in seeds[1].items()})
+        parent = ({j: None for j in seeds[0]}, {j: None for j in seeds[1]})
+        settled = (set(), set())
+        sign = (1, -1)
+        queues = tuple([(d + sign[side] * potential(j), j) for j, d in dist[side].items()] for side in (0, 1))
+        for queue in queues:
+            heapq.heapify(queue)
+        best, meeting = math.inf, -1
+        for j, d in dist[0].items():
+            if j in dist[1] and d + dist[1][j] < best:
+                best, meeting = d + dist[1][j], j
+
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            _, v = heapq.heappop(queues[side])
+            if v in settled[side]:
+                continue
+            settled[side].add(v)
+            d_here, d_other, par = dist[side], dist[1 - side], parent[side]
+            dv = d_here[v]
+            start, end = int(indptr[v]), int(indptr[v + 1])
+            for w, weight, edge in zip(indices[start:end].tolist(), weights[start:end].tolist(),
+                                       edge_chain[start:end].tolist()):
+                nd = dv + weight
+                if nd < d_here.get(w, math.inf):
+                    d_here[w] = nd
+                    par[w] = (v, edge)
+                    heapq.heappush(queues[side], (nd + sign[side] * potential(w), w))
+                other = d_other.get(w)
+                if other is not None and nd + other < best:
+                    best, meeting = nd + other, w
+        if meeting < 0:
+            return None
+        return best, meeting, parent, seeds
+
+    def shortest_path(self, source, target):
+        # (длина в метрах, список вершин исходного графа) или None, если точки не связаны
+        if source == target:
+            return 0.0, [source]
+        found = self._search(source, target)
+        direct = self._direct(source, target)
+        if direct is not None and (found is None or direct[0] <= found[0]):
+            return direct
+        if found is None:
+            return None
+        best, meeting, parent, seeds = found
+
+        # Рёбро с кодом edge проходится от a к b, если младший бит 0.
+        # Прямой поиск: от встречи назад к затравке
+        junction_node = self.junction_node
+        parts, v = [], meeting
+        while parent[0][v] is not None:
+            prev, edge = parent[0][v]
+            parts.append(self._shape(edge >> 1, reverse=bool(edge & 1)) + [int(junction_node[v])])
+            v = prev
+        nodes = seeds[0][v][1] + [int(junction_node[v])]
+        for part in reversed(parts):
+            nodes.extend(part)
+
+        # Обратный поиск шёл против движения: ребро v -> next в нём - это next -> v
+        v = meeting
+        while parent[1][v] is not None:
+            nxt, edge = parent[1][v]
+            nodes.extend(self._shape(edge >> 1, reverse=not edge & 1))
+            nodes.append(int(junction_node[nxt]))
+            v = nxt
+        nodes.extend(seeds[1][v][1])
+        return best, nodes
+
+    def route(self, from_lat, from_lon, to_lat, to_lon, mode='walking'):
+        source = self.nearest_node(from_lat, from_lon)
+        target = self.nearest_node(to_lat, to_lon)
+        if source is None or target is None:
+            raise RoutingError('No walkable road near the start or finish point')
+        found = self.shortest_path(source, target)
+        if found is None:
+            raise RoutingError('Start and finish are not connected')
+        distance, path = found
+        nodes = np.asarray(path)
+        points = list(zip(self.lat[nodes].tolist(), self.lon[nodes].tolist()))
+        return {
+            'mode': mode,
+            'distance': round(distance, 1),
+            'duration': round(distance / SPEEDS[mode]),
+            'point_count': len(points),
+            'polyline': tracks.encode_polyline(points),
+            'from': list(points[0]),
+            'to': list(points[-1]),
+        }
+
+
+def build_from_osm(osm_path, out_path):
+    with _open_osm(osm_path) as stream:
+        graph = build_graph(*read_osm(stream))
+    return save_graph(graph, out_path, source=os.path.basename(osm_path))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] != 'build':
+        raise SystemExit('usage: python routing.py build <extract.osm[.bz2]> <graph_dir>')
+    print(build_from_osm(sys.argv[2], sys.argv[3]))
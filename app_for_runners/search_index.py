@@ -0,0 +1,96 @@
+import base64
+import json
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import database
+
+log = logging.getLogger('runners')
+
+
+# Поиск пользователей по имени.
+# Имя хранится в нормализованном виде (user_info.name_norm, с B-tree индексом) -
+# по нему ищутся совпадения с начала имени. Совпадения в середине имени ищутся
+# через FTS5-таблицу с триграммным токенизатором (только SQLite >= 3.34),
+# которую поддерживают в актуальном состоянии триггеры на user_info.
+
+FTS_TABLE = 'user_info_fts'
+# Триграммный индекс не умеет искать строки короче трёх символов
+MIN_SUBSTRING_QUERY = 3
+
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name_norm, content='user_info', content_rowid='id_User', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_info_fts_ai AFTER INSERT ON user_info BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name_norm) VALUES (new.id_User, new.name_norm);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_info_fts_ad AFTER DELETE ON user_info BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name_norm) VALUES ('delete', old.id_User, old.name_norm);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS user_info_fts_au AFTER UPDATE OF name_norm ON user_info BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name_norm) VALUES ('delete', old.id_User, old.name_norm);
+        INSERT INTO {FTS_TABLE}(rowid, name_norm) VALUES (new.id_User, new.name_norm);
+    END""",
+]
+
+
+def normalize_name(name):
+    return ' '.join(name.split()).casefold() if name else name
+
+
+def create_fts_index(engine):
+    # Возвращает True, если триграммный индекс доступен
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            database.begin_ddl(conn)
+            for statement in FTS_DDL:
+                conn.execute(text(statement))
+    except OperationalError as e:
+        log.warning('Trigram search index is not available: %s', e)
+        return False
+    return True
+
+
+def fts_index_exists(engine):
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {'name': FTS_TABLE}).first() is not None
+
+
+def rebuild_fts_index(conn):
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+
+def fts_substring_ids(session, query, after_id, limit):
+    # id пользователей, в имени которых есть подстрока query, по возрастанию id
+    phrase = '"' + query.replace('"', '""') + '"'
+    rows = session.execute(text(
+        f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :phrase AND rowid > :after_id "
+        f"ORDER BY rowid LIMIT :limit"
+    ), {'phrase': phrase, 'after_id': after_id, 'limit': limit}).all()
+    return [row[0] for row in rows]
+
+
+# Курсор - позиция последнего выданного результата:
+# ярус 0 - совпадения с начала имени (ключ name_norm, id), ярус 1 - остальные (ключ id)
+def encode_cursor(tier, name_norm, user_id):
+    raw = json.dumps([tier, name_norm, user_id], ensure_ascii=False).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        tier, name_norm, user_id = json.loads(raw)
+        if tier not in (0, 1) or not isinstance(user_id, int):
+            return None
+        return tier, name_norm, user_id
+    except (ValueError, TypeError):
+        return None
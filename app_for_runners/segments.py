@@ -0,0 +1,93 @@
+import math
+
+import numpy as np
+
+import tracks
+
+
+# Сопоставление треков с сегментами ("segment efforts").
+# Кандидаты отбираются по габаритам (см. spatial_index.py), а здесь для каждой
+# пары трек/сегмент ищутся проходы: точка трека у начала сегмента, следующая за
+# ней точка у конца, и участок трека между ними не дальше MATCH_TOLERANCE от линии
+# сегмента в обе стороны (расстояние Хаусдорфа до ломаной, считается векторно).
+
+MATCH_TOLERANCE = 25.0  # м
+ENDPOINT_RADIUS = 25.0  # м
+# Не больше стольких пар точка-отрезок в одном векторном шаге
+DISTANCE_CHUNK = 1 << 20
+
+
+def project(lat, lon, lat0):
+    # Локальная равнопромежуточная проекция в метрах
+    scale = math.radians(1) * tracks.EARTH_RADIUS
+    return np.asarray(lon) * scale * math.cos(math.radians(lat0)), np.asarray(lat) * scale
+
+
+def distances_to_polyline(px, py, qx, qy):
+    # Для каждой точки (px, py) - расстояние до ближайшего отрезка ломаной (qx, qy)
+    if len(qx) == 1:
+        return np.hypot(px - qx[0], py - qy[0])
+    ax, ay, bx, by = qx[:-1], qy[:-1], qx[1:], qy[1:]
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    length2[length2 == 0] = 1e-12
+    step = max(1, DISTANCE_CHUNK // len(ax))
+    result = np.empty(len(px))
+    for start in range(0, len(px), step):
+        x, y = px[start:start + step, None], py[start:start + step, None]
+        t = np.clip(((x - ax) * dx + (y - ay) * dy) / length2, 0.0, 1.0)
+        result[start:start + step] = np.hypot(x - (ax + t * dx), y - (ay + t * dy)).min(axis=1)
+    return result
+
+
+def hausdorff_within(px, py, qx, qy, tolerance):
+    # Симметричное расстояние Хаусдорфа между ломаными не больше tolerance
+    return bool(distances_to_polyline(px, py, qx, qy).max() <= tolerance
+                and distances_to_polyline(qx, qy, px, py).max() <= tolerance)
+
+
+def _closest_in_runs(indices, distances):
+    # Подряд идущие индексы - один проход мимо точки; из каждого берём ближайший
+    if len(indices) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indices) > 1) + 1
+    return [int(run[distances[run].argmin()]) for run in np.split(indices, breaks)]
+
+
+def match_segment(track_lat, track_lon, track_times, segment_lat, segment_lon, tolerance=MATCH_TOLERANCE):
+    # Проходы сегмента в треке: [(индекс старта, индекс финиша, время в секундах), ...]
+    segment_lat = np.asarray(segment_lat, dtype=np.float64)
+    lat0 = float(segment_lat[0])
+    tx, ty = project(track_lat, track_lon, lat0)
+    sx, sy = project(segment_lat, segment_lon, lat0)
+
+    d_start = np.hypot(tx - sx[0], ty - sy[0])
+    d_end = np.hypot(tx - sx[-1], ty - sy[-1])
+    starts = _closest_in_runs(np.flatnonzero(d_start <= ENDPOINT_RADIUS), d_start)
+    ends = _closest_in_runs(np.flatnonzero(d_end <= ENDPOINT_RADIUS), d_end)
+
+    efforts, last_end = [], -1
+    for i in starts:
+        if i <= last_end:
+            continue
+        j = next((e for e in ends if e > i), None)
+        if j is None:
+            break
+        if hausdorff_within(tx[i:j + 1], ty[i:j + 1], sx, sy, tolerance):
+            efforts.append((i, j, float(track_times[j] - track_times[i])))
+            last_end = j
+    return efforts
+
+
+def best_effort(track_lat, track_lon, track_times, segment_lat, segment_lon, tolerance=MATCH_TOLERANCE):
+    # Самый быстрый проход (i, j, время) или None
+    efforts = [e for e in match_segment(track_lat, track_lon, track_times, segment_lat, segment_lon, tolerance)
+               if e[2] > 0]
+    return min(efforts, key=lambda e: e[2]) if efforts else None
+
+
+def decode_track(polyline, times):
+    # Массивы lat, lon, секунды от начала трека
+    points = np.asarray(tracks.decode_polyline(polyline)).reshape(-1, 2)
+    offsets = np.asarray(tracks.decode_polyline(times, 1, tracks.TIME_PRECISION)).reshape(-1)
+    return points[:, 0], points[:, 1], offsets
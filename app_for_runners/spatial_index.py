@@ -0,0 +1,155 @@
+import logging
+import math
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import database
+
+log = logging.getLogger('runners')
+
+
+# Пространственный индекс треков и сегментов.
+# В SQLite используются R*Tree-таблицы: габаритные прямоугольники треков, их
+# стартовые точки (вырожденные прямоугольники) и габариты сегментов. Их поддерживают
+# в актуальном состоянии триггеры на tracks и segments. R*Tree хранит координаты как float32 с округлением
+# наружу, поэтому выборка из него - только кандидаты, точную проверку делает вызывающий.
+
+BBOX_TABLE = 'track_bbox_rtree'
+START_TABLE = 'track_start_rtree'
+SEGMENT_TABLE = 'segment_bbox_rtree'
+METERS_PER_DEGREE = math.radians(1) * 6371008.8
+
+RTREE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {BBOX_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {START_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    f"""CREATE TRIGGER IF NOT EXISTS tracks_rtree_ai AFTER INSERT ON tracks BEGIN
+        INSERT INTO {BBOX_TABLE} VALUES (new.id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+        INSERT INTO {START_TABLE} VALUES (new.id, new.start_lat, new.start_lat, new.start_lon, new.start_lon);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS tracks_rtree_ad AFTER DELETE ON tracks BEGIN
+        DELETE FROM {BBOX_TABLE} WHERE id = old.id;
+        DELETE FROM {START_TABLE} WHERE id = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS tracks_rtree_au
+        AFTER UPDATE OF min_lat, max_lat, min_lon, max_lon, start_lat, start_lon ON tracks BEGIN
+        INSERT OR REPLACE INTO {BBOX_TABLE} VALUES (new.id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+        INSERT OR REPLACE INTO {START_TABLE} VALUES (new.id, new.start_lat, new.start_lat, new.start_lon, new.start_lon);
+    END""",
+]
+RTREE_TRIGGERS = ('tracks_rtree_ai', 'tracks_rtree_ad', 'tracks_rtree_au')
+
+SEGMENT_RTREE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEGMENT_TABLE} USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    f"""CREATE TRIGGER IF NOT EXISTS segments_rtree_ai AFTER INSERT ON segments BEGIN
+        INSERT INTO {SEGMENT_TABLE} VALUES (new.id, new.min_lat, new.max_lat, new.min_lon, new.max_lon);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS segments_rtree_ad AFTER DELETE ON segments BEGIN
+        DELETE FROM {SEGMENT_TABLE} WHERE id = old.id;
+    END""",
+]
+SEGMENT_RTREE_TRIGGERS = ('segments_rtree_ai', 'segments_rtree_ad')
+
+
+def create_rtree_index(engine):
+    # Для базы без миграций (в базе под миграциями индекс создают они).
+    # Возвращает True, если R*Tree доступен. Для только что созданного индекса
+    # переносим в него уже сохранённые записи. Всё в одной транзакции: при ошибке
+    # не остаётся ни таблиц, ни триггеров
+    if engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with engine.begin() as conn:
+            database.begin_ddl(conn)
+            for table, ddl, rebuild in ((BBOX_TABLE, RTREE_DDL, rebuild_rtree_index),
+                                        (SEGMENT_TABLE, SEGMENT_RTREE_DDL, rebuild_segment_rtree_index)):
+                existed = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ), {'name': table}).first() is not None
+                for statement in ddl:
+                    conn.execute(text(statement))
+                if not existed:
+                    rebuild(conn)
+    except OperationalError as e:
+        log.warning('Spatial index is not available: %s', e)
+        return False
+    return True
+
+
+def rtree_index_exists(engine):
+    if engine.dialect.name != 'sqlite':
+        return False
+    with engine.connect() as conn:
+        found = conn.execute(text(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (:bbox, :start, :segment)"
+        ), {'bbox': BBOX_TABLE, 'start': START_TABLE, 'segment': SEGMENT_TABLE}).scalar()
+    return found == 3
+
+
+def rebuild_rtree_index(conn):
+    conn.execute(text(f"DELETE FROM {BBOX_TABLE}"))
+    conn.execute(text(f"DELETE FROM {START_TABLE}"))
+    conn.execute(text(f"INSERT INTO {BBOX_TABLE} SELECT id, min_lat, max_lat, min_lon, max_lon FROM tracks"))
+    conn.execute(text(f"INSERT INTO {START_TABLE} SELECT id, start_lat, start_lat, start_lon, start_lon FROM tracks"))
+
+
+def rebuild_segment_rtree_index(conn):
+    conn.execute(text(f"DELETE FROM {SEGMENT_TABLE}"))
+    conn.execute(text(f"INSERT INTO {SEGMENT_TABLE} SELECT id, min_lat, max_lat, min_lon, max_lon FROM segments"))
+
+
+def expand_box(box, meters):
+    # Прямоугольник, расширенный на meters во все стороны (отрицательное значение - сужение)
+    min_lat, min_lon, max_lat, max_lon = box
+    dlat = meters / METERS_PER_DEGREE
+    dlon = meters / (METERS_PER_DEGREE * max(math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 0.01))
+    return min_lat - dlat, min_lon - dlon, max_lat + dlat, max_lon + dlon
+
+
+def bbox_around(lat, lon, radius):
+    # Прямоугольник (min_lat, min_lon, max_lat, max_lon), содержащий круг радиуса radius (м)
+    dlat = radius / METERS_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+    dlon = 180.0 if cos_lat < 1e-6 else min(radius / (METERS_PER_DEGREE * cos_lat), 180.0)
+    return max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0)
+
+
+def start_candidates(box):
+    # Подзапрос с id треков, стартовая точка которых попадает в прямоугольник
+    min_lat, min_lon, max_lat, max_lon = box
+    return text(
+        f"SELECT id FROM {START_TABLE} WHERE min_lat <= :max_lat AND max_lat >= :min_lat "
+        f"AND min_lon <= :max_lon AND max_lon >= :min_lon"
+    ).bindparams(min_lat=min_lat, min_lon=min_lon, max_lat=max_lat, max_lon=max_lon)
+
+
+def bbox_candidate_ids(session, box, before_id, limit):
+    # id треков, габариты которых пересекаются с прямоугольником, по убыванию id
+    min_lat, min_lon, max_lat, max_lon = box
+    rows = session.execute(text(
+        f"SELECT id FROM {BBOX_TABLE} WHERE min_lat <= :max_lat AND max_lat >= :min_lat "
+        f"AND min_lon <= :max_lon AND max_lon >= :min_lon AND id < :before_id ORDER BY id DESC LIMIT :limit"
+    ), {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon,
+        'before_id': before_id, 'limit': limit}).all()
+    return [row[0] for row in rows]
+
+
+def segments_inside_ids(session, box):
+    # id сегментов, габариты которых целиком внутри прямоугольника
+    min_lat, min_lon, max_lat, max_lon = box
+    rows = session.execute(text(
+        f"SELECT id FROM {SEGMENT_TABLE} WHERE min_lat >= :min_lat AND max_lat <= :max_lat "
+        f"AND min_lon >= :min_lon AND max_lon <= :max_lon"
+    ), {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon}).all()
+    return [row[0] for row in rows]
+
+
+def tracks_covering_ids(session, box, after_id, limit):
+    # id треков, габариты которых целиком накрывают прямоугольник, по возрастанию id
+    min_lat, min_lon, max_lat, max_lon = box
+    rows = session.execute(text(
+        f"SELECT id FROM {BBOX_TABLE} WHERE min_lat <= :min_lat AND max_lat >= :max_lat "
+        f"AND min_lon <= :min_lon AND max_lon >= :max_lon AND id > :after_id ORDER BY id LIMIT :limit"
+    ), {'min_lat': min_lat, 'min_lon': min_lon, 'max_lat': max_lat, 'max_lon': max_lon,
+        'after_id': after_id, 'limit': limit}).all()
+    return [row[0] for row in rows]
@@ -0,0 +1,67 @@
+-- Схема базы до первой миграции (20bfa948e72d): db.create_all() исходного app.py
+CREATE TABLE users (
+	"id_User" INTEGER NOT NULL, 
+	password VARCHAR(255) NOT NULL, 
+	email VARCHAR(100) NOT NULL, 
+	PRIMARY KEY ("id_User")
+);
+
+CREATE TABLE group_chat (
+	id INTEGER NOT NULL, 
+	title VARCHAR(255) NOT NULL, 
+	PRIMARY KEY (id)
+);
+
+CREATE TABLE friendships (
+	id INTEGER NOT NULL, 
+	user_id INTEGER, 
+	friend_id INTEGER, 
+	status VARCHAR(20), 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(user_id) REFERENCES users ("id_User"), 
+	FOREIGN KEY(friend_id) REFERENCES users ("id_User")
+);
+
+CREATE TABLE user_info (
+	"id_User" INTEGER NOT NULL, 
+	name VARCHAR(150) NOT NULL, 
+	weight FLOAT NOT NULL, 
+	height FLOAT NOT NULL, 
+	sex VARCHAR(10) NOT NULL, 
+	"Age" INTEGER NOT NULL, 
+	"Country" VARCHAR(30) NOT NULL, 
+	PRIMARY KEY ("id_User"), 
+	FOREIGN KEY("id_User") REFERENCES users ("id_User")
+);
+
+CREATE TABLE user_group_chat (
+	user_id INTEGER NOT NULL, 
+	chat_id INTEGER NOT NULL, 
+	joined_at DATETIME, 
+	PRIMARY KEY (user_id, chat_id), 
+	FOREIGN KEY(user_id) REFERENCES users ("id_User"), 
+	FOREIGN KEY(chat_id) REFERENCES group_chat (id)
+);
+
+CREATE TABLE group_message (
+	id INTEGER NOT NULL, 
+	chat_id INTEGER NOT NULL, 
+	sender_id INTEGER NOT NULL, 
+	content TEXT NOT NULL, 
+	timestamp DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(chat_id) REFERENCES group_chat (id), 
+	FOREIGN KEY(sender_id) REFERENCES users ("id_User")
+);
+
+CREATE TABLE user_statistic (
+	id INTEGER NOT NULL, 
+	"id_User" INTEGER NOT NULL, 
+	calories FLOAT NOT NULL, 
+	steps INTEGER NOT NULL, 
+	distance FLOAT NOT NULL, 
+	date DATE NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY("id_User") REFERENCES user_info ("id_User")
+);
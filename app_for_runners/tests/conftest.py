@@ -0,0 +1,79 @@
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+# Модули приложения лежат в app_for_runners и импортируются без пакета
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture(scope='session')
+def runners(tmp_path_factory):
+    # app.py настраивается переменными окружения при импорте: одна временная база на прогон
+    os.environ['DATABASE_URL'] = f"sqlite:///{tmp_path_factory.mktemp('db') / 'runners.db'}"
+    os.environ['SEGMENT_MATCHING'] = '0'
+    # Дешёвый хеш: тестам не нужна стойкость пароля
+    os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    import app
+    return app
+
+
+@pytest.fixture
+def client(runners):
+    return runners.app.test_client()
+
+
+@pytest.fixture
+def make_user(runners, client):
+    # Новый пользователь с анкетой: (user_id, токен)
+    def make_user(name='Бегун'):
+        email = f'{uuid.uuid4().hex[:12]}@example.com'
+        client.post('/register', json={'email': email, 'password': PASSWORD})
+        token = client.post('/login', json={'email': email, 'password': PASSWORD}).get_json()['token']
+        client.post('/api/user_info', headers={'Authorization': token}, json={
+            'name': name, 'weight': 70, 'height': 175, 'sex': 'm', 'age': 30, 'country': 'RU'})
+        return runners.decode_jwt(token)['user_id'], token
+    return make_user
+
+
+@pytest.fixture
+def make_chat(client):
+    # Групповой чат владельца с участниками: id чата
+    def make_chat(owner_token, member_ids, title='Пробежка'):
+        response = client.post('/api/group_chats', headers={'Authorization': owner_token},
+                               json={'title': title, 'members': member_ids})
+        return response.get_json()['chat_id']
+    return make_chat
+
+
+def gpx_document(points, started_at=datetime(2025, 6, 1, 7, 0), step=6):
+    # GPX с точкой каждые step секунд: points - [(lat, lon), ...]
+    trkpts = ''.join(
+        f'<trkpt lat="{lat:.6f}" lon="{lon:.6f}"><ele>150</ele>'
+        f'<time>{(started_at + timedelta(seconds=k * step)).strftime("%Y-%m-%dT%H:%M:%SZ")}</time></trkpt>'
+        for k, (lat, lon) in enumerate(points))
+    return ('<?xml version="1.0" encoding="UTF-8"?><gpx version="1.1" creator="tests" '
+            f'xmlns="http://www.topografix.com/GPX/1/1"><trk><name>Пробежка</name><trkseg>{trkpts}'
+            '</trkseg></trk></gpx>').encode()
+
+
+def straight_line(lat, lon, count, step=0.0002):
+    # Точки на север от (lat, lon), ~22 м между соседними
+    return [(lat + k * step, lon) for k in range(count)]
+
+
+@pytest.fixture
+def upload_track(client):
+    # Загружает трек по точкам: сводка трека из ответа
+    def upload_track(token, points, **kwargs):
+        response = client.post('/api/tracks', headers={'Authorization': token, 'Content-Type': 'application/gpx+xml'},
+                               data=gpx_document(points, **kwargs))
+        assert response.status_code == 201, response.get_json()
+        return response.get_json()
+    return upload_track
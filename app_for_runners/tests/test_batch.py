@@ -0,0 +1,44 @@
+def batch(client, token, requests, **options):
+    response = client.post('/api/batch', headers={'Authorization': token}, json={'requests': requests, **options})
+    return response.status_code, response.get_json()
+
+
+def test_batch_runs_sub_requests_in_order(client, make_user):
+    user_id, token = make_user('Пётр')
+    etag = client.get(f'/api/user_info/{user_id}', headers={'Authorization': token}).headers['ETag']
+
+    status, body = batch(client, token, [
+        {'id': 'info', 'path': f'/api/user_info/{user_id}'},
+        {'id': 'cached', 'path': f'/api/user_info/{user_id}', 'headers': {'If-None-Match': etag}},
+        {'id': 'rename', 'method': 'POST', 'path': '/api/user_info', 'body': {
+            'name': 'Пётр Иванов', 'weight': 70, 'height': 175, 'sex': 'm', 'age': 30, 'country': 'RU'}},
+        {'id': 'after', 'path': f'/api/user_info/{user_id}'},
+        {'id': 'missing', 'path': '/api/no_such_endpoint'},
+    ])
+    assert status == 200
+    responses = {item['id']: item for item in body['responses']}
+    assert [item['id'] for item in body['responses']] == ['info', 'cached', 'rename', 'after', 'missing']
+    assert responses['info']['status'] == 200 and responses['info']['body']['name'] == 'Пётр'
+    assert responses['cached']['status'] == 304
+    assert responses['after']['body']['name'] == 'Пётр Иванов'
+    assert responses['missing']['status'] == 404 and 'error' in responses['missing']['body']
+
+
+def test_batch_parallel_reads(client, make_user):
+    user_id, token = make_user()
+    status, body = batch(client, token, [{'path': f'/api/user_info/{user_id}'}, {'path': '/api/friends'}],
+                         parallel=True)
+    assert status == 200
+    assert [item['status'] for item in body['responses']] == [200, 200]
+    assert [item['id'] for item in body['responses']] == [0, 1]
+
+
+def test_batch_rejects_invalid_requests(client, make_user):
+    _, token = make_user()
+    assert batch(client, token, [])[0] == 400
+    assert batch(client, token, [{'path': '/metrics'}])[0] == 400
+    assert batch(client, token, [{'path': '/api/friends', 'method': 'TRACE'}])[0] == 400
+    assert batch(client, token, [{'path': '/api/friends'}] * 21)[0] == 400
+    status, body = batch(client, token, [{'method': 'POST', 'path': '/api/batch', 'body': {'requests': []}}])
+    assert status == 200 and body['responses'][0]['status'] == 400
+    assert client.post('/api/batch', json={'requests': [{'path': '/api/friends'}]}).status_code == 401
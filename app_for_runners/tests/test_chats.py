@@ -0,0 +1,112 @@
+from sqlalchemy import event as sqlalchemy_event
+
+
+def post_messages(runners, chat_id, sender_id, count):
+    with runners.app.app_context():
+        return [runners.store_message(chat_id, sender_id, f'сообщение {k}')[0] for k in range(count)]
+
+
+def test_messages_pages_go_back_in_time(runners, client, make_user, make_chat):
+    owner, token = make_user()
+    member, _ = make_user()
+    chat_id = make_chat(token, [member])
+    ids = post_messages(runners, chat_id, owner, 7)
+
+    details = client.get(f'/api/group_chats/{chat_id}?limit=3', headers={'Authorization': token}).get_json()
+    assert [m['id'] for m in details['messages']] == ids[-3:]
+    loaded = [m['id'] for m in details['messages']]
+    before_id = details['next_before_id']
+    while before_id is not None:
+        page = client.get(f'/api/group_chats/{chat_id}/messages?limit=3&before_id={before_id}',
+                          headers={'Authorization': token}).get_json()
+        loaded = [m['id'] for m in page['messages']] + loaded
+        before_id = page['next_before_id']
+    assert loaded == ids
+
+
+def test_messages_reject_bad_limit_and_outsiders(client, make_user, make_chat):
+    _, token = make_user()
+    _, outsider_token = make_user()
+    chat_id = make_chat(token, [])
+    response = client.get(f'/api/group_chats/{chat_id}/messages?limit=abc', headers={'Authorization': token})
+    assert response.status_code == 400
+    response = client.get(f'/api/group_chats/{chat_id}/messages', headers={'Authorization': outsider_token})
+    assert response.status_code == 403
+
+
+def test_chat_details_not_modified_until_new_message(runners, client, make_user, make_chat):
+    owner, token = make_user()
+    chat_id = make_chat(token, [])
+    url = f'/api/group_chats/{chat_id}'
+
+    first = client.get(url, headers={'Authorization': token})
+    etag = first.headers['ETag']
+    cached = client.get(url, headers={'Authorization': token, 'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.headers['ETag'] == etag
+
+    post_messages(runners, chat_id, owner, 1)
+    fresh = client.get(url, headers={'Authorization': token, 'If-None-Match': etag})
+    assert fresh.status_code == 200
+    assert fresh.headers['ETag'] != etag
+
+
+def test_user_info_not_modified_until_profile_changes(client, make_user):
+    _, token = make_user()
+    other, other_token = make_user('Анна')
+    url = f'/api/user_info/{other}'
+
+    etag = client.get(url, headers={'Authorization': token}).headers['ETag']
+    assert client.get(url, headers={'Authorization': token, 'If-None-Match': etag}).status_code == 304
+
+    client.post('/api/user_info', headers={'Authorization': other_token}, json={
+        'name': 'Анна Петрова', 'weight': 60, 'height': 170, 'sex': 'f', 'age': 30, 'country': 'RU'})
+    response = client.get(url, headers={'Authorization': token, 'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.get_json()['name'] == 'Анна Петрова'
+
+
+def test_user_info_304_reads_only_the_version(runners, client, make_user):
+    _, token = make_user()
+    other, _ = make_user()
+    url = f'/api/user_info/{other}'
+    etag = client.get(url, headers={'Authorization': token}).headers['ETag']
+
+    statements = []
+    with runners.app.app_context():
+        engine = runners.db.engine
+
+    def listener(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sqlalchemy_event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        assert client.get(url, headers={'Authorization': token, 'If-None-Match': etag}).status_code == 304
+    finally:
+        sqlalchemy_event.remove(engine, 'before_cursor_execute', listener)
+    user_info_reads = [s for s in statements if 'FROM user_info' in s]
+    assert len(user_info_reads) == 1 and 'user_info.weight' not in user_info_reads[0]
+
+    assert client.get('/api/user_info/999999', headers={'Authorization': token}).status_code == 404
+
+
+def test_inbox_orders_chats_by_last_message(runners, client, make_user, make_chat):
+    owner, token = make_user()
+    quiet = make_chat(token, [], title='Тихий')
+    older = make_chat(token, [], title='Вчерашний')
+    newer = make_chat(token, [], title='Сегодняшний')
+    post_messages(runners, older, owner, 1)
+    post_messages(runners, newer, owner, 1)
+    with runners.app.app_context():
+        last_id, _ = runners.store_message(newer, owner, 'x' * 300)
+
+    inbox = client.get('/api/group_chats', headers={'Authorization': token}).get_json()
+    assert [chat['id'] for chat in inbox] == [newer, older, quiet]
+    assert inbox[0]['lastMessageId'] == last_id
+    # Превью обрезано до MESSAGE_PREVIEW_LENGTH символов
+    assert inbox[0]['lastMessage'] == 'x' * runners.MESSAGE_PREVIEW_LENGTH
+    assert (inbox[2]['lastMessage'], inbox[2]['lastMessageId']) == ('', None)
+
+    page = client.get('/api/group_chats?limit=1&offset=1', headers={'Authorization': token}).get_json()
+    assert [chat['id'] for chat in page] == [older]
+    assert client.get('/api/group_chats?offset=-1', headers={'Authorization': token}).status_code == 400
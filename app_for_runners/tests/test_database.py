@@ -0,0 +1,36 @@
+import flask
+import pytest
+
+
+@pytest.fixture
+def read_engine(runners, monkeypatch):
+    # Отдельный пул чтения: в тестах он выключен, подставляется заглушка-маркер
+    marker = object()
+    monkeypatch.setitem(runners.app.extensions, 'db_read_engine', marker)
+    return marker
+
+
+def bind(runners):
+    return runners.db.session.get_bind()
+
+
+def test_get_reads_from_read_pool(runners, read_engine):
+    with runners.app.test_request_context('/api/friends', method='GET'):
+        assert bind(runners) is read_engine
+    with runners.app.test_request_context('/api/friends', method='POST'):
+        assert bind(runners) is runners.db.engine
+
+
+def test_socket_events_use_primary(runners, read_engine):
+    # Flask-SocketIO выполняет событие в контексте GET-запроса подключения и задаёт request.sid
+    with runners.app.test_request_context('/socket.io/', method='GET'):
+        flask.request.sid = 'abc'
+        assert bind(runners) is runners.db.engine
+
+
+def test_writing_get_view_uses_primary(runners, client, make_user, read_engine):
+    # Рейтинг друзей пересчитывает окна и сразу их читает: запрос к заглушке пула чтения упал бы
+    _, token = make_user()
+    response = client.get('/api/friends/leaderboard', headers={'Authorization': token})
+    assert response.status_code == 200
+    assert [entry['me'] for entry in response.get_json()['entries']] == [True]
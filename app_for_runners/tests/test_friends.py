@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+from friend_graph import FriendGraph
+
+
+def befriend(client, first, second):
+    (first_id, first_token), (second_id, second_token) = first, second
+    client.post('/api/friends/send_request', headers={'Authorization': first_token}, json={'friend_id': second_id})
+    response = client.post('/api/friends/accept_request', headers={'Authorization': second_token},
+                           json={'friend_id': first_id})
+    assert response.status_code == 200
+
+
+def test_suggestions_rank_friends_of_friends(client, make_user):
+    me, anna, boris, dmitry, elena = make_user(), make_user(), make_user(), make_user('Дмитрий'), make_user('Елена')
+    befriend(client, me, anna)
+    befriend(client, me, boris)
+    befriend(client, anna, dmitry)
+    befriend(client, boris, dmitry)
+    befriend(client, boris, elena)
+
+    response = client.get('/api/friends/suggestions', headers={'Authorization': me[1]})
+    assert response.get_json() == [
+        {'id': dmitry[0], 'name': 'Дмитрий', 'mutual_friends': 2},
+        {'id': elena[0], 'name': 'Елена', 'mutual_friends': 1},
+    ]
+    assert client.get('/api/friends/suggestions?limit=0', headers={'Authorization': me[1]}).status_code == 400
+
+
+def add_days(client, token, days):
+    # days - {сколько дней назад: шаги}
+    today = datetime.utcnow().date()
+    response = client.post('/api/user_statistic/batch', headers={'Authorization': token}, json={'records': [
+        {'date': (today - timedelta(days=ago)).isoformat(), 'calories': 0, 'steps': steps, 'distance': 0}
+        for ago, steps in days.items()]})
+    assert response.status_code == 201
+
+
+def test_leaderboard_sums_rolling_windows(runners, client, make_user):
+    me, anna, boris, stranger = make_user('Я'), make_user('Анна'), make_user('Борис'), make_user('Чужой')
+    befriend(client, me, anna)
+    befriend(client, boris, me)
+    add_days(client, me[1], {0: 100, 6: 100, 7: 1000})
+    add_days(client, anna[1], {1: 300, 29: 5000, 30: 7000})
+    add_days(client, stranger[1], {0: 99999})
+
+    def board(window):
+        response = client.get(f'/api/friends/leaderboard?metric=steps&window={window}', headers={'Authorization': me[1]})
+        assert response.status_code == 200
+        return [(e['rank'], e['name'], e['value'], e['me']) for e in response.get_json()['entries']]
+
+    # День ровно window назад уже не входит в окно; друг без записей - с нулём
+    assert board('7d') == [(1, 'Анна', 300, False), (2, 'Я', 200, True), (3, 'Борис', 0, False)]
+    assert board('30d') == [(1, 'Анна', 5300, False), (2, 'Я', 1200, True), (3, 'Борис', 0, False)]
+
+    # Новые записи прибавляются к уже посчитанным окнам, старые дни окна не меняют
+    add_days(client, boris[1], {0: 250, 2: 250})
+    add_days(client, me[1], {0: 50, 40: 1})
+    assert board('7d') == [(1, 'Борис', 500, False), (2, 'Анна', 300, False), (3, 'Я', 250, True)]
+
+    # Окно, посчитанное вчера, пересчитывается при первом запросе нового дня
+    Window = runners.UserStatisticWindow
+    with runners.app.app_context():
+        runners.db.session.execute(runners.db.update(Window).where(Window.id_User == anna[0]).values(
+            as_of=datetime.utcnow().date() - timedelta(days=1), steps=123456))
+        runners.db.session.commit()
+    assert board('30d') == [(1, 'Анна', 5300, False), (2, 'Я', 1250, True), (3, 'Борис', 500, False)]
+
+    assert client.get('/api/friends/leaderboard?window=1y', headers={'Authorization': me[1]}).status_code == 400
+    assert client.get('/api/friends/leaderboard?metric=pace', headers={'Authorization': me[1]}).status_code == 400
+
+
+class Loader:
+    def __init__(self, edges):
+        self.edges = edges
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return list(self.edges)
+
+
+def test_expired_graph_is_reloaded_once_in_background():
+    loader = Loader([(1, 2), (2, 1)])
+    tasks = []
+    graph = FriendGraph(loader, ttl=0.0, start_task=tasks.append)
+    assert graph.friends(1) == {2}
+    assert loader.calls == 1
+
+    # Граф устарел: все запросы получают старую копию, перечитывание запускается один раз
+    loader.edges += [(1, 3), (3, 1)]
+    assert [graph.friends(1) for _ in range(5)] == [{2}] * 5
+    assert len(tasks) == 1 and loader.calls == 1
+
+    tasks.pop()()
+    assert loader.calls == 2
+    assert graph.friends(1) == {2, 3}
+
+
+def test_edges_added_during_reload_are_kept():
+    tasks = []
+
+    def loader():
+        # Дружба подтверждена, пока читается граф, и в прочитанное не попала
+        graph.add_edge(1, 4)
+        return [(1, 2)]
+    graph = FriendGraph(loader, ttl=0.0, start_task=tasks.append)
+    assert graph.friends(1) == {2, 4}
+    graph.friends(1)
+    tasks.pop()()
+    assert graph.friends(1) == {2, 4}
+
+
+def test_failed_reload_keeps_serving_previous_graph():
+    calls = []
+    tasks = []
+
+    def loader():
+        calls.append(1)
+        if len(calls) > 1:
+            raise ConnectionError('database is unavailable')
+        return [(1, 2)]
+    graph = FriendGraph(loader, ttl=0.0, start_task=tasks.append)
+    assert graph.friends(1) == {2}
+    graph.friends(1)
+    tasks.pop()()
+    assert graph.friends(1) == {2}
+    # Следующий запрос пробует перечитать снова
+    assert len(tasks) == 1
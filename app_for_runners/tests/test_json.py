@@ -0,0 +1,107 @@
+import gzip
+import json
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import flask
+import pytest
+
+import compression
+import json_provider
+
+PAYLOAD = {
+    'name': 'Пробежка "утро"\n',
+    'date': date(2025, 6, 1),
+    'created_at': datetime(2025, 6, 1, 7, 0, 5, 120000),
+    'distance': 5012.25,
+    'steps': 7000,
+    'pace': Decimal('5.5'),
+    'empty': None,
+    'flags': [True, False],
+    'nested': [{'id': 1, 'points': [[53.35, 83.77]]}, {}],
+}
+
+
+@pytest.fixture(params=['std', 'orjson'])
+def provider(request, runners, monkeypatch):
+    if request.param == 'orjson' and json_provider.orjson is None:
+        pytest.skip('orjson is not installed')
+    provider = json_provider.make_provider(runners.app, request.param)
+    monkeypatch.setattr(runners.app, 'json', provider)
+    return provider
+
+
+def test_providers_write_the_same_documents(runners):
+    if json_provider.orjson is None:
+        pytest.skip('orjson is not installed')
+    std = json_provider.make_provider(runners.app, 'std')
+    fast = json_provider.make_provider(runners.app, 'orjson')
+    expected = dict(PAYLOAD, date='2025-06-01', created_at='2025-06-01T07:00:05.120000', pace='5.5')
+    for provider in (std, fast):
+        assert json.loads(provider.dumps_bytes(PAYLOAD)) == expected
+        assert provider.loads(provider.dumps(PAYLOAD)) == expected
+    with runners.app.app_context():
+        assert std.response(PAYLOAD).get_json() == fast.response(PAYLOAD).get_json() == expected
+
+
+@pytest.mark.parametrize('count', [0, 1, 5, 6, 13])
+def test_streamed_array_matches_a_single_dump(provider, count):
+    items = [{'id': k, 'date': date(2025, 6, 1) + timedelta(days=k)} for k in range(count)]
+    streamed = b''.join(json_provider.iter_json_array(provider, items, chunk_size=3))
+    assert json.loads(streamed) == json.loads(provider.dumps_bytes(items))
+    converted = b''.join(json_provider.iter_json_array(provider, items, lambda item: item['id'], chunk_size=3))
+    assert json.loads(converted) == list(range(count))
+
+
+def statistics(client, token, encoding=None):
+    headers = {'Authorization': token}
+    if encoding:
+        headers['Accept-Encoding'] = encoding
+    return client.get('/api/user_statistic?limit=100', headers=headers)
+
+
+def test_large_lists_are_streamed_and_compressed(runners, client, make_user, provider, monkeypatch):
+    _, token = make_user()
+    client.post('/api/user_statistic/batch', headers={'Authorization': token}, json={'records': [
+        {'date': (date(2025, 1, 1) + timedelta(days=k)).isoformat(), 'calories': k, 'steps': 100 * k,
+         'distance': k / 10} for k in range(60)]})
+    plain = statistics(client, token)
+    assert 'Content-Length' in plain.headers and 'Content-Encoding' not in plain.headers
+    expected = plain.get_json()
+    assert len(expected) == 60 and expected[0]['date'] == '2025-03-01'
+
+    # Список длиннее порога уходит потоком, частями по JSON_STREAM_CHUNK
+    monkeypatch.setitem(runners.app.config, 'JSON_STREAM_MIN_ITEMS', 10)
+    monkeypatch.setitem(runners.app.config, 'JSON_STREAM_CHUNK', 7)
+    streamed = statistics(client, token)
+    assert 'Content-Length' not in streamed.headers and json.loads(streamed.get_data()) == expected
+
+    compressed = statistics(client, token, 'gzip, deflate')
+    assert compressed.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in compressed.headers['Vary']
+    assert 'Content-Length' not in compressed.headers
+    assert json.loads(gzip.decompress(compressed.get_data())) == expected
+    assert 'Content-Encoding' not in statistics(client, token, 'gzip;q=0').headers
+
+
+def test_small_and_bodiless_responses_are_not_compressed(runners, client, make_user):
+    user_id, token = make_user()
+    headers = {'Authorization': token, 'Accept-Encoding': 'gzip'}
+    small = client.get(f'/api/user_info/{user_id}', headers=headers)
+    assert small.status_code == 200 and 'Content-Encoding' not in small.headers
+
+    cached = client.get(f'/api/user_info/{user_id}', headers=dict(headers, **{'If-None-Match': small.headers['ETag']}))
+    assert cached.status_code == 304 and 'Content-Encoding' not in cached.headers
+
+
+def test_compress_response_keeps_the_body(runners):
+    body = json.dumps([{'id': k, 'name': f'Бегун {k}'} for k in range(200)]).encode()
+    with runners.app.test_request_context(headers={'Accept-Encoding': 'gzip'}):
+        response = runners.app.response_class(body, mimetype='application/json')
+        compression.compress_response(response, flask.request.accept_encodings, min_size=1024)
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.content_length == len(response.get_data()) < len(body)
+        assert gzip.decompress(response.get_data()) == body
+
+        image = runners.app.response_class(body, mimetype='image/png')
+        compression.compress_response(image, flask.request.accept_encodings, min_size=1024)
+        assert 'Content-Encoding' not in image.headers and image.get_data() == body
@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import live_location
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_live(rate=5.0):
+    clock = Clock()
+    sent = []
+    live = live_location.LiveLocations(lambda event, data, room: sent.append((event, data, room)), rate=rate,
+                                       clock=clock, wall_clock=lambda: 1.7e9 + clock.now)
+    return live, clock, sent
+
+
+def test_updates_are_throttled_by_token_bucket():
+    live, clock, _ = make_live(rate=5.0)
+    live.start(1, 10, 'sid')
+    # Запас - две секунды (burst = 2 * rate), дальше rate точек в секунду
+    results = [live.update(1, 10, 53.3, 83.7) for _ in range(12)]
+    assert results.count('ok') == 10 and results[10:] == ['throttled', 'throttled']
+    clock.now += 1.0
+    results = [live.update(1, 10, 53.3, 83.7) for _ in range(6)]
+    assert results.count('ok') == 5 and results[-1] == 'throttled'
+    assert live.update(1, 11, 53.3, 83.7) == 'not_sharing'
+
+
+def test_tick_sends_one_event_with_latest_positions():
+    live, clock, sent = make_live()
+    live.start(1, 10, 'a')
+    live.start(1, 11, 'b')
+    for k in range(3):
+        live.update(1, 10, 53.3 + k * 1e-4, 83.7)
+    live.update(1, 11, 53.4, 83.8)
+    assert live.tick() == 1
+    (event, data, room), = sent
+    assert (event, room) == ('live_locations', 1)
+    assert (data['stream'], data['seq']) == (live.stream, 1)
+    assert sorted(p[:3] for p in data['positions']) == [[10, 5330020, 8370000], [11, 5340000, 8380000]]
+
+    # Следующая точка уходит разностью от разосланной
+    clock.now += 1
+    live.update(1, 10, 53.3003, 83.7)
+    live.tick()
+    assert sent[-1][1]['deltas'][0][:3] == [10, 10, 0]
+    assert live.tick() == 0
+
+
+def test_socket_update_is_acknowledged(runners, make_user, make_chat):
+    user_id, token = make_user()
+    chat_id = make_chat(token, [])
+    client = runners.socketio.test_client(runners.app, auth={'token': token})
+    try:
+        client.emit('live_location_start', {'chat_id': chat_id})
+        acks = [client.emit('live_location', {'chat_id': chat_id, 'lat': 53.3, 'lon': 83.7}, callback=True)
+                for _ in range(int(runners.live_locations.burst) + 1)]
+        assert acks[0] == 'ok' and acks[-1] == 'throttled'
+        assert client.emit('live_location', {'chat_id': chat_id, 'lat': 'x', 'lon': 1}, callback=True) != 'ok'
+
+        # Снимок потока этого процесса - по запросу клиента, пропустившего событие
+        runners.live_locations.tick()
+        client.get_received()
+        client.emit('live_location_snapshot', {'chat_id': chat_id, 'stream': runners.live_locations.stream})
+        snapshot, = [m['args'][0] for m in client.get_received() if m['name'] == 'live_location_snapshot']
+        assert snapshot['stream'] == runners.live_locations.stream
+        assert [member[:3] for member in snapshot['members']] == [[user_id, 5330000, 8370000]]
+        # Чужой поток отвечает сам - этот процесс молчит
+        client.emit('live_location_snapshot', {'chat_id': chat_id, 'stream': 'other'})
+        assert not client.get_received()
+    finally:
+        client.emit('live_location_stop', {'chat_id': chat_id})
+        client.disconnect()
+
+
+def test_recorded_run_is_saved_as_track_in_naive_utc(runners, client, make_user, make_chat):
+    user_id, token = make_user()
+    chat_id = make_chat(token, [], title='Вечерняя')
+    # 2025-06-01 07:00:00 UTC, точка каждые 10 секунд на север
+    started = 1748761200
+    points = [(53.3 + k * 0.0002, 83.7, 150.0, started + k * 10) for k in range(5)]
+    runners.persist_live_tracks([(user_id, chat_id, points)])
+
+    [track] = client.get('/api/tracks', headers={'Authorization': token}).get_json()
+    assert track['name'] == 'Вечерняя 2025-06-01'
+    assert track['point_count'] == 5
+    with runners.app.app_context():
+        row = runners.db.session.get(runners.Track, track['id'])
+        assert (row.started_at, row.finished_at) == (datetime(2025, 6, 1, 7, 0), datetime(2025, 6, 1, 7, 0, 40))
@@ -0,0 +1,72 @@
+import pytest
+
+from message_writer import MessageWriter, WriterBusy
+
+
+class Table:
+    # persist для MessageWriter: строки с content=None нарушают ограничение столбца
+    def __init__(self):
+        self.rows = []
+        self.down = False
+
+    def persist(self, rows):
+        if self.down or any(row['content'] is None for row in rows):
+            raise ValueError('NOT NULL constraint failed: group_message.content')
+        self.rows.extend(rows)
+
+
+def make_writer(table, **kwargs):
+    now = [0.0]
+    writer = MessageWriter(table.persist, batch_size=1000, max_retries=2, start_task=lambda target: None,
+                           sleep=lambda seconds: None, clock=lambda: now[0], **kwargs)
+    writer.start(0)
+    return writer
+
+
+def submit(writer, contents):
+    return [writer.submit({'chat_id': 1, 'sender_id': 1, 'content': content}) for content in contents]
+
+
+def test_bad_row_is_dropped_after_retries_and_the_rest_saved():
+    table = Table()
+    writer = make_writer(table)
+    ids = submit(writer, ['a', 'b', None, 'c', 'd'])
+
+    for _ in range(writer.max_retries):
+        assert writer.flush() == 0
+        assert writer.pending() == 5
+    # Следующая неудача - пачка пишется по половинам, плохая строка выбрасывается
+    assert writer.flush() == 4
+    assert [row['id'] for row in table.rows] == [ids[0], ids[1], ids[3], ids[4]]
+    assert writer.pending() == 0 and writer.dropped == 1
+
+    # Писатель снова работает как обычно
+    submit(writer, ['e'])
+    assert writer.flush() == 1
+
+
+def test_outage_keeps_every_row_buffered():
+    table = Table()
+    table.down = True
+    writer = make_writer(table)
+    submit(writer, ['a', 'b', 'c'])
+    for _ in range(writer.max_retries + 3):
+        assert writer.flush() == 0
+    assert writer.pending() == 3 and writer.dropped == 0
+
+    table.down = False
+    assert writer.flush() == 3
+    assert [row['content'] for row in table.rows] == ['a', 'b', 'c']
+
+
+def test_full_buffer_pushes_back():
+    table = Table()
+    table.down = True
+    writer = make_writer(table, max_pending=3)
+    submit(writer, ['a', 'b', 'c'])
+    with pytest.raises(WriterBusy):
+        submit(writer, ['d'])
+
+    table.down = False
+    assert writer.flush() == 3
+    assert submit(writer, ['d']) == [4]
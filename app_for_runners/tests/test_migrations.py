@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+from conftest import APP_DIR
+
+# База, созданная исходной версией приложения и помеченная первой миграцией
+BASELINE_SCHEMA = os.path.join(os.path.dirname(__file__), 'baseline_schema.sql')
+BASELINE_REVISION = '20bfa948e72d'
+
+
+def flask_db(db_path, *args):
+    # flask db в отдельном процессе: приложение импортируется с этой базой, как в эксплуатации
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', FLASK_APP='app', SEGMENT_MATCHING='0')
+    env.pop('DB_CREATE_ALL', None)
+    return subprocess.run([sys.executable, '-m', 'flask', 'db', *args], cwd=APP_DIR, env=env,
+                          capture_output=True, text=True, timeout=300)
+
+
+def make_baseline_db(path):
+    conn = sqlite3.connect(path)
+    with open(BASELINE_SCHEMA, encoding='utf-8') as f:
+        conn.executescript(f.read())
+    conn.executescript(f"""
+        CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL PRIMARY KEY);
+        INSERT INTO alembic_version VALUES ('{BASELINE_REVISION}');
+        INSERT INTO users VALUES (1, 'x', 'anna@example.com'), (2, 'x', 'boris@example.com');
+        INSERT INTO user_info VALUES (1, 'Анна  Петрова', 60, 170, 'f', 30, 'RU'),
+                                     (2, 'Борис', 80, 180, 'm', 35, 'RU');
+        INSERT INTO friendships VALUES (1, 1, 2, 'accepted', '2025-06-01 10:00:00');
+        INSERT INTO group_chat VALUES (1, 'Утренняя пробежка');
+        INSERT INTO user_group_chat VALUES (1, 1, '2025-06-01 10:00:00'), (2, 1, '2025-06-01 10:00:00');
+        INSERT INTO group_message VALUES (1, 1, 1, 'Привет', '2025-06-01 10:01:00'),
+                                         (2, 1, 2, 'В 7 у парка', '2025-06-01 10:02:00');
+        INSERT INTO user_statistic VALUES (1, 1, 100, 1000, 2.0, '2025-06-14'),
+                                          (2, 1, 50, 500, 1.0, '2025-06-14'),
+                                          (3, 1, 70, 700, 1.5, '2025-06-16');
+    """)
+    conn.commit()
+    conn.close()
+
+
+def test_upgrade_populated_baseline(tmp_path):
+    db_path = tmp_path / 'baseline.db'
+    make_baseline_db(db_path)
+
+    result = flask_db(db_path, 'upgrade')
+    assert result.returncode == 0, result.stderr
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+    assert conn.execute('SELECT name_norm FROM user_info WHERE id_User = 1').fetchone() == ('анна петрова',)
+    # Триграммный индекс заполнен из существующих строк и обновляется триггерами
+    match = "SELECT rowid FROM user_info_fts WHERE user_info_fts MATCH :q"
+    assert conn.execute(match, {'q': '"петр"'}).fetchall() == [(1,)]
+    conn.execute("UPDATE user_info SET name_norm = 'борис иванов' WHERE id_User = 2")
+    assert conn.execute(match, {'q': '"иван"'}).fetchall() == [(2,)]
+    assert conn.execute('SELECT last_message_id FROM group_chat WHERE id = 1').fetchone() == (2,)
+    # Две записи за 14 июня слиты в одну и считаются в суммах одним днём
+    assert conn.execute('SELECT COUNT(*) FROM user_statistic').fetchone() == (2,)
+    assert conn.execute(
+        "SELECT steps, days FROM user_statistic_rollup WHERE id_User = 1 AND granularity = 'week' "
+        "ORDER BY period_start"
+    ).fetchall() == [(1500, 1), (700, 1)]
+    assert conn.execute(
+        "SELECT steps, days FROM user_statistic_rollup WHERE id_User = 1 AND granularity = 'month'"
+    ).fetchall() == [(2200, 2)]
+    conn.close()
+
+    # Модели совпадают со схемой после миграций (виртуальные таблицы не в счёт)
+    result = flask_db(db_path, 'check')
+    assert result.returncode == 0, result.stderr
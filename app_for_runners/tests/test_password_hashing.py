@@ -0,0 +1,36 @@
+import uuid
+
+import pytest
+
+import password_hashing
+
+
+def busy_hasher():
+    # Ни одного свободного места в очереди: следующий вызов сразу получает отказ
+    hasher = password_hashing.PasswordHasher('pbkdf2:sha256:1000', workers=1, queue_size=0, offload=False)
+    assert hasher._os_limiter.admission.acquire(blocking=False)
+    return hasher
+
+
+def test_hasher_rejects_when_queue_is_full():
+    hasher = busy_hasher()
+    with pytest.raises(password_hashing.HasherBusy):
+        hasher.hash('secret')
+    hasher._os_limiter.admission.release()
+    assert hasher.check(hasher.hash('secret'), 'secret')
+
+
+def test_hasher_rejects_unknown_method():
+    with pytest.raises(ValueError):
+        password_hashing.PasswordHasher('md5')
+
+
+@pytest.mark.parametrize('path', ['/login', '/register'])
+def test_busy_hasher_answers_503(runners, client, monkeypatch, path):
+    # Вход существующего пользователя: для неизвестного email хеш не считается
+    credentials = {'email': f'{uuid.uuid4().hex[:12]}@example.com', 'password': 'secret'}
+    client.post('/register', json=credentials)
+    monkeypatch.setattr(runners, 'password_hasher', busy_hasher())
+    response = client.post(path, json=credentials)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
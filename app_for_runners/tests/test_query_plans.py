@@ -0,0 +1,15 @@
+import os
+import subprocess
+import sys
+
+from conftest import APP_DIR
+
+
+def test_no_unexpected_full_scans(tmp_path):
+    # benchmarks/query_plans.py на самом маленьком наборе данных: каждый SQL-запрос
+    # сценария проверяется через EXPLAIN QUERY PLAN
+    env = dict(os.environ, TMPDIR=str(tmp_path))
+    result = subprocess.run([sys.executable, '-m', 'benchmarks.query_plans', '--scale', 'tiny'], cwd=APP_DIR,
+                            env=env, capture_output=True, text=True, timeout=900)
+    assert result.returncode == 0, result.stdout + result.stderr[-2000:]
+    assert '"failures": 0' in result.stdout
@@ -0,0 +1,127 @@
+import heapq
+import io
+import random
+
+import numpy as np
+import pytest
+
+import routing
+
+LAT, LON, STEP = 53.35, 83.77, 0.001
+SIZE = 6
+
+
+def osm_document(seed=7):
+    # Сетка улиц SIZE x SIZE перекрёстков с точкой формы посередине каждого квартала,
+    # часть кварталов выброшена. Плюс автомагистраль и foot=no по диагонали
+    # (пешеходу нельзя) и отдельная тропинка в стороне от сетки
+    rnd = random.Random(seed)
+    nodes, ways = {}, []
+
+    def node(lat, lon):
+        nodes[len(nodes) + 1] = (lat, lon)
+        return len(nodes)
+
+    grid = [[node(LAT + i * STEP, LON + j * STEP) for j in range(SIZE)] for i in range(SIZE)]
+    for i in range(SIZE):
+        for j in range(SIZE):
+            for di, dj in ((0, 1), (1, 0)):
+                if i + di < SIZE and j + dj < SIZE and rnd.random() < 0.8:
+                    a, b = nodes[grid[i][j]], nodes[grid[i + di][j + dj]]
+                    shape = node((a[0] + b[0]) / 2 + rnd.uniform(-1, 1) * STEP / 5,
+                                 (a[1] + b[1]) / 2 + rnd.uniform(-1, 1) * STEP / 5)
+                    ways.append(({'highway': rnd.choice(['residential', 'footway', 'path'])},
+                                 [grid[i][j], shape, grid[i + di][j + dj]]))
+    diagonal = [grid[k][k] for k in range(SIZE)]
+    ways.append(({'highway': 'motorway'}, diagonal))
+    ways.append(({'highway': 'residential', 'foot': 'no'}, diagonal[::-1]))
+    ways.append(({'highway': 'footway'}, [node(LAT + 0.02, LON), node(LAT + 0.02, LON + STEP)]))
+
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><osm version="0.6">']
+    parts += [f'<node id="{k}" lat="{lat:.7f}" lon="{lon:.7f}"/>' for k, (lat, lon) in nodes.items()]
+    for k, (tags, refs) in enumerate(ways, 1):
+        parts.append(f'<way id="{k}">' + ''.join(f'<nd ref="{ref}"/>' for ref in refs)
+                     + ''.join(f'<tag k="{key}" v="{value}"/>' for key, value in tags.items()) + '</way>')
+    parts.append('</osm>')
+    return ''.join(parts).encode(), grid, nodes
+
+
+@pytest.fixture(scope='module')
+def city(tmp_path_factory):
+    document, grid, nodes = osm_document()
+    osm = tmp_path_factory.mktemp('osm') / 'city.osm'
+    osm.write_bytes(document)
+    path = str(tmp_path_factory.mktemp('graph') / 'city')
+    routing.build_from_osm(str(osm), path)
+    return routing.RoutingGraph.load(path), document, [[nodes[k] for k in row] for row in grid]
+
+
+def dijkstra(document, source):
+    # Эталон: обычная Дейкстра по всем вершинам, без стягивания цепочек
+    lat, lon, indptr, indices, weights = routing.node_graph(*routing.read_osm(io.BytesIO(document)))
+    start = int(np.flatnonzero((np.abs(lat - source[0]) < 1e-9) & (np.abs(lon - source[1]) < 1e-9))[0])
+    best, queue = {start: 0.0}, [(0.0, start)]
+    while queue:
+        d, v = heapq.heappop(queue)
+        if d > best[v]:
+            continue
+        for k in range(indptr[v], indptr[v + 1]):
+            u, nd = int(indices[k]), d + float(weights[k])
+            if nd < best.get(u, float('inf')):
+                best[u] = nd
+                heapq.heappush(queue, (nd, u))
+    # (расстояния до достижимых вершин, все вершины пешеходных путей) по координатам
+    coords = [(round(a, 7), round(b, 7)) for a, b in zip(lat.tolist(), lon.tolist())]
+    return {coords[v]: d for v, d in best.items()}, set(coords)
+
+
+def test_routes_are_shortest_walkable_paths(city):
+    graph, document, corners = city
+    source = corners[0][0]
+    expected, walkable = dijkstra(document, source)
+    reachable = 0
+    for row in corners:
+        for target in row:
+            key = (round(target[0], 7), round(target[1], 7))
+            if key not in walkable:
+                continue  # перекрёсток без улиц: точка привяжется к другой вершине
+            if key not in expected:
+                with pytest.raises(routing.RoutingError):
+                    graph.route(*source, *target)
+                continue
+            reachable += 1
+            found = graph.route(*source, *target, mode='running')
+            assert found['distance'] == pytest.approx(expected[key], abs=0.1)
+            assert found['duration'] == round(found['distance'] / routing.SPEEDS['running'])
+            points = routing.tracks.decode_polyline(found['polyline'])
+            assert len(points) == found['point_count']
+            assert points[0] == pytest.approx(source, abs=1e-5) and points[-1] == pytest.approx(target, abs=1e-5)
+    assert reachable > SIZE * SIZE // 2
+
+
+def test_unreachable_points_are_reported(city):
+    graph, _, corners = city
+    with pytest.raises(routing.RoutingError, match='not connected'):
+        graph.route(*corners[0][0], LAT + 0.02, LON)
+    with pytest.raises(routing.RoutingError, match='No walkable road'):
+        graph.route(*corners[0][0], LAT + 1, LON + 1)
+
+
+def test_route_endpoint(runners, client, make_user, city, monkeypatch):
+    _, token = make_user()
+    graph, _, corners = city
+    (from_lat, from_lon), (to_lat, to_lon) = corners[0][0], corners[0][1]
+    url = f'/api/route?from_lat={from_lat}&from_lon={from_lon}&to_lat={to_lat}&to_lon={to_lon}'
+
+    monkeypatch.setitem(runners.app.config, 'ROUTING_GRAPH', None)
+    monkeypatch.setattr(runners, 'routing_graph', None)
+    assert client.get(url, headers={'Authorization': token}).status_code == 503
+
+    monkeypatch.setattr(runners, 'routing_graph', graph)
+    response = client.get(url + '&mode=running', headers={'Authorization': token})
+    assert response.status_code == 200
+    assert response.get_json()['mode'] == 'running' and response.get_json()['distance'] > 0
+    assert client.get(url + '&mode=flying', headers={'Authorization': token}).status_code == 400
+    assert client.get('/api/route?from_lat=1', headers={'Authorization': token}).status_code == 400
+    far = f'/api/route?from_lat={from_lat}&from_lon={from_lon}&to_lat={LAT + 1}&to_lon={LON}'
+    assert client.get(far, headers={'Authorization': token}).status_code == 404
@@ -0,0 +1,43 @@
+import uuid
+
+import pytest
+
+
+def search(client, token, query, limit, cursor=None):
+    url = f'/api/users/search?name={query}&limit={limit}'
+    if cursor:
+        url += f'&cursor={cursor}'
+    response = client.get(url, headers={'Authorization': token})
+    assert response.status_code == 200
+    return [u['name'] for u in response.get_json()], response.headers.get('X-Next-Cursor')
+
+
+@pytest.mark.parametrize('fts', [True, False], ids=['fts', 'like'])
+def test_search_pages_prefix_then_substring_matches(runners, client, make_user, monkeypatch, fts):
+    if fts and not runners.search_fts_enabled:
+        pytest.skip('FTS index is not available')
+    monkeypatch.setattr(runners, 'search_fts_enabled', fts)
+    # Уникальная основа имени: база общая для всех тестов прогона
+    tag = 'zq' + uuid.uuid4().hex[:6]
+    _, token = make_user(f'{tag} сам')
+    prefix = [f'{tag}{k}' for k in range(3)]
+    substring = [f'x {tag}{k}' for k in range(3)]
+    for name in prefix + substring:
+        make_user(name)
+
+    found, cursor = search(client, token, tag, 2)
+    pages = 1
+    while cursor:
+        page, cursor = search(client, token, tag, 2, cursor)
+        found += page
+        pages += 1
+    # Сначала совпадения с начала имени по алфавиту, затем в середине - по id; сам ищущий не выдаётся
+    assert found == prefix + substring
+    assert pages == 3
+
+
+def test_search_rejects_empty_query_and_bad_cursor(client, make_user):
+    _, token = make_user()
+    assert client.get('/api/users/search?name=%20', headers={'Authorization': token}).status_code == 400
+    response = client.get('/api/users/search?name=abc&cursor=broken', headers={'Authorization': token})
+    assert response.status_code == 400
@@ -0,0 +1,98 @@
+import logging
+import random
+
+from conftest import straight_line
+
+
+def drain(runners):
+    # Фоновые проходы, пока в очереди есть треки или сегменты (в том числе ждущие повторной попытки)
+    for _ in range(50):
+        runners.run_segment_matching()
+        with runners.app.app_context():
+            if runners.Track.query.filter(runners.Track.segments_matched_at.is_(None)).first() is None \
+                    and runners.Segment.query.filter(runners.Segment.matched_at.is_(None)).first() is None:
+                return
+    raise AssertionError('segment matching did not finish')
+
+
+def somewhere():
+    # Своё место для каждого теста: база общая, чужие треки не должны попадать в габариты
+    return random.uniform(-60, 60), random.uniform(-170, 170)
+
+
+def efforts(client, token, track_id):
+    return client.get(f'/api/tracks/{track_id}/efforts', headers={'Authorization': token}).get_json()
+
+
+def test_track_is_matched_with_segment(runners, client, make_user, upload_track):
+    _, token = make_user()
+    lat, lon = somewhere()
+    route = straight_line(lat, lon, 30)
+    segment = client.post('/api/segments', headers={'Authorization': token},
+                          json={'name': 'Подъём', 'points': route[5:20]}).get_json()
+    track = upload_track(token, route)
+    drain(runners)
+
+    found = efforts(client, token, track['id'])
+    assert not found['matching']
+    assert [(e['segment_id'], e['start_index'], e['end_index']) for e in found['efforts']] == [(segment['id'], 5, 19)]
+    board = client.get(f"/api/segments/{segment['id']}/leaderboard", headers={'Authorization': token}).get_json()
+    assert [(e['track_id'], e['elapsed']) for e in board['entries']] == [(track['id'], 84)]
+
+
+def test_failing_track_does_not_block_later_tracks(runners, client, make_user, upload_track, monkeypatch, caplog):
+    _, token = make_user()
+    lat, lon = somewhere()
+    route = straight_line(lat, lon, 30)
+    client.post('/api/segments', headers={'Authorization': token}, json={'name': 'Мост', 'points': route[5:20]})
+    drain(runners)
+    broken = upload_track(token, route)
+    good = upload_track(token, route)
+
+    find_segment_efforts = runners.find_segment_efforts
+
+    def fail_on_broken(track, candidates):
+        if track.id == broken['id']:
+            raise ValueError('corrupt polyline')
+        return find_segment_efforts(track, candidates)
+    monkeypatch.setattr(runners, 'find_segment_efforts', fail_on_broken)
+
+    with caplog.at_level(logging.ERROR, logger='runners'):
+        runners.run_segment_matching()
+        # Неудачный трек не мешает следующему в том же проходе
+        assert len(efforts(client, token, good['id'])['efforts']) == 1
+        assert efforts(client, token, broken['id'])['matching']
+        drain(runners)
+
+    # После SEGMENT_MATCH_ATTEMPTS попыток трек убран из очереди
+    attempts = runners.app.config['SEGMENT_MATCH_ATTEMPTS']
+    with runners.app.app_context():
+        assert runners.db.session.get(runners.Track, broken['id']).segment_match_attempts == attempts
+    assert efforts(client, token, broken['id']) == {'matching': False, 'efforts': []}
+    failed = [r for r in caplog.records if r.exc_info and f"track {broken['id']}" in r.getMessage()]
+    assert len(failed) == attempts
+
+
+def test_segment_backfill_skips_failing_track(runners, client, make_user, upload_track, monkeypatch):
+    _, token = make_user()
+    lat, lon = somewhere()
+    route = straight_line(lat, lon, 30)
+    broken = upload_track(token, route)
+    good = upload_track(token, route)
+    drain(runners)
+
+    find_segment_efforts = runners.find_segment_efforts
+
+    def fail_on_broken(track, candidates):
+        if track.id == broken['id']:
+            raise ValueError('corrupt polyline')
+        return find_segment_efforts(track, candidates)
+    monkeypatch.setattr(runners, 'find_segment_efforts', fail_on_broken)
+
+    segment = client.post('/api/segments', headers={'Authorization': token},
+                          json={'name': 'Набережная', 'points': route[5:20]}).get_json()
+    drain(runners)
+
+    assert client.get(f"/api/segments/{segment['id']}", headers={'Authorization': token}).get_json()['matching'] is False
+    assert [e['segment_id'] for e in efforts(client, token, good['id'])['efforts']] == [segment['id']]
+    assert efforts(client, token, broken['id'])['efforts'] == []
@@ -0,0 +1,60 @@
+import time
+
+
+def connect(runners, **kwargs):
+    return runners.socketio.test_client(runners.app, **kwargs)
+
+
+def session_of(runners, user_id):
+    sess, = [s for s in runners.socket_sessions.values() if s['user_id'] == user_id]
+    return sess
+
+
+def test_connect_requires_a_valid_token(runners, make_user):
+    user_id, token = make_user()
+    assert not connect(runners).is_connected()
+    assert not connect(runners, auth={'token': 'not-a-jwt'}).is_connected()
+
+    # Токен принимается из auth-пакета, заголовка и query-параметра
+    for kwargs in ({'auth': {'token': token}}, {'headers': {'Authorization': token}},
+                   {'query_string': f'token={token}'}):
+        client = connect(runners, **kwargs)
+        assert client.is_connected()
+        assert session_of(runners, user_id)['rooms'] == set()
+        client.disconnect()
+    assert not [s for s in runners.socket_sessions.values() if s['user_id'] == user_id]
+
+
+def test_join_and_send_only_in_member_chats(runners, make_user, make_chat):
+    owner_id, owner_token = make_user()
+    _, stranger_token = make_user()
+    chat_id = make_chat(owner_token, [])
+    owner = connect(runners, auth={'token': owner_token})
+    stranger = connect(runners, auth={'token': stranger_token})
+    try:
+        stranger.emit('join_chat', {'chat_id': chat_id})
+        stranger.emit('send_message', {'chat_id': chat_id, 'content': 'чужое'})
+        assert not stranger.get_received()
+
+        owner.emit('join_chat', {'chat_id': chat_id})
+        assert [m['name'] for m in owner.get_received()] == ['joined']
+        assert session_of(runners, owner_id)['rooms'] == {chat_id}
+        owner.emit('send_message', {'chat_id': chat_id, 'content': 'привет'})
+        message, = [m['args'][0] for m in owner.get_received() if m['name'] == 'new_message']
+        assert message['sender_id'] == owner_id and message['content'] == 'привет'
+        assert not stranger.get_received()
+    finally:
+        owner.disconnect()
+        stranger.disconnect()
+
+
+def test_expired_session_is_dropped(runners, make_user, make_chat):
+    user_id, token = make_user()
+    chat_id = make_chat(token, [])
+    client = connect(runners, auth={'token': token})
+    session_of(runners, user_id)['exp'] = time.time() - 1
+
+    # Сервер отвечает session_expired и закрывает соединение
+    client.emit('join_chat', {'chat_id': chat_id})
+    assert not client.is_connected()
+    assert not [s for s in runners.socket_sessions.values() if s['user_id'] == user_id]
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+
+
+def upload(client, token, records):
+    return client.post('/api/user_statistic/batch', headers={'Authorization': token}, json={'records': records})
+
+
+def day_totals(client, token, day):
+    stats = client.get(f'/api/user_statistic?date={day}', headers={'Authorization': token}).get_json()
+    return [(s['steps'], s['distance']) for s in stats]
+
+
+def test_batch_sums_days_and_skips_repeated_keys(client, make_user):
+    _, token = make_user()
+    records = [
+        {'date': '2025-06-14', 'calories': 100, 'steps': 1000, 'distance': 1.0, 'idempotency_key': 'a'},
+        {'date': '2025-06-14', 'calories': 50, 'steps': 500, 'distance': 0.5, 'idempotency_key': 'b'},
+        # Повтор ключа в той же пачке применяется один раз
+        {'date': '2025-06-14', 'calories': 50, 'steps': 500, 'distance': 0.5, 'idempotency_key': 'b'},
+        {'date': '2025-06-15', 'calories': 70, 'steps': 700, 'distance': 0.7},
+    ]
+    response = upload(client, token, records)
+    assert response.status_code == 201
+    assert response.get_json() == {'success': True, 'applied': 3, 'duplicates': []}
+    assert day_totals(client, token, '2025-06-14') == [(1500, 1.5)]
+
+    # Клиент не получил ответ и отправил пачку ещё раз: записи с ключами не применяются снова
+    response = upload(client, token, records[:2] + [
+        {'date': '2025-06-14', 'calories': 10, 'steps': 100, 'distance': 0.1, 'idempotency_key': 'c'}])
+    assert response.status_code == 201
+    assert response.get_json() == {'success': True, 'applied': 1, 'duplicates': ['a', 'b']}
+    assert day_totals(client, token, '2025-06-14') == [(1600, 1.6)]
+
+
+def test_batch_validation(client, make_user):
+    _, token = make_user()
+    assert upload(client, token, []).status_code == 400
+    response = upload(client, token, [{'date': '2025-06-14', 'calories': 1, 'steps': 1, 'distance': 1},
+                                      {'date': '14.06.2025', 'calories': 1, 'steps': 1, 'distance': 1}])
+    assert response.status_code == 400 and response.get_json()['index'] == 1
+    response = upload(client, token, [{'date': '2025-06-14', 'calories': 1, 'steps': 1, 'distance': 1,
+                                       'idempotency_key': 'k' * 65}])
+    assert response.status_code == 400
+
+
+def test_old_sync_keys_are_pruned_with_the_change_log(runners, client, make_user):
+    user_id, token = make_user()
+    upload(client, token, [{'date': '2025-06-14', 'calories': 1, 'steps': 1, 'distance': 1, 'idempotency_key': 'old'},
+                           {'date': '2025-06-15', 'calories': 1, 'steps': 1, 'distance': 1, 'idempotency_key': 'new'}])
+    Key = runners.UserStatisticSyncKey
+    with runners.app.app_context():
+        old = datetime.utcnow() - timedelta(days=runners.app.config['SYNC_RETENTION_DAYS'] + 1)
+        runners.db.session.execute(runners.db.update(Key).where(Key.id_User == user_id, Key.key == 'old')
+                                   .values(created_at=old))
+        runners.db.session.commit()
+
+    _, pruned_keys = runners.prune_change_log()
+    assert pruned_keys >= 1
+    with runners.app.app_context():
+        assert [k for (k,) in runners.db.session.query(Key.key).filter(Key.id_User == user_id)] == ['new']
+
+
+def summary(client, token, granularity, date_from, date_to):
+    response = client.get(f'/api/user_statistic/summary?granularity={granularity}&from={date_from}&to={date_to}',
+                          headers={'Authorization': token})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_week_and_month_summaries_match_daily_records(runners, client, make_user):
+    user_id, token = make_user()
+    # Ежедневно со 2 по 15 июня 2025 (две полные недели с понедельника) и 1 июля
+    days = [f'2025-06-{d:02d}' for d in range(2, 16)] + ['2025-07-01']
+    upload(client, token, [{'date': day, 'calories': 10, 'steps': 100, 'distance': 1.0} for day in days])
+    # Вторая запись за уже известный день добавляет суммы, но не дни
+    upload(client, token, [{'date': '2025-06-10', 'calories': 5, 'steps': 50, 'distance': 0.5}])
+
+    with runners.app.app_context():
+        rollups = {(r.granularity, r.period_start.isoformat()): (r.steps, r.days)
+                   for r in runners.UserStatisticRollup.query.filter_by(id_User=user_id)}
+    assert rollups == {('week', '2025-06-02'): (700, 7), ('week', '2025-06-09'): (750, 7),
+                       ('week', '2025-06-30'): (100, 1), ('month', '2025-06-01'): (1450, 14),
+                       ('month', '2025-07-01'): (100, 1)}
+
+    # Неделя 2 июня обрезана началом диапазона - считается по дневным записям
+    weeks = summary(client, token, 'week', '2025-06-04', '2025-06-15')
+    assert [(b['start'], b['steps'], b['days']) for b in weeks['buckets']] == [
+        ('2025-06-02', 500, 5), ('2025-06-09', 750, 7)]
+    assert weeks['total']['steps'] == 1250 and weeks['total']['days'] == 12
+    daily = summary(client, token, 'day', '2025-06-04', '2025-06-15')
+    assert daily['total'] == weeks['total']
+
+    months = summary(client, token, 'month', '2025-06-01', '2025-08-31')
+    assert [(b['start'], b['steps'], b['days']) for b in months['buckets']] == [
+        ('2025-06-01', 1450, 14), ('2025-07-01', 100, 1), ('2025-08-01', 0, 0)]
+
+    assert client.get('/api/user_statistic/summary?granularity=year',
+                      headers={'Authorization': token}).status_code == 400
+    assert client.get('/api/user_statistic/summary?from=2025-06-10&to=2025-06-01',
+                      headers={'Authorization': token}).status_code == 400
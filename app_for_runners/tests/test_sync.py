@@ -0,0 +1,46 @@
+def sync(client, token, since=None):
+    url = '/api/sync' if since is None else f'/api/sync?since={since}'
+    response = client.get(url, headers={'Authorization': token})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def test_sync_returns_changes_after_cursor(runners, client, make_user, make_chat):
+    user_id, token = make_user()
+    friend_id, friend_token = make_user('Друг')
+    cursor = sync(client, token)['cursor']
+
+    client.post('/api/friends/send_request', headers={'Authorization': friend_token}, json={'friend_id': user_id})
+    chat_id = make_chat(friend_token, [user_id])
+    with runners.app.app_context():
+        message_id, _ = runners.store_message(chat_id, friend_id, 'привет')
+
+    changes = sync(client, token, cursor)
+    assert not changes['reset'] and not changes['has_more']
+    assert [(f['user_id'], f['friend_id'], f['status']) for f in changes['friendships']] == \
+        [(friend_id, user_id, 'pending')]
+    assert [chat['id'] for chat in changes['chats']] == [chat_id]
+    assert [m['id'] for m in changes['messages']] == [message_id]
+
+    # Всё уже получено - следующий запрос с новым курсором пуст
+    again = sync(client, token, changes['cursor'])
+    assert again['cursor'] == changes['cursor']
+    assert again['friendships'] == again['chats'] == again['messages'] == []
+
+
+def test_sync_reports_leaving_a_chat(client, make_user, make_chat):
+    user_id, token = make_user()
+    _, owner_token = make_user()
+    chat_id = make_chat(owner_token, [user_id])
+    cursor = sync(client, token)['cursor']
+
+    assert client.post(f'/api/group_chats/{chat_id}/leave', headers={'Authorization': token}).status_code == 200
+    assert sync(client, token, cursor)['removed_chats'] == [chat_id]
+
+
+def test_sync_cursor_errors(client, make_user):
+    _, token = make_user()
+    latest = sync(client, token)['cursor']
+    assert client.get('/api/sync?since=abc', headers={'Authorization': token}).status_code == 400
+    # Курсор из будущего (другая база) - клиент должен загрузить всё заново
+    assert sync(client, token, latest + 1000)['reset'] is True
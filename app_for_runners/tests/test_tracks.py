@@ -0,0 +1,148 @@
+import io
+import math
+import random
+from datetime import datetime
+
+import pytest
+
+import tracks
+from conftest import gpx_document, straight_line
+
+
+def somewhere():
+    # Своё место для каждого теста: база общая, чужие треки не должны попадать в выборку
+    return random.uniform(-60, 60), random.uniform(-170, 170)
+
+
+def test_uploaded_gpx_is_summarised_and_stored(runners, client, make_user, upload_track):
+    _, token = make_user()
+    lat, lon = somewhere()
+    points = straight_line(lat, lon, 50)
+    summary = upload_track(token, points, started_at=datetime(2025, 6, 1, 7, 0), step=6)
+
+    assert summary['name'] == 'Пробежка' and summary['point_count'] == 50
+    expected = sum(tracks.haversine(*a, *b) for a, b in zip(points, points[1:]))
+    assert summary['distance'] == pytest.approx(expected, rel=1e-6)
+    assert summary['started_at'] == '2025-06-01T07:00:00' and summary['finished_at'] == '2025-06-01T07:04:54'
+    assert summary['start'] == [pytest.approx(lat), pytest.approx(lon)]
+
+    track = client.get(f"/api/tracks/{summary['id']}", headers={'Authorization': token}).get_json()
+    assert track['tolerance'] == 0 and track['polyline_points'] == 50
+    decoded = tracks.decode_polyline(track['polyline'])
+    assert len(decoded) == len(points)
+    assert all(abs(a - c) <= 1e-5 and abs(b - d) <= 1e-5 for (a, b), (c, d) in zip(decoded, points))
+    assert tracks.decode_polyline(track['times'], dims=1, precision=1)[-1] == (294,)
+
+
+def test_multipart_upload_takes_the_form_name(client, make_user):
+    _, token = make_user()
+    response = client.post('/api/tracks', headers={'Authorization': token}, data={
+        'name': 'Утренняя', 'file': (io.BytesIO(gpx_document(straight_line(*somewhere(), 3))), 'run.gpx')})
+    assert response.status_code == 201
+    assert response.get_json()['name'] == 'Утренняя'
+
+
+@pytest.mark.parametrize('body', [
+    b'<gpx><trk><trkseg><trkpt lat="1" lon="2"></trkseg></trk></gpx>',
+    b'<gpx xmlns="http://www.topografix.com/GPX/1/1"><trk><trkseg></trkseg></trk></gpx>',
+    b'<gpx><trk><trkseg><trkpt lat="95" lon="2"/></trkseg></trk></gpx>',
+    b'<gpx><trk><trkseg><trkpt lat="x" lon="2"/></trkseg></trk></gpx>',
+])
+def test_invalid_gpx_is_rejected(client, make_user, body):
+    _, token = make_user()
+    response = client.post('/api/tracks', headers={'Authorization': token, 'Content-Type': 'application/gpx+xml'},
+                           data=body)
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def zigzag_corner(lat, lon, side=40, wiggle=2.5):
+    # На север, затем на восток; точки отходят от линии на ±wiggle м
+    lon_step = 0.0002 / math.cos(math.radians(lat))
+    wiggle_lat, wiggle_lon = wiggle / 111320, wiggle / 111320 / math.cos(math.radians(lat))
+    north = [(lat + k * 0.0002, lon + (wiggle_lon if k % 2 else -wiggle_lon)) for k in range(side)]
+    corner = lat + side * 0.0002
+    east = [(corner + (wiggle_lat if k % 2 else -wiggle_lat), lon + k * lon_step) for k in range(side + 1)]
+    return north + east
+
+
+def test_tolerance_selects_the_coarsest_fitting_level(runners, client, make_user, upload_track):
+    _, token = make_user()
+    points = zigzag_corner(*somewhere())
+    summary = upload_track(token, points)
+    with runners.app.app_context():
+        levels = [(lod.tolerance, lod.point_count)
+                  for lod in runners.TrackLod.query.filter_by(track_id=summary['id']).order_by('tolerance')]
+    # Зигзаг в ±2.5 м держится при допуске 2 м (уровень не нужен) и пропадает при 8 м: остаются концы и угол
+    assert levels == [(8.0, 3)]
+
+    def fetch(tolerance):
+        return client.get(f"/api/tracks/{summary['id']}?tolerance={tolerance}", headers={'Authorization': token})
+
+    full = fetch(4).get_json()
+    assert full['tolerance'] == 0 and full['polyline_points'] == len(points) and full['elevations']
+    for tolerance in (8, 1000):
+        coarse = fetch(tolerance).get_json()
+        assert coarse['tolerance'] == 8.0 and coarse['polyline_points'] == 3 and coarse['elevations'] is None
+        decoded = tracks.decode_polyline(coarse['polyline'])
+        assert [decoded[0], decoded[-1]] == [tracks.decode_polyline(full['polyline'])[i] for i in (0, -1)]
+        assert coarse['point_count'] == len(points)
+    assert fetch('x').status_code == 400
+
+
+@pytest.fixture(params=[True, False], ids=['rtree', 'btree'])
+def spatial_index(request, runners, monkeypatch):
+    if request.param and not runners.spatial_index_enabled:
+        pytest.skip('R*Tree index is not available')
+    monkeypatch.setattr(runners, 'spatial_index_enabled', request.param)
+
+
+def test_nearby_tracks_are_ordered_by_distance_to_start(client, make_user, upload_track, spatial_index):
+    _, token = make_user()
+    lat, lon = somewhere()
+    # Старты в 0 м, ~330 м и ~5.5 км к северу от точки поиска
+    near, middle, far = [upload_track(token, straight_line(lat + offset, lon, 5))['id']
+                         for offset in (0.0, 0.003, 0.05)]
+
+    def nearby(query=''):
+        response = client.get(f'/api/tracks/nearby?lat={lat}&lon={lon}{query}', headers={'Authorization': token})
+        assert response.status_code == 200
+        return response.get_json()
+
+    found = nearby()
+    assert [t['id'] for t in found] == [near, middle]
+    assert found[0]['distance_to_start'] < 1 and 300 < found[1]['distance_to_start'] < 360
+    assert [t['id'] for t in nearby('&radius=10000')] == [near, middle, far]
+    assert [t['id'] for t in nearby('&radius=100')] == [near]
+    assert [t['id'] for t in nearby('&radius=10000&limit=2')] == [near, middle]
+
+    for query in ('lat=1', f'lat={lat}&lon={lon}&radius=0', f'lat={lat}&lon={lon}&radius=60000',
+                  f'lat=91&lon={lon}', f'lat={lat}&lon=nan'):
+        assert client.get(f'/api/tracks/nearby?{query}', headers={'Authorization': token}).status_code == 400
+
+
+def test_bbox_returns_tracks_passing_through_newest_first(client, make_user, upload_track, spatial_index):
+    _, token = make_user()
+    lat, lon = somewhere()
+    # Угол: на север, затем на восток - габариты накрывают юго-восточный угол, маршрут туда не заходит
+    corner = upload_track(token, straight_line(lat, lon, 20) + [(lat + 0.0038, lon + k * 0.0002) for k in range(1, 20)])
+    through = [upload_track(token, [(lat + 0.0005, lon + k * 0.0002) for k in range(20)])['id'] for _ in range(2)]
+    box = (lat - 0.0001, lon + 0.0015, lat + 0.001, lon + 0.0025)
+
+    def in_box(query=''):
+        response = client.get('/api/tracks/bbox?min_lat={}&min_lon={}&max_lat={}&max_lon={}'.format(*box) + query,
+                              headers={'Authorization': token})
+        assert response.status_code == 200
+        return [t['id'] for t in response.get_json()], response.headers.get('X-Next-Cursor')
+
+    assert in_box() == (through[::-1], None)
+    first, cursor = in_box('&limit=1')
+    assert (first, cursor) == ([through[1]], str(through[1]))
+    assert in_box(f'&limit=1&before_id={cursor}') == ([through[0]], None)
+    assert corner['id'] not in in_box()[0]
+
+    # Маршрут целиком внутри прямоугольника
+    box = (lat - 0.01, lon - 0.01, lat + 0.01, lon + 0.01)
+    assert in_box() == ([through[1], through[0], corner['id']], None)
+    assert client.get('/api/tracks/bbox?min_lat=2&min_lon=0&max_lat=1&max_lon=1',
+                      headers={'Authorization': token}).status_code == 400
@@ -0,0 +1,286 @@
+import math
+import xml.etree.ElementTree as ET
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+# Потоковый разбор GPX и компактное хранение трека.
+# XML-дерево не накапливается в памяти: каждая точка сразу дописывается в закодированную
+# полилинию (алгоритм Google Encoded Polyline) и в упакованные массивы целых координат
+# для упрощения, а дистанция, набор высоты и габаритный прямоугольник считаются на лету.
+
+EARTH_RADIUS = 6371008.8  # м
+POLYLINE_PRECISION = 1e5  # ~1 м
+ELEVATION_PRECISION = 10  # дециметры
+TIME_PRECISION = 1  # секунды
+# Колебания высоты меньше порога считаем шумом GPS и в набор не включаем
+ELEVATION_NOISE = 2.0
+# Допуски упрощения (м) для уровней детализации, от подробного к грубому.
+# Для превью маршрута на карте обычно хватает нескольких сотен точек
+LOD_TOLERANCES = (2.0, 8.0, 32.0, 128.0)
+
+
+class GpxError(ValueError):
+    pass
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def _encode_number(value, out):
+    # out - bytearray: символы полилинии всегда ASCII, так буфер занимает байт на символ
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        out.append((0x20 | (value & 0x1f)) + 63)
+        value >>= 5
+    out.append(value + 63)
+
+
+def encode_polyline(points, precision=POLYLINE_PRECISION):
+    # points - последовательность кортежей одинаковой размерности
+    out, prev = bytearray(), None
+    for point in points:
+        current = [int(round(v * precision)) for v in point]
+        for i, v in enumerate(current):
+            _encode_number(v - (prev[i] if prev else 0), out)
+        prev = current
+    return out.decode('ascii')
+
+
+def decode_polyline(encoded, dims=2, precision=POLYLINE_PRECISION):
+    values, index, prev = [], 0, [0] * dims
+    point = []
+    while index < len(encoded):
+        result, shift = 0, 0
+        while True:
+            b = ord(encoded[index]) - 63
+            index += 1
+            result |= (b & 0x1f) << shift
+            shift += 5
+            if b < 0x20:
+                break
+        delta = ~(result >> 1) if result & 1 else result >> 1
+        i = len(point)
+        prev[i] += delta
+        point.append(prev[i] / precision)
+        if len(point) == dims:
+            values.append(tuple(point))
+            point = []
+    return values
+
+
+def encode_quantized(lat_q, lon_q):
+    # То же, что encode_polyline, но для уже квантованных координат (целые * 1e5)
+    out = bytearray()
+    lat_d = np.diff(lat_q, prepend=0).tolist()
+    lon_d = np.diff(lon_q, prepend=0).tolist()
+    for dlat, dlon in zip(lat_d, lon_d):
+        _encode_number(dlat, out)
+        _encode_number(dlon, out)
+    return out.decode('ascii')
+
+
+def point_importance(lat, lon, min_tolerance=LOD_TOLERANCES[0]):
+    # Douglas-Peucker с векторным расчётом расстояний: для каждой точки - допуск (м),
+    # при котором она ещё остаётся в упрощённой линии. Допуск потомка не больше
+    # допуска родителя, поэтому упрощение для любого t - это точки с importance > t,
+    # и все уровни детализации получаются из одного прохода.
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    n = len(lat)
+    importance = np.zeros(n)
+    if n == 0:
+        return importance
+    importance[0] = importance[-1] = np.inf
+
+    # Локальная равнопромежуточная проекция в метрах - на длине трека её точности хватает
+    scale = math.radians(1) * EARTH_RADIUS
+    y = lat * scale
+    x = lon * scale * math.cos(math.radians(float(lat.mean())))
+
+    stack = [(0, n - 1, np.inf)]
+    while stack:
+        i, j, limit = stack.pop()
+        if j - i < 2:
+            continue
+        px, py = x[i + 1:j], y[i + 1:j]
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        length = math.hypot(dx, dy)
+        if length == 0:
+            dist = np.hypot(px - x[i], py - y[i])
+        else:
+            dist = np.abs(dx * (y[i] - py) - dy * (x[i] - px)) / length
+        k = int(dist.argmax())
+        value = float(dist[k])
+        if value <= min_tolerance:
+            continue
+        k += i + 1
+        importance[k] = min(value, limit)
+        stack.append((i, k, importance[k]))
+        stack.append((k, j, importance[k]))
+    return importance
+
+
+def simplify_lods(lat_q, lon_q, tolerances=LOD_TOLERANCES):
+    # [(допуск, число точек, полилиния), ...]; уровни, не уменьшающие число точек
+    # по сравнению с более подробным, пропускаются
+    lat_q = np.asarray(lat_q, dtype=np.int64)
+    lon_q = np.asarray(lon_q, dtype=np.int64)
+    importance = point_importance(lat_q / POLYLINE_PRECISION, lon_q / POLYLINE_PRECISION, min(tolerances))
+    levels, previous = [], len(lat_q)
+    for tolerance in sorted(tolerances):
+        keep = importance > tolerance
+        count = int(keep.sum())
+        if count >= previous:
+            continue
+        levels.append((tolerance, count, encode_quantized(lat_q[keep], lon_q[keep])))
+        previous = count
+    return levels
+
+
+class TrackBuilder:
+    def __init__(self):
+        self.name = None
+        self.count = 0
+        self.distance = 0.0
+        self.elevation_gain = 0.0
+        self.min_lat = self.min_lon = math.inf
+        self.max_lat = self.max_lon = -math.inf
+        self.start = None
+        self.started_at = None
+        self.finished_at = None
+        self._polyline = bytearray()
+        self._elevations = bytearray()
+        # Квантованные координаты для упрощения (по 8 байт на точку)
+        self.lat_q = array('i')
+        self.lon_q = array('i')
+        self._prev = None
+        self._prev_ele = 0
+        self._has_ele = False
+        # Время точек - одномерная полилиния секунд от started_at
+        self._times = bytearray()
+        self._prev_offset = 0
+        self._ele_ref = None
+
+    def add_point(self, lat, lon, ele=None, time=None):
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise GpxError(f'Coordinates out of range: {lat}, {lon}')
+
+        q = (int(round(lat * POLYLINE_PRECISION)), int(round(lon * POLYLINE_PRECISION)))
+        prev_q = self._prev[2] if self._prev else (0, 0)
+        _encode_number(q[0] - prev_q[0], self._polyline)
+        _encode_number(q[1] - prev_q[1], self._polyline)
+        self.lat_q.append(q[0])
+        self.lon_q.append(q[1])
+
+        # Высоты - отдельная одномерная полилиния; пропуски заполняем предыдущим значением
+        ele_q = int(round(ele * ELEVATION_PRECISION)) if ele is not None else self._prev_ele
+        _encode_number(ele_q - self._prev_ele, self._elevations)
+        self._prev_ele = ele_q
+        if ele is not None:
+            self._has_ele = True
+            if self._ele_ref is None:
+                self._ele_ref = ele
+            elif ele - self._ele_ref >= ELEVATION_NOISE:
+                self.elevation_gain += ele - self._ele_ref
+                self._ele_ref = ele
+            elif self._ele_ref - ele >= ELEVATION_NOISE:
+                self._ele_ref = ele
+
+        if self._prev:
+            self.distance += haversine(self._prev[0], self._prev[1], lat, lon)
+        else:
+            self.start = (lat, lon)
+        self._prev = (lat, lon, q)
+
+        self.min_lat, self.max_lat = min(self.min_lat, lat), max(self.max_lat, lat)
+        self.min_lon, self.max_lon = min(self.min_lon, lon), max(self.max_lon, lon)
+        offset = self._prev_offset
+        if time is not None:
+            self.started_at = self.started_at or time
+            self.finished_at = time
+            offset = int(round((time - self.started_at).total_seconds() * TIME_PRECISION))
+        _encode_number(offset - self._prev_offset, self._times)
+        self._prev_offset = offset
+        self.count += 1
+
+    def lods(self):
+        return simplify_lods(np.frombuffer(self.lat_q, dtype=np.int32), np.frombuffer(self.lon_q, dtype=np.int32))
+
+    @property
+    def polyline(self):
+        return self._polyline.decode('ascii')
+
+    @property
+    def elevations(self):
+        return self._elevations.decode('ascii') if self._has_ele else None
+
+    @property
+    def times(self):
+        return self._times.decode('ascii') if self.started_at is not None else None
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_time(text):
+    if not text:
+        return None
+    try:
+        value = datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_gpx(stream, builder=None):
+    # Читает GPX из файлоподобного объекта. Обработанные точки удаляются
+    # из дерева сразу, поэтому память не растёт с размером файла.
+    builder = builder or TrackBuilder()
+    stack = []
+    try:
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                continue
+            stack.pop()
+            tag = _local(elem.tag)
+            if tag in ('trkpt', 'rtept'):
+                try:
+                    lat, lon = float(elem.get('lat')), float(elem.get('lon'))
+                except (TypeError, ValueError):
+                    raise GpxError('trkpt without valid lat/lon')
+                ele = time = None
+                for child in elem:
+                    child_tag = _local(child.tag)
+                    if child_tag == 'ele' and child.text:
+                        try:
+                            ele = float(child.text)
+                        except ValueError:
+                            pass
+                    elif child_tag == 'time':
+                        time = _parse_time(child.text)
+                builder.add_point(lat, lon, ele, time)
+            elif tag == 'name' and builder.name is None and elem.text and stack \
+                    and _local(stack[-1].tag) in ('metadata', 'trk', 'rte'):
+                builder.name = elem.text.strip()[:255]
+            else:
+                continue
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+    except ET.ParseError as e:
+        raise GpxError(f'Invalid GPX: {e}')
+    if builder.count == 0:
+        raise GpxError('GPX contains no track points')
+    return builder
@@ -1,6 +1,9 @@
+import 'dart:convert';
 import 'dart:io';
 import 'package:flutter/material.dart';
+import 'package:http/http.dart' as http;
 import 'package:map_routing/usersData/group_service.dart';
+import 'package:shared_preferences/shared_preferences.dart';
 import 'package:path_provider/path_provider.dart';
 import 'package:path/path.dart' as p;
 
@@ -31,10 +34,34 @@ class _AttachRouteDialogState extends State<AttachRouteDialog> {
     });
   }
 
+  // Файл отправляется потоком (multipart), сервер разбирает его сам
+  // и возвращает сводку трека: id, дистанцию, набор высоты и т.д.
   Future<void> _uploadGpx(String path) async {
-    // Заменить на твой метод
+    final prefs = await SharedPreferences.getInstance();
+    final token = prefs.getString('jwt_token');
 
-    Navigator.pop(context); // Закрыть диалог
+    final request = http.MultipartRequest(
+        'POST', Uri.parse('http://192.168.1.105:5000/api/tracks'))
+      ..headers['Authorization'] = token ?? ''
+      ..files.add(await http.MultipartFile.fromPath('file', path));
+
+    Map<String, dynamic>? track;
+    try {
+      final response = await http.Response.fromStream(await request.send());
+      if (response.statusCode == 201) {
+        track = json.decode(response.body);
+      } else if (mounted) {
+        ScaffoldMessenger.of(context).showSnackBar(
+          const SnackBar(content: Text('Не удалось загрузить маршрут')),
+        );
+      }
+    } catch (e) {
+      print('Ошибка загрузки маршрута: $e');
+    }
+
+    if (mounted) {
+      Navigator.pop(context, track); // Закрыть диалог
+    }
   }
 
   @override
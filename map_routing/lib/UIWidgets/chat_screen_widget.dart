@@ -19,6 +19,7 @@ class ChatScreen extends StatefulWidget {
 
 class _ChatScreenState extends State<ChatScreen> with RouteAware {
   final TextEditingController _messageController = TextEditingController();
+  final ScrollController _scrollController = ScrollController();
   late SocketChatService _socketService;
   String? _token;
   String? _currentUserId;
@@ -27,14 +28,20 @@ class _ChatScreenState extends State<ChatScreen> with RouteAware {
 
   String chatTitle = '';
   List<String> participants = [];
+  // Новые сообщения в начале списка (ListView перевёрнут)
   List<Map<String, dynamic>> messages = [];
+  int? _nextBeforeId;
+  bool _isLoadingOlder = false;
 
   bool isLoading = true;
 
+  static const int _pageSize = 50;
+
   @override
   void initState() {
     super.initState();
     _socketService = SocketChatService();
+    _scrollController.addListener(_onScroll);
     _loadTokenAndInitializeSocket();
   }
 
@@ -52,6 +59,7 @@ class _ChatScreenState extends State<ChatScreen> with RouteAware {
     routeObserver.unsubscribe(this);
     _socketService.disconnect();
     _messageController.dispose();
+    _scrollController.dispose();
     super.dispose();
   }
 
@@ -143,12 +151,60 @@ class _ChatScreenState extends State<ChatScreen> with RouteAware {
     }
   }
 
+  Map<String, dynamic> _messageFromJson(dynamic m) => {
+        'sender_id': m['sender_id']?.toString() ?? 'unknown',
+        'sender': m['sender'] ?? 'Неизвестный пользователь',
+        'content': m['content'] ?? '',
+      };
+
+  void _onScroll() {
+    // В перевёрнутом списке старые сообщения - у конца прокрутки
+    if (_scrollController.position.extentAfter < 300) {
+      _loadOlderMessages();
+    }
+  }
+
+  Future<void> _loadOlderMessages() async {
+    if (_isLoadingOlder || _nextBeforeId == null || _token == null) return;
+    setState(() => _isLoadingOlder = true);
+
+    try {
+      final groupChatService = GroupChatService(
+          baseUrl: 'http://192.168.1.105:5000', token: _token!);
+      final page = await groupChatService
+          .fetchMessages(widget.chatId,
+              limit: _pageSize, beforeId: _nextBeforeId)
+          .timeout(
+            const Duration(seconds: 10),
+            onTimeout: () => throw TimeoutException(
+                'Превышено время ожидания загрузки сообщений'),
+          );
+
+      if (!mounted) return;
+      setState(() {
+        // Сервер отдаёт страницу по возрастанию времени
+        messages.addAll(List<dynamic>.from(page['messages'] ?? [])
+            .reversed
+            .map(_messageFromJson));
+        _nextBeforeId = page['next_before_id'];
+        _isLoadingOlder = false;
+      });
+    } catch (e) {
+      if (!mounted) return;
+      setState(() => _isLoadingOlder = false);
+      ScaffoldMessenger.of(context).showSnackBar(
+        SnackBar(content: Text('Ошибка при загрузке сообщений: $e')),
+      );
+    }
+  }
+
   Future<void> _fetchChatData() async {
     try {
       final groupChatService = GroupChatService(
           baseUrl: 'http://192.168.1.105:5000', token: _token!);
-      final chatDetails =
-          await groupChatService.getChatDetails(widget.chatId).timeout(
+      final chatDetails = await groupChatService
+          .getChatDetails(widget.chatId, limit: _pageSize)
+          .timeout(
                 const Duration(seconds: 10),
                 onTimeout: () => throw TimeoutException(
                     'Превышено время ожидания загрузки чата'),
@@ -157,13 +213,11 @@ class _ChatScreenState extends State<ChatScreen> with RouteAware {
       setState(() {
         chatTitle = chatDetails['title'] ?? '';
         participants = List<String>.from(chatDetails['participants'] ?? []);
-        messages = List<Map<String, dynamic>>.from(
-          (chatDetails['messages'] ?? []).map((m) => {
-                'sender_id': m['sender_id']?.toString() ?? 'unknown',
-                'sender': m['sender'] ?? 'Неизвестный пользователь',
-                'content': m['content'] ?? '',
-              }),
-        );
+        messages = List<dynamic>.from(chatDetails['messages'] ?? [])
+            .reversed
+            .map(_messageFromJson)
+            .toList();
+        _nextBeforeId = chatDetails['next_before_id'];
         isLoading = false;
       });
     } catch (e) {
@@ -222,10 +276,19 @@ class _ChatScreenState extends State<ChatScreen> with RouteAware {
                   child: messages.isEmpty
                       ? const Center(child: Text("Нет сообщений"))
                       : ListView.builder(
+                          controller: _scrollController,
                           reverse: true,
                           padding: const EdgeInsets.all(12),
-                          itemCount: messages.length,
+                          itemCount:
+                              messages.length + (_isLoadingOlder ? 1 : 0),
                           itemBuilder: (context, index) {
+                            if (index == messages.length) {
+                              return const Padding(
+                                padding: EdgeInsets.all(8),
+                                child: Center(
+                                    child: CircularProgressIndicator()),
+                              );
+                            }
                             final message = messages[index];
                             final isCurrentUser =
                                 message['sender_id'] == _currentUserId;
@@ -45,9 +45,12 @@ class GroupChatService {
     }
   }
 
-  Future<Map<String, dynamic>> getChatDetails(String chatId) async {
+  Future<Map<String, dynamic>> getChatDetails(String chatId,
+      {int limit = 50}) async {
+    // Вместе с деталями приходит только последняя страница истории и
+    // next_before_id, остальное догружается через fetchMessages
     final response = await http.get(
-      Uri.parse('$baseUrl/api/group_chats/$chatId'),
+      Uri.parse('$baseUrl/api/group_chats/$chatId?limit=$limit'),
       headers: {
         'Authorization': token,
         'Content-Type': 'application/json',
@@ -60,4 +63,27 @@ class GroupChatService {
       throw Exception('Failed to load chat details');
     }
   }
-}
+
+  Future<Map<String, dynamic>> fetchMessages(String chatId,
+      {int limit = 50, int? beforeId}) async {
+    // Страница истории старше beforeId: {'messages': [...], 'next_before_id': id|null}
+    final query = {
+      'limit': '$limit',
+      if (beforeId != null) 'before_id': '$beforeId',
+    };
+    final response = await http.get(
+      Uri.parse('$baseUrl/api/group_chats/$chatId/messages')
+          .replace(queryParameters: query),
+      headers: {
+        'Authorization': token,
+        'Content-Type': 'application/json',
+      },
+    );
+
+    if (response.statusCode == 200) {
+      return json.decode(response.body);
+    } else {
+      throw Exception('Failed to load chat messages');
+    }
+  }
+}
\ No newline at end of file
@@ -19,6 +19,10 @@ class StatisticsService {
   DateTime? _lastFetchTime;
   final Duration cacheDuration = Duration(minutes: 1);
 
+  String _formatDate(DateTime day) =>
+      "${day.year}-${day.month.toString().padLeft(2, '0')}-${day.day.toString().padLeft(2, '0')}";
+
+  // Суммы по дням за последние 7 дней считает сервер
   Future<List<dynamic>> _fetchStats() async {
     final now = DateTime.now();
 
@@ -31,13 +35,16 @@ class StatisticsService {
     final prefs = await SharedPreferences.getInstance();
     final token = prefs.getString('jwt_token');
 
+    final from = _formatDate(now.subtract(const Duration(days: 6)));
+    final to = _formatDate(now);
     final response = await http.get(
-      Uri.parse('http://192.168.1.105:5000/api/user_statistic'),
+      Uri.parse(
+          'http://192.168.1.105:5000/api/user_statistic/summary?granularity=day&from=$from&to=$to'),
       headers: {'Authorization': token ?? ''},
     );
 
     if (response.statusCode == 200) {
-      _cachedStats = json.decode(response.body);
+      _cachedStats = json.decode(response.body)['buckets'];
       _lastFetchTime = now;
       return _cachedStats!;
     } else {
@@ -48,35 +55,13 @@ class StatisticsService {
   Future<List<Map<String, dynamic>>> fetchWeeklyStats() async {
     final stats = await _fetchStats();
 
-    final now = DateTime.now();
-    final last7Days = List.generate(7, (i) {
-      final day = now.subtract(Duration(days: 6 - i));
-      return "${day.year}-${day.month.toString().padLeft(2, '0')}-${day.day.toString().padLeft(2, '0')}";
-    });
-
-    // Создаем карту с ключом - дата, значениями по метрикам
-    Map<String, Map<String, dynamic>> dayStats = {
-      for (var day in last7Days)
-        day: {
-          'distance': 0.0,
-          'steps': 0,
-          'calories': 0.0
-        } // Changed from active_time to steps
-    };
-
-    for (var stat in stats) {
-      final date = stat['date'];
-      if (dayStats.containsKey(date)) {
-        dayStats[date]!['distance'] =
-            (stat['distance'] as num?)?.toDouble() ?? 0.0;
-        dayStats[date]!['steps'] =
-            (stat['steps'] as int?) ?? 0; // Changed from active_time to steps
-        dayStats[date]!['calories'] =
-            (stat['calories'] as num?)?.toDouble() ?? 0.0;
-      }
-    }
-
-    return last7Days.map((d) => dayStats[d]!).toList();
+    return stats
+        .map<Map<String, dynamic>>((day) => {
+              'distance': (day['distance'] as num?)?.toDouble() ?? 0.0,
+              'steps': (day['steps'] as num?)?.toInt() ?? 0,
+              'calories': (day['calories'] as num?)?.toDouble() ?? 0.0,
+            })
+        .toList();
   }
 
   Future<WeeklySummary> fetchAllWeeklyStats() async {